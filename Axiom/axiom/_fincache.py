@@ -44,12 +44,98 @@ def createCacheRemoveCallback(w, k, f):
 
 PROFILING = False
 
+class StrongCache:
+    """
+    A bounded collection of strong references to the most recently used
+    values of a L{FinalizingCache}, which keeps them alive (and so cached)
+    even when nothing else refers to them.
+
+    When it is full, the least recently used value is dropped to make room for
+    a new one.
+
+    @ivar size: the maximum number of values to keep alive.
+
+    @ivar evictions: the number of values dropped because they had not been
+        used recently enough.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.evictions = 0
+        # Map of keys to nodes of a circular doubly-linked list ordered from
+        # most to least recently used.  Each node is a list of
+        # [previous node, next node, key, value]; self.root is a sentinel
+        # node with no key or value.
+        self.nodes = {}
+        self.root = root = [None, None, None, None]
+        root[0] = root[1] = root
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def keep(self, key, value):
+        """
+        Mark C{value} as the most recently used, keeping it alive until enough
+        other values have been used since.
+        """
+        if self.size <= 0:
+            return
+        root = self.root
+        node = self.nodes.get(key)
+        if node is not None:
+            # Unlink it from where it is now.
+            node[0][1] = node[1]
+            node[1][0] = node[0]
+            node[3] = value
+        else:
+            if len(self.nodes) >= self.size:
+                oldest = root[0]
+                self.discard(oldest[2])
+                self.evictions += 1
+                log.msg(interface=iaxiom.IStatEvent, stat_cache_evictions=1,
+                        key=oldest[2])
+            node = self.nodes[key] = [None, None, key, value]
+        # Link it in at the front.
+        first = root[1]
+        node[0] = root
+        node[1] = first
+        first[0] = root[1] = node
+
+    def discard(self, key):
+        """
+        Stop keeping the value for C{key} alive, if it was being.
+        """
+        node = self.nodes.pop(key, None)
+        if node is not None:
+            node[0][1] = node[1]
+            node[1][0] = node[0]
+            node[3] = None
+
+    def clear(self):
+        """
+        Stop keeping any values alive.
+        """
+        for key in self.nodes.keys():
+            self.discard(key)
+
+
 class FinalizingCache:
     """Possibly useful for infrastructure?  This would be a nice addition (or
     perhaps even replacement) for twisted.python.finalize.
+
+    @ivar strong: a L{StrongCache} keeping the most recently used values in
+        this cache alive.
+
+    @ivar hits: the number of values successfully retrieved from this cache.
+
+    @ivar misses: the number of times a value was looked for in this cache but
+        was not present.  Users of the cache must count these themselves,
+        because L{has} may be the C{has_key} method of a C{dict}.
     """
-    def __init__(self):
+    def __init__(self, strongSize=0):
         self.data = {}
+        self.strong = StrongCache(strongSize)
+        self.hits = 0
+        self.misses = 0
         if not PROFILING:
             # see docstring for 'has'
             self.has = self.data.has_key
@@ -59,11 +145,13 @@ class FinalizingCache:
         assert key not in self.data, "Duplicate cache key: %r %r %r" % (key, value, self.data[key])
         self.data[key] = ref(value, createCacheRemoveCallback(
                 ref(self), key, fin))
+        self.strong.keep(key, value)
         return value
 
     def uncache(self, key, value):
-        assert self.get(key) is value
+        assert self.data[key]() is value
         del self.data[key]
+        self.strong.discard(key)
 
     def has(self, key):
         """Does the cache have this key?
@@ -85,6 +173,7 @@ class FinalizingCache:
         if o is None:
             raise CacheFault(
                 "FinalizingCache has %r but its value is no more." % (key,))
+        self.hits += 1
+        self.strong.keep(key, o)
         log.msg(interface=iaxiom.IStatEvent, stat_cache_hits=1, key=key)
         return o
-
@@ -26,15 +26,22 @@ from twisted.python import log
 
 from axiom import errors, iaxiom
 
+# The number of prepared statements the underlying connection keeps around for
+# reuse, keyed on their SQL.  The module default of 100 is smaller than the
+# number of distinct statements a typical application runs.
+PREPARED_STATEMENT_CACHE_SIZE = 500
+
 class Connection(object):
     def __init__(self, connection, timeout=None):
         self._connection = connection
         self._timeout = timeout
 
 
-    def fromDatabaseName(cls, dbFilename, timeout=None, isolationLevel=None):
+    def fromDatabaseName(cls, dbFilename, timeout=None, isolationLevel=None,
+                         cachedStatements=PREPARED_STATEMENT_CACHE_SIZE):
         return cls(dbapi2.connect(dbFilename, timeout=0,
-                                  isolation_level=isolationLevel))
+                                  isolation_level=isolationLevel,
+                                  cached_statements=cachedStatements))
     fromDatabaseName = classmethod(fromDatabaseName)
 
 
@@ -85,6 +92,22 @@ class Cursor(object):
 
 
     def execute(self, sql, args=()):
+        return self._execute(self._cursor.execute, sql, args)
+
+
+    def executemany(self, sql, argsList):
+        """
+        Execute one statement once for each sequence of arguments in
+        C{argsList}.  This is much faster than calling L{execute} repeatedly,
+        since the statement is only prepared once and fewer calls cross into
+        SQLite.
+
+        @param argsList: a C{list} of sequences of arguments.
+        """
+        return self._execute(self._cursor.executemany, sql, argsList)
+
+
+    def _execute(self, method, sql, args):
         try:
             try:
                 blockedTime = 0.0
@@ -113,7 +136,7 @@ class Cursor(object):
                     # information between multiple processes.
                     while 1:
                         try:
-                            return self._cursor.execute(sql, args)
+                            return method(sql, args)
                         except dbapi2.OperationalError, e:
                             if e.args[0] == 'database is locked':
                                 now = self.time()
@@ -135,7 +158,7 @@ class Cursor(object):
                             stat_cursor_blocked_time=blockedTime)
             except dbapi2.OperationalError, e:
                 if e.args[0] == 'database schema has changed':
-                    return self._cursor.execute(sql, args)
+                    return method(sql, args)
                 raise
         except (dbapi2.ProgrammingError,
                 dbapi2.InterfaceError,
@@ -143,10 +166,34 @@ class Cursor(object):
             raise self._connection.identifySQLError(sql, args, e)
 
 
+    def fetchmany(self, size):
+        """
+        Fetch at most C{size} more rows from the result set of the statement
+        most recently executed with this cursor.
+
+        @return: a C{list} of row tuples, empty when the result set has been
+            exhausted.
+        """
+        try:
+            return self._cursor.fetchmany(size)
+        except (dbapi2.ProgrammingError,
+                dbapi2.InterfaceError,
+                dbapi2.OperationalError), e:
+            raise self._connection.identifySQLError(None, None, e)
+
+
     def lastRowID(self):
         return self._cursor.lastrowid
 
 
+    def rowCount(self):
+        """
+        Return the number of rows changed by the last statement executed, or
+        -1 if it does not change any, as a SELECT does not.
+        """
+        return self._cursor.rowcount
+
+
     def close(self):
         self._cursor.close()
 
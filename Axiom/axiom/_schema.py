@@ -1,6 +1,8 @@
 
 # DELETE_OBJECT = 'DELETE FROM axiom_objects WHERE oid = ?'
 CREATE_OBJECT = 'INSERT INTO *DATABASE*.axiom_objects (type_id) VALUES (?)'
+CREATE_OBJECT_WITH_ID = 'INSERT INTO *DATABASE*.axiom_objects (oid, type_id) VALUES (?, ?)'
+HIGHEST_OBJECT_ID = 'SELECT MAX(oid) FROM *DATABASE*.axiom_objects'
 CREATE_TYPE = 'INSERT INTO *DATABASE*.axiom_types (typename, module, version) VALUES (?, ?, ?)'
 
 
@@ -35,8 +37,30 @@ CREATE TABLE *DATABASE*.axiom_attributes (
     attribute VARCHAR,
     docstring TEXT
 )
+""",
+
+"""
+CREATE TABLE *DATABASE*.axiom_schema_fingerprint (
+    fingerprint VARCHAR
+)
 """]
 
+# The fingerprint of the schema which was last found to be consistent with the
+# Python classes loaded when the store was opened; see Store._startup.  Stores
+# created before the table was added to BASE_SCHEMA do not have it until a
+# fingerprint is first saved.
+HAS_FINGERPRINT = ("SELECT COUNT(*) FROM *DATABASE*.sqlite_master "
+                   "WHERE type = 'table' AND name = 'axiom_schema_fingerprint'")
+
+CREATE_FINGERPRINT = BASE_SCHEMA[-1]
+
+GET_FINGERPRINT = 'SELECT fingerprint FROM *DATABASE*.axiom_schema_fingerprint'
+
+CLEAR_FINGERPRINT = 'DELETE FROM *DATABASE*.axiom_schema_fingerprint'
+
+SET_FINGERPRINT = ('INSERT INTO *DATABASE*.axiom_schema_fingerprint '
+                   '(fingerprint) VALUES (?)')
+
 TYPEOF_QUERY = """
 SELECT *DATABASE*.axiom_types.typename, *DATABASE*.axiom_types.module, *DATABASE*.axiom_types.version
     FROM *DATABASE*.axiom_types, *DATABASE*.axiom_objects
@@ -44,6 +68,15 @@ SELECT *DATABASE*.axiom_types.typename, *DATABASE*.axiom_types.module, *DATABASE
         AND *DATABASE*.axiom_types.oid = *DATABASE*.axiom_objects.type_id
 """
 
+# Like TYPEOF_QUERY, but for many objects at once.  The IN clause must be
+# filled in with as many parameters as there are object IDs.
+TYPEOF_MANY_QUERY = """
+SELECT *DATABASE*.axiom_objects.oid, *DATABASE*.axiom_types.typename, *DATABASE*.axiom_types.module, *DATABASE*.axiom_types.version
+    FROM *DATABASE*.axiom_types, *DATABASE*.axiom_objects
+    WHERE *DATABASE*.axiom_objects.oid IN (%s)
+        AND *DATABASE*.axiom_types.oid = *DATABASE*.axiom_objects.type_id
+"""
+
 HAS_SCHEMA_FEATURE = ("SELECT COUNT(oid) FROM *DATABASE*.sqlite_master "
                       "WHERE type = ? AND name = ?")
 
@@ -67,5 +100,9 @@ SCHEMA_FOR_TYPE = ('SELECT indexed, pythontype, attribute, docstring '
 
 CHANGE_TYPE = 'UPDATE *DATABASE*.axiom_objects SET type_id = ? WHERE oid = ?'
 
+# Like CHANGE_TYPE, but for every object whose ID is selected by a subselect
+# which must be filled in.
+CHANGE_TYPE_MANY = 'UPDATE *DATABASE*.axiom_objects SET type_id = ? WHERE oid IN (%s)'
+
 APP_VACUUM = 'DELETE FROM *DATABASE*.axiom_objects WHERE (type_id == -1) AND (oid != (SELECT MAX(oid) from *DATABASE*.axiom_objects))'
 
@@ -295,9 +295,98 @@ registerAdapter(CompoundOrdering, tuple, IOrdering)
 registerAdapter(UnspecifiedOrdering, type(None), IOrdering)
 registerAdapter(SimpleOrdering, Comparable, IOrdering)
 
-def compoundIndex(*columns):
-    for column in columns:
-        column.compoundIndexes.append(columns)
+class CompoundIndex(object):
+    """
+    An index over one or more columns of an item type, as declared with
+    L{compoundIndex}.
+
+    @ivar columns: a C{tuple} of the attributes indexed, in order.
+
+    @ivar directions: a C{tuple} with an entry for each of C{columns}: the
+        direction in which that column is sorted in the index, either C{'DESC'}
+        or C{''} for the default (ascending) order.
+
+    @ivar covering: a C{tuple} of attributes whose values are also kept in the
+        index, so that queries which need only these and C{columns} can be
+        answered from the index alone.
+
+    @ivar where: C{None} if every item is indexed, otherwise an L{IComparison}
+        which is true of the items which are.  See L{compoundIndex}.
+    """
+    def __init__(self, columns, covering=(), where=None):
+        self.columns = []
+        self.directions = []
+        for column in columns:
+            if isinstance(column, SimpleOrdering):
+                self.columns.append(column.attribute)
+                if column.isDescending:
+                    self.directions.append(_DESC)
+                else:
+                    self.directions.append('')
+            else:
+                self.columns.append(column)
+                self.directions.append('')
+        self.columns = tuple(self.columns)
+        self.directions = tuple(self.directions)
+        self.covering = tuple(covering)
+        if where is not None:
+            where = LiteralComparison(where)
+        self.where = where
+
+
+    def __iter__(self):
+        """
+        Iterate over all of the attributes kept in this index.
+        """
+        return iter(self.columns + self.covering)
+
+
+    def __repr__(self):
+        return 'CompoundIndex(%r, %r, %r, %r)' % (
+            self.columns, self.directions, self.covering, self.where)
+
+
+
+def compoundIndex(*columns, **kw):
+    """
+    Declare an index on one or more attributes of an item type.  This is
+    called in the body of an L{Item<axiom.item.Item>} subclass.
+
+    Each column may be given as an attribute, or as the C{ascending} or
+    C{descending} ordering of one to say which way that column is sorted in the
+    index, so that a query sorted by a mix of ascending and descending columns
+    can be answered in index order.
+
+    @param covering: a sequence of further attributes to store in the index,
+        after C{columns}, so that queries which need no other attributes can be
+        answered without reading the table.
+
+    @param where: an L{IComparison}, involving only attributes of this item
+        type, which the items to index must satisfy.  Only they are kept in the
+        index.  SQLite will only use such a partial index for a query whose
+        own comparison includes this one with the same literal values, rather
+        than bound parameters, so queries should use the returned index's
+        C{where} comparison for that::
+
+            class Message(Item):
+                read = boolean(default=False)
+                received = timestamp()
+                unread = compoundIndex(received.descending,
+                                       where=(read == False))
+
+            store.query(Message, Message.unread.where,
+                        sort=Message.received.descending)
+
+    @rtype: L{CompoundIndex}
+    """
+    covering = kw.pop('covering', ())
+    where = kw.pop('where', None)
+    if kw:
+        raise TypeError("Unexpected keyword arguments: %r" % (kw.keys(),))
+    index = CompoundIndex(columns, covering, where)
+    for column in index.columns:
+        column.compoundIndexes.append(index)
+    return index
 
 class SQLAttribute(inmemory, Comparable):
     """
@@ -500,6 +589,51 @@ class SQLAttribute(inmemory, Comparable):
                 st._rejectChanges -= 1
 
 
+def _columnStructureKey(column, store):
+    """
+    Return a hashable object which identifies the SQL that C{column} stands for
+    in queries against C{store}, or C{None} if there is no such object.
+
+    Two columns with equal keys are rendered identically by
+    C{column.getColumnName(store)}, so the keys can be used to cache SQL
+    generated from them.
+
+    @param column: an L{IColumn} provider.
+    @param store: an L{axiom.store.Store}.
+    """
+    try:
+        return store.attrToStructureKeyCache[column]
+    except KeyError:
+        pass
+    tableClass = column.type
+    if not isinstance(tableClass, type):
+        # Columns of a Placeholder are named with a table alias which is only
+        # assigned while a particular query is being built.
+        return None
+    key = store.attrToStructureKeyCache[column] = (
+        tableClass.typeName, tableClass.schemaVersion,
+        column.getShortColumnName(store))
+    return key
+
+
+
+def _comparisonStructureKey(comparison, store):
+    """
+    Return a hashable object which identifies the SQL generated by
+    C{comparison.getQuery(store)}, or C{None} if there is no such object (for
+    example, because C{comparison} is not one of the comparisons defined in
+    this module).
+
+    Comparisons with equal keys produce the same SQL, differing only in the
+    values they bind to its parameters.
+    """
+    structureKey = getattr(comparison, '_structureKey', None)
+    if structureKey is None:
+        return None
+    return structureKey(store)
+
+
+
 class TwoAttributeComparison:
     implements(IComparison)
     def __init__(self, leftAttribute, operationString, rightAttribute):
@@ -524,6 +658,14 @@ class TwoAttributeComparison:
         return []
 
 
+    def _structureKey(self, store):
+        left = _columnStructureKey(self.leftAttribute, store)
+        right = _columnStructureKey(self.rightAttribute, store)
+        if left is None or right is None:
+            return None
+        return (TwoAttributeComparison, left, self.operationString, right)
+
+
     def __repr__(self):
         return ' '.join((self.leftAttribute.fullyQualifiedName(),
                          self.operationString,
@@ -547,6 +689,12 @@ class AttributeValueComparison:
     def getInvolvedTables(self):
         return [self.attribute.type]
 
+    def _structureKey(self, store):
+        column = _columnStructureKey(self.attribute, store)
+        if column is None:
+            return None
+        return (AttributeValueComparison, column, self.operationString)
+
     def __repr__(self):
         return ' '.join((self.attribute.fullyQualifiedName(),
                          self.operationString,
@@ -572,6 +720,12 @@ class NullComparison:
     def getInvolvedTables(self):
         return [self.attribute.type]
 
+    def _structureKey(self, store):
+        column = _columnStructureKey(self.attribute, store)
+        if column is None:
+            return None
+        return (NullComparison, column, self.negate)
+
 class LikeFragment:
     def getLikeArgs(self):
         return []
@@ -582,6 +736,9 @@ class LikeFragment:
     def getLikeTables(self):
         return []
 
+    def _structureKey(self, st):
+        return self.getLikeQuery(st)
+
 class LikeNull(LikeFragment):
     def getLikeQuery(self, st):
         return "NULL"
@@ -606,6 +763,9 @@ class LikeColumn(LikeFragment):
     def getLikeTables(self):
         return [self.attribute.type]
 
+    def _structureKey(self, st):
+        return _columnStructureKey(self.attribute, st)
+
 
 class LikeComparison:
     implements(IComparison)
@@ -643,6 +803,13 @@ class LikeComparison:
                         pyval, None, store))
         return l
 
+    def _structureKey(self, store):
+        parts = [_columnStructureKey(self.attribute, store)]
+        parts.extend([lf._structureKey(store) for lf in self.likeParts])
+        if None in parts:
+            return None
+        return (LikeComparison, self.negate, tuple(parts))
+
 
 
 class AggregateComparison:
@@ -681,6 +848,13 @@ class AggregateComparison:
                     t for t in cond.getInvolvedTables() if t not in tables])
         return tables
 
+    def _structureKey(self, store):
+        keys = tuple([_comparisonStructureKey(cond, store)
+                      for cond in self.conditions])
+        if None in keys:
+            return None
+        return (self.operator, keys)
+
     def __repr__(self):
         return '%s(%s)' % (self.__class__.__name__,
                            ', '.join(map(repr, self.conditions)))
@@ -775,11 +949,106 @@ class SequenceComparison:
             self.containerClause(store))
 
 
+    def _structureKey(self, store):
+        column = _columnStructureKey(self.attribute, store)
+        if self.containerClause == self._columnContainer:
+            container = _columnStructureKey(self.container, store)
+        elif self.containerClause == self._queryContainer:
+            sqlKey = getattr(self.container, '_sqlKey', None)
+            if sqlKey is None:
+                return None
+            container = sqlKey('SELECT', self.container._queryTarget)
+        else:
+            # The number of bind parameters depends on the length of the
+            # sequence.
+            self._sequenceContainer(store)
+            container = len(self._sequence)
+        if column is None or container is None:
+            return None
+        return (SequenceComparison, column, self.negate, container)
+
+
     def getInvolvedTables(self):
         return [self.attribute.type]
 
 
 
+def _sqlLiteral(value):
+    """
+    Return the SQL for a literal value of one of the types which attributes
+    give SQLite.
+    """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, long)):
+        return str(value)
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, buffer):
+        return "X'%s'" % (str(value).encode('hex'),)
+    if isinstance(value, basestring):
+        return "'%s'" % (value.replace("'", "''"),)
+    raise TypeError("Cannot express %r in SQL" % (value,))
+
+
+
+class LiteralComparison:
+    """
+    Wrap any other L{IComparison}, putting the values of its arguments into
+    its SQL instead of binding them to parameters.
+
+    Queries including a L{LiteralComparison} can use partial indexes whose
+    condition is the same comparison, which SQLite will not do for a
+    comparison with parameters, since it cannot tell what they will be when
+    the query is planned.
+    """
+    implements(IComparison)
+
+    def __init__(self, comparison):
+        self.comparison = comparison
+
+
+    def getQuery(self, store):
+        parts = self.comparison.getQuery(store).split('?')
+        args = self.comparison.getArgs(store)
+        if len(parts) != len(args) + 1:
+            raise ValueError(
+                "Cannot put %d arguments into %r" % (len(args), parts))
+        sql = [parts[0]]
+        for (arg, part) in zip(args, parts[1:]):
+            sql.append(_sqlLiteral(arg))
+            sql.append(part)
+        return ''.join(sql)
+
+
+    def getArgs(self, store):
+        return []
+
+
+    def getInvolvedTables(self):
+        return self.comparison.getInvolvedTables()
+
+
+    def _structureKey(self, store):
+        comparison = _comparisonStructureKey(self.comparison, store)
+        if comparison is None:
+            return None
+        key = (LiteralComparison, comparison,
+               tuple(self.comparison.getArgs(store)))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+
+    def __repr__(self):
+        return 'LiteralComparison(%r)' % (self.comparison,)
+
+
+
 class AND(AggregateComparison):
     """
     Combine 2 L{IComparison}s such that this is true when both are true.
@@ -822,6 +1091,18 @@ class TableOrderComparisonWrapper(object):
         return self.comparison.getArgs(store)
 
 
+    def _structureKey(self, store):
+        keys = []
+        for table in self.tables:
+            if not isinstance(table, type):
+                return None
+            keys.append((table.typeName, table.schemaVersion))
+        comparison = _comparisonStructureKey(self.comparison, store)
+        if comparison is None:
+            return None
+        return (TableOrderComparisonWrapper, tuple(keys), comparison)
+
+
 
 class boolean(SQLAttribute):
     sqltype = 'BOOLEAN'
@@ -1066,6 +1347,7 @@ class timestamp(integer):
 
 _cascadingDeletes = {}
 _disallows = {}
+_nullifies = {}
 
 class reference(integer):
     NULLIFY = object()
@@ -1088,6 +1370,10 @@ class reference(integer):
             _cascadingDeletes.setdefault(reftype, []).append(self)
         if whenDeleted is reference.DISALLOW:
             _disallows.setdefault(reftype, []).append(self)
+        if whenDeleted is reference.NULLIFY and reftype is not None:
+            # Untyped references are only nullified lazily, when the item they
+            # refer to turns out to be gone.
+            _nullifies.setdefault(reftype, []).append(self)
 
     def reprFor(self, oself):
         obj = getattr(oself, self.underlying, None)
@@ -5,11 +5,12 @@ Utilities for performing repetitive tasks over potentially large sets
 of data over an extended period of time.
 """
 
-import weakref, datetime, os, sys
+import weakref, datetime, os, sys, zlib
 
 from zope.interface import implements
 
 from twisted.python import reflect, failure, log, procutils, util, runtime
+from twisted.python import filepath
 from twisted.internet import task, defer, reactor, error, protocol
 from twisted.application import service
 
@@ -22,6 +23,14 @@ from axiom.dependency import installOn
 
 VERBOSE = False
 
+# The number of child processes which do remote batch processing for a site
+# store.  Its substores are spread across them by path.
+BATCH_PROCESSES = 1
+
+# How often, in seconds, a pool of batch processes is checked for one with
+# nothing to do, which is then given a substore with work from the busiest.
+REBALANCE_INTERVAL = 30.0
+
 _processors = weakref.WeakValueDictionary()
 
 
@@ -55,6 +64,14 @@ class _ProcessingFailure(Exception):
         Mark the unit of work as failed in the database and update the listener
         so as to skip it next time.
         """
+        self.record()
+
+
+    def record(self):
+        """
+        Mark the unit of work as failed in the database, without changing which
+        work the listener will be given next.
+        """
         self.reliableListener.lastRun = extime.Time()
         BatchProcessingError(
             store=self.reliableListener.store,
@@ -187,17 +204,17 @@ class _ReliableListener(item.Item):
                              item=item)
 
 
-    def _forwardWork(self, workUnitType):
+    def _forwardWork(self, workUnitType, limit=2):
         if VERBOSE:
             log.msg("%r looking forward from %r" % (self, self.forwardMark,))
         return self.store.query(
             workUnitType,
             workUnitType.storeID > self.forwardMark,
             sort=workUnitType.storeID.ascending,
-            limit=2)
+            limit=limit)
 
 
-    def _backwardWork(self, workUnitType):
+    def _backwardWork(self, workUnitType, limit=2):
         if VERBOSE:
             log.msg("%r looking backward from %r" % (self, self.backwardMark,))
         if self.backwardMark == 0:
@@ -206,13 +223,13 @@ class _ReliableListener(item.Item):
             workUnitType,
             workUnitType.storeID < self.backwardMark,
             sort=workUnitType.storeID.descending,
-            limit=2)
+            limit=limit)
 
 
-    def _extraWork(self):
+    def _extraWork(self, limit=2):
         return self.store.query(_ReliableTracker,
                                 _ReliableTracker.listener == self,
-                                limit=2)
+                                limit=limit)
 
 
     def _doOneWork(self, workUnit, failureType):
@@ -228,44 +245,108 @@ class _ReliableListener(item.Item):
             raise failureType(self, workUnit, f)
 
 
-    def step(self):
-        first = True
-        for workTracker in self._extraWork():
-            if first:
-                first = False
-            else:
-                return True
-            item = workTracker.item
-            workTracker.deleteFromStore()
-            self._doOneWork(item, _TrackedProcessingFailure)
+    def _doWork(self, work):
+        """
+        Process several units of work, each of which is reverted and recorded
+        as a failure if it cannot be processed, without disturbing the others.
 
-        for workUnit in self._forwardWork(self.processor.workUnitType):
-            if first:
-                first = False
-            else:
-                return True
-            self.forwardMark = workUnit.storeID
-            self._doOneWork(workUnit, _ForwardProcessingFailure)
+        If the listener has a C{processItems} method, it is given all of the
+        work units at once, and only given them one at a time if that fails.
 
-        for workUnit in self._backwardWork(self.processor.workUnitType):
-            if first:
-                first = False
+        @param work: A C{list} of two-tuples of a work unit and the
+            L{_ProcessingFailure} subclass to use if it fails.
+        """
+        processItems = getattr(self.listener, 'processItems', None)
+        if processItems is not None:
+            try:
+                self.store.savepoint(
+                    processItems, [workUnit for (workUnit, failureType) in work])
+            except:
+                if VERBOSE:
+                    log.msg("Processing %d units of work together failed" % (
+                            len(work),))
+                    log.err()
             else:
-                return True
-            self.backwardMark = workUnit.storeID
-            self._doOneWork(workUnit, _BackwardProcessingFailure)
+                return
+            processItem = lambda workUnit: processItems([workUnit])
+        else:
+            processItem = self.listener.processItem
+
+        for (workUnit, failureType) in work:
+            try:
+                self.store.savepoint(processItem, workUnit)
+            except:
+                e = failureType(self, workUnit, failure.Failure())
+                log.msg("%r failed while processing %r:" % (self, workUnit))
+                log.err(e.failure)
+                e.record()
 
-        if first:
+
+    def step(self, batchSize=1):
+        """
+        Process at most C{batchSize} units of work: first any items which have
+        been specially added, then new items, then old ones.
+
+        If C{batchSize} is one, a failure to process the unit of work is raised
+        as a L{_ProcessingFailure}.  Otherwise, each unit of work is processed
+        in a savepoint of its own, and failures are recorded as
+        L{BatchProcessingError}s as they occur.
+
+        @return: C{True} if there is more work to do, C{False} otherwise.
+        @raise _NoWorkUnits: If there was no work to do at all.
+        """
+        # Look for one more unit of work than will be processed, to find out
+        # whether there is more to do.
+        limit = batchSize + 1
+        work = [(workTracker, _TrackedProcessingFailure)
+                for workTracker in self._extraWork(limit)]
+        if len(work) < limit:
+            work.extend([
+                    (workUnit, _ForwardProcessingFailure)
+                    for workUnit in self._forwardWork(
+                        self.processor.workUnitType, limit - len(work))])
+        if len(work) < limit:
+            work.extend([
+                    (workUnit, _BackwardProcessingFailure)
+                    for workUnit in self._backwardWork(
+                        self.processor.workUnitType, limit - len(work))])
+        if not work:
             raise _NoWorkUnits()
-        if VERBOSE:
+        more = len(work) > batchSize
+        del work[batchSize:]
+
+        for (i, (workUnit, failureType)) in enumerate(work):
+            if failureType is _TrackedProcessingFailure:
+                work[i] = (workUnit.item, failureType)
+                workUnit.deleteFromStore()
+            elif failureType is _ForwardProcessingFailure:
+                self.forwardMark = workUnit.storeID
+            else:
+                self.backwardMark = workUnit.storeID
+
+        if batchSize == 1:
+            [(workUnit, failureType)] = work
+            self._doOneWork(workUnit, failureType)
+        else:
+            self._doWork(work)
+        if VERBOSE and not more:
             log.msg("%r.step() returning False" % (self,))
-        return False
+        return more
 
 
 
 class _BatchProcessorMixin:
+    """
+    @cvar batchSize: The number of units of work given to a listener each time
+        it is stepped, unless some other number is given to L{step}.  Set it
+        on a type returned by L{processor} to change it for all of that type's
+        processors.
+    """
+    batchSize = 1
 
-    def step(self, style=iaxiom.LOCAL, skip=()):
+    def step(self, style=iaxiom.LOCAL, skip=(), batchSize=None):
+        if batchSize is None:
+            batchSize = self.batchSize
         now = extime.Time()
         first = True
 
@@ -280,7 +361,7 @@ class _BatchProcessorMixin:
                 return True
             listener.lastRun = now
             try:
-                if listener.step():
+                if listener.step(batchSize):
                     if VERBOSE:
                         log.msg("%r.step() reported more work to do, returning True from %r.step()" % (listener, self))
                     return True
@@ -852,10 +933,14 @@ class JuiceChild(juice.Juice):
 
 class SetStore(juice.Command):
     """
-    Specify the location of the site store.
+    Specify the location of the site store.  A process in a pool of
+    C{workers} batch processes is also told which one it is, and handles only
+    its share of the substores.
     """
     commandName = 'Set-Store'
-    arguments = [('storepath', juice.Path())]
+    arguments = [('storepath', juice.Path()),
+                 ('worker', juice.Integer(optional=True)),
+                 ('workers', juice.Integer(optional=True))]
 
 
 class SuspendProcessor(juice.Command):
@@ -891,21 +976,98 @@ class CallItemMethod(juice.Command):
                  ('method', juice.String())]
 
 
+class AdoptSubStore(juice.Command):
+    """
+    Begin processing a substore, even if it would otherwise be left to another
+    batch process.
+    """
+    commandName = 'Adopt-SubStore'
+    arguments = [('storepath', juice.Path())]
+
+
+
+class ReleaseSubStore(juice.Command):
+    """
+    Stop processing a substore, even if it would otherwise be processed by the
+    receiving batch process.
+    """
+    commandName = 'Release-SubStore'
+    arguments = [('storepath', juice.Path())]
+
+
+
+class CountBusySubStores(juice.Command):
+    """
+    Find out how many of the substores a batch process is handling have work
+    left to do.
+    """
+    commandName = 'Count-Busy-SubStores'
+    response = [('count', juice.Integer())]
+
+
+
+class ShedSubStore(juice.Command):
+    """
+    Release one of the substores which a batch process has work left to do
+    for, so that another process can take it over.  No substore is given if
+    there are none which can be released.
+    """
+    commandName = 'Shed-SubStore'
+    response = [('storepath', juice.Path(optional=True))]
+
+
+
+def _defaultWorker(path, workers):
+    """
+    Choose which of a pool of batch processes handles the substore at the
+    given path, unless it has been moved to another.
+
+    @param path: The path of the substore's database directory.
+    @type path: C{str} or C{unicode}
+
+    @param workers: The number of processes in the pool.
+
+    @return: The index of a process in the pool.
+    """
+    if isinstance(path, unicode):
+        path = path.encode('utf-8')
+    return zlib.crc32(path) % workers
+
+
+
 class BatchProcessingControllerService(service.Service):
     """
-    Controls starting, stopping, and passing messages to the system process in
-    charge of remote batch processing.
+    Controls starting, stopping, and passing messages to the system processes
+    in charge of remote batch processing.
+
+    Each substore is handled by one process in a pool, which is chosen by the
+    substore's path unless work has been rebalanced since: every
+    L{REBALANCE_INTERVAL} seconds, each process which has no work left to do
+    takes over a substore which does from the busiest process, provided that
+    process is busy with more than one substore.
+
+    @ivar processes: The number of processes in the pool.
+
+    @ivar controllers: A C{list} of L{ProcessController}s, one for each
+        process in the pool.
+
+    @ivar assignments: A C{dict} mapping the paths of substores which have been
+        moved to another process to the index of that process.
     """
 
-    def __init__(self, store):
+    def __init__(self, store, processes=None):
         self.store = store
+        if processes is None:
+            processes = BATCH_PROCESSES
+        self.processes = processes
+        self.assignments = {}
+        self.rebalanceCall = None
         self.setName("Batch Processing Controller")
 
 
     def startService(self):
         service.Service.startService(self)
         tacPath = util.sibpath(__file__, "batch.tac")
-        proto = BatchProcessingProtocol()
         rundir = self.store.dbdir.child("run")
         logdir = rundir.child("logs")
         for d in rundir, logdir:
@@ -913,26 +1075,95 @@ class BatchProcessingControllerService(service.Service):
                 d.createDirectory()
             except OSError:
                 pass
-        self.batchController = ProcessController(
-            "batch", proto, tacPath,
-            self._setStore, self._restartProcess,
-            logdir.child("batch.log").path,
-            rundir.child("batch.pid").path)
+        self.controllers = [
+            self._makeController(index, tacPath, rundir, logdir)
+            for index in range(self.processes)]
+        self.batchController = self.controllers[0]
+        if self.processes > 1:
+            self.rebalanceCall = task.LoopingCall(self._rebalance)
+            self.rebalanceCall.start(REBALANCE_INTERVAL, now=False)
+
+
+    def _makeController(self, index, tacPath, rundir, logdir):
+        """
+        Create the L{ProcessController} for one process in the pool.
+        """
+        if self.processes == 1:
+            name = "batch"
+        else:
+            name = "batch-%d" % (index,)
+        return ProcessController(
+            name, BatchProcessingProtocol(), tacPath,
+            lambda: self._setStore(index),
+            lambda: self._restartProcess(index),
+            logdir.child(name + ".log").path,
+            rundir.child(name + ".pid").path)
 
 
-    def _setStore(self):
-        return SetStore(storepath=self.store.dbdir).do(self.batchController.juice)
+    def _setStore(self, index=0):
+        """
+        Tell a newly started process which store to work on, which share of its
+        substores to handle, and about any substores which have been moved to
+        or from it.
+        """
+        proto = self.controllers[index].juice
+        if self.processes == 1:
+            d = SetStore(storepath=self.store.dbdir).do(proto)
+        else:
+            d = SetStore(storepath=self.store.dbdir,
+                         worker=index,
+                         workers=self.processes).do(proto)
+        for (path, owner) in self.assignments.items():
+            if owner == index:
+                command = AdoptSubStore
+            elif _defaultWorker(path, self.processes) == index:
+                command = ReleaseSubStore
+            else:
+                continue
+            d.addCallback(
+                lambda ign, command=command, path=path: command(
+                    storepath=filepath.FilePath(path)).do(proto))
+        return d
 
 
-    def _restartProcess(self):
-        reactor.callLater(1.0, self.batchController.getProcess)
+    def _restartProcess(self, index=0):
+        reactor.callLater(1.0, self.controllers[index].getProcess)
 
 
     def stopService(self):
         service.Service.stopService(self)
-        d = self.batchController.stopProcess()
-        d.addErrback(lambda err: err.trap(error.ProcessDone))
-        return d
+        if self.rebalanceCall is not None:
+            self.rebalanceCall.stop()
+            self.rebalanceCall = None
+        stopping = []
+        for controller in self.controllers:
+            d = controller.stopProcess()
+            d.addErrback(lambda err: err.trap(error.ProcessDone))
+            stopping.append(d)
+        return defer.gatherResults(stopping)
+
+
+    def _getProcess(self, index):
+        """
+        Get the juice protocol connected to one process in the pool, starting
+        the rest of the pool if it is not running, so that all substores are
+        handled.
+        """
+        for (i, controller) in enumerate(self.controllers):
+            if i != index and controller.mode == 'stopped':
+                controller.getProcess().addErrback(
+                    lambda err: err.trap(ProcessUnavailable))
+        return self.controllers[index].getProcess()
+
+
+    def _workerFor(self, storepath):
+        """
+        Find which process in the pool handles the substore at the given path.
+        """
+        path = storepath.path
+        if path in self.assignments:
+            return self.assignments[path]
+        return _defaultWorker(path, self.processes)
 
 
     def call(self, itemMethod):
@@ -943,22 +1174,84 @@ class BatchProcessingControllerService(service.Service):
         """
         item = itemMethod.im_self
         method = itemMethod.im_func.func_name
-        return self.batchController.getProcess().addCallback(
+        return self._getProcess(self._workerFor(item.store.dbdir)).addCallback(
             CallItemMethod(storepath=item.store.dbdir,
                            storeid=item.storeID,
                            method=method).do)
 
 
     def suspend(self, storepath, storeID):
-        return self.batchController.getProcess().addCallback(
+        return self._getProcess(self._workerFor(storepath)).addCallback(
             SuspendProcessor(storepath=storepath, storeid=storeID).do)
 
 
     def resume(self, storepath, storeID):
-        return self.batchController.getProcess().addCallback(
+        return self._getProcess(self._workerFor(storepath)).addCallback(
             ResumeProcessor(storepath=storepath, storeid=storeID).do)
 
 
+    def _rebalance(self):
+        """
+        Find out how busy each running process in the pool is, and move
+        substores from the busiest to those which are idle.
+        """
+        ready = [index for (index, controller) in enumerate(self.controllers)
+                 if controller.mode == 'ready']
+        if len(ready) < 2:
+            return
+        d = defer.gatherResults([
+                CountBusySubStores().do(self.controllers[index].juice)
+                for index in ready])
+        d.addCallback(lambda boxes: self._moveSubStores(
+                dict(zip(ready, [box['count'] for box in boxes]))))
+        d.addErrback(log.err, "Rebalancing batch processes failed")
+        return d
+
+
+    def _moveSubStores(self, loads):
+        """
+        Move one busy substore to each idle process from whichever process is
+        busiest at the time.
+
+        @param loads: A C{dict} mapping the index of each running process to
+            the number of its substores which have work to do.
+        """
+        moves = []
+        for target in [index for index in loads if loads[index] == 0]:
+            source = target
+            for index in loads:
+                if loads[index] > loads[source]:
+                    source = index
+            if loads[source] < 2:
+                break
+            loads[source] -= 1
+            loads[target] += 1
+            moves.append(self._moveSubStore(source, target))
+        return defer.gatherResults(moves)
+
+
+    def _moveSubStore(self, source, target):
+        """
+        Have one process in the pool give up one of its busy substores, and
+        another take it over.
+        """
+        def shed(box):
+            storepath = box['storepath']
+            if storepath is None:
+                return
+            if _defaultWorker(storepath.path, self.processes) == target:
+                self.assignments.pop(storepath.path, None)
+            else:
+                self.assignments[storepath.path] = target
+            if VERBOSE:
+                log.msg("Moving SubStore %s from batch process %d to %d" % (
+                        storepath.path, source, target))
+            return self._getProcess(target).addCallback(
+                AdoptSubStore(storepath=storepath).do)
+        return ShedSubStore().do(self.controllers[source].juice).addCallback(
+            shed)
+
+
 
 class _SubStoreBatchChannel(object):
     """
@@ -995,11 +1288,27 @@ def storeBatchServiceSpecialCase(st, pups):
 
 
 class BatchProcessingProtocol(JuiceChild):
+    """
+    @ivar worker: The index of this process in a pool of batch processes, or
+        C{None} if it is the only one.
+
+    @ivar workers: The number of processes in the pool, or C{None}.
+
+    @ivar adopted: A C{set} of the paths of substores which this process has
+        been told to handle, although they would otherwise be left to another.
+
+    @ivar released: A C{set} of the paths of substores which this process has
+        been told to leave to another, although it would otherwise handle them.
+    """
     siteStore = None
+    worker = None
+    workers = None
 
     def __init__(self, service=None, issueGreeting=False):
         juice.Juice.__init__(self, issueGreeting)
         self.storepaths = []
+        self.adopted = set()
+        self.released = set()
         if service is not None:
             service.cooperator = cooperator.Cooperator()
         self.service = service
@@ -1012,11 +1321,13 @@ class BatchProcessingProtocol(JuiceChild):
             reactor.stop()
 
 
-    def command_SET_STORE(self, storepath):
+    def command_SET_STORE(self, storepath, worker=None, workers=None):
         from axiom import store
 
         assert self.siteStore is None
 
+        self.worker = worker
+        self.workers = workers
         self.siteStore = store.Store(storepath, debug=False)
         self.subStores = {}
         self.pollCall = task.LoopingCall(self._pollSubStores)
@@ -1042,8 +1353,94 @@ class BatchProcessingProtocol(JuiceChild):
     command_CALL_ITEM_METHOD.command = CallItemMethod
 
 
+    def command_ADOPT_SUBSTORE(self, storepath):
+        path = storepath.path
+        self.released.discard(path)
+        self.adopted.add(path)
+        if path not in self.subStores:
+            self._addSubStore(path)
+        return {}
+    command_ADOPT_SUBSTORE.command = AdoptSubStore
+
+
+    def command_RELEASE_SUBSTORE(self, storepath):
+        return self._releaseSubStore(storepath.path).addCallback(
+            lambda ign: {})
+    command_RELEASE_SUBSTORE.command = ReleaseSubStore
+
+
+    def command_COUNT_BUSY_SUBSTORES(self):
+        return {'count': len([svc for svc in self.subStores.itervalues()
+                              if svc.busy])}
+    command_COUNT_BUSY_SUBSTORES.command = CountBusySubStores
+
+
+    def command_SHED_SUBSTORE(self):
+        # Substores with suspended processors stay here, since suspension
+        # would not survive the move.
+        busy = [path for (path, svc) in self.subStores.iteritems()
+                if svc.busy and not svc.suspended]
+        if not busy:
+            return {}
+        path = min(busy)
+        return self._releaseSubStore(path).addCallback(
+            lambda ign: {'storepath': filepath.FilePath(path)})
+    command_SHED_SUBSTORE.command = ShedSubStore
+
+
+    def _handles(self, path):
+        """
+        Determine whether this process is responsible for the substore at the
+        given path.
+        """
+        if path in self.adopted:
+            return True
+        if path in self.released:
+            return False
+        if self.workers is None:
+            return True
+        return _defaultWorker(path, self.workers) == self.worker
+
+
+    def _releaseSubStore(self, path):
+        """
+        Stop handling the substore at the given path.
+
+        @return: A L{Deferred} which fires when its service has stopped.
+        """
+        self.adopted.discard(path)
+        self.released.add(path)
+        svc = self.subStores.pop(path, None)
+        if svc is None:
+            return defer.succeed(None)
+        if VERBOSE:
+            log.msg("Released SubStore " + path)
+        return defer.maybeDeferred(svc.disownServiceParent)
+
+
+    def _addSubStore(self, path):
+        """
+        Open the substore at the given path and start processing it, logging
+        any failure to do so.
+        """
+        from axiom import store
+        try:
+            s = store.Store(path, debug=False)
+        except eaxiom.SQLError, e:
+            # Generally, database is locked.
+            log.msg("Opening sub-Store failed with SQLError: %r" % (e,))
+        except:
+            log.msg("Opening sub-Store failed with bad error:")
+            log.err()
+        else:
+            self.subStores[path] = BatchProcessingService(s, style=iaxiom.REMOTE)
+            self.subStores[path].setServiceParent(self.service)
+            if VERBOSE:
+                log.msg("Added SubStore " + path)
+
+
     def _pollSubStores(self):
-        from axiom import store, substore
+        from axiom import substore
 
         # Any service which has encountered an error will have logged it and
         # then stopped.  Prune those here, so that they are noticed as missing
@@ -1053,7 +1450,8 @@ class BatchProcessingProtocol(JuiceChild):
                 del self.subStores[path]
 
         try:
-            paths = set([p.path for p in self.siteStore.query(substore.SubStore).getColumn("storepath")])
+            paths = set([p.path for p in self.siteStore.query(substore.SubStore).getColumn("storepath")
+                         if self._handles(p.path)])
         except eaxiom.SQLError, e:
             # Generally, database is locked.
             log.msg("SubStore query failed with SQLError: %r" % (e,))
@@ -1068,29 +1466,26 @@ class BatchProcessingProtocol(JuiceChild):
                 if VERBOSE:
                     log.msg("Removed SubStore " + removed)
             for added in paths - set(self.subStores):
-                try:
-                    s = store.Store(added, debug=False)
-                except eaxiom.SQLError, e:
-                    # Generally, database is locked.
-                    log.msg("Opening sub-Store failed with SQLError: %r" % (e,))
-                except:
-                    log.msg("Opening sub-Store failed with bad error:")
-                    log.err()
-                else:
-                    self.subStores[added] = BatchProcessingService(s, style=iaxiom.REMOTE)
-                    self.subStores[added].setServiceParent(self.service)
-                    if VERBOSE:
-                        log.msg("Added SubStore " + added)
+                self._addSubStore(added)
 
 
 
 class BatchProcessingService(service.Service):
     """
     Steps over the L{iaxiom.IBatchProcessor} powerups for a single L{axiom.store.Store}.
+
+    @ivar batchSize: The number of units of work to give each listener in one
+        transaction, or C{None} to use the C{batchSize} of each processor.
+
+    @ivar busy: Whether there was more work to do the last time this service
+        stepped its processors.
     """
-    def __init__(self, store, style=iaxiom.LOCAL):
+    busy = False
+
+    def __init__(self, store, style=iaxiom.LOCAL, batchSize=None):
         self.store = store
         self.style = style
+        self.batchSize = batchSize
         self.suspended = []
 
 
@@ -1120,6 +1515,7 @@ class BatchProcessingService(service.Service):
         """
         work = self.step()
         for result, more in work:
+            self.busy = more
             yield result
             if not self.running:
                 break
@@ -1131,6 +1527,9 @@ class BatchProcessingService(service.Service):
 
 
     def step(self):
+        stepArgs = {}
+        if self.batchSize is not None:
+            stepArgs['batchSize'] = self.batchSize
         while True:
             items = list(self.items())
 
@@ -1145,7 +1544,9 @@ class BatchProcessingService(service.Service):
                 if VERBOSE:
                     log.msg("Stepping processor %r (suspended is %r)" % (item, self.suspended))
                 try:
-                    itemHasMore = item.store.transact(item.step, style=self.style, skip=self.suspended)
+                    itemHasMore = item.store.transact(
+                        item.step, style=self.style, skip=self.suspended,
+                        **stepArgs)
                 except _ProcessingFailure, e:
                     log.msg("%r failed while processing %r:" % (e.reliableListener, e.workUnit))
                     log.err(e.failure)
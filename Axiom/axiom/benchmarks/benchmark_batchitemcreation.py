@@ -1,8 +1,16 @@
 
 """
 Benchmark batch creation of a large number of simple Items in a transaction.
+
+Run with an argument of C{batch} (the default) to create the items with
+L{Store.batchInsert}, or C{create} to instantiate each item in a single
+transaction, so that they are all written to the database when it is
+checkpointed.  An optional second argument gives the number of items to
+create.
 """
 
+import sys, time
+
 from epsilon.scripts import benchmark
 
 from axiom.store import Store
@@ -14,11 +22,32 @@ class AB(Item):
     b = text()
 
 def main():
+    if len(sys.argv) > 1:
+        mode = sys.argv[1]
+    else:
+        mode = 'batch'
+    if len(sys.argv) > 2:
+        count = int(sys.argv[2])
+    else:
+        count = 10000
+
     s = Store("TEMPORARY.axiom")
+    rows = [(x, unicode(x)) for x in xrange(count)]
+    if mode == 'batch':
+        def create():
+            s.batchInsert(AB, (AB.a, AB.b), rows)
+    else:
+        def create():
+            for (a, b) in rows:
+                AB(store=s, a=a, b=b)
+
+    before = time.time()
     benchmark.start()
-    rows = [(x, unicode(x)) for x in xrange(10000)]
-    s.transact(lambda: s.batchInsert(AB, (AB.a, AB.b), rows))
+    s.transact(create)
     benchmark.stop()
+    elapsed = time.time() - before
+    print '%s: %d items in %.2f seconds (%d items/second)' % (
+        mode, count, elapsed, count / elapsed)
 
 
 if __name__ == '__main__':
@@ -1,26 +1,57 @@
 
 """
-Benchmark batch creation of a large number of simple Items in a transaction.
+Benchmark batch deletion of a large number of simple Items in a transaction.
+
+Run with an argument of C{cascade} to also give each item two dependent items
+which refer to it with C{whenDeleted=reference.CASCADE}, each of which has a
+dependent of its own, and an item which refers to it with
+C{whenDeleted=reference.NULLIFY}.  All of these must be dealt with by the
+deletion.
 """
 
+import sys, time, gc
+
 from epsilon.scripts import benchmark
 
 from axiom.store import Store
 from axiom.item import Item
-from axiom.attributes import integer, text
+from axiom.attributes import integer, text, reference
 
 class AB(Item):
     a = integer()
     b = text()
 
+class Dependent(Item):
+    ab = reference(reftype=AB, whenDeleted=reference.CASCADE)
+
+class SecondDependent(Item):
+    dependent = reference(reftype=Dependent, whenDeleted=reference.CASCADE)
+
+class Referrer(Item):
+    ab = reference(reftype=AB, whenDeleted=reference.NULLIFY)
+
 def main():
+    cascade = sys.argv[1:] == ['cascade']
     s = Store("TEMPORARY.axiom")
     rows = [(x, unicode(x)) for x in xrange(10000)]
     s.transact(lambda: s.batchInsert(AB, (AB.a, AB.b), rows))
-
+    if cascade:
+        def dependents():
+            abs = list(s.query(AB))
+            s.batchInsert(Dependent, (Dependent.ab,),
+                          [(ab,) for ab in abs for i in range(2)])
+            s.batchInsert(SecondDependent, (SecondDependent.dependent,),
+                          [(d,) for d in s.query(Dependent)])
+            s.batchInsert(Referrer, (Referrer.ab,), [(ab,) for ab in abs])
+        s.transact(dependents)
+    # Make sure none of the items are still in memory.
+    gc.collect()
+
+    before = time.time()
     benchmark.start()
     s.transact(s.query(AB).deleteFromStore)
     benchmark.stop()
+    print 'deleted in %.2f seconds' % (time.time() - before,)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,62 @@
+
+"""
+Benchmark the upgrade of a large number of items whose upgrader was registered
+with L{registerAttributeCopyingUpgrader}.
+
+Run with an argument of C{bulk} (the default) to let the upgrade be done in
+SQL, without loading the items, or C{item} to register the upgrader with a
+C{postCopy} function, so that each item is loaded and upgraded in turn.  An
+optional second argument gives the number of items to upgrade.
+"""
+
+import sys, time
+
+from epsilon.scripts import benchmark
+
+from axiom.store import Store
+from axiom.item import Item, declareLegacyItem
+from axiom.attributes import integer, text
+from axiom.upgrade import registerAttributeCopyingUpgrader
+
+class AB(Item):
+    schemaVersion = 2
+    a = integer()
+    b = text()
+    c = integer(default=0)
+
+LegacyAB = declareLegacyItem(AB.typeName, 1, dict(a=integer(), b=text()))
+
+def main():
+    if len(sys.argv) > 1:
+        mode = sys.argv[1]
+    else:
+        mode = 'bulk'
+    if len(sys.argv) > 2:
+        count = int(sys.argv[2])
+    else:
+        count = 10000
+
+    if mode == 'bulk':
+        registerAttributeCopyingUpgrader(AB, 1, 2)
+    else:
+        registerAttributeCopyingUpgrader(AB, 1, 2, lambda ab: None)
+
+    s = Store("TEMPORARY.axiom")
+    rows = [(x, unicode(x)) for x in xrange(count)]
+    s.transact(lambda: s.batchInsert(LegacyAB, (LegacyAB.a, LegacyAB.b), rows))
+    s.close()
+
+    # Open the store again so that it finds the items to upgrade.
+    s = Store("TEMPORARY.axiom")
+    before = time.time()
+    benchmark.start()
+    for ignored in s._upgradeManager.upgradeBatch(100):
+        pass
+    benchmark.stop()
+    elapsed = time.time() - before
+    print '%s: %d items in %.2f seconds (%d items/second)' % (
+        mode, count, elapsed, count / elapsed)
+
+
+if __name__ == '__main__':
+    main()
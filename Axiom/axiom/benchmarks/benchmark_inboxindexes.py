@@ -0,0 +1,112 @@
+
+"""
+Benchmark the queries behind a mail client's inbox views, against messages with
+the plain indexes which are all that could be declared before, and against
+messages with partial and mixed-direction indexes declared for those views.
+
+An optional argument gives the number of messages of each kind.
+"""
+
+import sys, time, random
+
+from epsilon.scripts import benchmark
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import integer, boolean, text, compoundIndex, AND
+
+# The number of folders the messages are spread over, and the fraction of
+# them which are unread.
+FOLDERS = 10
+UNREAD = 0.05
+
+# The number of messages on a page of a view.
+PAGE = 20
+
+class PlainMessage(Item):
+    folder = integer()
+    read = boolean()
+    received = integer()
+    sender = text()
+
+    compoundIndex(folder, received)
+    compoundIndex(folder, read, received)
+    compoundIndex(folder, sender, received)
+
+
+class IndexedMessage(Item):
+    folder = integer()
+    read = boolean()
+    received = integer()
+    sender = text()
+
+    compoundIndex(folder, received)
+    unread = compoundIndex(folder, received.descending, where=(read == False))
+    compoundIndex(folder, sender, received.descending)
+
+
+def views(s, messageType, unread):
+    """
+    Return the names and functions of the views to time for C{messageType} in
+    the store C{s}, whose unread messages are found with the comparison
+    C{unread}.
+    """
+    def unreadPage():
+        return list(s.query(
+                messageType, AND(messageType.folder == 3, unread),
+                sort=messageType.received.descending, limit=PAGE))
+    def unreadCount():
+        return s.query(messageType,
+                       AND(messageType.folder == 3, unread)).count()
+    def bySenderPage(page):
+        return list(s.query(
+                messageType, messageType.folder == 3,
+                sort=[messageType.sender.ascending,
+                      messageType.received.descending],
+                limit=PAGE, offset=PAGE * page))
+    return [('newest unread', unreadPage),
+            ('unread count', unreadCount),
+            ('by sender, newest first', lambda: bySenderPage(0)),
+            ('by sender, newest first, page 50', lambda: bySenderPage(50))]
+
+
+def timed(f, count=50):
+    """
+    Call C{f} C{count} times and return the mean time taken by each call.
+    """
+    before = time.time()
+    for i in xrange(count):
+        f()
+    return (time.time() - before) / count
+
+
+def main():
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    else:
+        count = 100000
+
+    s = Store("TEMPORARY.axiom")
+    rows = [(random.randrange(FOLDERS), random.random() >= UNREAD, i,
+             u'sender%d@example.com' % (random.randrange(200),))
+            for i in xrange(count)]
+    for messageType in PlainMessage, IndexedMessage:
+        s.transact(
+            s.batchInsert, messageType,
+            [messageType.folder, messageType.read, messageType.received,
+             messageType.sender], rows)
+
+    benchmark.start()
+    results = []
+    for ((name, plain), (ignored, indexed)) in zip(
+        views(s, PlainMessage, PlainMessage.read == False),
+        views(s, IndexedMessage, IndexedMessage.unread.where)):
+        results.append((name, timed(plain), timed(indexed)))
+    benchmark.stop()
+    for (name, plain, indexed) in results:
+        print '%s: %.2f milliseconds with plain indexes, %.2f with declared ones' % (
+            name, plain * 1000, indexed * 1000)
+
+
+if __name__ == '__main__':
+    main()
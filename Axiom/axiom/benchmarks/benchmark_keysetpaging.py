@@ -0,0 +1,80 @@
+
+"""
+Benchmark finding pages deep into the results of a query over a large table,
+with LIMIT and OFFSET and with keyset pagination.
+
+The first argument, if given, is the number of items the query finds (there
+are as many again which it does not).  Any others are the pages to find, in
+place of the defaults.
+"""
+
+import sys, time
+
+from epsilon.scripts import benchmark
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import integer, compoundIndex
+
+# The number of items on each page.
+PAGE = 20
+
+# The number of times each page is found.
+REPEAT = 20
+
+class Message(Item):
+    folder = integer()
+    received = integer()
+    compoundIndex(folder, received.descending)
+
+
+def timed(f):
+    """
+    Call C{f} L{REPEAT} times and return the mean time each call took.
+    """
+    before = time.time()
+    for i in xrange(REPEAT):
+        f()
+    return (time.time() - before) / REPEAT
+
+
+def main():
+    count = 100000
+    pages = [1, 50, 500, 2500, 4999]
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        pages = map(int, sys.argv[2:])
+
+    s = Store("TEMPORARY.axiom")
+    s.transact(s.batchInsert, Message, [Message.folder, Message.received],
+               [(i % 2, i // 3) for i in xrange(count * 2)])
+    query = s.query(Message, Message.folder == 0,
+                    sort=[Message.received.descending,
+                          Message.storeID.descending])
+
+    results = []
+    benchmark.start()
+    for page in pages:
+        offset = page * PAGE
+        [last] = s.query(Message, Message.folder == 0,
+                         sort=query.sort, offset=offset - 1, limit=1)
+        cursor = query.cursorFor(last)
+        expected = query.pageAfter(cursor, PAGE)
+        if list(s.query(Message, Message.folder == 0, sort=query.sort,
+                        offset=offset, limit=PAGE)) != expected:
+            raise AssertionError("Pages differ at %d" % (page,))
+        results.append((
+                page,
+                timed(lambda: list(s.query(Message, Message.folder == 0,
+                                           sort=query.sort, offset=offset,
+                                           limit=PAGE))),
+                timed(lambda: query.pageAfter(cursor, PAGE))))
+    benchmark.stop()
+    for (page, offset, keyset) in results:
+        print 'page %d: %.2f milliseconds with OFFSET, %.2f with a cursor' % (
+            page, offset * 1000, keyset * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+
+"""
+Benchmark the rate at which the scheduler runs a backlog of events which are
+all overdue, for backlogs of several sizes.
+
+The first argument, if given, is the number of events to run in each
+transaction (by default, one).  Any others are the sizes of the backlogs to
+drain, in place of the defaults.
+"""
+
+import sys, time
+from datetime import timedelta
+
+from epsilon.scripts import benchmark
+from epsilon.extime import Time
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import integer
+from axiom.iaxiom import IScheduler
+from axiom.scheduler import TimedEvent
+
+class Runnable(Item):
+    runs = integer(default=0)
+
+    def run(self):
+        self.runs += 1
+
+
+def drain(s, backlog):
+    """
+    Schedule C{backlog} overdue events, then tick the scheduler until it has
+    run them all, and return how long that took.
+    """
+    past = Time() - timedelta(hours=1)
+    def schedule():
+        s.batchInsert(Runnable, (Runnable.runs,), [(0,)] * backlog)
+        s.batchInsert(TimedEvent, (TimedEvent.time, TimedEvent.runnable),
+                      [(past, runnable) for runnable in s.query(Runnable)])
+    s.transact(schedule)
+
+    scheduler = IScheduler(s)
+    before = time.time()
+    while scheduler._getNextEvent(scheduler.now()) is not None:
+        scheduler.tick()
+    elapsed = time.time() - before
+
+    s.transact(s.query(Runnable).deleteFromStore)
+    return elapsed
+
+
+def main():
+    eventsPerTransaction = 1
+    backlogs = [100, 1000, 10000]
+    if len(sys.argv) > 1:
+        eventsPerTransaction = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        backlogs = map(int, sys.argv[2:])
+
+    s = Store("TEMPORARY.axiom")
+    IScheduler(s).eventsPerTransaction = eventsPerTransaction
+    benchmark.start()
+    results = [(backlog, drain(s, backlog)) for backlog in backlogs]
+    benchmark.stop()
+    for (backlog, elapsed) in results:
+        print '%d events per transaction: %d events in %.2f seconds (%d events/second)' % (
+            eventsPerTransaction, backlog, elapsed, backlog / elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+
+"""
+Benchmark operations on a large L{axiom.sequence.List}: inserting entries in
+its middle and at its start, deleting them, membership tests, and reading a
+slice.
+
+An optional argument gives the number of entries in the list.
+"""
+
+import sys, time
+
+from epsilon.scripts import benchmark
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import integer
+from axiom.sequence import List
+
+class Entry(Item):
+    value = integer()
+
+def timed(description, count, f):
+    """
+    Call C{f} C{count} times and report how long each call took.
+    """
+    before = time.time()
+    for i in xrange(count):
+        f()
+    elapsed = time.time() - before
+    print '%s: %.2f milliseconds each' % (description, elapsed / count * 1000)
+
+
+def main():
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    else:
+        count = 100000
+
+    s = Store("TEMPORARY.axiom")
+    def fill():
+        entries = [Entry(store=s, value=i) for i in xrange(count)]
+        return entries, List(entries, store=s)
+    before = time.time()
+    entries, seq = s.transact(fill)
+    print 'created %d entries in %.2f seconds' % (count, time.time() - before)
+
+    middle = count // 2
+    benchmark.start()
+    timed('insert in the middle', 100,
+          lambda: s.transact(seq.insert, middle, entries[0]))
+    timed('insert at the start', 100,
+          lambda: s.transact(seq.insert, 0, entries[0]))
+    timed('delete from the middle', 100,
+          lambda: s.transact(seq.__delitem__, middle))
+    timed('membership', 100, lambda: entries[-1] in seq)
+    timed('count', 100, lambda: seq.count(entries[0]))
+    timed('read one entry from the middle', 100, lambda: seq[middle])
+    timed('read a 100 entry slice', 100, lambda: seq[middle:middle + 100])
+    benchmark.stop()
+
+
+if __name__ == '__main__':
+    main()
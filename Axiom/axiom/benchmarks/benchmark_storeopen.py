@@ -0,0 +1,82 @@
+
+"""
+Benchmark opening stores which contain increasing numbers of item types, both
+when their schema has been checked before and is not checked again, and when
+it is checked each time.
+
+The arguments, if given, are the numbers of item types, in place of the
+defaults.
+"""
+
+import sys, time
+
+from epsilon.scripts import benchmark
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import integer, text
+from axiom import _schema
+
+# The number of times each store is opened.
+OPENS = 20
+
+# The item types defined so far by itemTypes.
+_itemTypes = []
+
+def itemTypes(count):
+    """
+    Return C{count} item types, each with a few attributes and an index,
+    defining any which have not been defined already.
+    """
+    for i in xrange(len(_itemTypes), count):
+        _itemTypes.append(type('Type%d' % (i,), (Item,), dict(
+                    __module__=__name__,
+                    typeName='benchmark_storeopen_type_%d' % (i,),
+                    schemaVersion=1,
+                    a=integer(indexed=True),
+                    b=text(),
+                    c=integer())))
+    return _itemTypes[:count]
+
+
+def openStore(path, check):
+    """
+    Open and close the store at C{path}, and return how long that took.  If
+    C{check} is true, make sure the store's schema is checked the next time it
+    is opened.
+    """
+    before = time.time()
+    s = Store(path)
+    elapsed = time.time() - before
+    if check:
+        s.executeSchemaSQL(_schema.CLEAR_FINGERPRINT)
+    s.close()
+    return elapsed
+
+
+def main():
+    counts = [10, 100, 500]
+    if len(sys.argv) > 1:
+        counts = map(int, sys.argv[1:])
+
+    results = []
+    benchmark.start()
+    for count in counts:
+        path = 'TEMPORARY-%d.axiom' % (count,)
+        s = Store(path)
+        for itemType in itemTypes(count):
+            itemType(store=s)
+        s.close()
+        openStore(path, False)
+        cached = sum([openStore(path, False) for i in xrange(OPENS)])
+        openStore(path, True)
+        checked = sum([openStore(path, True) for i in xrange(OPENS)])
+        results.append((count, cached / OPENS, checked / OPENS))
+    benchmark.stop()
+    for (count, cached, checked) in results:
+        print '%d types: %.2f milliseconds to open, %.2f checking schema' % (
+            count, cached * 1000, checked * 1000)
+
+
+if __name__ == '__main__':
+    main()
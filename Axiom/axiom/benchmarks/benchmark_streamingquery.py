@@ -0,0 +1,53 @@
+
+"""
+Benchmark iteration of a query with a large number of results, either by
+streaming them from the database a chunk at a time or by loading them all at
+once, and report the peak memory use of each.
+
+Run with an argument of C{stream} (the default) or C{list}.  Since the peak
+resident set size of a process never decreases, each approach must be measured
+in a separate process.
+"""
+
+import sys, resource
+
+from epsilon.scripts import benchmark
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import integer, text
+
+class AB(Item):
+    a = integer()
+    b = text()
+
+def main():
+    if len(sys.argv) > 1:
+        mode = sys.argv[1]
+    else:
+        mode = 'stream'
+    s = Store("TEMPORARY.axiom")
+    # Insert the rows a few at a time, so that populating the store does not
+    # itself raise the peak memory use of the process.
+    for start in xrange(0, 100000, 1000):
+        s.transact(lambda: s.batchInsert(
+                AB, (AB.a, AB.b),
+                ((x, u'x' * 1000) for x in xrange(start, start + 1000))))
+
+    query = s.query(AB).getColumn('b')
+    if mode == 'stream':
+        results = query.stream()
+    else:
+        results = iter(query)
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    benchmark.start()
+    for b in results:
+        pass
+    benchmark.stop()
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print '%s: peak RSS grew by %d kB' % (mode, after - before)
+
+
+if __name__ == '__main__':
+    main()
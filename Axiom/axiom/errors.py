@@ -84,6 +84,15 @@ class TableAlreadyExists(SQLError):
 
 
 
+class StreamingQueryInterrupted(RuntimeError):
+    """
+    A streaming query which was begun inside a transaction was resumed after
+    that transaction had finished.  Its remaining results can no longer be
+    trusted to be consistent with the results it has already produced.
+    """
+
+
+
 class UnknownItemType(Exception):
     """
     Can't load an item: it's of a type that I don't see anywhere in Python.
@@ -255,6 +255,10 @@ class IReliableListener(Interface):
     {IReliableListener} providers are given to
     L{IBatchProcessor.addReliableListener} and will then have L{processItem}
     called with items handled by that processor.
+
+    When a processor is stepped with a batch size of more than one, a provider
+    may also have a C{processItems} method, which is then called with a
+    C{list} of items in place of calling L{processItem} for each of them.
     """
 
     def processItem(item):
@@ -705,6 +705,14 @@ class Item(Empowered, slotmachine._Strict):
             if not self.__legacy__:
                 self.store.objectCache.uncache(self.storeID, self)
             return
+        self._reload()
+
+
+    def _reload(self):
+        """
+        Discard any changes made to this item in memory, replacing its
+        attribute values with the ones in the database, where it must exist.
+        """
         self.__dirty__.clear()
         dbattrs = self.store.querySQL(
             self._baseSelectSQL(self.store),
@@ -760,21 +768,36 @@ class Item(Empowered, slotmachine._Strict):
 
         if self.store is None:
             raise NotInStore("You can't checkpoint %r: not in a store" % (self,))
+        self._checkpoint(self.store.executeSQL)
 
 
+    def _checkpoint(self, executeSQL):
+        """
+        Do the work of L{checkpoint}, passing each SQL statement it requires
+        to C{executeSQL} rather than necessarily executing it immediately.
+
+        L{Store.checkpoint} uses this to collect the statements for every item
+        changed in a transaction, so that identical statements can be executed
+        together.
+
+        @param executeSQL: a callable taking an SQL statement and a C{list} of
+            its arguments, which will be executed before the transaction ends.
+        """
         if self.__deleting:
             if not self.__everInserted:
                 # don't issue duplicate SQL and crap; we were created, then
                 # destroyed immediately.
                 return
-            self.store.executeSQL(self._baseDeleteSQL(self.store), [self.storeID])
+            executeSQL(self._baseDeleteSQL(self.store), [self.storeID])
             # re-using OIDs plays havoc with the cache, and with other things
             # as well.  We need to make sure that we leave a placeholder row at
             # the end of the table.
             if self.__deletingObject:
                 # Mark this object as dead.
-                self.store.executeSchemaSQL(_schema.CHANGE_TYPE,
-                                            [-1, self.storeID])
+                executeSQL(
+                    _schema.CHANGE_TYPE.replace('*DATABASE*',
+                                                self.store.databaseName),
+                    [-1, self.storeID])
 
                 # Can't do this any more:
                 # self.store.executeSchemaSQL(_schema.DELETE_OBJECT, [self.storeID])
@@ -798,7 +821,7 @@ class Item(Empowered, slotmachine._Strict):
                 # we might have been checkpointed twice within the same
                 # transaction; just don't do anything.
                 return
-            self.store.executeSQL(*self._updateSQL())
+            executeSQL(*self._updateSQL())
         else:
             # case 2: we are in the middle of creating the object, we've never
             # been inserted into the db before
@@ -811,7 +834,7 @@ class Item(Empowered, slotmachine._Strict):
                 insertArgs.append(attributeValue)
 
             # XXX this isn't atomic, gross.
-            self.store.executeSQL(self._baseInsertSQL(self.store), insertArgs)
+            executeSQL(self._baseInsertSQL(self.store), insertArgs)
             self.__everInserted = True
         # In case 1, we're dirty but we did an update, synchronizing the
         # database, in case 2, we haven't been created but we issue an insert.
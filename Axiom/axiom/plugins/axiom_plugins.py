@@ -25,6 +25,7 @@ from axiom import store, attributes, userbase, dependency, errors
 from axiom.substore import SubStore
 from axiom.scripts import axiomatic
 from axiom.listversions import ListVersions
+from axiom.queryprofile import QueryProfiler
 from axiom import version
 from axiom.iaxiom import IVersion
 
@@ -145,6 +146,59 @@ class Browse(axiomatic.AxiomaticCommand):
 
 
 
+class Profile(axiomatic.AxiomaticCommand):
+    synopsis = "[options] [script]"
+
+    name = 'profile'
+    description = ('Run Python code against an Axiom store and report on the '
+                   'SQL statements it caused to be run.')
+
+    optParameters = [
+        ('command', 'c', None, 'Python code to run, instead of a script.'),
+        ('count', 'n', '10', 'Number of statements to report on.'),
+        ('order', 'o', 'total',
+         'What to order the statements by: total, mean or max time, '
+         'count or rows.'),
+        ]
+
+    def parseArgs(self, script=None):
+        self['script'] = script
+
+
+    def postOptions(self):
+        try:
+            count = int(self['count'])
+        except ValueError:
+            raise usage.UsageError('count must be an integer')
+        if self['order'] not in QueryProfiler.orderings:
+            raise usage.UsageError(
+                'order must be one of ' +
+                ', '.join(sorted(QueryProfiler.orderings)))
+        if (self['command'] is None) == (self['script'] is None):
+            raise usage.UsageError('Specify either a script or a command')
+
+        if self['command'] is not None:
+            source, filename = self['command'], '<command>'
+        else:
+            filename = self['script']
+            source = file(filename).read()
+        code = compile(source, filename, 'exec')
+
+        siteStore = self.parent.getStore()
+        namespace = {'db': siteStore, 'store': store}
+        profiler = siteStore.startProfiling()
+        try:
+            siteStore.transact(self._run, code, namespace)
+        finally:
+            siteStore.stopProfiling()
+        print profiler.report(count, self['order'])
+
+
+    def _run(self, code, namespace):
+        exec code in namespace
+
+
+
 class UserbaseMixin:
     def installOn(self, other):
         # XXX check installation on other, not store
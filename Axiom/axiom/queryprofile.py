@@ -0,0 +1,326 @@
+# -*- test-case-name: axiom.test.test_queryprofile -*-
+
+"""
+Profiling of the SQL statements run by a L{Store<axiom.store.Store>}.
+
+Profiling is off by default.  It is turned on for one store with
+L{Store.startProfiling<axiom.store.Store.startProfiling>}, which returns the
+L{QueryProfiler} that records every statement the store runs from then on,
+whether it came from a query or was passed to
+L{Store.querySQL<axiom.store.Store.querySQL>} directly.  From a manhole or
+C{axiomatic browse}::
+
+    >>> profiler = db.startProfiling()
+    >>> # ... let the application run for a while ...
+    >>> print profiler.report()
+    >>> db.stopProfiling()
+
+C{axiomatic profile} runs some code against a store and prints the report.
+"""
+
+import os, re, sys, math, random
+
+from axiom.errors import SQLError
+
+# The greatest number of execution times kept for each statement, from which
+# its percentile latencies are estimated.  Once there are more, a random sample
+# of them is kept.
+SAMPLES = 1000
+
+# The greatest number of distinct SQL strings whose fingerprints are
+# remembered.  Statements with varying numbers of parameters produce a great
+# many strings, so the memo is emptied whenever it reaches this size.
+FINGERPRINT_CACHE_SIZE = 1000
+
+# The modules, relative to this package, which only pass statements along on
+# behalf of their callers, and so are skipped when looking for the code
+# responsible for a statement.
+_internalModules = ['store', 'item', 'attributes', 'slotmachine',
+                    'queryprofile']
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_internalPaths = dict.fromkeys([os.path.join(_here, name)
+                                for name in _internalModules])
+_isInternal = {}
+
+_literal = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_parameterList = re.compile(r'\?(?:\s*,\s*\?)+')
+_whitespace = re.compile(r'\s+')
+
+# The statements which SQLite will explain, as opposed to schema changes.
+_explainable = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+
+def fingerprint(sql):
+    """
+    Reduce an SQL statement to a form shared by all the statements which differ
+    from it only in their literal values or in the number of parameters in a
+    list.
+
+    @type sql: C{str}
+    @rtype: C{str}
+    """
+    sql = _literal.sub('?', sql)
+    sql = _parameterList.sub('?, ...', sql)
+    return _whitespace.sub(' ', sql).strip()
+
+
+
+def _callSite():
+    """
+    Return the file name and line number of the code outside Axiom's query
+    machinery which is running the current statement.
+    """
+    frame = sys._getframe(2)
+    while frame.f_back is not None:
+        filename = frame.f_code.co_filename
+        try:
+            internal = _isInternal[filename]
+        except KeyError:
+            internal = _isInternal[filename] = (
+                os.path.splitext(os.path.abspath(filename))[0]
+                in _internalPaths)
+        if not internal:
+            break
+        frame = frame.f_back
+    return (frame.f_code.co_filename, frame.f_lineno)
+
+
+
+class StatementStatistics(object):
+    """
+    What is known about all the executions of statements with one fingerprint.
+
+    @ivar fingerprint: the fingerprint of the statements, as returned by
+        L{fingerprint}.
+
+    @ivar count: the number of times the statements were run.
+
+    @ivar totalTime: the number of seconds spent running them, in total.
+
+    @ivar rows: the number of rows they returned, in total, counting the rows
+        changed by statements which return none.
+
+    @ivar callSites: a C{dict} mapping C{(filename, lineno)} tuples to the
+        number of statements run from there.
+
+    @ivar samples: some of the execution times, at most L{SAMPLES} of them.
+
+    @ivar slowestTime: the number of seconds taken by the slowest execution.
+
+    @ivar slowestSQL: the SQL of the slowest execution.
+
+    @ivar slowestArgs: the arguments of the slowest execution.
+
+    @ivar plan: C{None} if the slowest execution has not been explained,
+        otherwise a C{list} of the details of each step of its query plan, as
+        given by SQLite's C{EXPLAIN QUERY PLAN}.
+    """
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.count = 0
+        self.totalTime = 0.0
+        self.rows = 0
+        self.callSites = {}
+        self.samples = []
+        self.slowestTime = -1.0
+        self.slowestSQL = None
+        self.slowestArgs = None
+        self.plan = None
+
+
+    def record(self, sql, args, elapsed, rows, callSite, count=1):
+        """
+        Add C{count} executions of a statement, which took C{elapsed} seconds
+        between them, to these statistics.
+        """
+        self.count += count
+        self.totalTime += elapsed
+        self.rows += rows
+        self.callSites[callSite] = self.callSites.get(callSite, 0) + count
+        # Executions run together are sampled once, at their mean time.
+        elapsed = elapsed / count
+        if len(self.samples) < SAMPLES:
+            self.samples.append(elapsed)
+        else:
+            i = random.randrange(self.count)
+            if i < SAMPLES:
+                self.samples[i] = elapsed
+        if elapsed > self.slowestTime:
+            self.slowestTime = elapsed
+            self.slowestSQL = sql
+            self.slowestArgs = args
+            self.plan = None
+
+
+    def meanTime(self):
+        """
+        Return the mean number of seconds taken to run the statements.
+        """
+        return self.totalTime / self.count
+
+
+    def percentile(self, percent):
+        """
+        Return an estimate of the number of seconds within which C{percent}
+        percent of the executions of the statements finished.
+        """
+        samples = sorted(self.samples)
+        index = int(math.ceil(len(samples) * percent / 100.0)) - 1
+        return samples[max(index, 0)]
+
+
+    def fullScans(self):
+        """
+        Return the details of the steps of the plan of the slowest execution
+        which read every row of a table or index, or C{None} if it has not been
+        explained.
+        """
+        if self.plan is None:
+            return None
+        return [detail for detail in self.plan
+                if detail.startswith('SCAN ')
+                and detail != 'SCAN CONSTANT ROW']
+
+
+
+class QueryProfiler(object):
+    """
+    Statistics about the SQL statements run by a store, grouped by their
+    fingerprints.
+
+    @ivar store: the L{Store<axiom.store.Store>} being profiled.
+
+    @ivar statements: a C{dict} mapping fingerprints to
+        L{StatementStatistics}.
+    """
+    # The ways statements can be ordered in a report, and the functions which
+    # give the value they are ordered by.
+    orderings = {
+        'total': lambda stats: stats.totalTime,
+        'count': lambda stats: stats.count,
+        'mean': lambda stats: stats.meanTime(),
+        'max': lambda stats: stats.slowestTime,
+        'rows': lambda stats: stats.rows}
+
+    def __init__(self, store):
+        self.store = store
+        self.statements = {}
+        self._fingerprints = {}
+
+
+    def record(self, sql, args, elapsed, rows, count=1):
+        """
+        Add executions of a statement to the profile.
+
+        @param sql: the SQL that was run.
+        @param args: the arguments it was run with, the first time.
+        @param elapsed: the number of seconds it took, in total.
+        @param rows: the number of rows it returned, or changed if it returns
+            none.
+        @param count: the number of times it was run, with different
+            arguments, at once.
+        """
+        try:
+            key = self._fingerprints[sql]
+        except KeyError:
+            if len(self._fingerprints) >= FINGERPRINT_CACHE_SIZE:
+                self._fingerprints.clear()
+            key = self._fingerprints[sql] = fingerprint(sql)
+        try:
+            stats = self.statements[key]
+        except KeyError:
+            stats = self.statements[key] = StatementStatistics(key)
+        stats.record(sql, args, elapsed, rows, _callSite(), count)
+
+
+    def reset(self):
+        """
+        Forget everything recorded so far.
+        """
+        self.statements.clear()
+
+
+    def slowest(self, count=10, orderBy='total'):
+        """
+        Return the statistics of the statements which took the most time.
+
+        @param count: the greatest number of statements to return.
+
+        @param orderBy: how to measure the time taken: C{'total'}, C{'mean'}
+            or C{'max'}; or C{'count'} or C{'rows'} to order the statements by
+            how many times they were run or how many rows they returned.
+
+        @return: a C{list} of L{StatementStatistics}, most expensive first.
+        """
+        try:
+            key = self.orderings[orderBy]
+        except KeyError:
+            raise ValueError("Unknown ordering: %r" % (orderBy,))
+        statements = self.statements.values()
+        statements.sort(key=key, reverse=True)
+        return statements[:count]
+
+
+    def explain(self, stats):
+        """
+        Ask SQLite how it runs the slowest execution of some statements, and
+        remember its answer as their C{plan}.
+
+        The statement is not run, so this is safe for statements which change
+        the database, too.  Statements which SQLite cannot explain, such as
+        schema changes or those referring to tables which no longer exist, are
+        left with a C{plan} of C{None}.
+
+        @type stats: L{StatementStatistics}
+        """
+        sql = stats.slowestSQL
+        if stats.plan is not None or sql is None:
+            return
+        if sql.lstrip().split(None, 1)[0].upper() not in _explainable:
+            return
+        cursor = self.store.connection.cursor()
+        try:
+            try:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, stats.slowestArgs)
+                stats.plan = [str(row[-1]) for row in cursor]
+            except SQLError:
+                pass
+        finally:
+            cursor.close()
+
+
+    def report(self, count=10, orderBy='total'):
+        """
+        Describe the statements which took the most time, explaining each of
+        them and flagging those whose plans scan whole tables.
+
+        @param count: the greatest number of statements to describe.
+
+        @param orderBy: how the statements are ordered; see L{slowest}.
+
+        @rtype: C{str}
+        """
+        lines = []
+        for stats in self.slowest(count, orderBy):
+            self.explain(stats)
+            lines.append(stats.fingerprint)
+            lines.append(
+                '  %d executions, %d rows, %.2fms total, %.2fms mean, '
+                'p50 %.2fms, p90 %.2fms, p99 %.2fms, %.2fms max' % (
+                    stats.count, stats.rows, stats.totalTime * 1000,
+                    stats.meanTime() * 1000, stats.percentile(50) * 1000,
+                    stats.percentile(90) * 1000, stats.percentile(99) * 1000,
+                    stats.slowestTime * 1000))
+            sites = stats.callSites.items()
+            sites.sort(key=lambda (site, n): n, reverse=True)
+            for ((filename, lineno), n) in sites:
+                lines.append('  %d from %s:%d' % (n, filename, lineno))
+            if stats.plan is not None:
+                for detail in stats.plan:
+                    lines.append('  plan: ' + detail)
+                for detail in stats.fullScans():
+                    lines.append('  FULL SCAN: ' + detail)
+            lines.append('')
+        return '\n'.join(lines)
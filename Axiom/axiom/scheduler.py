@@ -108,28 +108,99 @@ class _WackyControlFlow(Exception):
 MAX_WORK_PER_TICK = 10
 
 class SchedulerMixin:
+    """
+    Implementation of L{IScheduler} in terms of L{TimedEvent}s in C{store}.
+
+    Other processes may schedule events in the same store, so the time of the
+    next event is always found by querying the database, never remembered.
+
+    @ivar eventsPerTransaction: The number of events run in each transaction
+        by L{tick}.  If it is more than one, the due events are loaded that
+        many at a time, in one query, and each event is run in a savepoint,
+        so that a failure in one of them does not revert the others.  If it
+        is one, each event is loaded by a query of its own in the transaction
+        which runs it.
+    """
+    eventsPerTransaction = 1
+
     def _oneTick(self, now):
         theEvent = self._getNextEvent(now)
         if theEvent is None:
             return False
+        self._runEvent(now, theEvent)
+        return True
+
+
+    def _runEvent(self, now, theEvent):
         try:
             theEvent.invokeRunnable()
         except:
             raise _WackyControlFlow(theEvent, failure.Failure())
         self.lastEventAt = now
-        return True
 
 
     def _getNextEvent(self, now):
         # o/` gonna party like it's 1984 o/`
-        theEventL = list(self.store.query(TimedEvent,
-                                          TimedEvent.time <= now,
-                                          sort=TimedEvent.time.ascending,
-                                          limit=1))
+        theEventL = self._getDueEvents(now, 1)
         if theEventL:
             return theEventL[0]
 
 
+    def _getDueEvents(self, now, limit):
+        """
+        Load at most C{limit} of the events which are due to be run at C{now},
+        earliest first, along with their runnables.
+        """
+        return list(self.store.query(TimedEvent,
+                                     TimedEvent.time <= now,
+                                     sort=TimedEvent.time.ascending,
+                                     limit=limit,
+                                     prefetch=[TimedEvent.runnable]))
+
+
+    def _stillDue(self, now, theEvent):
+        """
+        Determine whether an event loaded by L{_getDueEvents} is still due, as
+        running the events before it may have rescheduled or deleted it.
+        """
+        if theEvent.store is None or theEvent.time > now:
+            return False
+        if theEvent in (self.store.transaction or ()):
+            # Changed earlier in this transaction, maybe deleted; only the
+            # database knows for sure.
+            return bool(self.store.query(
+                    TimedEvent,
+                    AND(TimedEvent.storeID == theEvent.storeID,
+                        TimedEvent.time <= now)).count())
+        return True
+
+
+    def _runEvents(self, now, limit):
+        """
+        Load at most C{limit} of the events which are due to be run at C{now}
+        and run them in the current transaction, so that no other process can
+        change them in between, each in a savepoint of its own, handling any
+        of them which fail.
+
+        @return: A three-tuple of the number of events which were run, the
+            number of those which failed, and whether more events are due.
+        """
+        ran = errors = 0
+        # Load one more, to find out whether there are any left afterwards.
+        events = self._getDueEvents(now, limit + 1)
+        for theEvent in events[:limit]:
+            if not self._stillDue(now, theEvent):
+                continue
+            try:
+                self.store.savepoint(self._runEvent, now, theEvent)
+            except _WackyControlFlow, wcf:
+                theEvent.handleError(now, wcf.failureObject)
+                log.err(wcf.failureObject)
+                errors += 1
+            ran += 1
+        return ran, errors, len(events) > limit
+
+
     def tick(self):
         now = self.now()
         self.nextEventAt = None
@@ -137,6 +208,14 @@ class SchedulerMixin:
         workUnitsPerformed = 0
         errors = 0
         while workBeingDone and workUnitsPerformed < MAX_WORK_PER_TICK:
+            if self.eventsPerTransaction > 1:
+                limit = min(self.eventsPerTransaction,
+                            MAX_WORK_PER_TICK - workUnitsPerformed)
+                ran, failed, workBeingDone = self.store.transact(
+                    self._runEvents, now, limit)
+                workUnitsPerformed += ran
+                errors += failed
+                continue
             try:
                 workBeingDone = self.store.transact(self._oneTick, now)
             except _WackyControlFlow, wcf:
@@ -146,6 +225,8 @@ class SchedulerMixin:
                 workBeingDone = True
             if workBeingDone:
                 workUnitsPerformed += 1
+        # Other processes may have scheduled events in this store, so the
+        # database is the only place to find out which is next.
         x = list(self.store.query(TimedEvent, sort=TimedEvent.time.ascending, limit=1))
         if x:
             self._transientSchedule(x[0].time, now)
@@ -372,7 +453,7 @@ class _SchedulerCompatMixin(object):
         if '_axiom_memory_dummy' in vars(self):
             stacklevel = 7
         else:
-            stacklevel = 5
+            stacklevel = 6
         warnings.warn(
             self.__class__.__name__ + " is deprecated since Axiom 0.5.32.  "
             "Just adapt stores to IScheduler.",
@@ -1,7 +1,27 @@
 # -*- test-case-name: axiom.test.test_sequence -*-
 
+"""
+A persistent list of items.
+
+The entries of a L{List} are L{_ListItem}s, kept in order by their C{_index}
+keys.  The keys are sparse: a new entry takes a key between those of its
+neighbours, so that nothing else has to be renumbered, and only when there is
+no key left between two neighbours are the keys of the entries around them
+spread out again.
+"""
+
 from axiom.item import Item
-from axiom.attributes import reference, integer, AND
+from axiom.attributes import reference, integer, AND, compoundIndex
+
+# The distance between the keys of successive entries appended to a List, or
+# spread out when it is rebalanced.  This many entries can be inserted at the
+# same place, each time halving the gap, before there is no key left there.
+SPACING = 2 ** 16
+
+# The number of entries on each side of a position whose keys are spread out
+# when there is no key left there.  The window is doubled until the keys
+# around it leave enough room.
+REBALANCE_WINDOW = 8
 
 class _ListItem(Item):
     typeName = 'list_item'
@@ -11,6 +31,9 @@ class _ListItem(Item):
     _value = reference()
     _container = reference()
 
+    compoundIndex(_container, _index)
+    compoundIndex(_container, _value)
+
 class List(Item):
     typeName = 'list'
     schemaVersion = 1
@@ -22,20 +45,103 @@ class List(Item):
         if args:
             self.extend(args[0])
 
-    def _queryListItems(self):
-        return self.store.query(_ListItem, _ListItem._container == self)
+    def _queryListItems(self, offset=None, limit=None, prefetch=False,
+                        sort=_ListItem._index.ascending):
+        """
+        Return a query for the entries of this list, in order.
+
+        @param prefetch: If true, load the values of the entries along with
+            them.
+        """
+        if prefetch:
+            prefetch = [_ListItem._value]
+        else:
+            prefetch = None
+        return self.store.query(_ListItem, _ListItem._container == self,
+                                offset=offset, limit=limit, sort=sort,
+                                prefetch=prefetch)
+
+    def _listItemsAt(self, index, count, prefetch=False):
+        """
+        Return a list of the entries of this list starting with the one at
+        C{index}, up to C{count} of them.
+
+        SQLite skips the rows before an offset one at a time, so entries
+        nearer the end of the list are found by skipping from there instead.
+        """
+        count = min(count, self.length - index)
+        if count <= 0:
+            return []
+        fromEnd = self.length - index - count
+        if fromEnd < index:
+            items = list(self._queryListItems(
+                    offset=fromEnd, limit=count, prefetch=prefetch,
+                    sort=_ListItem._index.descending))
+            items.reverse()
+            return items
+        return list(self._queryListItems(
+                offset=index, limit=count, prefetch=prefetch))
 
     def _getListItem(self, index):
-        return list(self.store.query(_ListItem,
-                                     AND(_ListItem._container == self,
-                                         _ListItem._index == index)))[0]
+        for li in self._listItemsAt(index, 1):
+            return li
+        raise IndexError('stored List index out of range')
+
+    def _keysAt(self, index, count):
+        """
+        Return the keys of up to C{count} entries of this list, starting with
+        the one at C{index}.
+        """
+        return [li._index for li in self._listItemsAt(index, count)]
+
+    def _keyBefore(self, index):
+        """
+        Return a key for a new entry at C{index}, before the entry there now
+        (if any), or C{None} if there is no key left for it.
+        """
+        if index == 0:
+            if not self.length:
+                return 0
+            return self._keysAt(0, 1)[0] - SPACING
+        below, above = (self._keysAt(index - 1, 2) + [None])[:2]
+        if above is None:
+            return below + SPACING
+        if above - below < 2:
+            return None
+        return (below + above) // 2
+
+    def _rebalance(self, index):
+        """
+        Spread out the keys of the entries around C{index}, so that there is a
+        key left between each of them.
+        """
+        width = REBALANCE_WINDOW
+        while True:
+            start = max(index - width, 0)
+            end = min(index + width, self.length)
+            count = end - start
+            if start > 0:
+                lower = self._keysAt(start - 1, 1)[0]
+            else:
+                lower = None
+            if end < self.length:
+                upper = self._keysAt(end, 1)[0]
+            else:
+                upper = None
+
+            if lower is None and upper is None:
+                lower, upper = -SPACING, count * SPACING
+            elif lower is None:
+                lower = upper - (count + 1) * SPACING
+            elif upper is None:
+                upper = lower + (count + 1) * SPACING
+            step = (upper - lower) // (count + 1)
+            if step >= 2:
+                break
+            width *= 2
 
-    def _delListItem(self, index, resetIndexes=True):
-        for li in self.store.query(_ListItem,
-                                   AND(_ListItem._container == self,
-                                       _ListItem._index == index)):
-            li.deleteFromStore(deleteObject=True)
-            break
+        for (i, li) in enumerate(self._listItemsAt(start, count)):
+            li._index = lower + step * (i + 1)
 
     def _fixIndex(self, index, truncate=False):
         """
@@ -60,6 +166,14 @@ class List(Item):
         return index
 
     def __getitem__(self, index):
+        if isinstance(index, slice):
+            positions = range(*index.indices(self.length))
+            if not positions:
+                return []
+            first = min(positions)
+            values = [li._value for li in self._listItemsAt(
+                    first, max(positions) - first + 1, prefetch=True)]
+            return [values[pos - first] for pos in positions]
         index = self._fixIndex(index)
         return self._getListItem(index)._value
 
@@ -67,6 +181,10 @@ class List(Item):
         index = self._fixIndex(index)
         self._getListItem(index)._value = value
 
+    def __iter__(self):
+        for li in self._queryListItems(prefetch=True):
+            yield li._value
+
     def __add__(self, other):
         return list(self) + list(other)
     def __radd__(self, other):
@@ -78,13 +196,20 @@ class List(Item):
         return other * list(self)
 
     def index(self, other, start=0, maximum=None):
-        if maximum is None:
-            maximum = len(self)
-        for pos in range(start, maximum):
-            if pos >= len(self):
-                break
-            if self[pos] == other:
-                return pos
+        start, maximum, ignored = slice(start, maximum).indices(self.length)
+        if start < maximum:
+            comparison = AND(_ListItem._container == self,
+                             _ListItem._value == other)
+            if start:
+                comparison = AND(comparison,
+                                 _ListItem._index >= self._keysAt(start, 1)[0])
+            for key in self.store.query(_ListItem, comparison, limit=1,
+                                        sort=_ListItem._index.ascending
+                                        ).getColumn('_index'):
+                pos = self.store.count(_ListItem, AND(
+                        _ListItem._container == self, _ListItem._index < key))
+                if pos < maximum:
+                    return pos
         raise ValueError, 'List.index(x): %r not in List' % other
 
     def __len__(self):
@@ -92,15 +217,15 @@ class List(Item):
 
     def __delitem__(self, index):
         assert not isinstance(index, slice), 'slices are not supported (yet)'
+        index = self._fixIndex(index)
         self._getListItem(index).deleteFromStore()
-        if index < self.length - 1:
-            for item in self.store.query(_ListItem, AND(
-                    _ListItem._container == self, _ListItem._index > index)):
-                item._index -= 1
         self.length -= 1
 
     def __contains__(self, value):
-        return bool(self.count(value))
+        return bool(list(self.store.query(
+                    _ListItem, AND(_ListItem._container == self,
+                                   _ListItem._value == value),
+                    limit=1).getColumn('storeID')))
 
     def append(self, value):
         """
@@ -120,18 +245,14 @@ class List(Item):
         # If we do List(length=5).insert(50, x), we don't want
         # x's _ListItem._index to actually be 50.
         index = min(index, self.length)
-        # This uses list() in case our contents change halfway through.
-        # But does that _really_ work?
-        for li in list(self.store.query(_ListItem,
-                                        AND(_ListItem._container == self,
-                                            _ListItem._index >= index))):
-            # XXX: The performance of this operation probably sucks
-            # compared to what it would be with an UPDATE.
-            li._index += 1
+        key = self._keyBefore(index)
+        if key is None:
+            self._rebalance(index)
+            key = self._keyBefore(index)
         _ListItem(store=self.store,
                   _value=value,
                   _container=self,
-                  _index=index)
+                  _index=key)
         self.length += 1
 
     def pop(self, index=None):
@@ -147,28 +268,18 @@ class List(Item):
 
     def reverse(self):
         # XXX: Also needs to be an atomic action.
-        length = 0
-        for li in list(self.store.query(_ListItem,
-                                        _ListItem._container == self,
-                                        sort=_ListItem._index.desc)):
-            li._index = length
-            length += 1
-        self.length = length
+        for li in list(self._queryListItems()):
+            li._index = -li._index
 
     def sort(self, *args):
         # We want to sort by value, not sort by _ListItem.  We could
         # accomplish this by having _ListItem.__cmp__ do something
         # with self._value, but that seemed wrong. This was easier.
-        values = [li._value for li in self._queryListItems()]
+        items = list(self._queryListItems(prefetch=True))
+        values = [li._value for li in items]
         values.sort(*args)
-        index = 0
-        for li in self._queryListItems():
-            # XXX: Well, can it?
-            assert index < len(values), \
-                   '_ListItems were added during a sort (can this happen?)'
-            li._index = index
-            li._value = values[index]
-            index += 1
+        for (li, value) in zip(items, values):
+            li._value = value
 
     def count(self, value):
         return self.store.count(_ListItem, AND(
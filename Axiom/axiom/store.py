@@ -8,7 +8,11 @@ This module holds the Axiom Store class and related classes, such as queries.
 from epsilon import hotfix
 hotfix.require('twisted', 'filepath_copyTo')
 
-import time, os, itertools, warnings, sys, operator, weakref
+import time, os, itertools, warnings, sys, operator, weakref, base64
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
 
 from zope.interface import implements
 
@@ -24,6 +28,7 @@ from epsilon.pending import PendingEvent
 from epsilon.cooperator import SchedulingService
 
 from axiom import _schema, attributes, upgrade, _fincache, iaxiom, errors
+from axiom import queryprofile
 from axiom import item
 from axiom._pysqlite2 import Connection
 
@@ -31,6 +36,8 @@ from axiom.item import \
     _typeNameToMostRecentClass, declareLegacyItem, \
     _legacyTypes, Empowered, serviceSpecialCase, _StoreIDComparer
 
+_itemCheckpoint = item.Item.checkpoint.im_func
+
 IN_MEMORY_DATABASE = ':memory:'
 
 # The special storeID used to mark the store itself as the target of a
@@ -39,6 +46,21 @@ STORE_SELF_ID = -1
 
 tempCounter = itertools.count()
 
+# The number of rows fetched from the database at a time by a streaming query.
+# See BaseQuery.stream.
+DEFAULT_STREAM_CHUNK_SIZE = 100
+
+# The maximum number of compiled query fragments remembered by each Store.  See
+# Store._compiledQuery.
+QUERY_CACHE_SIZE = 1000
+
+# The number of rows Store.batchInsert inserts with each group of statements.
+BATCH_INSERT_SIZE = 1000
+
+# The largest number of parameters given to a single IN (...) clause.  Older
+# versions of SQLite allow no more than 999 parameters in one statement.
+IN_CLAUSE_SIZE = 500
+
 # A mapping from MetaItem instances to precomputed structures describing the
 # indexes necessary for those MetaItems.  Avoiding recomputing this speeds up
 # opening stores significantly.
@@ -49,6 +71,10 @@ _requiredTableIndexes = weakref.WeakKeyDictionary()
 # up opening stores significantly.
 _inMemorySchemaCache = weakref.WeakKeyDictionary()
 
+# A mapping from MetaItem instances to the parts of schema fingerprints (see
+# Store._schemaFingerprint) describing their in-memory schema.
+_fingerprintCache = weakref.WeakKeyDictionary()
+
 
 
 class NoEmptyItems(Exception):
@@ -143,6 +169,18 @@ def storeServiceSpecialCase(st, pups):
     return collection
 
 
+def _tableStructureKey(tableClass):
+    """
+    Return a hashable object identifying the table which holds items of the
+    given class, or C{None} if C{tableClass} is not an L{Item} subclass (for
+    example, if it is a L{Placeholder}).
+    """
+    if not isinstance(tableClass, type):
+        return None
+    return (tableClass.typeName, tableClass.schemaVersion)
+
+
+
 def _typeIsTotallyUnknown(typename, version):
     return ((typename not in _typeNameToMostRecentClass)
             and ((typename, version) not in _legacyTypes))
@@ -196,8 +234,17 @@ class BaseQuery:
         self.limit = limit
         self.offset = offset
         self.sort = iaxiom.IOrdering(sort)
-        tables = self._involvedTables()
-        self._computeFromClause(tables)
+        self._structure = self._structureKey()
+        if self._structure is None:
+            self._compileClauses()
+        else:
+            (self.fromClauseParts,
+             self.sortClauseParts) = store._compiledQuery(
+                self._structure, self._compileClauses)
+            if self.comparison is not None:
+                self.args = self.comparison.getArgs(self.store)
+            else:
+                self.args = []
 
 
     _cloneAttributes = 'store tableClass comparison limit offset sort'.split()
@@ -241,6 +288,65 @@ class BaseQuery:
                 self._runQuery('EXPLAIN SELECT', self._queryTarget))
 
 
+    def _structureKey(self):
+        """
+        Return a hashable object which identifies the FROM and ORDER BY clauses
+        of this query, and the form of its WHERE clause, or C{None} if this
+        query cannot be described that way.  Queries with equal keys differ at
+        most in the values bound to their SQL parameters, their limit and
+        their offset, so the SQL generated for one can be reused for the
+        others.
+        """
+        tables = self._resultTypesKey()
+        if tables is None:
+            return None
+        if self.comparison is None:
+            comparison = ()
+        else:
+            comparison = attributes._comparisonStructureKey(
+                self.comparison, self.store)
+            if comparison is None:
+                return None
+        sort = []
+        for attr, direction in self.sort.orderColumns():
+            column = attributes._columnStructureKey(attr, self.store)
+            if column is None:
+                return None
+            sort.append((column, direction))
+        return (tables, comparison, tuple(sort))
+
+
+    def _resultTypesKey(self):
+        """
+        Return a hashable object identifying the type of the results of this
+        query, or C{None} if there is no such object.
+        """
+        return _tableStructureKey(self.tableClass)
+
+
+    def _sqlKey(self, verb, subject):
+        """
+        Return a hashable object which identifies the SQL generated by
+        L{_sqlAndArgs} for the given verb and subject, or C{None} if that SQL
+        cannot be cached.
+        """
+        if self._structure is None:
+            return None
+        return (self._structure, verb, subject,
+                self.limit, type(self.limit), self.offset, type(self.offset))
+
+
+    def _compileClauses(self):
+        """
+        Generate the FROM and ORDER BY clauses of this query.
+
+        @return: a two-tuple of the parts of each clause.
+        """
+        tables = self._involvedTables()
+        self._computeFromClause(tables)
+        return self.fromClauseParts, self.sortClauseParts
+
+
     def _involvedTables(self):
         """
         Return a list of tables involved in this query,
@@ -292,6 +398,20 @@ class BaseQuery:
 
 
     def _sqlAndArgs(self, verb, subject):
+        key = self._sqlKey(verb, subject)
+        if key is None:
+            sqlstr = self._compileSQL(verb, subject)
+        else:
+            sqlstr = self.store._compiledQuery(
+                key, self._compileSQL, verb, subject)
+        return (sqlstr, self.args)
+
+
+    def _compileSQL(self, verb, subject):
+        """
+        Generate an SQL statement for this query with the given verb and
+        subject (the expression following the verb).
+        """
         limitClause = []
         if self.limit is not None:
             # XXX LIMIT and OFFSET used to be using ?, but they started
@@ -320,8 +440,7 @@ class BaseQuery:
             sqlParts.extend(['ORDER BY', ', '.join(self.sortClauseParts)])
         if limitClause:
             sqlParts.append(' '.join(limitClause))
-        sqlstr = ' '.join(sqlParts)
-        return (sqlstr, self.args)
+        return ' '.join(sqlParts)
 
 
     def _runQuery(self, verb, subject):
@@ -336,10 +455,32 @@ class BaseQuery:
         sqlstr, sqlargs = self._sqlAndArgs(verb, subject)
         sqlResults = self.store.querySQL(sqlstr, sqlargs)
         cs = self.locateCallSite()
+        hits, misses = self.store._takeQueryCacheStats()
         log.msg(interface=iaxiom.IStatEvent,
-                querySite=cs, queryTime=time.time() - t, querySQL=sqlstr)
+                querySite=cs, queryTime=time.time() - t, querySQL=sqlstr,
+                stat_query_cache_hits=hits, stat_query_cache_misses=misses)
         return sqlResults
 
+
+    def _streamQuery(self, verb, subject, chunkSize):
+        """
+        Like L{_runQuery}, but rather than a list of all the results, return an
+        iterator of lists of at most C{chunkSize} results, which are fetched
+        from the database only as they are needed.
+        """
+        t = time.time()
+        if not self.store.autocommit:
+            self.store.checkpoint()
+        sqlstr, sqlargs = self._sqlAndArgs(verb, subject)
+        sqlResults = self.store._streamSQL(sqlstr, sqlargs, chunkSize)
+        cs = self.locateCallSite()
+        hits, misses = self.store._takeQueryCacheStats()
+        log.msg(interface=iaxiom.IStatEvent,
+                querySite=cs, queryTime=time.time() - t, querySQL=sqlstr,
+                stat_query_cache_hits=hits, stat_query_cache_misses=misses)
+        return sqlResults
+
+
     def locateCallSite(self):
         i = 3
         frame = sys._getframe(i)
@@ -350,7 +491,7 @@ class BaseQuery:
         return (frame.f_code.co_filename, frame.f_lineno)
 
 
-    def _selectStuff(self, verb='SELECT'):
+    def _selectStuff(self, verb='SELECT', chunkSize=None):
         """
         Return a generator which yields the massaged results of this query with
         a particular SQL verb.
@@ -362,9 +503,28 @@ class BaseQuery:
         @param verb: a str containing the SQL verb to execute.  This really
         must be some variant of 'SELECT', the only two currently implemented
         being 'SELECT' and 'SELECT DISTINCT'.
+
+        @param chunkSize: C{None} to load every result of the query before
+        yielding the first one, or an L{int} giving the number of rows to load
+        at a time from a cursor dedicated to this query.
         """
-        sqlResults = self._runQuery(verb, self._queryTarget)
-        for row in sqlResults:
+        if chunkSize is None:
+            chunks = [self._runQuery(verb, self._queryTarget)]
+        else:
+            chunks = self._streamQuery(verb, self._queryTarget, chunkSize)
+        for rows in chunks:
+            for result in self._massageChunk(rows):
+                yield result
+
+
+    def _massageChunk(self, rows):
+        """
+        Massage a list of rows received from the database together.  By
+        default, each is simply massaged in turn with L{_massageData}.
+
+        @return: an iterable of massaged results.
+        """
+        for row in rows:
             yield self._massageData(row)
 
 
@@ -423,6 +583,38 @@ class BaseQuery:
         return self._selectStuff('SELECT')
 
 
+    def stream(self, chunkSize=DEFAULT_STREAM_CHUNK_SIZE):
+        """
+        Iterate the results of this query without loading all of them into
+        memory first.
+
+        Iterating a query directly reads every row of its result before the
+        first one is produced.  This method instead reads the rows from a
+        database cursor of their own, C{chunkSize} at a time, as they are
+        needed.  Use it for queries with very large numbers of results.
+
+        As with ordinary iteration, changes made in the current transaction
+        are written to the database before the query begins.  If the query is
+        begun inside a transaction, it must be iterated to completion (or
+        abandoned) before that transaction finishes.  Outside of a transaction,
+        the database remains locked against writes by other processes until
+        iteration is complete.  In either case, the effect of changing items
+        which this query matches before it has produced them is undefined.
+
+        @param chunkSize: the number of rows to load at a time.
+        @type chunkSize: L{int}
+
+        @raise axiom.errors.StreamingQueryInterrupted: if iteration continues
+            after the transaction it was begun in has finished.
+
+        @return: an iterator of the same results iterating this query would
+            give.
+        """
+        if chunkSize < 1:
+            raise ValueError("chunkSize must be positive: %r" % (chunkSize,))
+        return self._selectStuff('SELECT', chunkSize)
+
+
     _selfiter = None
     def next(self):
         """
@@ -448,6 +640,79 @@ class _FakeItemForFilter:
         self.store = store
 
 
+class _SQLValueComparison(attributes.AttributeValueComparison):
+    """
+    A comparison of a column with a value which is already in the form the
+    database stores, such as one taken from a keyset pagination cursor.
+    """
+    def getArgs(self, store):
+        return [self.value]
+
+
+
+def _encodeCursor(values):
+    """
+    Encode the sort key of a row as a keyset pagination cursor.
+
+    @param values: a sequence of SQL values: C{None}, C{int}s, C{long}s,
+        C{float}s, C{unicode} or C{buffer}s.
+
+    @return: a C{str} which can be put in a URL.
+    """
+    parts = []
+    for value in values:
+        if value is None:
+            tag, data = 'n', ''
+        elif isinstance(value, (int, long)):
+            tag, data = 'i', str(value)
+        elif isinstance(value, float):
+            tag, data = 'f', repr(value)
+        elif isinstance(value, unicode):
+            tag, data = 'u', value.encode('utf-8')
+        else:
+            tag, data = 'b', str(value)
+        parts.append('%s%d:%s' % (tag, len(data), data))
+    return base64.urlsafe_b64encode(''.join(parts))
+
+
+
+def _decodeCursor(cursor):
+    """
+    Decode a keyset pagination cursor made by L{_encodeCursor}.
+
+    @raise ValueError: if C{cursor} is not such a cursor.
+
+    @return: a C{list} of SQL values.
+    """
+    try:
+        data = base64.urlsafe_b64decode(str(cursor))
+    except TypeError:
+        raise ValueError("Invalid cursor: %r" % (cursor,))
+    values = []
+    while data:
+        tag = data[0]
+        length, data = data[1:].split(':', 1)
+        length = int(length)
+        value, data = data[:length], data[length:]
+        if len(value) != length:
+            raise ValueError("Invalid cursor: %r" % (cursor,))
+        if tag == 'n' and not value:
+            value = None
+        elif tag == 'i':
+            value = int(value)
+        elif tag == 'f':
+            value = float(value)
+        elif tag == 'u':
+            value = value.decode('utf-8')
+        elif tag == 'b':
+            value = buffer(value)
+        else:
+            raise ValueError("Invalid cursor: %r" % (cursor,))
+        values.append(value)
+    return values
+
+
+
 def _isColumnUnique(col):
     """
     Determine if an IColumn provider is unique.
@@ -457,18 +722,91 @@ def _isColumnUnique(col):
     """
     return isinstance(col, _StoreIDComparer)
 
+
+
+def _deletedOneByOne(tableClass):
+    """
+    Determine whether items of C{tableClass} must be deleted one at a time,
+    because their 'deleted' callback or 'deleteFromStore' is overridden.
+    """
+    return (tableClass.deleted.im_func is not item.Item.deleted.im_func or
+            tableClass.deleteFromStore.im_func is not
+            item.Item.deleteFromStore.im_func)
+
+
+
+def _chunked(storeIDs):
+    """
+    Split C{storeIDs} into C{list}s short enough to be used in an C{IN}
+    clause.
+    """
+    return [storeIDs[start:start + IN_CLAUSE_SIZE]
+            for start in xrange(0, len(storeIDs), IN_CLAUSE_SIZE)]
+
+
+
+def _referringTo(store, tableClass, storeIDs):
+    """
+    Make a comparison factory, for L{item.allowDeletion}, for the items of
+    C{tableClass} with C{storeIDs}.
+
+    References only compare with items, or with a query for the storeIDs of
+    items, so the storeIDs are found with such a query.
+    """
+    storeIDQuery = store.query(
+        tableClass, tableClass.storeID.oneOf(storeIDs)).getColumn("storeID")
+    return lambda attr: attr.oneOf(storeIDQuery)
+
+
+
 class ItemQuery(BaseQuery):
     """
     This class is a query whose results will be Item instances.  This is the
     type always returned from L{Store.query}.
     """
 
+    _cloneAttributes = BaseQuery._cloneAttributes + ['prefetch']
+
     def __init__(self, *a, **k):
         """
         Create an ItemQuery.  This is typically done via L{Store.query}.
+
+        @param prefetch: a sequence of L{attributes.reference} attributes of
+        the item class this query is for, which will be resolved as each
+        result is loaded.  See L{Store.query}.
         """
+        prefetch = tuple(k.pop('prefetch', None) or ())
         BaseQuery.__init__(self, *a, **k)
-        self._queryTarget = (
+        self._prefetchColumns = []
+        if prefetch:
+            # Attributes compare equal to anything (the result of == is a
+            # comparison object), so look them up by identity.
+            columns = {}
+            for (i, (name, attr)) in enumerate(self.tableClass.getSchema()):
+                # The first column of each row is the storeID.
+                columns[id(attr)] = i + 1
+        for attr in prefetch:
+            if not (isinstance(attr, attributes.reference)
+                    and id(attr) in columns):
+                raise ValueError(
+                    "%r is not a reference attribute of %r" % (
+                        attr, self.tableClass))
+            self._prefetchColumns.append(columns[id(attr)])
+        self.prefetch = prefetch
+        tableKey = self._resultTypesKey()
+        if tableKey is None:
+            self._queryTarget = self._compileQueryTarget()
+        else:
+            self._queryTarget = self.store._compiledQuery(
+                (ItemQuery, tableKey), self._compileQueryTarget)
+
+
+    def _compileQueryTarget(self):
+        """
+        Generate the list of columns which must be selected to load the items
+        this query finds.
+        """
+        return (
             self.tableClass.storeID.getColumnName(self.store) + ', ' + (
                 ', '.join(
                     [attrobj.getColumnName(self.store)
@@ -564,6 +902,157 @@ class ItemQuery(BaseQuery):
                     sort=sort,
                     limit=pagesize + 1))
 
+    def _keysetColumns(self):
+        """
+        Return the columns which order the results of this query for keyset
+        pagination, as a C{list} of two-tuples of a column and C{True} if it is
+        sorted in ascending order.  The last is always the storeID, so that no
+        two results have the same key.
+
+        @raise ValueError: if the sort order involves other item types.
+        """
+        columns = []
+        for (column, direction) in self.sort.orderColumns():
+            if column.type is not self.tableClass:
+                raise ValueError(
+                    "Keyset pagination cannot sort by %r, which is not an "
+                    "attribute of %r" % (column, self.tableClass))
+            columns.append((column, direction != 'DESC'))
+            if _isColumnUnique(column):
+                return columns
+        # Break ties in the same direction as the last column, so that an
+        # index on the sort columns (which ends with the storeID) can be read
+        # in order.
+        ascending = not columns or columns[-1][1]
+        columns.append((self.tableClass.storeID, ascending))
+        return columns
+
+
+    def cursorFor(self, result):
+        """
+        Return a cursor giving the position of one of the results of this
+        query, from which L{pageAfter} and L{pageBefore} can continue.
+
+        The cursor is a string of letters, digits, C{"-"}, C{"_"} and C{"="},
+        which can be kept between transactions or put in a URL.  It remains
+        valid whatever happens to the item it was made from.
+
+        @type result: an instance of this query's item type.
+        @rtype: C{str}
+        """
+        return _encodeCursor([
+                column.infilter(column.__get__(result), result, self.store)
+                for (column, ascending) in self._keysetColumns()])
+
+
+    def _segments(self, columns, values):
+        """
+        Divide the rows which come after the row with the key C{values}, in the
+        order given by C{columns}, into segments which each occupy a single
+        range of an index on those columns.
+
+        A single condition for all of those rows would be a disjunction which
+        SQLite cannot use to seek into an index, so each segment is queried for
+        separately instead, until a page is full.
+
+        @return: a C{list} of comparisons, one for each segment, in order.
+        """
+        (column, ascending), value = columns[0], values[0]
+        segments = []
+        if len(columns) > 1:
+            if value is None:
+                equal = attributes.NullComparison(column)
+            else:
+                equal = _SQLValueComparison(column, '=', value)
+            segments.extend([
+                    attributes.AND(equal, segment)
+                    for segment in self._segments(columns[1:], values[1:])])
+        # NULLs come first in ascending order and last in descending order.
+        if ascending:
+            if value is None:
+                segments.append(attributes.NullComparison(column, negate=True))
+            else:
+                segments.append(_SQLValueComparison(column, '>', value))
+        elif value is not None:
+            segments.append(_SQLValueComparison(column, '<', value))
+            if getattr(column, 'allowNone', False):
+                segments.append(attributes.NullComparison(column))
+        return segments
+
+
+    def _seek(self, cursor, pagesize, forward):
+        """
+        Implement L{pageAfter} and L{pageBefore}.
+        """
+        if pagesize < 1:
+            raise ValueError("pagesize must be positive: %r" % (pagesize,))
+        columns = self._keysetColumns()
+        if not forward:
+            columns = [(column, not ascending)
+                       for (column, ascending) in columns]
+        if cursor is None:
+            segments = [None]
+        else:
+            values = _decodeCursor(cursor)
+            if len(values) != len(columns):
+                raise ValueError("Cursor %r is not for this query" % (cursor,))
+            segments = self._segments(columns, values)
+        sort = attributes.CompoundOrdering([
+                attributes.SimpleOrdering(column, ascending and 'ASC' or 'DESC')
+                for (column, ascending) in columns])
+        results = []
+        for segment in segments:
+            comparison = self.comparison
+            if segment is not None:
+                if comparison is None:
+                    comparison = segment
+                else:
+                    comparison = attributes.AND(comparison, segment)
+            results.extend(self.store.query(
+                    self.tableClass, comparison, sort=sort,
+                    limit=pagesize - len(results), prefetch=self.prefetch))
+            if len(results) == pagesize:
+                break
+        if not forward:
+            results.reverse()
+        return results
+
+
+    def pageAfter(self, cursor=None, pagesize=20):
+        """
+        Return a page of the results of this query, found by seeking to a
+        position in them rather than by counting the results before it, so
+        that late pages are found as quickly as early ones when the sort order
+        is indexed.
+
+        The results are ordered by this query's sort order, then by storeID if
+        that is not part of it, so that each has a unique position.  The limit
+        and offset of this query are ignored.
+
+        @param cursor: C{None} for the first page, or a cursor returned by
+            L{cursorFor}, for the page following the result it was made from.
+
+        @param pagesize: the greatest number of results to return.
+
+        @raise ValueError: if the query is sorted by attributes of other item
+            types, or C{cursor} is not a cursor for this query.
+
+        @return: a C{list} of results, in order.
+        """
+        return self._seek(cursor, pagesize, True)
+
+
+    def pageBefore(self, cursor=None, pagesize=20):
+        """
+        Return a page of the results of this query preceding the result
+        C{cursor} was made from, or the last page if C{cursor} is C{None}.  See
+        L{pageAfter}.
+
+        @return: a C{list} of results, in order.
+        """
+        return self._seek(cursor, pagesize, False)
+
+
     def _massageData(self, row):
         """
         Convert a row into an Item instance by loading cached items or
@@ -579,6 +1068,41 @@ class ItemQuery(BaseQuery):
         return result
 
 
+    def _massageChunk(self, rows):
+        """
+        Load the items referred to by the C{prefetch} attributes of the items
+        in C{rows} with as few queries as possible, then massage the rows and
+        resolve those attributes on each result.
+        """
+        if not self.prefetch:
+            return BaseQuery._massageChunk(self, rows)
+        return self._prefetchChunks(rows)
+
+
+    def _prefetchChunks(self, rows):
+        """
+        Implement L{_massageChunk} for queries with prefetched attributes,
+        working through C{rows} a few at a time so that the number of items
+        kept alive at once is limited.
+        """
+        for start in xrange(0, len(rows), DEFAULT_STREAM_CHUNK_SIZE):
+            chunk = rows[start:start + DEFAULT_STREAM_CHUNK_SIZE]
+            storeIDs = []
+            for row in chunk:
+                for column in self._prefetchColumns:
+                    storeIDs.append(row[column])
+            # Keep these alive until they have been resolved on the results
+            # which refer to them.
+            prefetched = self.store._loadItems(
+                storeIDs, not self.tableClass.__legacy__)
+            for row in chunk:
+                result = self._massageData(row)
+                for attr in self.prefetch:
+                    attr.__get__(result)
+                yield result
+            del prefetched
+
+
     def getColumn(self, attributeName, raw=False):
         """
         Get an L{iaxiom.IQuery} whose results will be values of a single
@@ -626,34 +1150,161 @@ class ItemQuery(BaseQuery):
 
         # If there's a 'deleted' callback on the Item type or 'deleteFromStore'
         # is overridden, we have to do it the slow way.
-        deletedOverridden = (
-            self.tableClass.deleted.im_func is not item.Item.deleted.im_func)
-        deleteFromStoreOverridden = (
-            self.tableClass.deleteFromStore.im_func is not
-            item.Item.deleteFromStore.im_func)
-
-        if deletedOverridden or deleteFromStoreOverridden:
+        if _deletedOneByOne(self.tableClass):
             for it in self:
                 it.deleteFromStore()
         else:
+            if not self.store.autocommit:
+                self.store.checkpoint()
+
+            # The storeIDs of the items being deleted, and of the items which
+            # cascade from them, are loaded a level of the cascade at a time,
+            # so that the SQL stays the same however deep the cascade goes,
+            # but none of the items need to be loaded.  All of them are found,
+            # and checked for referents which disallow their deletion, before
+            # any of them are deleted.
+            cached = self._cachedItems()
+            for tableClass, storeIDs, dependents in self._findCascade():
+                self._deleteStoreIDs(tableClass, storeIDs, dependents, cached)
+
+
+    def _cachedItems(self):
+        """
+        Find the items in memory, so that those which are deleted can be
+        deleted one at a time and know that they have been deleted.
+
+        @return: a C{dict} mapping item types to C{dict}s mapping storeIDs to
+        the items in memory of that type.
+        """
+        cached = {}
+        for ref in self.store.objectCache.data.values():
+            it = ref()
+            if it is not None:
+                cached.setdefault(type(it), {})[it.storeID] = it
+        return cached
+
+
+    def _findCascade(self):
+        """
+        Find the items which are found by this query, and the items which
+        cascade from them, without deleting any of them.
+
+        Items whose type requires them to be deleted one at a time are loaded,
+        and the items which cascade from those are left for them to find when
+        they are deleted.
+
+        @raise DeletionDisallowed: if any of the items found has referents
+        with whenDeleted == reference.DISALLOW.
+
+        @return: a C{list} of triples of an item type, a C{list} of the
+        storeIDs of the items of that type to delete, and a C{list} of the
+        items which cascade from those and must be deleted one at a time.
+        """
+        store = self.store
+        storeIDs = list(self.getColumn("storeID"))
+        found = {self.tableClass: set(storeIDs)}
+        pending = [(self.tableClass, storeIDs)]
+        cascade = []
+        while pending:
+            tableClass, storeIDs = pending.pop()
+            chunks = _chunked(storeIDs)
+            for chunk in chunks:
+                if not item.allowDeletion(
+                    store, tableClass, _referringTo(store, tableClass, chunk)):
+                    raise errors.DeletionDisallowed(
+                        'Cannot delete item; '
+                        'has referents with whenDeleted == reference.DISALLOW')
+
+            # Find other item types whose instances need to be deleted when
+            # items of this type are deleted.  Items already found are not
+            # looked for again; for types which cascade to themselves, that
+            # might never end.
+            dependents = []
+            for cascadingAttr in (
+                attributes._cascadingDeletes.get(tableClass, []) +
+                attributes._cascadingDeletes.get(None, [])):
+                dependentType = cascadingAttr.type
+                seen = found.setdefault(dependentType, set())
+                dependentIDs = []
+                for chunk in chunks:
+                    query = store.query(
+                        dependentType,
+                        _referringTo(store, tableClass, chunk)(cascadingAttr))
+                    if _deletedOneByOne(dependentType):
+                        for it in query:
+                            if it.storeID in seen:
+                                continue
+                            if not item.allowDeletion(
+                                store, dependentType,
+                                lambda attr: attr == it):
+                                raise errors.DeletionDisallowed(
+                                    'Cannot delete item; '
+                                    'has referents with whenDeleted == '
+                                    'reference.DISALLOW')
+                            seen.add(it.storeID)
+                            dependents.append(it)
+                    else:
+                        for storeID in query.getColumn("storeID"):
+                            if storeID not in seen:
+                                seen.add(storeID)
+                                dependentIDs.append(storeID)
+                if dependentIDs:
+                    pending.append((dependentType, dependentIDs))
+            cascade.append((tableClass, storeIDs, dependents))
+        return cascade
+
+
+    def _deleteStoreIDs(self, tableClass, storeIDs, dependents, cached):
+        """
+        Delete the items of C{tableClass} with C{storeIDs}, and C{dependents},
+        the items which cascade from them which must be deleted one at a time.
+
+        @param cached: the items in memory, as returned by L{_cachedItems}.
+        Those deleted are removed from it.
+        """
+        store = self.store
+
+        # Items which have already been deleted, as dependents of items
+        # deleted one at a time, are no longer in the store.
+        for it in dependents:
+            if it.store is not None:
+                it.deleteFromStore()
+        inMemory = cached.get(tableClass, {})
+        for storeID in storeIDs:
+            it = inMemory.pop(storeID, None)
+            if it is not None and it.store is not None:
+                it.deleteFromStore()
 
-            # Find other item types whose instances need to be deleted
-            # when items of the type in this query are deleted, and
-            # remove them from the store.
-            def itemsToDelete(attr):
-                return attr.oneOf(self.getColumn("storeID"))
-
-            if not item.allowDeletion(self.store, self.tableClass, itemsToDelete):
-                raise errors.DeletionDisallowed(
-                    'Cannot delete item; '
-                    'has referents with whenDeleted == reference.DISALLOW')
+        nullifiedAttrs = [
+            nullifiedAttr
+            for nullifiedAttr in attributes._nullifies.get(tableClass, [])
+            if (nullifiedAttr.type.typeName, nullifiedAttr.type.schemaVersion)
+            in store.typenameAndVersionToID]
+        tableName = store.getTableName(tableClass)
+        storeIDColumn = store.getShortColumnName(tableClass.storeID)
+        for chunk in _chunked(storeIDs):
+            marks = ', '.join(['?'] * len(chunk))
+            # Clear references which are to be nullified, in tables which
+            # exist in this store.
+            for nullifiedAttr in nullifiedAttrs:
+                column = nullifiedAttr.getShortColumnName(store)
+                store.executeSQL(
+                    'UPDATE %s SET %s = NULL WHERE %s IN (%s)' % (
+                        store.getTableName(nullifiedAttr.type),
+                        column, column, marks),
+                    chunk)
+
+            # Mark the objects as dead, as Item.checkpoint does.
+            store.executeSchemaSQL(
+                _schema.CHANGE_TYPE_MANY % (marks,), [-1] + chunk)
+
+            # actually run the DELETE for the items in this chunk.
+            store.executeSQL(
+                'DELETE FROM %s WHERE %s IN (%s)' % (
+                    tableName, storeIDColumn, marks),
+                chunk)
 
-            for it in item.dependentItems(self.store,
-                                          self.tableClass, itemsToDelete):
-                it.deleteFromStore()
 
-            # actually run the DELETE for the items in this query.
-            self._runQuery('DELETE', "")
 
 class MultipleItemQuery(BaseQuery):
     """
@@ -696,6 +1347,18 @@ class MultipleItemQuery(BaseQuery):
 
         self._queryTarget = ', '.join(targets)
 
+
+    def _resultTypesKey(self):
+        """
+        Return a hashable object identifying the types of the results of this
+        query, or C{None} if there is no such object.
+        """
+        keys = tuple(map(_tableStructureKey, self.tableClass))
+        if None in keys:
+            return None
+        return keys
+
+
     def _involvedTables(self):
         """
         Return a list of tables involved in this query,
@@ -809,6 +1472,16 @@ class _DistinctQuery(object):
         return self.query._selectStuff('SELECT DISTINCT')
 
 
+    def stream(self, chunkSize=DEFAULT_STREAM_CHUNK_SIZE):
+        """
+        Iterate the distinct results of the wrapped query without loading all
+        of them into memory first.  See L{BaseQuery.stream}.
+        """
+        if chunkSize < 1:
+            raise ValueError("chunkSize must be positive: %r" % (chunkSize,))
+        return self.query._selectStuff('SELECT DISTINCT', chunkSize)
+
+
     def count(self):
         """
         Count the number of distinct results of the wrapped query.
@@ -1035,6 +1708,14 @@ class Store(Empowered):
     transaction = None          # set of objects changed in the current transaction
     touched = None              # set of objects changed since the last checkpoint
 
+    _subStorePool = None        # axiom.substore.SubStorePool of the substores
+                                # open in this store, created when the first
+                                # is opened
+
+    queryProfiler = None        # axiom.queryprofile.QueryProfiler recording
+                                # the statements run by this store, if it is
+                                # being profiled
+
     databaseName = 'main'       # can differ if database is attached to another
                                 # database.
 
@@ -1078,7 +1759,8 @@ class Store(Empowered):
     storeID = STORE_SELF_ID
 
 
-    def __init__(self, dbdir=None, filesdir=None, debug=False, parent=None, idInParent=None):
+    def __init__(self, dbdir=None, filesdir=None, debug=False, parent=None, idInParent=None,
+                 objectCacheSize=0):
         """
         Create a store.
 
@@ -1100,6 +1782,12 @@ class Store(Empowered):
         L{axiom.substore.Substore}, the storeID of the item within its parent
         which opened it.
 
+        @param objectCacheSize: The number of recently used items this Store
+        should keep in memory even when nothing else refers to them, so that
+        loading them again does not require a trip to the database.  By
+        default, items are only cached for as long as they are referred to
+        elsewhere.
+
         @raises: C{ValueError} if both C{dbdir} and C{filesdir} are specified.
         """
         if parent is not None or idInParent is not None:
@@ -1119,10 +1807,13 @@ class Store(Empowered):
         self.statementCache = {} # non-normalized => normalized qmark SQL
                                  # statements
 
+        self._compiledQueries = {} # structure of a query => SQL generated
+                                   # for it.  See _compiledQuery.
+
         self.activeTables = {}  # tables which have had items added/removed
                                 # this run
 
-        self.objectCache = _fincache.FinalizingCache()
+        self.objectCache = _fincache.FinalizingCache(objectCacheSize)
 
         self.tableQueries = {}  # map typename: query string w/ storeID
                                 # parameter.  a typename is a persistent
@@ -1138,6 +1829,7 @@ class Store(Empowered):
 
         self.typeToTableNameCache = {}
         self.attrToColumnNameCache = {}
+        self.attrToStructureKeyCache = {}
 
         self._upgradeManager = upgrade._StoreUpgrade(self)
 
@@ -1249,6 +1941,8 @@ class Store(Empowered):
 
         self.attachedToParent = True
         self.databaseName = self.parent._attachChild(self)
+        # Table names include the database name.
+        self._compiledQueries.clear()
         self.connection = self.parent.connection
         self.cursor = self.parent.cursor
 
@@ -1283,9 +1977,23 @@ class Store(Empowered):
                     raise ImportError('cannot find module ' + module, str(err))
             self.typenameAndVersionToID[typename, version] = oid
 
+        # If the schema was found to be consistent with these same classes
+        # before, there is no need to check it again; only the old types need
+        # their schema loaded, to be prepared for upgrading.
+        fingerprint = self._schemaFingerprint()
+        verified = fingerprint == self._loadSchemaFingerprint()
+        if verified:
+            oldTypeIDs = []
+            for (typename, version), typeID in self.typenameAndVersionToID.iteritems():
+                cls = _typeNameToMostRecentClass.get(typename)
+                if cls is not None and version != cls.schemaVersion:
+                    oldTypeIDs.append(typeID)
+        else:
+            oldTypeIDs = None
+
         # Can't call this until typenameAndVersionToID is populated, since this
         # depends on building a reverse map of that.
-        persistedSchema = self._loadTypeSchema()
+        persistedSchema = self._loadTypeSchema(oldTypeIDs)
 
         # Now that we have persistedSchema, loop over everything again and
         # prepare old types.
@@ -1300,18 +2008,81 @@ class Store(Empowered):
                 else:
                     typesToCheck.append(cls)
 
-        for cls in typesToCheck:
-            self._checkTypeSchemaConsistency(cls, persistedSchema)
+        if not verified:
+            for cls in typesToCheck:
+                self._checkTypeSchemaConsistency(cls, persistedSchema)
+
+            # Schema is consistent!  Now, if I forgot to create any indexes
+            # last time I saw this table, do it now...
+            extantIndexes = self._loadExistingIndexes()
+            for cls in typesToCheck:
+                self._createIndexesFor(cls, extantIndexes)
 
-        # Schema is consistent!  Now, if I forgot to create any indexes last
-        # time I saw this table, do it now...
-        extantIndexes = self._loadExistingIndexes()
-        for cls in typesToCheck:
-            self._createIndexesFor(cls, extantIndexes)
+            self._saveSchemaFingerprint(fingerprint)
 
         self._upgradeManager.checkUpgradePaths()
 
 
+    def _schemaFingerprint(self):
+        """
+        Summarize the types in this store and the schema, including indexes,
+        which the Python classes loaded now give the most recent version of
+        each.  If a store had the same fingerprint when its schema was last
+        checked, it need not be checked again.
+
+        @return: a C{str}
+        """
+        parts = []
+        for (key, typeID) in sorted(self.typenameAndVersionToID.iteritems()):
+            cls = _typeNameToMostRecentClass.get(key[0])
+            if cls is None or cls.schemaVersion != key[1]:
+                # Old types' schemas are loaded from the database, so there's
+                # nothing to check them against.
+                parts.append((typeID, key))
+                continue
+            try:
+                schema = _fingerprintCache[cls]
+            except KeyError:
+                schema = _fingerprintCache[cls] = (
+                    [(attr.attrname, attr.sqltype)
+                     for (name, attr) in cls.getSchema()],
+                    sorted(self._requiredIndexesFor(cls)))
+            parts.append((typeID, key, schema))
+        return md5(repr(parts)).hexdigest()
+
+
+    def _loadSchemaFingerprint(self):
+        """
+        Return the fingerprint saved when the schema of this store was last
+        checked, or C{None} if there is none.
+        """
+        if self.dbdir is None:
+            return None
+        [(hasTable,)] = self.querySchemaSQL(_schema.HAS_FINGERPRINT)
+        if not hasTable:
+            return None
+        for (fingerprint,) in self.querySchemaSQL(_schema.GET_FINGERPRINT):
+            return fingerprint
+        return None
+
+
+    def _saveSchemaFingerprint(self, fingerprint):
+        """
+        Save the fingerprint of a schema which has just been checked, for
+        L{_loadSchemaFingerprint}.  In-memory stores are always new, so it is
+        not saved for them.
+        """
+        if self.dbdir is None:
+            return
+        [(hasTable,)] = self.querySchemaSQL(_schema.HAS_FINGERPRINT)
+        if not hasTable:
+            self.createSQL(
+                _schema.CREATE_FINGERPRINT.replace("*DATABASE*",
+                                                   self.databaseName))
+        self.executeSchemaSQL(_schema.CLEAR_FINGERPRINT)
+        self.executeSchemaSQL(_schema.SET_FINGERPRINT, [fingerprint])
+
+
     def _loadExistingIndexes(self):
         """
         Return a C{set} of the SQL indexes which already exist in the
@@ -1424,7 +2195,7 @@ class Store(Empowered):
         return p
 
 
-    def _loadTypeSchema(self):
+    def _loadTypeSchema(self, typeIDs=None):
         """
         Load all of the stored schema information for all types known by this
         store.  It's important to load everything all at once (rather than
@@ -1432,6 +2203,9 @@ class Store(Empowered):
         store opening fast.  A single query with many results is much faster
         than many queries with a few results each.
 
+        @param typeIDs: If not C{None}, a list of the IDs of the only types
+            whose schema information is to be loaded.
+
         @return: A dict with two-tuples of item type name and schema version as
             keys and lists of five-tuples of attribute schema information for
             that type.  The elements of the five-tuple are::
@@ -1458,9 +2232,16 @@ class Store(Empowered):
         # Indexing attribute, ordering by it, and getting rid of row_offset
         # from the schema and the sorted() here doesn't seem to be any faster
         # than doing this.
-        persistedSchema = sorted(self.querySchemaSQL(
-            "SELECT attribute, type_id, sqltype, indexed, "
-            "pythontype, docstring FROM *DATABASE*.axiom_attributes "))
+        sql = ("SELECT attribute, type_id, sqltype, indexed, "
+               "pythontype, docstring FROM *DATABASE*.axiom_attributes ")
+        if typeIDs is None:
+            args = []
+        elif not typeIDs:
+            return {}
+        else:
+            sql += "WHERE type_id IN (%s)" % (', '.join(['?'] * len(typeIDs)),)
+            args = typeIDs
+        persistedSchema = sorted(self.querySchemaSQL(sql, args))
 
         # This is trivially (but measurably!) faster than getattr(attributes,
         # pythontype).
@@ -1632,7 +2413,7 @@ class Store(Empowered):
         return default
 
     def query(self, tableClass, comparison=None,
-              limit=None, offset=None, sort=None):
+              limit=None, offset=None, sort=None, prefetch=None):
         """
         Return a generator of instances of C{tableClass},
         or tuples of instances if C{tableClass} is a
@@ -1673,15 +2454,23 @@ class Store(Empowered):
         @param sort: an L{ISort}, something that comes from an SQLAttribute's
         'ascending' or 'descending' attribute.
 
+        @param prefetch: a sequence of L{axiom.attributes.reference} attributes
+        of C{tableClass}, which may not be a tuple if this is given.  The items
+        these attributes refer to are loaded in bulk, a group of results at a
+        time, rather than one by one as each attribute is accessed.
+
         @return: an L{ItemQuery} object, which is an iterable of Items or
         tuples of Items, according to tableClass.
         """
         if isinstance(tableClass, tuple):
-            queryClass = MultipleItemQuery
-        else:
-            queryClass = ItemQuery
+            if prefetch:
+                raise ValueError(
+                    "prefetch is only supported for queries of one item type")
+            return MultipleItemQuery(
+                self, tableClass, comparison, limit, offset, sort)
 
-        return queryClass(self, tableClass, comparison, limit, offset, sort)
+        return ItemQuery(self, tableClass, comparison, limit, offset, sort,
+                         prefetch=prefetch)
 
     def sum(self, summableAttribute, *a, **k):
         args = (self, summableAttribute.type) + a
@@ -1716,6 +2505,15 @@ class Store(Empowered):
 
         @return: None.
         """
+        self.transact(self._batchInsert, itemType, itemAttributes, dataRows)
+
+
+    def _batchInsert(self, itemType, itemAttributes, dataRows):
+        """
+        Do the work of L{batchInsert} in a transaction, which is required by
+        L{_allocateStoreIDs}.  Rows are inserted L{BATCH_INSERT_SIZE} at a
+        time, so that C{dataRows} need never be loaded into memory all at once.
+        """
         class FakeItem:
             pass
         _NEEDS_DEFAULT = object() # token for lookup failure
@@ -1726,25 +2524,113 @@ class Store(Empowered):
         schema = [attr for (name, attr) in itemType.getSchema()]
         for i, attr in enumerate(itemAttributes):
             indices[attr] = i
-        for row in dataRows:
-            oid = self.store.executeSchemaSQL(
-                _schema.CREATE_OBJECT, [self.store.getTypeID(itemType)])
-            insertArgs = [oid]
-            for attr in schema:
-                i = indices.get(attr, _NEEDS_DEFAULT)
-                if i is _NEEDS_DEFAULT:
-                    pyval = attr.default
-                else:
-                    pyval = row[i]
-                dbval = attr._convertPyval(fakeOSelf, pyval)
-                insertArgs.append(dbval)
-            self.executeSQL(sql, insertArgs)
+        dataRows = iter(dataRows)
+        while True:
+            rows = list(itertools.islice(dataRows, BATCH_INSERT_SIZE))
+            if not rows:
+                break
+            insertArgsList = []
+            oids = self._allocateStoreIDs(itemType, len(rows))
+            for oid, row in itertools.izip(oids, rows):
+                insertArgs = [oid]
+                for attr in schema:
+                    i = indices.get(attr, _NEEDS_DEFAULT)
+                    if i is _NEEDS_DEFAULT:
+                        pyval = attr.default
+                    else:
+                        pyval = row[i]
+                    dbval = attr._convertPyval(fakeOSelf, pyval)
+                    insertArgs.append(dbval)
+                insertArgsList.append(insertArgs)
+            self.executeManySQL(sql, insertArgsList)
+
+
+    def _allocateStoreIDs(self, tableClass, count):
+        """
+        Create rows in the objects table for C{count} new items of the given
+        type with a single statement, rather than one at a time.
+
+        This must be called in a transaction, so that no other connection can
+        create objects between the highest existing storeID being found and the
+        new ones being inserted after it.
+
+        @return: a C{list} of the new storeIDs, in ascending order.
+        """
+        assert self.transaction is not None, (
+            "Store IDs can only be allocated in a transaction.")
+        typeID = self.getTypeID(tableClass)
+        [(highest,)] = self.querySchemaSQL(_schema.HIGHEST_OBJECT_ID)
+        if highest is None:
+            highest = 0
+        oids = range(highest + 1, highest + 1 + count)
+        self.executeManySQL(
+            _schema.CREATE_OBJECT_WITH_ID.replace('*DATABASE*',
+                                                  self.databaseName),
+            [(oid, typeID) for oid in oids])
+        return oids
+
+
+    def _compiledQuery(self, key, compile, *a):
+        """
+        Look up some SQL generated for a query in this store's cache, generating
+        it if it is not present.
+
+        Generating the SQL for a query involves a lot of string building which
+        is repeated every time a query of the same shape is run, even though
+        only the values bound to its parameters differ.  Each query instead
+        computes a key which describes that shape and uses this method to do
+        the string building only once per key.  The SQLite binding also keeps
+        a prepared statement for each distinct string it sees, so reusing
+        these strings avoids re-preparing the statements, too.
+
+        The number of lookups which found the SQL already cached and the number
+        which did not are counted, and are reported (as
+        C{stat_query_cache_hits} and C{stat_query_cache_misses}) by the
+        L{IStatEvent} logged for the next query run.  See
+        L{_takeQueryCacheStats}.
+
+        @param key: a hashable object describing the SQL to generate.
+
+        @param compile: a callable which will be invoked with C{*a} to generate
+            the SQL if it is not cached.
+
+        @return: the result of C{compile(*a)}, or the result of a previous
+            call with the same key.
+        """
+        try:
+            result = self._compiledQueries[key]
+        except KeyError:
+            self._queryCacheMisses += 1
+            result = compile(*a)
+            if len(self._compiledQueries) >= QUERY_CACHE_SIZE:
+                self._compiledQueries.clear()
+            self._compiledQueries[key] = result
+        else:
+            self._queryCacheHits += 1
+        return result
+
+
+    _queryCacheHits = 0
+    _queryCacheMisses = 0
+
+    def _takeQueryCacheStats(self):
+        """
+        Return the number of hits and misses in the cache maintained by
+        L{_compiledQuery} since the last call, and reset them to zero.
+
+        @return: a two-tuple of L{int}s.
+        """
+        stats = (self._queryCacheHits, self._queryCacheMisses)
+        self._queryCacheHits = self._queryCacheMisses = 0
+        return stats
+
 
     def _loadedItem(self, itemClass, storeID, attrs):
         if self.objectCache.has(storeID):
             result = self.objectCache.get(storeID)
             # XXX do checks on consistency between attrs and DB object, maybe?
         else:
+            self.objectCache.misses += 1
             result = itemClass.existingInStore(self, storeID, attrs)
             if not result.__legacy__:
                 self.objectCache.cache(storeID, result)
@@ -1761,6 +2647,14 @@ class Store(Empowered):
         if self._rejectChanges:
             raise errors.ChangeRejected()
         if self.transaction is not None:
+            if self._savepoints:
+                # An item which is new to the transaction must be forgotten
+                # entirely if a savepoint it was changed in is rolled back.
+                isNew = item not in self.transaction
+                for (new, changed, tableCounts) in self._savepoints:
+                    if isNew:
+                        new.add(item)
+                    changed.add(item)
             self.transaction.add(item)
             self.touched.add(item)
 
@@ -1768,17 +2662,32 @@ class Store(Empowered):
     def checkpoint(self):
         self._rejectChanges += 1
         try:
+            # Items are asked for the statements they need, which are then
+            # grouped by SQL so that functionally identical statements (say,
+            # inserting many items of one type) are issued with executemany.
+            statements = {}
+            order = []
+            def executeSQL(sql, args):
+                if sql not in statements:
+                    statements[sql] = []
+                    order.append(sql)
+                statements[sql].append(args)
             for item in self.touched:
-                # XXX: it should be possible here, using various clever hacks, to
-                # automatically optimize functionally identical statements into
-                # executemany.
-                item.checkpoint()
+                if type(item).checkpoint.im_func is _itemCheckpoint:
+                    item._checkpoint(executeSQL)
+                else:
+                    # It has customized checkpointing; leave it to do its own
+                    # thing.
+                    item.checkpoint()
+            for sql in order:
+                self.executeManySQL(sql, statements[sql])
             self.touched.clear()
         finally:
             self._rejectChanges -= 1
 
     executedThisTransaction = None
     tablesCreatedThisTransaction = None
+    _savepoints = None
 
     def transact(self, f, *a, **k):
         """
@@ -1821,6 +2730,91 @@ class Store(Empowered):
         finally:
             self._cleanupTxnState()
 
+
+    def savepoint(self, f, *a, **k):
+        """
+        Execute C{f(*a, **k)} in the current transaction such that if it raises
+        an exception, only the changes made by C{f} are reverted, and the rest
+        of the transaction may still be committed.
+
+        If no transaction is in progress, this is the same as L{transact}.
+
+        @return: Whatever C{f(*a, **kw)} returns.
+        @raise: Whatever C{f(*a, **kw)} raises, or a database exception.
+        """
+        if self.transaction is None:
+            return self.transact(f, *a, **k)
+        if self.attachedToParent:
+            return self.parent.savepoint(f, *a, **k)
+        # The database has to reflect everything done in the transaction so
+        # far for rolling back to the savepoint to restore it.
+        self.checkpoint()
+        name = 'axiom_savepoint_%d' % (len(self._savepoints),)
+        self.cursor.execute('SAVEPOINT ' + name)
+        point = (set(), set(), [
+                (store, len(store.tablesCreatedThisTransaction))
+                for store in self._storesInTransaction()])
+        self._savepoints.append(point)
+        try:
+            try:
+                result = f(*a, **k)
+            except:
+                exc = Failure()
+                try:
+                    self._rollbackToSavepoint(name, point)
+                except:
+                    log.err(exc)
+                    raise
+                raise
+            else:
+                self.cursor.execute('RELEASE SAVEPOINT ' + name)
+            return result
+        finally:
+            self._savepoints.remove(point)
+
+
+    def _storesInTransaction(self):
+        """
+        Return a C{list} of this store and all the stores attached to it, which
+        share its transactions.
+        """
+        stores = [self]
+        for sub in self._attachedChildren.values():
+            stores.extend(sub._storesInTransaction())
+        return stores
+
+
+    def _rollbackToSavepoint(self, name, point):
+        """
+        Undo everything done since a savepoint was started by L{savepoint}, in
+        the database and in memory.
+        """
+        new, changed, tableCounts = point
+        self.cursor.execute('ROLLBACK TO SAVEPOINT ' + name)
+        self.cursor.execute('RELEASE SAVEPOINT ' + name)
+        log.msg(interface=iaxiom.IStatEvent, stat_savepoint_rollbacks=1)
+        self._rejectChanges += 1
+        try:
+            for item in changed:
+                if item in new:
+                    item.revert()
+                else:
+                    # It was already part of the transaction, so it must not
+                    # be treated as though it had never existed.
+                    item._reload()
+        finally:
+            self._rejectChanges -= 1
+        self.touched.difference_update(changed)
+        self.transaction.difference_update(new)
+        for (outerNew, outerChanged, outerTableCounts) in self._savepoints:
+            if outerNew is not new:
+                outerNew.difference_update(new)
+                outerChanged.difference_update(new)
+        for (store, count) in tableCounts:
+            created = store.tablesCreatedThisTransaction[count:]
+            del store.tablesCreatedThisTransaction[count:]
+            store._forgetTables(created)
+
     # The following three methods are necessary...
     # - in PySQLite: because PySQLite has some buggy transaction handling which
     #   makes it impossible to issue explicit BEGIN statements - which we
@@ -1838,9 +2832,11 @@ class Store(Empowered):
         if self.attachedToParent:
             self.transaction = self.parent.transaction
             self.touched = self.parent.touched
+            self._savepoints = self.parent._savepoints
         else:
             self.transaction = set()
             self.touched = set()
+            self._savepoints = []
         self.autocommit = False
         for sub in self._attachedChildren.values():
             sub._setupTxnState()
@@ -1884,7 +2880,21 @@ class Store(Empowered):
         finally:
             self._rejectChanges -= 1
         self.transaction.clear()
-        for tableClass in self.tablesCreatedThisTransaction:
+        self._forgetTables(self.tablesCreatedThisTransaction)
+        for sub in self._attachedChildren.values():
+            sub._inMemoryRollback()
+
+
+    def _forgetTables(self, tableClasses):
+        """
+        Discard everything known about the tables for the given item types,
+        whose creation has been rolled back.
+        """
+        if tableClasses:
+            # Queries compiled in this transaction may have caused tables which
+            # no longer exist to be created.
+            self._compiledQueries.clear()
+        for tableClass in tableClasses:
             del self.typenameAndVersionToID[tableClass.typeName,
                                             tableClass.schemaVersion]
             # Clear all cache related to this table
@@ -1900,20 +2910,19 @@ class Store(Empowered):
                 if attr in self.attrToColumnNameCache:
                     del self.attrToColumnNameCache[attr]
 
-        for sub in self._attachedChildren.values():
-            sub._inMemoryRollback()
-
 
     def _cleanupTxnState(self):
         self.autocommit = True
         self.transaction = None
         self.touched = None
+        self._savepoints = None
         self.executedThisTransaction = None
         self.tablesCreatedThisTransaction = []
         for sub in self._attachedChildren.values():
             sub._cleanupTxnState()
 
     def close(self, _report=True):
+        self.objectCache.strong.clear()
         self.cursor.close()
         self.cursor = self.connection = None
         if self.debug and _report:
@@ -2114,6 +3123,58 @@ class Store(Empowered):
         return typeID
 
 
+    def _requiredIndexesFor(self, tableClass):
+        """
+        Return a C{set} of the indexes required by the schema defined by
+        C{tableClass}, each a three-tuple of a tuple of the SQL for each
+        indexed column, a tuple of the names from which the index's name is
+        made (see L{_indexNameOf}), and the SQL condition of a partial index or
+        C{None}.
+        """
+        try:
+            indexes = _requiredTableIndexes[tableClass]
+        except KeyError:
+            indexes = set()
+            for nam, atr in tableClass.getSchema():
+                if atr.indexed:
+                    indexes.add(((atr.getShortColumnName(self),), (atr.attrname,), None))
+                for compound in atr.compoundIndexes:
+                    indexes.add(self._describeIndex(tableClass, compound))
+            _requiredTableIndexes[tableClass] = indexes
+        return indexes
+
+
+    def _describeIndex(self, tableClass, index):
+        """
+        Return the description of an index of C{tableClass}, in the form used
+        by L{_requiredIndexesFor}.
+
+        @type index: L{attributes.CompoundIndex}
+        """
+        columns = []
+        names = []
+        for (atr, direction) in zip(index.columns, index.directions):
+            if direction:
+                columns.append('%s %s' % (atr.getShortColumnName(self),
+                                          direction))
+                names.append('%s_%s' % (atr.attrname, direction.lower()))
+            else:
+                columns.append(atr.getShortColumnName(self))
+                names.append(atr.attrname)
+        for atr in index.covering:
+            columns.append(atr.getShortColumnName(self))
+            names.append(atr.attrname)
+        where = None
+        if index.where is not None:
+            # Conditions of indexes can only refer to the indexed table, so
+            # its columns need not be qualified, and should not be, since the
+            # database may be attached under another name later.
+            where = index.where.getQuery(self).replace(
+                self.getTableName(tableClass) + '.', '')
+            names.append('where_' + md5(where.encode('utf-8')).hexdigest()[:8])
+        return (tuple(columns), tuple(names), where)
+
+
     def _createIndexesFor(self, tableClass, extantIndexes):
         """
         Create any indexes which don't exist and are required by the schema
@@ -2127,17 +3188,7 @@ class Store(Empowered):
             names of all indexes which already exist in the underlying database
             and do not need to be created.
         """
-        try:
-            indexes = _requiredTableIndexes[tableClass]
-        except KeyError:
-            indexes = set()
-            for nam, atr in tableClass.getSchema():
-                if atr.indexed:
-                    indexes.add(((atr.getShortColumnName(self),), (atr.attrname,)))
-                for compound in atr.compoundIndexes:
-                    indexes.add((tuple(inatr.getShortColumnName(self) for inatr in compound),
-                                 tuple(inatr.attrname for inatr in compound)))
-            _requiredTableIndexes[tableClass] = indexes
+        indexes = self._requiredIndexesFor(tableClass)
 
         # _ZOMFG_ SQL is such a piece of _shit_: you can't fully qualify the
         # table name in CREATE INDEX statements because the _INDEX_ is fully
@@ -2145,13 +3196,15 @@ class Store(Empowered):
 
         indexColumnPrefix = '.'.join(self.getTableName(tableClass).split(".")[1:])
 
-        for (indexColumns, indexAttrs) in indexes:
+        for (indexColumns, indexAttrs, where) in indexes:
             nameOfIndex = self._indexNameOf(tableClass, indexAttrs)
             if nameOfIndex in extantIndexes:
                 continue
             csql = 'CREATE INDEX %s.%s ON %s(%s)' % (
                 self.databaseName, nameOfIndex, indexColumnPrefix,
                 ', '.join(indexColumns))
+            if where is not None:
+                csql += ' WHERE ' + where
             self.createSQL(csql)
 
 
@@ -2201,6 +3254,7 @@ class Store(Empowered):
             return self
         if self.objectCache.has(storeID):
             return self.objectCache.get(storeID)
+        self.objectCache.misses += 1
         log.msg(interface=iaxiom.IStatEvent, stat_cache_misses=1, key=storeID)
         results = self.querySchemaSQL(_schema.TYPEOF_QUERY, [storeID])
         assert (len(results) in [1, 0]),\
@@ -2214,55 +3268,216 @@ class Store(Empowered):
                 if default is _noItem:
                     raise errors.ItemNotFound("No results for known-to-be-good object")
                 return default
-            attrs = attrs[0]
-            useMostRecent = False
-            moreRecentAvailable = False
+            return self._itemFromRow(storeID, typename, version, attrs[0],
+                                     autoUpgrade)
+        if default is _noItem:
+            raise KeyError(storeID)
+        return default
 
-            # The schema may have changed since the last time I saw the
-            # database.  Let's look to see if this is suspiciously broken...
 
+    def _itemFromRow(self, storeID, typename, version, attrs, autoUpgrade):
+        """
+        Create an item from a row of the table for its type, upgrading it and
+        caching it as necessary.
+
+        @param typename: the name of the item's type, from the types table.
+
+        @param version: the schema version of the item's type, from the types
+        table.
+
+        @param attrs: the row from the item's table, without its storeID.
+
+        @param autoUpgrade: whether an item of an old schema version should be
+        upgraded to the most recent one.
+
+        @raise UnknownItemType: see L{getItemByID}.
+
+        @raise RuntimeError: see L{getItemByID}.
+        """
+        useMostRecent = False
+        moreRecentAvailable = False
+
+        # The schema may have changed since the last time I saw the
+        # database.  Let's look to see if this is suspiciously broken...
+
+        if _typeIsTotallyUnknown(typename, version):
+            # Another process may have created it - let's re-up the schema
+            # and see what we get.
+            self._startup()
+
+            # OK, all the modules have been loaded now, everything
+            # verified.
             if _typeIsTotallyUnknown(typename, version):
-                # Another process may have created it - let's re-up the schema
-                # and see what we get.
-                self._startup()
-
-                # OK, all the modules have been loaded now, everything
-                # verified.
-                if _typeIsTotallyUnknown(typename, version):
-
-                    # If there is STILL no inkling of it anywhere, we are
-                    # almost certainly boned.  Let's tell the user in a
-                    # structured way, at least.
-                    raise errors.UnknownItemType(
-                        "cannot load unknown schema/version pair: %r %r - id: %r" %
-                        (typename, version, storeID))
-
-            if typename in _typeNameToMostRecentClass:
-                moreRecentAvailable = True
-                mostRecent = _typeNameToMostRecentClass[typename]
-
-                if mostRecent.schemaVersion < version:
-                    raise RuntimeError("%s:%d - was found in the database and most recent %s is %d" %
-                                       (typename, version, typename, mostRecent.schemaVersion))
-                if mostRecent.schemaVersion == version:
-                    useMostRecent = True
-            if useMostRecent:
-                T = mostRecent
+
+                # If there is STILL no inkling of it anywhere, we are
+                # almost certainly boned.  Let's tell the user in a
+                # structured way, at least.
+                raise errors.UnknownItemType(
+                    "cannot load unknown schema/version pair: %r %r - id: %r" %
+                    (typename, version, storeID))
+
+        if typename in _typeNameToMostRecentClass:
+            moreRecentAvailable = True
+            mostRecent = _typeNameToMostRecentClass[typename]
+
+            if mostRecent.schemaVersion < version:
+                raise RuntimeError("%s:%d - was found in the database and most recent %s is %d" %
+                                   (typename, version, typename, mostRecent.schemaVersion))
+            if mostRecent.schemaVersion == version:
+                useMostRecent = True
+        if useMostRecent:
+            T = mostRecent
+        else:
+            T = self.getOldVersionOf(typename, version)
+        x = T.existingInStore(self, storeID, attrs)
+        if moreRecentAvailable and (not useMostRecent) and autoUpgrade:
+            # upgradeVersion will do caching as necessary, we don't have to
+            # cache here.  (It must, so that app code can safely call
+            # upgradeVersion and get a consistent object out of it.)
+            x = self.transact(self._upgradeManager.upgradeItem, x)
+        elif not x.__legacy__:
+            # We loaded the most recent version of an object
+            self.objectCache.cache(storeID, x)
+        return x
+
+
+    def getItemsByIDs(self, storeIDs, default=_noItem, autoUpgrade=True):
+        """
+        Retrieve many items by their storeIDs, and return them.
+
+        This is equivalent to calling L{getItemByID} for each storeID, but
+        rather than two queries for each item which is not already cached, it
+        performs one query to find the types of all of them and then one query
+        for each of those types.
+
+        @param storeIDs: an iterable of L{int}s which refer to items in this
+        store.
+
+        @param default: if passed, use this value in place of any item which
+        cannot be found, rather than raising.
+
+        @param autoUpgrade: as for L{getItemByID}.
+
+        @raise TypeError: if any storeID is not an integer.
+
+        @raise KeyError: if no item corresponded to one of the given storeIDs.
+
+        @raise UnknownItemType: see L{getItemByID}.
+
+        @raise RuntimeError: see L{getItemByID}.
+
+        @return: a C{list} of items (or C{default}), one for each of the
+        given storeIDs in the same order.
+        """
+        storeIDs = list(storeIDs)
+        for storeID in storeIDs:
+            if not isinstance(storeID, (int, long)):
+                raise TypeError("storeID *must* be an int or long, not %r" % (
+                        type(storeID).__name__,))
+        items = self._loadItems(storeIDs, autoUpgrade)
+        results = []
+        for storeID in storeIDs:
+            if storeID in items:
+                results.append(items[storeID])
+            elif default is _noItem:
+                raise KeyError(storeID)
             else:
-                T = self.getOldVersionOf(typename, version)
-            x = T.existingInStore(self, storeID, attrs)
-            if moreRecentAvailable and (not useMostRecent) and autoUpgrade:
-                # upgradeVersion will do caching as necessary, we don't have to
-                # cache here.  (It must, so that app code can safely call
-                # upgradeVersion and get a consistent object out of it.)
-                x = self.transact(self._upgradeManager.upgradeItem, x)
-            elif not x.__legacy__:
-                # We loaded the most recent version of an object
-                self.objectCache.cache(storeID, x)
-            return x
-        if default is _noItem:
-            raise KeyError(storeID)
-        return default
+                results.append(default)
+        return results
+
+
+    def _loadItems(self, storeIDs, autoUpgrade=True):
+        """
+        Implement L{getItemsByIDs}, loading the items with the given storeIDs
+        which are not already cached with one query for the types of all of
+        them and one query for each of those types.
+
+        @param storeIDs: an iterable of L{int}s or C{None}s.  C{None}s, and
+        storeIDs which do not refer to any item, are ignored.
+
+        @return: a C{dict} mapping the storeIDs of the items found to the
+        items.  Items are only cached for as long as something refers to them,
+        so this must be kept for as long as they are wanted.
+        """
+        items = {}
+        wanted = []
+        for storeID in storeIDs:
+            if storeID is None or storeID in items:
+                continue
+            if storeID == STORE_SELF_ID:
+                items[storeID] = self
+            elif self.objectCache.has(storeID):
+                items[storeID] = self.objectCache.get(storeID)
+            else:
+                # Mark it as seen, but not yet found.
+                items[storeID] = None
+                wanted.append(storeID)
+        if wanted:
+            self.objectCache.misses += len(wanted)
+            log.msg(interface=iaxiom.IStatEvent,
+                    stat_cache_misses=len(wanted), key=wanted)
+
+        byType = {}
+        for start in xrange(0, len(wanted), IN_CLAUSE_SIZE):
+            chunk = wanted[start:start + IN_CLAUSE_SIZE]
+            sql = _schema.TYPEOF_MANY_QUERY % (', '.join(['?'] * len(chunk)),)
+            for (storeID, typename, module, version) in self.querySchemaSQL(
+                sql, chunk):
+                byType.setdefault((typename, version), []).append(storeID)
+
+        for (typename, version), typeIDs in byType.iteritems():
+            for start in xrange(0, len(typeIDs), IN_CLAUSE_SIZE):
+                chunk = typeIDs[start:start + IN_CLAUSE_SIZE]
+                sql = 'SELECT oid, * FROM %s WHERE oid IN (%s)' % (
+                    self._tableNameFor(typename, version),
+                    ', '.join(['?'] * len(chunk)))
+                for row in self.querySQL(sql, chunk):
+                    storeID = row[0]
+                    # Upgrading one item may have loaded others.
+                    if self.objectCache.has(storeID):
+                        items[storeID] = self.objectCache.get(storeID)
+                    else:
+                        items[storeID] = self._itemFromRow(
+                            storeID, typename, version, row[1:], autoUpgrade)
+
+        for typeIDs in byType.itervalues():
+            for storeID in typeIDs:
+                if items[storeID] is None:
+                    # Its row was not where its type said it would be, most
+                    # likely because it was upgraded along with another item
+                    # loaded before it.  Look again.
+                    items[storeID] = self.getItemByID(storeID, None,
+                                                      autoUpgrade)
+        for storeID in wanted:
+            if items[storeID] is None:
+                del items[storeID]
+        return items
+
+
+    def startProfiling(self):
+        """
+        Begin recording statistics about every SQL statement this store runs,
+        if that is not being done already.
+
+        @rtype: L{axiom.queryprofile.QueryProfiler}
+        @return: the profiler doing the recording.
+        """
+        if self.queryProfiler is None:
+            self.queryProfiler = queryprofile.QueryProfiler(self)
+        return self.queryProfiler
+
+
+    def stopProfiling(self):
+        """
+        Stop recording statistics about the SQL statements this store runs.
+
+        @rtype: L{axiom.queryprofile.QueryProfiler}
+        @return: the profiler which was doing the recording, with everything it
+            recorded, or C{None} if this store was not being profiled.
+        """
+        profiler = self.queryProfiler
+        self.queryProfiler = None
+        return profiler
 
 
     def querySchemaSQL(self, sql, args=()):
@@ -2283,6 +3498,9 @@ class Store(Empowered):
     def _queryandfetch(self, sql, args):
         if self.debug:
             print '**', sql, '--', ', '.join(map(str, args))
+        profiler = self.queryProfiler
+        if profiler is not None:
+            started = time.time()
         self.cursor.execute(sql, args)
         before = time.time()
         result = list(self.cursor)
@@ -2291,12 +3509,56 @@ class Store(Empowered):
             log.msg('Extremely long list(cursor): %s' % (after - before,))
             log.msg(sql)
             # import traceback; traceback.print_stack()
+        if profiler is not None:
+            profiler.record(sql, args, after - started,
+                            len(result) or max(self.cursor.rowCount(), 0))
         if self.debug:
             print '  lastrow:', self.cursor.lastRowID()
             print '  result:', result
         return result
 
 
+    def _streamSQL(self, sql, args, chunkSize):
+        """
+        Execute a SELECT statement on a cursor of its own, rather than the
+        cursor shared by everything else which uses this store.
+
+        @param chunkSize: the maximum number of rows to load into memory at a
+            time.
+
+        @return: an iterator of C{list}s of at most C{chunkSize} rows each.
+            The cursor is closed when this iterator is exhausted or discarded.
+        """
+        if self.debug:
+            print '** (streaming)', sql, '--', ', '.join(map(str, args))
+        profiler = self.queryProfiler
+        transaction = self.transaction
+        cursor = self.connection.cursor()
+        before = time.time()
+        cursor.execute(sql, args)
+        # The time spent in the database and the number of rows read, which
+        # are only known once the results are all fetched.
+        totals = [time.time() - before, 0]
+        def chunks():
+            try:
+                while True:
+                    if (transaction is not None
+                        and self.transaction is not transaction):
+                        raise errors.StreamingQueryInterrupted(sql)
+                    before = time.time()
+                    rows = cursor.fetchmany(chunkSize)
+                    totals[0] += time.time() - before
+                    totals[1] += len(rows)
+                    if not rows:
+                        return
+                    yield rows
+            finally:
+                cursor.close()
+                if profiler is not None:
+                    profiler.record(sql, args, totals[0], totals[1])
+        return chunks()
+
+
     def createSQL(self, sql, args=()):
         """
         For use with auto-committing statements such as CREATE TABLE or CREATE
@@ -2335,6 +3597,31 @@ class Store(Empowered):
             self.executedThisTransaction.append((result, sql, args))
         return result
 
+
+    def executeManySQL(self, sql, argsList):
+        """
+        For use with many UPDATE or INSERT statements which differ only in
+        their arguments.
+
+        @param argsList: an iterable of sequences of arguments, one for each
+            time the statement is to be executed.
+        """
+        argsList = list(argsList)
+        profiler = self.queryProfiler
+        if profiler is not None:
+            before = time.time()
+        if self.debug:
+            print '** (%d times)' % (len(argsList),), sql
+            timeinto(self.execTimes, self.cursor.executemany, sql, argsList)
+        else:
+            self.cursor.executemany(sql, argsList)
+        if profiler is not None and argsList:
+            profiler.record(sql, argsList[0], time.time() - before,
+                            max(self.cursor.rowCount(), 0), len(argsList))
+        if self.executedThisTransaction is not None:
+            for args in argsList:
+                self.executedThisTransaction.append((None, sql, args))
+
 # This isn't actually useful any more.  It turns out that the pysqlite
 # documentation is confusingly worded; it's perfectly possible to create tables
 # within transactions, but PySQLite's automatic transaction management (which
@@ -3,8 +3,9 @@
 from zope.interface import implements
 
 from twisted.application import service
+from twisted.python import log
 
-from axiom.iaxiom import IPowerupIndirector
+from axiom.iaxiom import IPowerupIndirector, IStatEvent
 
 from axiom.store import Store
 from axiom.item import Item
@@ -12,6 +13,148 @@ from axiom.attributes import path, inmemory, reference
 
 from axiom.upgrade import registerUpgrader
 
+class SubStorePool(object):
+    """
+    The on-disk substores of one store which are open, most recently used
+    first.
+
+    Once more than C{maxOpen} of them are open, the least recently used ones
+    are closed as others are opened, and are opened again the next time
+    L{SubStore.open} is called for them (or they are adapted to something).
+    Anything else still referring to a closed substore's L{Store} or its items
+    can no longer use them, so substores are never closed while they are in a
+    transaction, attached to their parent, running services, or have open
+    substores of their own.  In-memory substores are never closed.
+
+    @ivar maxOpen: The number of substores to keep open, or C{None} to keep
+        them all open.
+
+    @ivar opens: The number of substores opened for the first time.
+
+    @ivar closes: The number of substores closed because they had not been
+        used recently enough.
+
+    @ivar reopens: The number of substores opened again after being closed
+        because they had not been used recently enough.
+    """
+    def __init__(self, maxOpen=None):
+        self.maxOpen = maxOpen
+        self.opens = 0
+        self.closes = 0
+        self.reopens = 0
+        # Map of substore paths to nodes of a circular doubly-linked list
+        # ordered from most to least recently used.  Each node is a list of
+        # [previous node, next node, path, SubStore]; self._root is a
+        # sentinel node.
+        self._nodes = {}
+        self._root = root = [None, None, None, None]
+        root[0] = root[1] = root
+        # Paths of substores closed by this pool.
+        self._closed = set()
+
+
+    def __len__(self):
+        return len(self._nodes)
+
+
+    def _unlink(self, node):
+        node[0][1] = node[1]
+        node[1][0] = node[0]
+
+
+    def _link(self, node):
+        root = self._root
+        first = root[1]
+        node[0] = root
+        node[1] = first
+        first[0] = root[1] = node
+
+
+    def used(self, substore):
+        """
+        Note that C{substore} has been opened or used, and close the least
+        recently used substores if too many are open.
+
+        @param substore: a L{SubStore} whose store is open.
+        """
+        if substore.storepath is None:
+            return
+        key = substore.storepath.path
+        node = self._nodes.get(key)
+        if node is not None:
+            self._unlink(node)
+            self._link(node)
+            return
+
+        if key in self._closed:
+            self._closed.remove(key)
+            self.reopens += 1
+            log.msg(interface=IStatEvent, stat_substore_reopens=1)
+        else:
+            self.opens += 1
+            log.msg(interface=IStatEvent, stat_substore_opens=1)
+        node = self._nodes[key] = [None, None, key, substore]
+        self._link(node)
+        self._closeIdle()
+
+
+    def closed(self, substore):
+        """
+        Forget C{substore}, which has been closed.
+        """
+        if substore.storepath is None:
+            return
+        node = self._nodes.pop(substore.storepath.path, None)
+        if node is not None:
+            self._unlink(node)
+
+
+    def _closeIdle(self):
+        """
+        Close idle substores, least recently used first, until no more than
+        C{maxOpen} are open or none of the others are idle.
+        """
+        if self.maxOpen is None:
+            return
+        root = self._root
+        node = root[0]
+        while len(self._nodes) > self.maxOpen and node is not root:
+            previous = node[0]
+            # Never close the substore which was just opened.
+            if node is not root[1] and self._idle(node[3].substore):
+                key = node[2]
+                node[3].close()
+                self._closed.add(key)
+                self.closes += 1
+                log.msg(interface=IStatEvent, stat_substore_closes=1)
+            node = previous
+
+
+    def _idle(self, store):
+        """
+        Determine whether C{store} can be closed without disturbing anything
+        using it.
+        """
+        if store.transaction is not None or store.attachedToParent:
+            return False
+        if store._axiom_service is not None and store._axiom_service.running:
+            return False
+        if store._subStorePool is not None and len(store._subStorePool):
+            return False
+        return True
+
+
+
+def getSubStorePool(store):
+    """
+    Return the L{SubStorePool} of the substores of C{store} which are open.
+    """
+    if store._subStorePool is None:
+        store._subStorePool = SubStorePool()
+    return store._subStorePool
+
+
+
 class SubStore(Item):
 
     schemaVersion = 1
@@ -38,18 +181,20 @@ class SubStore(Item):
     createNew = classmethod(createNew)
 
     def close(self):
+        getSubStorePool(self.store).closed(self)
         self.substore.close()
         del self.substore._openSubStore
         del self.substore
 
     def open(self, debug=False):
         if hasattr(self, 'substore'):
-            return self.substore
+            s = self.substore
         else:
             s = self.substore = self.createStore(debug)
             s._openSubStore = self # don't fall out of cache as long as the
                                    # store is alive!
-            return s
+        getSubStorePool(self.store).used(self)
+        return s
 
     def createStore(self, debug):
         """
@@ -66,12 +211,14 @@ class SubStore(Item):
             return Store(parent=self.store,
                          filesdir=filesdir,
                          idInParent=self.storeID,
-                         debug=debug)
+                         debug=debug,
+                         objectCacheSize=self.store.objectCache.strong.size)
         else:
             return Store(self.storepath.path,
                          parent=self.store,
                          idInParent=self.storeID,
-                         debug=debug)
+                         debug=debug,
+                         objectCacheSize=self.store.objectCache.strong.size)
 
     def __conform__(self, interface):
         """
@@ -1,6 +1,7 @@
 
 from twisted.trial import unittest
 from twisted.python import failure, filepath
+from twisted.internet import defer
 from twisted.application import service
 
 from axiom import iaxiom, store, item, attributes, batch, substore
@@ -34,6 +35,22 @@ class WorkListener(item.Item):
 
 
 
+class BulkWorkListener(item.Item):
+    """
+    A listener which can process several work units at once.
+    """
+    comply = attributes.integer()
+
+    listener = attributes.inmemory(doc="""
+    A callable which will be invoked by processItems with a list of work
+    units.
+    """)
+
+    def processItems(self, items):
+        self.listener(items)
+
+
+
 class BatchTestCase(unittest.TestCase):
     def setUp(self):
         self.procType = batch.processor(TestWorkUnit)
@@ -473,6 +490,149 @@ class BatchTestCase(unittest.TestCase):
         self.assertIdentical(proc.run(), None)
 
 
+    def _batchStep(self, proc, batchSize):
+        """
+        Step C{proc} in a transaction, giving its listener C{batchSize} units
+        of work.
+        """
+        return self.store.transact(proc.step, batchSize=batchSize)
+
+
+    def test_batchProgress(self):
+        """
+        Several units of work, new and old, are processed each time a
+        processor is stepped with a batch size of more than one.
+        """
+        processedItems = []
+        def listener(item):
+            processedItems.append(item.information)
+
+        proc = self.procType(store=self.store)
+        for i in range(2):
+            TestWorkUnit(store=self.store, information=i)
+        listener = WorkListener(store=self.store, listener=listener)
+        proc.addReliableListener(listener)
+        for i in range(2, 5):
+            TestWorkUnit(store=self.store, information=i)
+
+        self.failUnless(self._batchStep(proc, 3))
+        self.assertEquals(processedItems, [2, 3, 4])
+        self.failIf(self._batchStep(proc, 3))
+        self.assertEquals(processedItems, [2, 3, 4, 1, 0])
+        self.failIf(self._batchStep(proc, 3))
+        self.assertEquals(processedItems, [2, 3, 4, 1, 0])
+
+
+    def test_batchSizeAttribute(self):
+        """
+        A processor gives its listeners as many units of work as the
+        C{batchSize} attribute of its type says, unless told otherwise.
+        """
+        processedItems = []
+        self.patch(self.procType, 'batchSize', 2)
+        proc = self.procType(store=self.store)
+        listener = WorkListener(
+            store=self.store,
+            listener=lambda item: processedItems.append(item.information))
+        proc.addReliableListener(listener)
+        for i in range(3):
+            TestWorkUnit(store=self.store, information=i)
+        self.store.transact(proc.step)
+        self.assertEquals(processedItems, [0, 1])
+
+
+    def test_batchBrokenListener(self):
+        """
+        When a listener fails to process one unit of work in a batch, the
+        changes it made for that unit are reverted and the failure is
+        recorded, but the others in the batch are still processed.
+        """
+        processedItems = []
+        def listener(item):
+            item.information += 10
+            if item.information == 11:
+                raise RuntimeError("Not that one.")
+            processedItems.append(item.information)
+
+        proc = self.procType(store=self.store)
+        listener = WorkListener(store=self.store, listener=listener)
+        proc.addReliableListener(listener)
+        for i in range(3):
+            TestWorkUnit(store=self.store, information=i)
+
+        self.failIf(self._batchStep(proc, 3))
+        self.assertEquals(processedItems, [10, 12])
+        self.assertEquals(
+            list(self.store.query(
+                    TestWorkUnit,
+                    sort=TestWorkUnit.storeID.ascending).getColumn(
+                    "information")),
+            [10, 1, 12])
+        self.assertEquals(
+            [(l, i.information) for (l, i) in proc.getFailedItems()],
+            [(listener, 1)])
+        self.assertEquals(len(self.flushLoggedErrors(RuntimeError)), 1)
+
+        # The failed unit of work is not given to the listener again.
+        self.assertRaises(batch._NoWorkUnits,
+                          self.store.findUnique(batch._ReliableListener).step,
+                          3)
+
+
+    def test_processItems(self):
+        """
+        A listener with a C{processItems} method is given the whole batch of
+        work units at once.
+        """
+        batches = []
+        proc = self.procType(store=self.store)
+        listener = BulkWorkListener(
+            store=self.store,
+            listener=lambda items: batches.append(
+                [item.information for item in items]))
+        proc.addReliableListener(listener)
+        for i in range(5):
+            TestWorkUnit(store=self.store, information=i)
+        self.failUnless(self._batchStep(proc, 3))
+        self.failIf(self._batchStep(proc, 3))
+        self.assertEquals(batches, [[0, 1, 2], [3, 4]])
+
+
+    def test_processItemsFailure(self):
+        """
+        If C{processItems} fails, the units of work in the batch are given to
+        it again one at a time, so that only the ones which fail are recorded
+        as failures.
+        """
+        batches = []
+        def listener(items):
+            information = [item.information for item in items]
+            for item in items:
+                item.information += 10
+            batches.append(information)
+            if 1 in information:
+                raise RuntimeError("Not that one.")
+
+        proc = self.procType(store=self.store)
+        listener = BulkWorkListener(store=self.store, listener=listener)
+        proc.addReliableListener(listener)
+        for i in range(3):
+            TestWorkUnit(store=self.store, information=i)
+
+        self.failIf(self._batchStep(proc, 3))
+        self.assertEquals(batches, [[0, 1, 2], [0], [1], [2]])
+        self.assertEquals(
+            list(self.store.query(
+                    TestWorkUnit,
+                    sort=TestWorkUnit.storeID.ascending).getColumn(
+                    "information")),
+            [10, 1, 12])
+        self.assertEquals(
+            [(l, i.information) for (l, i) in proc.getFailedItems()],
+            [(listener, 1)])
+        self.assertEquals(len(self.flushLoggedErrors(RuntimeError)), 1)
+
+
 
 class BatchCallTestItem(item.Item):
     called = attributes.boolean(default=False)
@@ -605,3 +765,231 @@ class RemoteTestCase(unittest.TestCase):
         self.assertEquals(
             st.query(BatchWorkItem, BatchWorkItem.value == u"processed").count(),
             BATCH_WORK_UNITS)
+
+
+    def test_processingServiceBatches(self):
+        """
+        L{BatchProcessingService} can give each listener several units of work
+        in one transaction, recording the failures among them.
+        """
+        BATCH_WORK_UNITS = 3
+
+        st = store.Store()
+        source = BatchWorkSource(store=st)
+        for i in range(BATCH_WORK_UNITS):
+            BatchWorkItem(store=st)
+
+        source.addReliableListener(BrokenReliableListener(store=st), iaxiom.REMOTE)
+        source.addReliableListener(WorkingReliableListener(store=st), iaxiom.REMOTE)
+
+        svc = batch.BatchProcessingService(
+            st, iaxiom.REMOTE, batchSize=BATCH_WORK_UNITS)
+
+        task = svc.step()
+
+        # One iteration for each listener.
+        for i in xrange(2):
+            task.next()
+
+        self.assertEquals(
+            len(self.flushLoggedErrors(BrokenException)),
+            BATCH_WORK_UNITS)
+        self.assertEquals(
+            len(list(source.getFailedItems())), BATCH_WORK_UNITS)
+        self.assertEquals(
+            st.query(BatchWorkItem, BatchWorkItem.value == u"processed").count(),
+            BATCH_WORK_UNITS)
+
+
+
+class FakeJuice(object):
+    """
+    Stand-in for the juice connection to a batch process, which records the
+    commands sent to it.
+
+    @ivar responses: A C{dict} mapping command names to the boxes to respond
+        to them with.
+    """
+    transport = None
+
+    def __init__(self):
+        self.commands = []
+        self.responses = {}
+
+
+    def sendBoxCommand(self, command, box, requiresAnswer=True):
+        self.commands.append((command, dict(box)))
+        return defer.succeed(self.responses.get(command, {}))
+
+
+
+class FakeProcessController(object):
+    """
+    Stand-in for the L{batch.ProcessController} of a running batch process.
+    """
+    mode = 'ready'
+
+    def __init__(self):
+        self.juice = FakeJuice()
+
+
+    def getProcess(self):
+        return defer.succeed(self.juice)
+
+
+
+class ProcessPoolTests(unittest.TestCase):
+    """
+    Tests for spreading the substores of a site store across a pool of batch
+    processes.
+    """
+    def setUp(self):
+        self.dbdir = filepath.FilePath(self.mktemp())
+        self.store = store.Store(self.dbdir)
+        self.paths = [
+            substore.SubStore.createNew(self.store, ['sub%d' % (i,)]
+                                        ).storepath.path
+            for i in range(8)]
+
+
+    def test_defaultWorker(self):
+        """
+        Substores are spread across all of the processes in a pool by their
+        paths.
+        """
+        workers = [batch._defaultWorker(path, 3) for path in self.paths]
+        self.assertEquals(sorted(set(workers)), [0, 1, 2])
+        self.assertEquals(
+            [batch._defaultWorker(unicode(path), 3) for path in self.paths],
+            workers)
+
+
+    def _childProtocol(self, worker, workers):
+        """
+        Create a L{batch.BatchProcessingProtocol} like one in a batch process,
+        for the given share of the substores.
+        """
+        proto = batch.BatchProcessingProtocol(service.MultiService())
+        proto.command_SET_STORE(
+            storepath=self.dbdir, worker=worker, workers=workers)
+        self.addCleanup(proto.pollCall.stop)
+        return proto
+
+
+    def test_childShare(self):
+        """
+        A batch process in a pool handles only its share of the substores.
+        """
+        proto = self._childProtocol(1, 3)
+        self.assertEquals(
+            sorted(proto.subStores),
+            sorted([path for path in self.paths
+                    if batch._defaultWorker(path, 3) == 1]))
+
+
+    def test_adoptAndRelease(self):
+        """
+        A batch process handles substores it is told to adopt, and stops
+        handling those it is told to release, even when they are looked for
+        again.
+        """
+        proto = self._childProtocol(0, 2)
+        [mine] = [path for path in self.paths
+                  if batch._defaultWorker(path, 2) == 0][:1]
+        [other] = [path for path in self.paths
+                   if batch._defaultWorker(path, 2) == 1][:1]
+        proto.command_ADOPT_SUBSTORE(storepath=filepath.FilePath(other))
+        proto.command_RELEASE_SUBSTORE(storepath=filepath.FilePath(mine))
+        proto._pollSubStores()
+        self.failUnless(other in proto.subStores)
+        self.failIf(mine in proto.subStores)
+
+
+    def test_shedSubStore(self):
+        """
+        A batch process sheds one of its busy substores, but not one with
+        suspended processors, and reports how many busy ones it has.
+        """
+        proto = self._childProtocol(0, 1)
+        busy, suspended = sorted(proto.subStores)[:2]
+        proto.subStores[busy].busy = True
+        proto.subStores[suspended].busy = True
+        proto.subStores[suspended].suspended.append(object())
+        self.assertEquals(
+            proto.command_COUNT_BUSY_SUBSTORES(), {'count': 2})
+
+        result = []
+        proto.command_SHED_SUBSTORE().addCallback(result.append)
+        self.assertEquals(result[0]['storepath'].path, busy)
+        self.failIf(busy in proto.subStores)
+        self.assertEquals(proto.command_SHED_SUBSTORE(), {})
+
+
+    def _controller(self, processes):
+        """
+        Create a L{batch.BatchProcessingControllerService} for a pool of fake
+        processes.
+        """
+        svc = batch.BatchProcessingControllerService(self.store, processes)
+        svc.controllers = [FakeProcessController() for i in range(processes)]
+        return svc
+
+
+    def test_moveSubStores(self):
+        """
+        Each idle process is given a substore from the busiest process, if it
+        is busy with more than one.
+        """
+        svc = self._controller(4)
+        moves = []
+        def moveSubStore(source, target):
+            moves.append((source, target))
+            return defer.succeed(None)
+        svc._moveSubStore = moveSubStore
+        svc._moveSubStores({0: 3, 1: 0, 2: 1, 3: 0})
+        self.assertEquals(moves, [(0, 1), (0, 3)])
+        del moves[:]
+        svc._moveSubStores({0: 2, 1: 0, 2: 0, 3: 1})
+        self.assertEquals(moves, [(0, 1)])
+        del moves[:]
+        svc._moveSubStores({0: 1, 1: 0, 2: 0, 3: 1})
+        self.assertEquals(moves, [])
+
+
+    def test_moveSubStore(self):
+        """
+        A substore shed by one process is adopted by another, to which
+        commands for it are then sent.
+        """
+        svc = self._controller(2)
+        [path] = [p for p in self.paths if batch._defaultWorker(p, 2) == 0][:1]
+        source, target = svc.controllers
+        source.juice.responses['Shed-SubStore'] = {'storepath': path}
+        svc._moveSubStore(0, 1)
+        self.assertEquals(source.juice.commands, [('Shed-SubStore', {})])
+        self.assertEquals(target.juice.commands,
+                          [('Adopt-SubStore', {'storepath': path})])
+        self.assertEquals(svc.assignments, {path: 1})
+
+        svc.suspend(filepath.FilePath(path), 1)
+        self.assertEquals(target.juice.commands[-1][0], 'Suspend-Processor')
+
+
+    def test_restartedProcess(self):
+        """
+        A restarted process in a pool is told again about substores which have
+        been moved to or from it.
+        """
+        svc = self._controller(2)
+        [fromFirst] = [p for p in self.paths
+                       if batch._defaultWorker(p, 2) == 0][:1]
+        [toFirst] = [p for p in self.paths
+                     if batch._defaultWorker(p, 2) == 1][:1]
+        svc.assignments = {fromFirst: 1, toFirst: 0}
+        svc._setStore(0)
+        self.assertEquals(
+            sorted(svc.controllers[0].juice.commands),
+            sorted([('Set-Store', {'storepath': self.dbdir.path,
+                                   'worker': '0', 'workers': '2'}),
+                    ('Adopt-SubStore', {'storepath': toFirst}),
+                    ('Release-SubStore', {'storepath': fromFirst})]))
@@ -0,0 +1,223 @@
+
+"""
+Tests for L{axiom._fincache} and its use as the item cache of a L{Store}.
+"""
+
+import gc
+
+from twisted.trial.unittest import TestCase
+from twisted.python import log
+
+from axiom._fincache import StrongCache
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import integer
+from axiom.iaxiom import IStatEvent
+from axiom.substore import SubStore
+
+
+
+class CachedThing(Item):
+    """
+    An item for exercising the item cache.
+    """
+    value = integer()
+
+
+
+class StrongCacheTests(TestCase):
+    """
+    Tests for L{StrongCache}, a bounded LRU collection of strong references.
+    """
+    def test_keep(self):
+        """
+        L{StrongCache.keep} holds on to values until the cache is full.
+        """
+        cache = StrongCache(2)
+        cache.keep(1, 'a')
+        cache.keep(2, 'b')
+        self.assertEquals(len(cache), 2)
+        self.assertEquals(cache.evictions, 0)
+
+
+    def test_evictLeastRecentlyUsed(self):
+        """
+        When L{StrongCache} is full, the least recently kept value is dropped
+        to make room for a new one.
+        """
+        cache = StrongCache(2)
+        cache.keep(1, 'a')
+        cache.keep(2, 'b')
+        cache.keep(1, 'a')
+        cache.keep(3, 'c')
+        self.assertEquals(sorted(cache.nodes.keys()), [1, 3])
+        self.assertEquals(cache.evictions, 1)
+
+
+    def test_discard(self):
+        """
+        L{StrongCache.discard} drops the value for a key, and ignores keys it
+        does not have.
+        """
+        cache = StrongCache(2)
+        cache.keep(1, 'a')
+        cache.keep(2, 'b')
+        cache.discard(1)
+        cache.discard(4)
+        self.assertEquals(cache.nodes.keys(), [2])
+        cache.keep(3, 'c')
+        cache.keep(4, 'd')
+        self.assertEquals(sorted(cache.nodes.keys()), [3, 4])
+
+
+    def test_clear(self):
+        """
+        L{StrongCache.clear} drops all values.
+        """
+        cache = StrongCache(2)
+        cache.keep(1, 'a')
+        cache.keep(2, 'b')
+        cache.clear()
+        self.assertEquals(len(cache), 0)
+        self.assertEquals(cache.evictions, 0)
+
+
+    def test_disabled(self):
+        """
+        A L{StrongCache} with a size of zero keeps nothing.
+        """
+        cache = StrongCache(0)
+        cache.keep(1, 'a')
+        self.assertEquals(len(cache), 0)
+
+
+
+class StoreObjectCacheTests(TestCase):
+    """
+    Tests for the strong references a L{Store} can keep to recently used items.
+    """
+    def setUp(self):
+        self.store = Store(objectCacheSize=2)
+        self.events = []
+        log.addObserver(self.events.append)
+        self.addCleanup(log.removeObserver, self.events.append)
+
+
+    def _forget(self, item):
+        """
+        Drop all references to C{item} other than the store's, and return its
+        storeID.
+        """
+        storeID = item.storeID
+        del item
+        gc.collect()
+        return storeID
+
+
+    def test_keptAlive(self):
+        """
+        Items which are no longer referred to elsewhere remain in the cache.
+        """
+        storeID = self._forget(CachedThing(store=self.store, value=1))
+        self.failUnless(self.store.objectCache.has(storeID))
+        misses = self.store.objectCache.misses
+        self.assertEquals(self.store.getItemByID(storeID).value, 1)
+        self.assertEquals(self.store.objectCache.misses, misses)
+
+
+    def test_eviction(self):
+        """
+        The least recently used item is evicted from the cache when the limit
+        is reached, and must be loaded from the database again.
+        """
+        storeIDs = [self._forget(CachedThing(store=self.store, value=i))
+                    for i in range(3)]
+        gc.collect()
+        self.failIf(self.store.objectCache.has(storeIDs[0]))
+        self.failUnless(self.store.objectCache.has(storeIDs[2]))
+        self.assertEquals(self.store.objectCache.strong.evictions, 1)
+        self.assertEquals(
+            sum([e.get('stat_cache_evictions', 0) for e in self.events
+                 if e.get('interface') is IStatEvent]),
+            1)
+
+        misses = self.store.objectCache.misses
+        self.assertEquals(self.store.getItemByID(storeIDs[0]).value, 0)
+        self.assertEquals(self.store.objectCache.misses, misses + 1)
+
+
+    def test_queryHits(self):
+        """
+        Items loaded by queries are served from the cache and refreshed in it.
+        """
+        storeIDs = [self._forget(CachedThing(store=self.store, value=i))
+                    for i in range(2)]
+        hits = self.store.objectCache.hits
+        self.assertEquals(
+            [x.storeID for x in self.store.query(
+                CachedThing, sort=CachedThing.storeID.ascending)],
+            storeIDs)
+        self.assertEquals(self.store.objectCache.hits, hits + 2)
+
+
+    def test_deletion(self):
+        """
+        Deleted items are no longer kept alive.
+        """
+        item = CachedThing(store=self.store)
+        storeID = item.storeID
+        item.deleteFromStore()
+        self.failIf(storeID in self.store.objectCache.strong.nodes)
+        self.assertRaises(KeyError, self.store.getItemByID, storeID)
+
+
+    def test_transactionalDeletion(self):
+        """
+        Items deleted in a transaction are no longer kept alive once it is
+        committed.
+        """
+        item = CachedThing(store=self.store)
+        storeID = item.storeID
+        self.store.transact(item.deleteFromStore)
+        self.failIf(storeID in self.store.objectCache.strong.nodes)
+
+
+    def test_revert(self):
+        """
+        Items created in a transaction which is reverted are no longer kept
+        alive.
+        """
+        created = []
+        def txn():
+            created.append(CachedThing(store=self.store).storeID)
+            raise ValueError()
+        self.assertRaises(ValueError, self.store.transact, txn)
+        self.failIf(created[0] in self.store.objectCache.strong.nodes)
+        self.failIf(self.store.objectCache.has(created[0]))
+
+
+    def test_close(self):
+        """
+        Closing a store drops the items it is keeping alive.
+        """
+        CachedThing(store=self.store)
+        self.store.close()
+        self.assertEquals(len(self.store.objectCache.strong), 0)
+
+
+    def test_substore(self):
+        """
+        Substores keep as many items alive as their parent.
+        """
+        substore = SubStore.createNew(self.store, ['sub']).open()
+        self.assertEquals(substore.objectCache.strong.size, 2)
+
+
+    def test_defaultDisabled(self):
+        """
+        By default, a store keeps items alive only as long as something else
+        refers to them.
+        """
+        store = Store()
+        storeID = self._forget(CachedThing(store=store))
+        self.failIf(store.objectCache.has(storeID))
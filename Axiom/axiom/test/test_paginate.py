@@ -1,7 +1,9 @@
 # Copyright 2006 Divmod, Inc.  See LICENSE file for details
 
 """
-This module contains tests for the L{axiom.store.ItemQuery.paginate} method.
+This module contains tests for the L{axiom.store.ItemQuery.paginate} method,
+and for keyset pagination with L{axiom.store.ItemQuery.pageAfter} and
+L{axiom.store.ItemQuery.pageBefore}.
 """
 
 from twisted.trial.unittest import TestCase
@@ -9,7 +11,7 @@ from twisted.trial.unittest import TestCase
 
 from axiom.store import Store
 from axiom.item import Item
-from axiom.attributes import integer, compoundIndex
+from axiom.attributes import integer, text, compoundIndex, SimpleOrdering
 
 from axiom.test.util import QueryCounter
 
@@ -169,3 +171,160 @@ class CrossTransactionIteration(TestCase):
         "extension of the API.")
 
 
+
+
+
+class KeysetSortHelper(Item):
+    folder = integer()
+    received = integer()
+    sender = text()
+    compoundIndex(folder, received.descending)
+
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    Tests for L{ItemQuery.pageAfter}, L{ItemQuery.pageBefore} and
+    L{ItemQuery.cursorFor}.
+    """
+    def setUp(self):
+        self.store = Store()
+        senders = [u'alice', u'bob', None, u'd\N{LATIN SMALL LETTER E WITH ACUTE}']
+        for i in range(30):
+            KeysetSortHelper(store=self.store, folder=i % 2, received=i // 3,
+                             sender=senders[i % 4])
+
+
+    def _walk(self, query, pagesize, forward=True):
+        """
+        Collect all the results of C{query} a page at a time, checking that no
+        page is larger than C{pagesize}.
+        """
+        results = []
+        cursor = None
+        while True:
+            if forward:
+                page = query.pageAfter(cursor, pagesize)
+            else:
+                page = query.pageBefore(cursor, pagesize)
+            self.failUnless(len(page) <= pagesize)
+            if not page:
+                return results
+            if forward:
+                results.extend(page)
+                cursor = query.cursorFor(page[-1])
+            else:
+                results[:0] = page
+                cursor = query.cursorFor(page[0])
+
+
+    def _check(self, comparison, sort, expected):
+        """
+        Page through a query forwards and backwards with several page sizes,
+        and check that its results are found in the C{expected} order.
+        """
+        query = self.store.query(KeysetSortHelper, comparison, sort=sort)
+        for pagesize in 1, 2, 7, 100:
+            self.assertEquals(self._walk(query, pagesize), expected)
+            self.assertEquals(self._walk(query, pagesize, False), expected)
+
+
+    def test_storeIDTiebreaker(self):
+        """
+        Results whose sort columns are the same are ordered by storeID, in the
+        direction of the last sort column.
+        """
+        for sort in (KeysetSortHelper.received.ascending,
+                     KeysetSortHelper.received.descending):
+            self._check(None, sort, list(self.store.query(
+                        KeysetSortHelper, sort=[
+                            sort, SimpleOrdering(KeysetSortHelper.storeID,
+                                                 sort.direction)])))
+
+
+    def test_unsorted(self):
+        """
+        Unsorted queries are paged through in storeID order.
+        """
+        self._check(KeysetSortHelper.folder == 1, None, list(
+                self.store.query(KeysetSortHelper, KeysetSortHelper.folder == 1,
+                                 sort=KeysetSortHelper.storeID.ascending)))
+
+
+    def test_mixedDirections(self):
+        """
+        Queries sorted by several columns in different directions, some of
+        them containing C{None}, are paged through in order.
+        """
+        for sort in ([KeysetSortHelper.sender.ascending,
+                      KeysetSortHelper.received.descending],
+                     [KeysetSortHelper.sender.descending,
+                      KeysetSortHelper.received.ascending]):
+            self._check(
+                KeysetSortHelper.folder == 0, sort, list(self.store.query(
+                        KeysetSortHelper, KeysetSortHelper.folder == 0,
+                        sort=sort + [SimpleOrdering(KeysetSortHelper.storeID,
+                                                    sort[-1].direction)])))
+
+
+    def test_constantWork(self):
+        """
+        Finding a page late in the results takes no more work than finding one
+        early in them, when the sort order is indexed.
+        """
+        query = self.store.query(KeysetSortHelper, KeysetSortHelper.folder == 1,
+                                 sort=KeysetSortHelper.received.descending)
+        results = list(query)
+        qc = QueryCounter(self.store)
+        early = qc.measure(query.pageAfter, query.cursorFor(results[1]), 3)
+        late = qc.measure(query.pageAfter, query.cursorFor(results[-5]), 3)
+        self.assertEquals(early, late)
+
+
+    def test_cursorSurvivesDeletion(self):
+        """
+        A cursor remains usable after the item it was made from is deleted.
+        """
+        query = self.store.query(KeysetSortHelper,
+                                 sort=KeysetSortHelper.received.ascending)
+        results = list(query)
+        cursor = query.cursorFor(results[4])
+        results.pop(4).deleteFromStore()
+        self.assertEquals(query.pageAfter(cursor, 3), results[4:7])
+        self.assertEquals(query.pageBefore(cursor, 3), results[1:4])
+
+
+    def test_invalidCursor(self):
+        """
+        Cursors which were not made by L{ItemQuery.cursorFor}, or were made
+        for queries with different sort orders, are rejected.
+        """
+        query = self.store.query(KeysetSortHelper,
+                                 sort=KeysetSortHelper.received.ascending)
+        other = self.store.query(
+            KeysetSortHelper, sort=[KeysetSortHelper.received.ascending,
+                                    KeysetSortHelper.sender.ascending])
+        cursor = other.cursorFor(list(other)[0])
+        self.assertRaises(ValueError, query.pageAfter, cursor)
+        self.assertRaises(ValueError, query.pageAfter, 'x' + cursor)
+        self.assertRaises(ValueError, query.pageBefore, 'not a cursor')
+
+
+    def test_otherTableSort(self):
+        """
+        Queries sorted by attributes of other item types cannot be paged
+        through this way.
+        """
+        query = self.store.query(
+            KeysetSortHelper,
+            KeysetSortHelper.received == SingleColumnSortHelper.mainColumn,
+            sort=SingleColumnSortHelper.mainColumn.ascending)
+        self.assertRaises(ValueError, query.pageAfter)
+
+
+    def test_pagesize(self):
+        """
+        Page sizes must be positive.
+        """
+        query = self.store.query(KeysetSortHelper)
+        self.assertRaises(ValueError, query.pageAfter, None, 0)
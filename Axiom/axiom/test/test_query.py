@@ -1,16 +1,18 @@
 
-import operator, random
+import operator, random, gc
 
+from twisted.python import log
 from twisted.trial.unittest import TestCase, SkipTest
 
-from axiom.iaxiom import IComparison, IColumn
+from axiom.iaxiom import IComparison, IColumn, IStatEvent
 from axiom.store import Store, ItemQuery, MultipleItemQuery
 from axiom.item import Item, Placeholder
 from axiom.test.util import QueryCounter
 
 from axiom import errors
 from axiom.attributes import (
-    reference, text, bytes, integer, AND, OR, TableOrderComparisonWrapper)
+    reference, text, bytes, integer, AND, OR, TableOrderComparisonWrapper,
+    LiteralComparison)
 
 class A(Item):
     schemaVersion = 1
@@ -95,6 +97,28 @@ class BasicQuery(TestCase):
         self.assertEquals(comparison.getArgs(s), [])
 
 
+    def test_literalComparison(self):
+        """
+        L{LiteralComparison} puts the values of the arguments of the comparison
+        it wraps into its SQL, and finds the same items as that comparison.
+        """
+        s = Store()
+        ThingWithCharacterAndByteStrings(store=s, characterString=u"it's",
+                                         byteString='\x00\xff')
+        ThingWithCharacterAndByteStrings(store=s, characterString=u'other')
+        inner = AND(ThingWithCharacterAndByteStrings.characterString == u"it's",
+                    ThingWithCharacterAndByteStrings.byteString == '\x00\xff')
+        comparison = LiteralComparison(inner)
+        self.assertEquals(
+            comparison.getQuery(s),
+            "((%s.[characterString] = 'it''s') AND (%s.[byteString] = X'00ff'))" % (
+                ThingWithCharacterAndByteStrings.getTableName(s),
+                ThingWithCharacterAndByteStrings.getTableName(s)))
+        self.assertEquals(comparison.getArgs(s), [])
+        self.assertEquals(
+            s.query(ThingWithCharacterAndByteStrings, comparison).count(), 1)
+
+
     def test_simplestQuery(self):
         """
         Test that an ItemQuery with no comparison, sorting, or limit generates
@@ -1865,3 +1889,380 @@ class PlaceholderTestCase(TestCase):
         expectedSQL = "placeholder_0.oid, placeholder_0.[attr], placeholder_0.[characters], placeholder_0.[other]"
 
         self.assertEquals(query._queryTarget, expectedSQL)
+
+
+
+class StreamingQueryTests(TestCase):
+    """
+    Tests for L{BaseQuery.stream}, which iterates query results a chunk of rows
+    at a time.
+    """
+    def setUp(self):
+        self.store = Store()
+        def populate():
+            for i in range(10):
+                E(store=self.store, name=u'e%d' % (i,), amount=i)
+        self.store.transact(populate)
+
+
+    def test_itemQuery(self):
+        """
+        Streaming an item query yields the same items, in the same order, as
+        iterating it does, regardless of the chunk size.
+        """
+        query = self.store.query(E, sort=E.amount.descending)
+        expected = list(query)
+        for chunkSize in [1, 3, 10, 11]:
+            self.assertEquals(list(query.stream(chunkSize)), expected)
+
+
+    def test_attributeQuery(self):
+        """
+        Streaming an attribute query yields the attribute values.
+        """
+        query = self.store.query(E, E.amount < 5, sort=E.amount.ascending)
+        self.assertEquals(list(query.getColumn('amount').stream(2)),
+                          [0, 1, 2, 3, 4])
+
+
+    def test_multipleItemQuery(self):
+        """
+        Streaming a L{MultipleItemQuery} yields tuples of items.
+        """
+        query = self.store.query(
+            (E, C), AND(E.name == C.name), sort=E.amount.ascending)
+        c = C(store=self.store, name=u'e3')
+        self.assertEquals(list(query.stream(2)),
+                          [(self.store.findUnique(E, E.amount == 3), c)])
+
+
+    def test_distinctQuery(self):
+        """
+        Streaming a distinct query yields each value once.
+        """
+        for i in range(3):
+            E(store=self.store, name=u'dup', amount=100)
+        query = self.store.query(E, E.amount >= 9).getColumn('amount')
+        self.assertEquals(sorted(query.distinct().stream(1)), [9, 100])
+
+
+    def test_chunkSize(self):
+        """
+        Only C{chunkSize} rows are loaded from the database at a time.
+        """
+        fetches = []
+        cursorClass = type(self.store.cursor)
+        originalFetchmany = cursorClass.fetchmany
+        def fetchmany(cursor, size):
+            rows = originalFetchmany(cursor, size)
+            fetches.append(len(rows))
+            return rows
+        cursorClass.fetchmany = fetchmany
+        self.addCleanup(setattr, cursorClass, 'fetchmany', originalFetchmany)
+        results = self.store.query(E).stream(4)
+        results.next()
+        self.assertEquals(fetches, [4])
+        list(results)
+        self.assertEquals(fetches, [4, 4, 2, 0])
+
+
+    def test_dedicatedCursor(self):
+        """
+        Other queries may be run while a streaming query is being iterated.
+        """
+        names = []
+        for e in self.store.query(E, sort=E.amount.ascending).stream(2):
+            names.append(self.store.findUnique(E, E.storeID == e.storeID).name)
+        self.assertEquals(names, [u'e%d' % (i,) for i in range(10)])
+
+
+    def test_checkpoint(self):
+        """
+        Changes made in the current transaction are visible to a streaming
+        query begun later in that transaction.
+        """
+        def txn():
+            self.store.findUnique(E, E.amount == 0).amount = 20
+            return list(self.store.query(
+                E, E.amount > 8, sort=E.amount.ascending).getColumn(
+                    'amount').stream(1))
+        self.assertEquals(self.store.transact(txn), [9, 20])
+
+
+    def test_transactionFinished(self):
+        """
+        A streaming query begun in a transaction raises
+        L{errors.StreamingQueryInterrupted} if it is resumed after that
+        transaction has finished.
+        """
+        def txn():
+            results = self.store.query(E).stream(1)
+            results.next()
+            return results
+        results = self.store.transact(txn)
+        self.assertRaises(errors.StreamingQueryInterrupted, results.next)
+
+
+    def test_invalidChunkSize(self):
+        """
+        A chunk size less than one is rejected.
+        """
+        self.assertRaises(ValueError, self.store.query(E).stream, 0)
+        self.assertRaises(
+            ValueError, self.store.query(E).distinct().stream, 0)
+
+
+
+class CompiledQueryCacheTests(TestCase):
+    """
+    Tests for the cache of SQL generated for queries kept by each L{Store}.
+    """
+    def setUp(self):
+        self.store = Store()
+        self.events = []
+        log.addObserver(self.events.append)
+        self.addCleanup(log.removeObserver, self.events.append)
+
+
+    def _cacheStats(self):
+        """
+        Return the number of query cache hits and misses logged since the last
+        call.
+        """
+        hits = misses = 0
+        for event in self.events:
+            if event.get('interface') is IStatEvent:
+                hits += event.get('stat_query_cache_hits', 0)
+                misses += event.get('stat_query_cache_misses', 0)
+        del self.events[:]
+        return hits, misses
+
+
+    def test_sameStructureSameSQL(self):
+        """
+        Queries which differ only in the values they compare against generate
+        the identical SQL string, with different arguments.
+        """
+        first = self.store.query(E, AND(E.amount > 3, E.name == u'x'),
+                                 sort=E.amount.ascending)
+        second = self.store.query(E, AND(E.amount > 7, E.name == u'y'),
+                                  sort=E.amount.ascending)
+        firstSQL, firstArgs = first._sqlAndArgs('SELECT', first._queryTarget)
+        secondSQL, secondArgs = second._sqlAndArgs(
+            'SELECT', second._queryTarget)
+        self.assertIdentical(firstSQL, secondSQL)
+        self.assertEquals(firstArgs, [3, u'x'])
+        self.assertEquals(secondArgs, [7, u'y'])
+
+
+    def test_hitsAndMisses(self):
+        """
+        Cache misses are reported the first time a query of a particular shape
+        is run, and only cache hits are reported after that.
+        """
+        list(self.store.query(E, E.amount == 1))
+        hits, misses = self._cacheStats()
+        self.failUnless(misses)
+        list(self.store.query(E, E.amount == 2))
+        self.assertEquals(self._cacheStats(), (hits + misses, 0))
+
+
+    def test_differentStructure(self):
+        """
+        Queries with different comparisons, sorts, limits or offsets generate
+        different SQL.
+        """
+        queries = [
+            self.store.query(E, E.amount == 1),
+            self.store.query(E, E.amount != 1),
+            self.store.query(E, E.name == u'1'),
+            self.store.query(E, E.name == None),
+            self.store.query(E, E.amount.oneOf([1, 2])),
+            self.store.query(E, E.amount.oneOf([1, 2, 3])),
+            self.store.query(E, E.name.like(u'a', E.transaction)),
+            self.store.query(E, OR(E.amount == 1, E.amount == 2)),
+            self.store.query(E, AND(E.amount == 1, E.amount == 2)),
+            self.store.query(E, sort=E.amount.ascending),
+            self.store.query(E, sort=E.amount.descending),
+            self.store.query(E, limit=1),
+            self.store.query(E, limit=2),
+            self.store.query(E, limit=2, offset=1)]
+        sql = set([query._sqlAndArgs('SELECT', query._queryTarget)[0]
+                   for query in queries])
+        self.assertEquals(len(sql), len(queries))
+
+
+    def test_limitType(self):
+        """
+        A limit of the wrong type is rejected even if a query with an equal
+        limit has already been compiled.
+        """
+        list(self.store.query(E, limit=1))
+        self.assertRaises(TypeError, list, self.store.query(E, limit=1.0))
+
+
+    def test_placeholdersNotCached(self):
+        """
+        Queries involving L{Placeholder}s are not cached, since their SQL
+        depends on aliases assigned to each placeholder.
+        """
+        p = Placeholder(E)
+        E(store=self.store, amount=1)
+        query = self.store.query(E, E.amount == p.amount)
+        self.assertIdentical(query._structure, None)
+        self.assertIdentical(query._sqlKey('SELECT', query._queryTarget), None)
+        self.assertEquals(len(list(query)), 1)
+
+
+    def test_unknownComparison(self):
+        """
+        Queries with comparisons other than those defined by Axiom are not
+        cached.
+        """
+        class Comparison(object):
+            def getInvolvedTables(self):
+                return [E]
+            def getQuery(self, store):
+                return '1 = 1'
+            def getArgs(self, store):
+                return []
+        query = self.store.query(E, Comparison())
+        self.assertIdentical(query._structure, None)
+        self.assertEquals(list(query), [])
+
+
+    def test_revertTableCreation(self):
+        """
+        SQL compiled in a transaction which creates a table is forgotten if the
+        transaction is reverted.
+        """
+        class Reverted(Exception):
+            pass
+        def txn():
+            list(self.store.query(C, C.name == u'x'))
+            raise Reverted()
+        self.assertRaises(Reverted, self.store.transact, txn)
+        self.assertEquals(self.store._compiledQueries, {})
+        C(store=self.store, name=u'x')
+        self.assertEquals(self.store.query(C, C.name == u'x').count(), 1)
+
+
+
+class PrefetchTests(TestCase):
+    """
+    Tests for the C{prefetch} argument to L{Store.query}, which loads the items
+    referred to by the results of a query in bulk.
+    """
+    def setUp(self):
+        self.store = Store()
+        def populate():
+            for i in range(5):
+                A(store=self.store, type=u'c%d' % (i,),
+                  reftoc=C(store=self.store, name=u'%d' % (i,)))
+            for i in range(3):
+                A(store=self.store, type=u'b%d' % (i,),
+                  reftoc=B(store=self.store, name=u'%d' % (i,)))
+            A(store=self.store, type=u'none')
+        self.store.transact(populate)
+        # Everything was just created; nothing refers to it any more, so it is
+        # no longer cached.
+        gc.collect()
+
+        self.statements = []
+        querySQL = self.store.querySQL
+        def countingQuerySQL(sql, args=()):
+            self.statements.append(sql)
+            return querySQL(sql, args)
+        self.store.querySQL = countingQuerySQL
+
+
+    def _references(self, results):
+        """
+        Return a sorted list of the names of the items referred to by the
+        given results of a query for L{A}.
+        """
+        return sorted([a.reftoc and a.reftoc.name for a in results])
+
+
+    def test_withoutPrefetch(self):
+        """
+        Without prefetching, each reference is resolved with queries of its
+        own.
+        """
+        results = list(self.store.query(A))
+        self.assertEquals(
+            self._references(results),
+            [None, u'0', u'0', u'1', u'1', u'2', u'2', u'3', u'4'])
+        self.assertEquals(len(self.statements), 1 + 8 * 2)
+
+
+    def test_prefetch(self):
+        """
+        With prefetching, the referenced items are loaded with one query for
+        their types and one query for each type.
+        """
+        results = list(self.store.query(A, prefetch=[A.reftoc]))
+        self.assertEquals(len(self.statements), 1 + 1 + 2)
+        self.assertEquals(
+            self._references(results),
+            [None, u'0', u'0', u'1', u'1', u'2', u'2', u'3', u'4'])
+        self.assertEquals(len(self.statements), 1 + 1 + 2)
+
+
+    def test_alreadyCached(self):
+        """
+        Items which are already cached are not loaded again.
+        """
+        cached = list(self.store.query(C))
+        del self.statements[:]
+        list(self.store.query(A, prefetch=[A.reftoc]))
+        self.assertEquals(len(self.statements), 1 + 1 + 1)
+
+
+    def test_stream(self):
+        """
+        Prefetching works when streaming a query's results, a chunk of rows at
+        a time.
+        """
+        self.store.querySQL = self.store.__class__.querySQL.__get__(
+            self.store)
+        results = list(self.store.query(A, prefetch=[A.reftoc]).stream(4))
+        self.assertEquals(
+            self._references(results),
+            [None, u'0', u'0', u'1', u'1', u'2', u'2', u'3', u'4'])
+
+
+    def test_distinct(self):
+        """
+        Prefetching works for distinct queries.
+        """
+        results = list(
+            self.store.query(A, prefetch=[A.reftoc]).distinct())
+        self.assertEquals(len(self.statements), 1 + 1 + 2)
+        self.assertEquals(len(results), 9)
+
+
+    def test_cloneQuery(self):
+        """
+        Clones of a query prefetch the same attributes.
+        """
+        query = self.store.query(A, prefetch=[A.reftoc]).cloneQuery(limit=2)
+        self.assertEquals(query.prefetch, (A.reftoc,))
+
+
+    def test_notReference(self):
+        """
+        Only reference attributes of the queried item class can be prefetched.
+        """
+        self.assertRaises(
+            ValueError, self.store.query, A, prefetch=[A.type])
+        self.assertRaises(
+            ValueError, self.store.query, A, prefetch=[B.cref])
+
+
+    def test_multipleItemQuery(self):
+        """
+        Prefetching is not supported for queries of more than one item type.
+        """
+        self.assertRaises(
+            ValueError, self.store.query, (A, B), prefetch=[A.reftoc])
@@ -0,0 +1,310 @@
+
+"""
+Tests for L{axiom.queryprofile} and the profiling of the statements run by a
+L{Store}.
+"""
+
+from twisted.trial.unittest import TestCase
+from twisted.python import usage
+
+from axiom.store import Store
+from axiom.item import Item
+from axiom.attributes import integer, text
+from axiom.queryprofile import fingerprint, StatementStatistics
+from axiom.plugins.axiom_plugins import Profile
+
+from axiom.test.util import CommandStub
+from axiom.test.test_upgrading import callWithStdoutRedirect
+
+
+
+class ProfiledThing(Item):
+    """
+    An item to run statements about.
+    """
+    indexed = integer(indexed=True)
+    unindexed = integer()
+    name = text()
+
+
+
+class FingerprintTests(TestCase):
+    """
+    Tests for L{fingerprint}.
+    """
+    def test_literals(self):
+        """
+        Numbers and strings in a statement are replaced with placeholders.
+        """
+        self.assertEquals(
+            fingerprint("SELECT * FROM item_x_v1 WHERE a = 12 AND b = 'it''s' "
+                        "LIMIT 3 OFFSET 4.5"),
+            'SELECT * FROM item_x_v1 WHERE a = ? AND b = ? LIMIT ? OFFSET ?')
+
+
+    def test_parameterLists(self):
+        """
+        Lists of parameters of any length have the same fingerprint.
+        """
+        self.assertEquals(fingerprint('SELECT a FROM b WHERE c IN (?, ?)'),
+                          fingerprint('SELECT a FROM b WHERE c IN (?,?,?,?)'))
+        self.assertEquals(fingerprint('SELECT a FROM b WHERE c IN (?)'),
+                          'SELECT a FROM b WHERE c IN (?)')
+
+
+    def test_whitespace(self):
+        """
+        Runs of whitespace are collapsed.
+        """
+        self.assertEquals(fingerprint('  SELECT  a\n  FROM b '),
+                          'SELECT a FROM b')
+
+
+
+class StatementStatisticsTests(TestCase):
+    """
+    Tests for L{StatementStatistics}.
+    """
+    def test_record(self):
+        """
+        L{StatementStatistics.record} adds up the executions of statements and
+        remembers the slowest.
+        """
+        stats = StatementStatistics('SELECT ?')
+        for i in range(1, 101):
+            stats.record('SELECT %d' % (i,), (), i / 100.0, 2, ('x.py', i % 2))
+        self.assertEquals(stats.count, 100)
+        self.assertEquals(stats.rows, 200)
+        self.assertAlmostEqual(stats.totalTime, 50.5)
+        self.assertAlmostEqual(stats.meanTime(), 0.505)
+        self.assertEquals(stats.callSites, {('x.py', 0): 50, ('x.py', 1): 50})
+        self.assertEquals(stats.slowestSQL, 'SELECT 100')
+        self.assertEquals(stats.percentile(50), 0.5)
+        self.assertEquals(stats.percentile(90), 0.9)
+        self.assertEquals(stats.percentile(100), 1.0)
+
+
+    def test_recordMany(self):
+        """
+        L{StatementStatistics.record} counts each of several executions run
+        at once, and samples their mean time.
+        """
+        stats = StatementStatistics('INSERT ?')
+        stats.record('INSERT 1', (), 2.0, 4, ('x.py', 1), 4)
+        self.assertEquals(stats.count, 4)
+        self.assertEquals(stats.rows, 4)
+        self.assertEquals(stats.totalTime, 2.0)
+        self.assertEquals(stats.callSites, {('x.py', 1): 4})
+        self.assertEquals(stats.samples, [0.5])
+        self.assertEquals(stats.slowestTime, 0.5)
+
+
+    def test_fullScans(self):
+        """
+        L{StatementStatistics.fullScans} returns the steps of the plan which
+        read every row of a table.
+        """
+        stats = StatementStatistics('SELECT ?')
+        self.assertIdentical(stats.fullScans(), None)
+        stats.plan = ['SCAN item_x_v1', 'SEARCH item_y_v1 USING INDEX i (a=?)',
+                      'SCAN CONSTANT ROW']
+        self.assertEquals(stats.fullScans(), ['SCAN item_x_v1'])
+
+
+
+class StoreProfilingTests(TestCase):
+    """
+    Tests for L{Store.startProfiling} and the L{QueryProfiler} it returns.
+    """
+    def setUp(self):
+        self.store = Store()
+        for i in range(5):
+            ProfiledThing(store=self.store, indexed=i, unindexed=i)
+
+
+    def test_disabled(self):
+        """
+        Stores are not profiled unless that is asked for.
+        """
+        self.assertIdentical(self.store.queryProfiler, None)
+        self.assertIdentical(self.store.stopProfiling(), None)
+
+
+    def test_startStop(self):
+        """
+        L{Store.startProfiling} returns a profiler which records statements
+        until L{Store.stopProfiling} is called.
+        """
+        profiler = self.store.startProfiling()
+        self.assertIdentical(self.store.startProfiling(), profiler)
+        self.store.querySQL('SELECT 1')
+        self.assertIdentical(self.store.stopProfiling(), profiler)
+        self.store.querySQL('SELECT 2')
+        self.assertEquals(profiler.statements.keys(), ['SELECT ?'])
+        self.assertEquals(profiler.statements['SELECT ?'].count, 1)
+
+
+    def test_queries(self):
+        """
+        Each query run by the store is recorded under its fingerprint, with the
+        number of rows it returned and the code which ran it.
+        """
+        profiler = self.store.startProfiling()
+        list(self.store.query(ProfiledThing, ProfiledThing.indexed < 3))
+        list(self.store.query(ProfiledThing, ProfiledThing.indexed < 4))
+        [stats] = [stats for stats in profiler.statements.values()
+                   if stats.fingerprint.startswith('SELECT')]
+        self.assertEquals(stats.count, 2)
+        self.assertEquals(stats.rows, 7)
+        self.assertEquals(
+            sorted(stats.callSites.values()), [1, 1])
+        for (filename, lineno) in stats.callSites:
+            self.assertEquals(filename, __file__.replace('.pyc', '.py'))
+
+
+    def test_streamingQueries(self):
+        """
+        Streaming queries are recorded once all of their results have been
+        read.
+        """
+        profiler = self.store.startProfiling()
+        results = self.store.query(ProfiledThing).stream(2)
+        self.assertEquals(len(list(results)), 5)
+        [stats] = profiler.statements.values()
+        self.assertEquals((stats.count, stats.rows), (1, 5))
+
+
+    def test_batchInsert(self):
+        """
+        Statements run many times at once are recorded once for each time they
+        were run, with the rows they changed.
+        """
+        profiler = self.store.startProfiling()
+        self.store.batchInsert(ProfiledThing, [ProfiledThing.indexed],
+                               [(i,) for i in range(3)])
+        inserts = [stats for stats in profiler.statements.values()
+                   if stats.fingerprint.startswith('INSERT')]
+        self.assertEquals([stats.count for stats in inserts], [3, 3])
+        self.assertEquals([stats.rows for stats in inserts], [3, 3])
+
+
+    def test_reset(self):
+        """
+        L{QueryProfiler.reset} forgets everything recorded.
+        """
+        profiler = self.store.startProfiling()
+        self.store.querySQL('SELECT 1')
+        profiler.reset()
+        self.assertEquals(profiler.statements, {})
+
+
+    def test_slowest(self):
+        """
+        L{QueryProfiler.slowest} orders statements by the given measure.
+        """
+        profiler = self.store.startProfiling()
+        profiler.record('SELECT a', (), 1.0, 1)
+        profiler.record('SELECT b', (), 0.6, 5)
+        profiler.record('SELECT b', (), 0.6, 5)
+        self.assertEquals([s.fingerprint for s in profiler.slowest()],
+                          ['SELECT b', 'SELECT a'])
+        self.assertEquals([s.fingerprint for s in profiler.slowest(1, 'max')],
+                          ['SELECT a'])
+        self.assertRaises(ValueError, profiler.slowest, 1, 'bogus')
+
+
+    def test_explain(self):
+        """
+        L{QueryProfiler.explain} records the plan of the slowest execution of a
+        statement, from which scans of whole tables can be found.
+        """
+        profiler = self.store.startProfiling()
+        self.store.count(ProfiledThing, ProfiledThing.unindexed == 3)
+        self.store.count(ProfiledThing, ProfiledThing.indexed == 3)
+        self.store.stopProfiling()
+        scans = {}
+        for stats in profiler.statements.values():
+            profiler.explain(stats)
+            scans[stats.fingerprint] = stats.fullScans()
+        self.assertEquals(len(scans), 2)
+        for (statement, fullScans) in scans.items():
+            if 'unindexed' in statement:
+                self.assertEquals(len(fullScans), 1)
+            else:
+                self.assertEquals(fullScans, [])
+
+
+    def test_explainSchemaChange(self):
+        """
+        Statements which cannot be explained are left without a plan.
+        """
+        profiler = self.store.startProfiling()
+        self.store.createSQL('CREATE TABLE profiled (x INTEGER)')
+        [stats] = profiler.statements.values()
+        profiler.explain(stats)
+        self.assertIdentical(stats.plan, None)
+
+
+    def test_report(self):
+        """
+        L{QueryProfiler.report} describes the statements which took longest,
+        with their plans and any full table scans.
+        """
+        profiler = self.store.startProfiling()
+        self.store.count(ProfiledThing, ProfiledThing.unindexed == 3)
+        report = profiler.report()
+        self.assertIn('1 executions, 1 rows', report)
+        self.assertIn('plan: ', report)
+        self.assertIn('FULL SCAN: ', report)
+        self.assertIn(__file__.replace('.pyc', '.py'), report)
+
+
+
+class ProfileCommandTests(TestCase):
+    """
+    Tests for the I{axiomatic profile} command.
+    """
+    def setUp(self):
+        self.store = Store()
+        ProfiledThing(store=self.store, indexed=1, unindexed=1)
+
+
+    def _profile(self, *argv):
+        command = Profile()
+        command.parent = CommandStub(self.store, 'profile')
+        result, output = callWithStdoutRedirect(
+            command.parseOptions, list(argv))
+        return output.getvalue()
+
+
+    def test_command(self):
+        """
+        I{axiomatic profile -c} runs the given code with the store available as
+        C{db}, and reports on the statements it ran.
+        """
+        output = self._profile(
+            '-c', 'from axiom.test.test_queryprofile import ProfiledThing\n'
+            'db.count(ProfiledThing, ProfiledThing.unindexed == 1)')
+        self.assertIn('FULL SCAN: ', output)
+        self.assertIdentical(self.store.queryProfiler, None)
+
+
+    def test_script(self):
+        """
+        I{axiomatic profile} runs the given script.
+        """
+        script = self.mktemp()
+        f = file(script, 'w')
+        f.write('db.querySQL("SELECT 1")\n')
+        f.close()
+        self.assertIn('SELECT ?', self._profile(script))
+
+
+    def test_usage(self):
+        """
+        I{axiomatic profile} rejects bad options.
+        """
+        self.assertRaises(usage.UsageError, self._profile)
+        self.assertRaises(usage.UsageError, self._profile, '-c', 'x', 'y')
+        self.assertRaises(usage.UsageError, self._profile, '-n', 'x', 'y')
+        self.assertRaises(usage.UsageError, self._profile, '-o', 'x', 'y')
@@ -8,7 +8,7 @@ from twisted.trial.unittest import TestCase
 from twisted.application.service import IService
 from twisted.internet.defer import Deferred
 from twisted.internet.task import Clock
-from twisted.python import filepath, versions
+from twisted.python import filepath, versions, log
 
 from epsilon.extime import Time
 
@@ -19,7 +19,7 @@ from axiom.item import Item
 from axiom.substore import SubStore
 
 from axiom.attributes import integer, text, inmemory, boolean, timestamp
-from axiom.iaxiom import IScheduler
+from axiom.iaxiom import IScheduler, IStatEvent
 from axiom.dependency import installOn
 
 class TestEvent(Item):
@@ -294,6 +294,140 @@ class TopStoreSchedTest(SchedTest, TestCase):
 
 
 
+    def test_eventsScheduledOutOfOrder(self):
+        """
+        Events are run on time when others which are due earlier are scheduled
+        after them, between ticks.
+        """
+        S = IScheduler(self.store)
+        events = [TestEvent(store=self.store, testCase=self, name=u't%d' % i)
+                  for i in range(7)]
+        now = self.now()
+        for (i, event) in enumerate(events[:2]):
+            S.schedule(event, now + timedelta(seconds=i + 1))
+        self.clock.advance(0.5)
+        for (i, event) in enumerate(events[2:]):
+            S.schedule(event, now + timedelta(seconds=7 - i))
+        for i in range(len(events)):
+            self.clock.advance(1)
+            self.assertEquals(
+                sorted([event.runCount for event in events]),
+                [0] * (len(events) - i - 1) + [1] * (i + 1))
+
+
+    def test_eventScheduledElsewhere(self):
+        """
+        An event which is scheduled without the scheduler knowing, as by
+        another process using the same store, is found and run on time once
+        the scheduler has ticked.
+        """
+        S = IScheduler(self.store)
+        events = [TestEvent(store=self.store, testCase=self, name=u't%d' % i)
+                  for i in range(4)]
+        now = self.now()
+        S.schedule(events[0], now + timedelta(seconds=1))
+        S.schedule(events[1], now + timedelta(seconds=2))
+        S.schedule(events[2], now + timedelta(seconds=10))
+        self.clock.advance(1)
+        TimedEvent(store=self.store, time=now + timedelta(seconds=3),
+                   runnable=events[3])
+        self.clock.advance(1)
+        self.assertEquals(events[3].runCount, 0)
+        self.clock.advance(1)
+        self.assertEquals([event.runCount for event in events], [1, 1, 0, 1])
+
+
+
+class GroupedTopStoreSchedTest(TopStoreSchedTest):
+    """
+    Tests for a site store scheduler which runs several events in each
+    transaction.
+    """
+    def setUp(self):
+        TopStoreSchedTest.setUp(self)
+        IScheduler(self.store).eventsPerTransaction = 3
+
+
+    def test_dueEventsLoadedTogether(self):
+        """
+        The events run in each transaction are loaded at once, in that
+        transaction.
+        """
+        sched = IScheduler(self.store)
+        loaded = []
+        getDueEvents = sched._getDueEvents
+        def recordingGetDueEvents(now, limit):
+            events = getDueEvents(now, limit)
+            loaded.append((len(events), self.store.transaction is not None))
+            return events
+        sched._getDueEvents = recordingGetDueEvents
+        events = [TestEvent(store=self.store, testCase=self, name=u't%d' % i)
+                  for i in range(3)]
+        for event in events:
+            sched.schedule(event, self.now())
+        self.clock.advance(1)
+        self.assertEquals([event.runCount for event in events], [1, 1, 1])
+        self.assertEquals(loaded, [(3, True)])
+
+
+    def test_oneTransaction(self):
+        """
+        Several events which are due at once are run in one transaction.
+        """
+        commits = []
+        def observer(event):
+            if event.get('interface') is IStatEvent:
+                commits.extend([1] * event.get('stat_commits', 0))
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+        events = [TestEvent(store=self.store, testCase=self, name=u't%d' % i)
+                  for i in range(3)]
+        for event in events:
+            IScheduler(self.store).schedule(event, self.now())
+        del commits[:]
+        self.clock.advance(1)
+        self.assertEquals([event.runCount for event in events], [1, 1, 1])
+        self.assertEquals(len(commits), 1)
+
+
+    def test_failureIsolated(self):
+        """
+        When an event fails, the changes it made are reverted, but those made
+        by the other events run in the same transaction are kept.
+        """
+        S = IScheduler(self.store)
+        first = TestEvent(store=self.store, testCase=self, name=u'first')
+        spec = SpecialErrorHandler(store=self.store)
+        last = TestEvent(store=self.store, testCase=self, name=u'last')
+        S.schedule(first, self.now())
+        S.schedule(spec, self.now() + timedelta(seconds=0.1))
+        S.schedule(last, self.now() + timedelta(seconds=0.2))
+        self.clock.advance(1)
+
+        self.assertEquals(len(self.flushLoggedErrors(SpecialError)), 1)
+        self.assertEquals((first.runCount, last.runCount), (1, 1))
+        self.failUnless(spec.procd)
+        self.failIf(spec.broken)
+        self.assertEquals(self.store.query(TimedEvent).count(), 0)
+
+
+    def test_unscheduledByEarlierEvent(self):
+        """
+        An event which is unscheduled by another event run before it in the
+        same transaction is not run.
+        """
+        S = IScheduler(self.store)
+        victim = TestEvent(store=self.store, testCase=self, name=u'victim')
+        runner = HookRunner(
+            store=self.store, hook=lambda runner: S.unscheduleAll(victim))
+        S.schedule(runner, self.now())
+        S.schedule(victim, self.now() + timedelta(seconds=0.1))
+        self.clock.advance(1)
+        self.assertEquals(victim.runCount, 0)
+        self.assertEquals(self.store.query(TimedEvent).count(), 0)
+
+
+
 class SubSchedulerTests(SchedTest, TestCase):
     """
     Tests for the substore implementation of IScheduler.
@@ -3,7 +3,7 @@ from twisted.trial import unittest
 from axiom.attributes import integer
 from axiom.errors import NoCrossStoreReferences
 from axiom.item import Item
-from axiom.sequence import List
+from axiom.sequence import List, _ListItem, SPACING
 from axiom.store import Store
 
 
@@ -169,7 +169,6 @@ class TestSequenceOperations(SequenceTestCase):
         self.assertEquals(seq[0:3], [self.i0, self.i1, self.i2])
         self.assertEquals(seq[1:0], [])
         self.assertEquals(seq[-1:], [self.i3])
-    test_slices.todo = "Slices are not supported yet"
 
     def test_slice_with_step(self):
         seq = List(store=self.store)
@@ -179,7 +178,15 @@ class TestSequenceOperations(SequenceTestCase):
         seq.append(self.i3)
         self.assertEquals(seq[0:4:2], [self.i0, self.i2])
         self.assertEquals(seq[1:5:2], [self.i1, self.i3])
-    test_slice_with_step.todo = "Slices are not supported yet"
+
+    def test_slice_with_negative_step(self):
+        seq = List(store=self.store)
+        seq.append(self.i0)
+        seq.append(self.i1)
+        seq.append(self.i2)
+        seq.append(self.i3)
+        self.assertEquals(seq[::-1], [self.i3, self.i2, self.i1, self.i0])
+        self.assertEquals(seq[3:0:-2], [self.i3, self.i1])
 
     def test_len(self):
         seq = List(store=self.store)
@@ -578,3 +585,71 @@ class TestMutableSequenceOperations(SequenceTestCase):
         del seq1[0]
         self.assertIdentical(seq2[0], self.i1)
         self.assertIdentical(seq2[1], self.i2)
+
+
+class TestSparseKeys(SequenceTestCase):
+    """
+    Tests for the keys which keep the entries of a L{List} in order.
+    """
+    def _keys(self, seq):
+        return list(self.store.query(
+                _ListItem, _ListItem._container == seq,
+                sort=_ListItem._index.ascending).getColumn('_index'))
+
+    def test_insertBetween(self):
+        """
+        An entry inserted between two others takes a key between theirs,
+        without changing theirs.
+        """
+        seq = List([self.i0, self.i1], store=self.store)
+        seq.insert(1, self.i2)
+        self.assertEquals(self._keys(seq), [0, SPACING // 2, SPACING])
+        self.assertContents(seq, [self.i0, self.i2, self.i1])
+
+    def test_rebalance(self):
+        """
+        When there is no key left between two entries, the keys around them
+        are spread out again, keeping the entries in order.
+        """
+        seq = List([self.i0, self.i1], store=self.store)
+        expected = [self.i0, self.i1]
+        for i in range(40):
+            seq.insert(1, self.i2)
+            expected.insert(1, self.i2)
+        seq.insert(2, self.i3)
+        expected.insert(2, self.i3)
+        self.assertEquals(list(seq), expected)
+        keys = self._keys(seq)
+        self.assertEquals(keys, sorted(set(keys)))
+
+    def test_denseKeys(self):
+        """
+        Entries with consecutive keys, as given to them by earlier versions
+        of L{List}, can have others inserted between them.
+        """
+        seq = List(store=self.store, length=3)
+        for (i, value) in enumerate([self.i0, self.i1, self.i2]):
+            _ListItem(store=self.store, _container=seq, _index=i,
+                      _value=value)
+        seq.insert(1, self.i3)
+        seq.insert(3, self.i4)
+        self.assertContents(
+            seq, [self.i0, self.i3, self.i1, self.i4, self.i2])
+
+    def test_deleteKeepsKeys(self):
+        """
+        Deleting an entry does not change the keys of the others.
+        """
+        seq = List([self.i0, self.i1, self.i2], store=self.store)
+        del seq[-3]
+        self.assertEquals(self._keys(seq), [SPACING, SPACING * 2])
+        self.assertContents(seq, [self.i1, self.i2])
+
+    def test_iterate(self):
+        """
+        Iterating over a L{List} does not look up each entry by its position.
+        """
+        seq = List([self.i0, self.i1, self.i2], store=self.store)
+        self.patch(List, '__getitem__', None)
+        self.assertEquals(list(seq), [self.i0, self.i1, self.i2])
+        self.assertEquals(max(seq), self.i2)
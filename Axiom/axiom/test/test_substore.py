@@ -1,3 +1,5 @@
+from zope.interface import Interface
+
 from twisted.application.service import Service, IService
 from twisted.python import filepath
 
@@ -5,7 +7,7 @@ from twisted.trial import unittest
 
 from axiom.store import Store
 from axiom.item import Item
-from axiom.substore import SubStore
+from axiom.substore import SubStore, getSubStorePool
 
 from axiom.attributes import text, bytes, boolean, inmemory
 
@@ -127,6 +129,135 @@ class SubStoreTest(unittest.TestCase):
         f.close()
         self.assertEqual(open(f.finalpath.path).read(), "yay")
 
+class IMarker(Interface):
+    """
+    An interface for a powerup of a substore.
+    """
+
+
+
+class SubStorePoolTests(unittest.TestCase):
+    """
+    Tests for L{SubStorePool}, which closes substores which have not been used
+    recently.
+    """
+    def setUp(self):
+        self.store = Store(filepath.FilePath(self.mktemp()))
+        self.substores = [SubStore.createNew(self.store, [str(i)])
+                          for i in range(3)]
+        self.pool = getSubStorePool(self.store)
+        self.pool.maxOpen = 2
+
+
+    def isOpen(self, substore):
+        return hasattr(substore, 'substore')
+
+
+    def test_counts(self):
+        """
+        L{SubStorePool} counts the substores opened, and does not close any
+        while no more than C{maxOpen} are open.
+        """
+        for substore in self.substores[:2]:
+            substore.open()
+            substore.open()
+        self.assertEquals(len(self.pool), 2)
+        self.assertEquals(
+            (self.pool.opens, self.pool.closes, self.pool.reopens),
+            (5, 0, 0))
+
+
+    def test_closeLeastRecentlyUsed(self):
+        """
+        When more than C{maxOpen} substores are open, the least recently used
+        one is closed, and opened again when it is next used.
+        """
+        first, second, third = self.substores
+        first.open()
+        second.open()
+        first.open()
+        third.open()
+        self.failIf(self.isOpen(second))
+        self.failUnless(self.isOpen(first))
+        self.assertEquals(self.pool.closes, 1)
+
+        SubStored(store=second.open(), a=u'hello')
+        self.failIf(self.isOpen(first))
+        self.assertEquals(self.pool.reopens, 1)
+        self.assertEquals(
+            second.open().findUnique(SubStored).a, u'hello')
+
+
+    def test_adaptation(self):
+        """
+        A substore which was closed is opened again when its L{SubStore} is
+        adapted to an interface.
+        """
+        first, second, third = self.substores
+        substore = first.open()
+        powerup = SubStored(store=substore, a=u'powerup')
+        substore.powerUp(powerup, IMarker)
+        second.open()
+        third.open()
+        self.failIf(self.isOpen(first))
+        self.assertEquals(IMarker(first).a, u'powerup')
+        self.failUnless(self.isOpen(first))
+
+
+    def test_transaction(self):
+        """
+        A substore is not closed while it is in a transaction.
+        """
+        first, second, third = self.substores
+        def txn():
+            second.open()
+            third.open()
+        first.open().transact(txn)
+        self.failUnless(self.isOpen(first))
+        self.failIf(self.isOpen(second))
+
+
+    def test_runningService(self):
+        """
+        A substore is not closed while its service is running.
+        """
+        first, second, third = self.substores
+        service = IService(first.open())
+        service.startService()
+        self.addCleanup(service.stopService)
+        second.open()
+        third.open()
+        self.failUnless(self.isOpen(first))
+        self.failIf(self.isOpen(second))
+
+
+    def test_explicitClose(self):
+        """
+        A substore closed by L{SubStore.close} is no longer in the pool, and is
+        not counted as reopened when it is opened again.
+        """
+        first = self.substores[0]
+        first.open()
+        first.close()
+        self.assertEquals(len(self.pool), 0)
+        first.open()
+        self.assertEquals(self.pool.reopens, 0)
+
+
+    def test_memorySubStores(self):
+        """
+        In-memory substores are never closed.
+        """
+        store = Store()
+        pool = getSubStorePool(store)
+        pool.maxOpen = 0
+        substore = SubStore.createNew(store, ['sub'])
+        substore.open()
+        self.failUnless(self.isOpen(substore))
+        self.assertEquals(len(pool), 0)
+
+
+
 class SubStoreStartupSemantics(unittest.TestCase):
     """
     These tests verify that interactions between store and substore services
@@ -13,11 +13,11 @@ from twisted.trial import unittest
 from twisted.python import filepath
 from twisted.application.service import IService
 from twisted.internet.defer import maybeDeferred
-from twisted.python.reflect import namedModule
+from twisted.python.reflect import namedModule, qual
 from twisted.python import log
 
 from axiom.iaxiom import IAxiomaticCommand
-from axiom import store, upgrade, item, errors, attributes
+from axiom import store, upgrade, item, errors, attributes, iaxiom
 from axiom.upgrade import _StoreUpgrade
 from axiom.item import declareLegacyItem
 from axiom.scripts import axiomatic
@@ -312,6 +312,34 @@ class SwordUpgradeTest(SchemaUpgradeTest):
         return s.whenFullyUpgraded().addCallback(afterUpgrade)
 
 
+    def test_getItemsByIDs(self):
+        """
+        L{Store.getItemsByIDs} upgrades the items it loads, even if upgrading
+        one of them also upgrades another.
+        """
+        playerID, swordID = self._testTwoObjectUpgrade()
+        choose(newapp)
+        s = self.openStore()
+        player, sword = s.getItemsByIDs([playerID, swordID])
+        self._testPlayerAndSwordState(player, sword)
+
+
+    def test_getItemsByIDsWithoutUpgrade(self):
+        """
+        L{Store.getItemsByIDs} loads items of old versions without upgrading
+        them if asked not to.
+        """
+        playerID, swordID = self._testTwoObjectUpgrade()
+        choose(newapp)
+        s = self.openStore()
+        player, sword = s.getItemsByIDs([playerID, swordID],
+                                        autoUpgrade=False)
+        self.failUnless(player.__legacy__)
+        self.failUnless(sword.__legacy__)
+        self.assertEquals(player.name, u'Milton')
+        self.assertEquals(sword.hurtfulness, 7)
+
+
     def _testAutoUpgrade(self, playerID, swordID):
         choose(newapp)
         s = self.openStore()
@@ -697,6 +725,136 @@ class DuringUpgradeTests(unittest.TestCase):
 
 
 
+bulk_old = loadSchemaModule('axiom.test.upgrade_fixtures.bulk_old')
+
+bulk_new = loadSchemaModule('axiom.test.upgrade_fixtures.bulk_new')
+
+
+class BulkUpgradeTests(unittest.TestCase):
+    """
+    Tests for upgrading items registered with
+    L{upgrade.registerAttributeCopyingUpgrader} and
+    L{upgrade.registerDeletionUpgrader} without loading them.
+    """
+    def setUp(self):
+        self.dbdir = filepath.FilePath(self.mktemp())
+        choose(bulk_old)
+        old = store.Store(self.dbdir)
+        self.other = bulk_old.Strict(store=old, count=100).storeID
+        self.copied = [
+            bulk_old.Copied(store=old, count=i, name=unicode(i),
+                            other=old.getItemByID(self.other)).storeID
+            for i in range(5)]
+        self.removed = [bulk_old.Removed(store=old, count=i).storeID
+                        for i in range(3)]
+        self.removing = bulk_old.Removing(
+            store=old, removed=old.getItemByID(self.removed[0])).storeID
+        old.close()
+
+        choose(bulk_new)
+        self.store = store.Store(self.dbdir)
+        self.upgrader = self.store._upgradeManager
+        self.events = []
+        log.addObserver(self.events.append)
+        self.addCleanup(log.removeObserver, self.events.append)
+
+
+    def tearDown(self):
+        self.store.close()
+        choose(None)
+
+
+    def _upgradeWithoutLoading(self, count):
+        """
+        Upgrade the store C{count} items at a time, failing if any item is
+        loaded to be upgraded.
+        """
+        def upgradeItem(theItem):
+            self.fail("%r should not have been loaded." % (theItem,))
+        self.upgrader.upgradeItem = upgradeItem
+        for ignored in self.upgrader.upgradeBatch(count):
+            pass
+
+
+    def test_copy(self):
+        """
+        Items upgraded by copying their attributes have the same values for
+        them after the upgrade, and the defaults for new attributes.
+        """
+        self._upgradeWithoutLoading(2)
+        for (i, storeID) in enumerate(self.copied):
+            copied = self.store.getItemByID(storeID)
+            self.assertIdentical(type(copied), bulk_new.Copied)
+            self.assertEquals(copied.count, i)
+            self.assertEquals(copied.name, unicode(i))
+            self.assertEquals(copied.other.storeID, self.other)
+            self.assertEquals(copied.size, bulk_new.DEFAULT_SIZE)
+            self.assertEquals(copied.label, u'unlabelled')
+        self.assertEquals(self.store.query(bulk_new.Copied).count(), 5)
+        self.failIf(self.upgrader.upgradesPending)
+
+
+    def test_delete(self):
+        """
+        Items upgraded by deleting them are deleted, along with the items which
+        are deleted when they are.
+        """
+        self._upgradeWithoutLoading(2)
+        for storeID in self.removed + [self.removing]:
+            self.assertRaises(KeyError, self.store.getItemByID, storeID)
+
+
+    def test_postCopyNotBulk(self):
+        """
+        An upgrader registered with a C{postCopy} function is run for each
+        item.
+        """
+        upgrade.registerAttributeCopyingUpgrader(
+            bulk_new.Copied, 2, 3, lambda copied: None)
+        self.assertEquals(
+            self.upgrader._bulkUpgradePlan(
+                self.store.getOldVersionOf(bulk_new.Copied.typeName, 1)),
+            None)
+
+
+    def test_disallowedNone(self):
+        """
+        If a copied attribute is C{None} but the new version of the item does
+        not allow that, the items are upgraded one at a time, and the failure
+        names the item which could not be upgraded.
+        """
+        strict = self.store.getOldVersionOf(bulk_new.Strict.typeName, 1)
+        self.store.executeSQL(
+            'UPDATE %s SET %s = NULL' % (
+                self.store.getTableName(strict),
+                self.store.getShortColumnName(strict.count)))
+        error = self.assertRaises(
+            errors.ItemUpgradeError, list, self.upgrader.upgradeBatch(10))
+        self.assertEquals(error.storeID, self.other)
+
+
+    def test_progress(self):
+        """
+        Each batch of upgrades is reported with a stat event giving the number
+        of items it upgraded, and the total for each type is logged when it is
+        finished.
+        """
+        self._upgradeWithoutLoading(2)
+        upgraded = [e['stat_items_upgraded'] for e in self.events
+                    if e.get('interface') is iaxiom.IStatEvent
+                    and 'stat_items_upgraded' in e]
+        self.assertEquals(sorted(upgraded), [1, 1, 1, 2, 2, 2])
+        messages = [''.join(e['message']) for e in self.events
+                    if e.get('message')]
+        self.failUnless(
+            [m for m in messages if m.endswith(
+                'finished upgrading %s (5 items)' % (
+                    qual(self.store.getOldVersionOf(
+                        bulk_new.Copied.typeName, 1)),))],
+            messages)
+
+
+
 class AxiomaticUpgradeTest(unittest.TestCase):
     """
     L{Upgrade} implements an I{axiomatic} subcommand for synchronously
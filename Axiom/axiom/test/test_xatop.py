@@ -2,6 +2,7 @@
 
 import sys
 import os
+import gc
 
 from twisted.trial import unittest
 from twisted.internet import protocol, defer
@@ -9,7 +10,7 @@ from twisted.python.util import sibpath
 from twisted.python import log, filepath
 
 from epsilon import extime
-from axiom import attributes, item, store, errors
+from axiom import attributes, item, store, errors, _schema
 from axiom.iaxiom import IStatEvent
 
 from axiom._pysqlite2 import sqlite_version_info
@@ -46,6 +47,22 @@ class TestItem(item.Item):
 
 
 
+class RichlyIndexed(item.Item):
+    """
+    An item type with partial, covering and mixed-direction indexes.
+    """
+    folder = attributes.integer()
+    read = attributes.boolean(default=False)
+    received = attributes.integer()
+    subject = attributes.text()
+
+    byFolder = attributes.compoundIndex(folder, received.descending,
+                                        covering=[subject])
+    unread = attributes.compoundIndex(folder, received.descending,
+                                      where=(read == False))
+
+
+
 class StoreTests(unittest.TestCase):
     def testCreation(self):
         dbdir = filepath.FilePath(self.mktemp())
@@ -282,6 +299,69 @@ class StoreTests(unittest.TestCase):
         self.assertRaises(RuntimeError, store.Store, dbpath)
 
 
+    def _reopenWithoutChecks(self, dbpath):
+        """
+        Open the store at C{dbpath} again, and return a list of the types whose
+        schema was checked as it was opened.
+        """
+        checked = []
+        def check(self, actualType, onDiskSchema):
+            checked.append(actualType)
+        self.patch(store.Store, '_checkTypeSchemaConsistency', check)
+        store.Store(dbpath).close()
+        return checked
+
+
+    def test_schemaFingerprint(self):
+        """
+        Once the schema of a store has been checked, it is not checked again
+        when the store is opened with the same item types.
+        """
+        dbpath = self.mktemp()
+        s = store.Store(dbpath)
+        TestItem(store=s)
+        s.close()
+        # The type was created after the schema was checked.
+        self.assertEquals(self._reopenWithoutChecks(dbpath), [TestItem])
+        self.assertEquals(self._reopenWithoutChecks(dbpath), [])
+
+
+    def test_schemaFingerprintIndexes(self):
+        """
+        The schema of a store is checked again if the item types it contains
+        require a new index, and the index is created.
+        """
+        class Unindexed(item.Item):
+            attribute = attributes.integer()
+        dbpath = self.mktemp()
+        s = store.Store(dbpath)
+        Unindexed(store=s)
+        s.close()
+        store.Store(dbpath).close()
+        del Unindexed, s
+
+        class Unindexed(item.Item):
+            attribute = attributes.integer(indexed=True)
+        self.assertEquals(self._reopenWithoutChecks(dbpath), [Unindexed])
+        s = store.Store(dbpath)
+        self.assertIn(s._indexNameOf(Unindexed, ['attribute']),
+                      s._loadExistingIndexes())
+
+
+    def test_schemaFingerprintTableMissing(self):
+        """
+        Stores created before schema fingerprints were saved have their schema
+        checked and are given a fingerprint.
+        """
+        dbpath = self.mktemp()
+        s = store.Store(dbpath)
+        TestItem(store=s)
+        s.executeSchemaSQL('DROP TABLE *DATABASE*.axiom_schema_fingerprint')
+        s.close()
+        self.assertEquals(self._reopenWithoutChecks(dbpath), [TestItem])
+        self.assertEquals(self._reopenWithoutChecks(dbpath), [])
+
+
     def test_createAndLoadExistingIndexes(self):
         """
         L{Store._loadExistingIndexes} returns a C{set} containing the names of
@@ -301,6 +381,116 @@ class StoreTests(unittest.TestCase):
                  s._indexNameOf(TestItem, ['bar', 'baz'])]))
 
 
+    def _indexSQL(self, s, tableClass):
+        """
+        Return a C{dict} mapping the names of the indexes of C{tableClass} in
+        C{s} to the SQL which created them.
+        """
+        return dict(s.querySchemaSQL(
+                "SELECT name, sql FROM *DATABASE*.sqlite_master "
+                "WHERE type = 'index' AND tbl_name = ?",
+                [s.getTableName(tableClass).split('.', 1)[1]]))
+
+
+    def _plan(self, query):
+        """
+        Return the details of SQLite's plan for C{query}.
+        """
+        sql, args = query._sqlAndArgs('SELECT', query._queryTarget)
+        return ' '.join([str(row[-1]) for row in query.store.querySQL(
+                    'EXPLAIN QUERY PLAN ' + sql, args)])
+
+
+    def test_richIndexes(self):
+        """
+        Indexes declared with directions, covering columns and conditions are
+        created as such.
+        """
+        s = store.Store()
+        RichlyIndexed(store=s)
+        indexes = self._indexSQL(s, RichlyIndexed)
+        self.assertEquals(len(indexes), 2)
+        byFolder = indexes[s._indexNameOf(
+                RichlyIndexed, ['folder', 'received_desc', 'subject'])]
+        self.assertIn('([folder], [received] DESC, [subject])', byFolder)
+        [unread] = [sql for sql in indexes.values() if 'WHERE' in sql]
+        self.assertIn('([folder], [received] DESC) WHERE ([read] = 0)',
+                      unread)
+
+
+    def test_richIndexesUsed(self):
+        """
+        Queries sorted by a mix of ascending and descending columns, and
+        queries including the condition of a partial index, are answered with
+        the indexes declared for them.
+        """
+        s = store.Store()
+        RichlyIndexed(store=s)
+        indexes = self._indexSQL(s, RichlyIndexed)
+        [unread] = [name for (name, sql) in indexes.items() if 'WHERE' in sql]
+        [byFolder] = [name for name in indexes if name != unread]
+
+        plan = self._plan(s.query(
+                RichlyIndexed,
+                attributes.AND(RichlyIndexed.folder == 1,
+                               RichlyIndexed.unread.where),
+                sort=RichlyIndexed.received.descending))
+        self.assertIn(unread, plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+        plan = self._plan(s.query(
+                RichlyIndexed, RichlyIndexed.folder == 1,
+                sort=RichlyIndexed.received.descending))
+        self.assertIn(byFolder, plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+    def test_partialIndexContents(self):
+        """
+        Queries including the condition of a partial index find only the items
+        satisfying it.
+        """
+        s = store.Store()
+        for i in range(4):
+            RichlyIndexed(store=s, folder=1, received=i, read=bool(i % 2))
+        self.assertEquals(
+            list(s.query(RichlyIndexed,
+                         attributes.AND(RichlyIndexed.folder == 1,
+                                        RichlyIndexed.unread.where),
+                         sort=RichlyIndexed.received.descending
+                         ).getColumn('received')),
+            [2, 0])
+
+
+    def test_richIndexesCreatedOnce(self):
+        """
+        Declared indexes are created when a store is opened if they are
+        missing, and left alone if they are there.
+        """
+        dbpath = self.mktemp()
+        s = store.Store(dbpath)
+        RichlyIndexed(store=s)
+        indexes = self._indexSQL(s, RichlyIndexed)
+        [unread] = [name for (name, sql) in indexes.items() if 'WHERE' in sql]
+        s.executeSchemaSQL('DROP INDEX *DATABASE*.' + unread)
+        s.executeSchemaSQL(_schema.CLEAR_FINGERPRINT)
+        s.close()
+
+        s = store.Store(dbpath)
+        self.assertEquals(self._indexSQL(s, RichlyIndexed), indexes)
+        s.close()
+        s = store.Store(dbpath)
+        self.assertEquals(self._indexSQL(s, RichlyIndexed), indexes)
+
+
+    def test_compoundIndexArguments(self):
+        """
+        L{attributes.compoundIndex} rejects unknown keyword arguments.
+        """
+        self.assertRaises(TypeError, attributes.compoundIndex,
+                          RichlyIndexed.folder, unique=True)
+
+
     def test_loadExistingAttachedStoreIndexes(self):
         """
         If a store is attached to its parent, L{Store._loadExistingIndexes}
@@ -815,6 +1005,75 @@ class DeleteFromStoreTrackingItem(item.Item):
 
 
 
+class CascadeParent(item.Item):
+    """
+    An item for testing the deletion of items referring to it.
+    """
+    value = attributes.integer()
+
+
+
+class CascadeChild(item.Item):
+    """
+    An item deleted along with the L{CascadeParent} it refers to.
+    """
+    parent = attributes.reference(reftype=CascadeParent,
+                                  whenDeleted=attributes.reference.CASCADE)
+
+
+
+class CascadeGrandchild(item.Item):
+    """
+    An item deleted along with the L{CascadeChild} it refers to.
+    """
+    parent = attributes.reference(reftype=CascadeChild,
+                                  whenDeleted=attributes.reference.CASCADE)
+
+
+
+class NullifiedReferrer(item.Item):
+    """
+    An item whose reference to a L{CascadeParent} is cleared when that is
+    deleted.
+    """
+    parent = attributes.reference(reftype=CascadeParent,
+                                  whenDeleted=attributes.reference.NULLIFY)
+
+
+
+class CascadeDeletedTracker(item.Item):
+    """
+    An item deleted along with the L{CascadeParent} it refers to, which counts
+    how many times instances of it have been deleted.
+    """
+    deletedTimes = 0
+    parent = attributes.reference(reftype=CascadeParent,
+                                  whenDeleted=attributes.reference.CASCADE)
+
+    def deleted(self):
+        CascadeDeletedTracker.deletedTimes += 1
+
+
+
+class CascadeNode(item.Item):
+    """
+    An item deleted along with the item it refers to, which may be another
+    L{CascadeNode}.
+    """
+    n = attributes.integer()
+    parent = attributes.reference(whenDeleted=attributes.reference.CASCADE)
+
+
+
+class CascadeBlocker(item.Item):
+    """
+    An item which prevents the L{CascadeNode} it refers to from being deleted.
+    """
+    node = attributes.reference(whenDeleted=attributes.reference.DISALLOW,
+                                reftype=CascadeNode)
+
+
+
 class MassInsertDeleteTests(unittest.TestCase):
 
     def setUp(self):
@@ -915,6 +1174,43 @@ class MassInsertDeleteTests(unittest.TestCase):
         self.assertEquals(items[0].store, self.store)
         self.assertEquals(items[1].store, self.store)
 
+    def test_batchInsertStoreIDs(self):
+        """
+        L{Store.batchInsert} gives the items it creates consecutive storeIDs
+        following those of existing items, and later items follow them.
+        """
+        first = AttributefulItem(store=self.store)
+        self.store.batchInsert(AttributefulItem,
+                               [AttributefulItem.withoutDefault],
+                               [(1,), (2,), (3,)])
+        last = AttributefulItem(store=self.store)
+        self.assertEquals(
+            list(self.store.query(AttributefulItem,
+                                  sort=AttributefulItem.storeID.ascending
+                                  ).getColumn("storeID")),
+            range(first.storeID, first.storeID + 5))
+        self.assertEquals(last.storeID, first.storeID + 4)
+        inserted = self.store.getItemByID(first.storeID + 2)
+        self.assertIdentical(type(inserted), AttributefulItem)
+        self.assertEquals(inserted.withoutDefault, 2)
+
+
+    def test_batchInsertMany(self):
+        """
+        L{Store.batchInsert} accepts an iterator of more rows than it inserts
+        at once.
+        """
+        self.patch(store, 'BATCH_INSERT_SIZE', 2)
+        self.store.batchInsert(AttributefulItem,
+                               [AttributefulItem.withoutDefault],
+                               ((i,) for i in range(5)))
+        self.assertEquals(
+            list(self.store.query(AttributefulItem,
+                                  sort=AttributefulItem.storeID.ascending
+                                  ).getColumn("withoutDefault")),
+            range(5))
+
+
     def testBatchDelete(self):
         """
         Ensure that unqualified batchDelete removes all the items of a
@@ -957,6 +1253,423 @@ class MassInsertDeleteTests(unittest.TestCase):
         self.assertEqual(DeleteFromStoreTrackingItem.deletedTimes, 1)
 
 
+    def _cascadeItems(self):
+        """
+        Create some L{CascadeParent}s, each with L{CascadeChild}ren which have
+        L{CascadeGrandchild}ren, and L{NullifiedReferrer}s referring to them.
+        Return the storeIDs of everything, not keeping any of it in memory.
+        """
+        storeIDs = {}
+        def txn():
+            for i in range(3):
+                parent = CascadeParent(store=self.store, value=i)
+                ids = storeIDs[i] = [parent.storeID]
+                for j in range(2):
+                    child = CascadeChild(store=self.store, parent=parent)
+                    grandchild = CascadeGrandchild(store=self.store,
+                                                   parent=child)
+                    referrer = NullifiedReferrer(store=self.store,
+                                                 parent=parent)
+                    ids.extend([child.storeID, grandchild.storeID,
+                                referrer.storeID])
+        self.store.transact(txn)
+        gc.collect()
+        return storeIDs
+
+
+    def _objectType(self, storeID):
+        """
+        Return the type ID of an object in the objects table.
+        """
+        [(typeID,)] = self.store.querySchemaSQL(
+            'SELECT type_id FROM *DATABASE*.axiom_objects WHERE oid = ?',
+            [storeID])
+        return typeID
+
+
+    def test_batchDeleteCascade(self):
+        """
+        Batch deletion deletes items which refer to the deleted items with
+        C{whenDeleted=reference.CASCADE}, and items which refer to those, and
+        clears references with C{whenDeleted=reference.NULLIFY}, without
+        loading any of them.
+        """
+        storeIDs = self._cascadeItems()
+        misses = self.store.objectCache.misses
+        self.store.transact(
+            self.store.query(CascadeParent,
+                             CascadeParent.value < 2).deleteFromStore)
+        self.assertEquals(self.store.objectCache.misses, misses)
+
+        self.assertEquals(
+            list(self.store.query(CascadeParent).getColumn("value")), [2])
+        self.assertEquals(self.store.query(CascadeChild).count(), 2)
+        self.assertEquals(self.store.query(CascadeGrandchild).count(), 2)
+        self.assertEquals(self.store.query(NullifiedReferrer).count(), 6)
+        self.assertEquals(
+            self.store.query(NullifiedReferrer,
+                             NullifiedReferrer.parent == None).count(), 4)
+
+        for i in range(2):
+            for storeID in storeIDs[i]:
+                if self.store.getItemByID(storeID, None) is None:
+                    self.assertEquals(self._objectType(storeID), -1)
+        for storeID in storeIDs[2]:
+            self.assertNotEquals(self._objectType(storeID), -1)
+
+
+    def test_batchDeleteCascadeInMemory(self):
+        """
+        Items in memory which are deleted by a batch deletion, whether
+        directly or by cascading, know that they have been deleted.
+        """
+        parent = CascadeParent(store=self.store)
+        child = CascadeChild(store=self.store, parent=parent)
+        storeIDs = [parent.storeID, child.storeID]
+        self.store.query(CascadeParent).deleteFromStore()
+        self.assertIdentical(parent.store, None)
+        self.assertIdentical(child.store, None)
+        for storeID in storeIDs:
+            self.assertRaises(KeyError, self.store.getItemByID, storeID)
+
+
+    def test_batchDeleteCascadeSlow(self):
+        """
+        Items with a C{deleted} method which are deleted by cascading from a
+        batch deletion are deleted one at a time, so that it is called.
+        """
+        parent = CascadeParent(store=self.store)
+        for i in range(2):
+            CascadeDeletedTracker(store=self.store, parent=parent)
+        del parent
+        gc.collect()
+        CascadeDeletedTracker.deletedTimes = 0
+        self.store.query(CascadeParent).deleteFromStore()
+        self.assertEquals(CascadeDeletedTracker.deletedTimes, 2)
+        self.assertEquals(self.store.query(CascadeDeletedTracker).count(), 0)
+
+
+    def test_batchDeleteDeepCascade(self):
+        """
+        Batch deletion deletes every item of a long chain of items of a type
+        which cascades to itself.
+        """
+        def txn():
+            parent = None
+            for n in range(200):
+                parent = CascadeNode(store=self.store, n=n, parent=parent)
+        self.store.transact(txn)
+        gc.collect()
+        self.store.transact(
+            self.store.query(CascadeNode, CascadeNode.n == 0).deleteFromStore)
+        self.assertEquals(self.store.query(CascadeNode).count(), 0)
+
+
+    def test_batchDeleteCascadeDisallowed(self):
+        """
+        Batch deletion outside of a transaction deletes nothing if any item
+        which cascades from the items being deleted may not be deleted.
+        """
+        top = CascadeNode(store=self.store, n=0)
+        middle = CascadeNode(store=self.store, n=1, parent=top)
+        CascadeBlocker(store=self.store, node=middle)
+        del top, middle
+        gc.collect()
+        self.assertRaises(
+            errors.DeletionDisallowed,
+            self.store.query(CascadeNode, CascadeNode.n == 0).deleteFromStore)
+        self.assertEquals(
+            list(self.store.query(CascadeNode,
+                                  sort=CascadeNode.n.ascending).getColumn("n")),
+            [0, 1])
+        self.assertEquals(
+            self.store.findUnique(CascadeBlocker).node.n, 1)
+
+
+
+class CheckpointTests(unittest.TestCase):
+    """
+    Tests for L{Store.checkpoint}, which writes the changes made to items in a
+    transaction to the database.
+    """
+    def setUp(self):
+        self.store = store.Store()
+        self.executed = []
+        executeManySQL = self.store.executeManySQL
+        def recordingExecuteManySQL(sql, argsList):
+            argsList = list(argsList)
+            self.executed.append((sql, argsList))
+            return executeManySQL(sql, argsList)
+        self.store.executeManySQL = recordingExecuteManySQL
+
+
+    def test_groupedStatements(self):
+        """
+        Identical statements required by different items are executed
+        together, once for each item.
+        """
+        existing = [AttributefulItem(store=self.store, withoutDefault=i)
+                    for i in range(2)]
+        def txn():
+            for i in range(3):
+                AttributefulItem(store=self.store, withoutDefault=i)
+            for x in existing:
+                x.withoutDefault += 10
+        self.store.transact(txn)
+
+        insertSQL = AttributefulItem._baseInsertSQL(self.store)
+        inserts = [argsList for (sql, argsList) in self.executed
+                   if sql == insertSQL]
+        self.assertEquals(len(inserts), 1)
+        self.assertEquals(len(inserts[0]), 3)
+        updates = [argsList for (sql, argsList) in self.executed
+                   if sql.startswith('UPDATE')]
+        self.assertEquals(len(updates), 1)
+        self.assertEquals(len(updates[0]), 2)
+        self.assertEquals(
+            sorted(self.store.query(AttributefulItem).getColumn(
+                    "withoutDefault")),
+            [0, 1, 2, 10, 11])
+
+
+    def test_deletion(self):
+        """
+        Items deleted in a transaction are removed from their table and marked
+        as dead in the objects table.
+        """
+        items = [AttributefulItem(store=self.store) for i in range(3)]
+        storeIDs = [x.storeID for x in items]
+        def txn():
+            for x in items[:2]:
+                x.deleteFromStore()
+        self.store.transact(txn)
+        self.assertEquals(
+            list(self.store.query(AttributefulItem).getColumn("storeID")),
+            storeIDs[2:])
+        for storeID in storeIDs[:2]:
+            self.assertRaises(KeyError, self.store.getItemByID, storeID)
+
+
+
+class GetItemsByIDsTests(unittest.TestCase):
+    """
+    Tests for L{Store.getItemsByIDs}.
+    """
+    def setUp(self):
+        self.store = store.Store()
+        self.items = []
+        for i in range(3):
+            self.items.append(AttributefulItem(store=self.store,
+                                               withoutDefault=i))
+            self.items.append(TestItem(store=self.store, foo=i))
+        self.storeIDs = [x.storeID for x in self.items]
+        self.items = None
+        gc.collect()
+
+
+    def test_order(self):
+        """
+        Items are returned in the order their storeIDs were given, whatever
+        their types.
+        """
+        storeIDs = self.storeIDs[::-1] + [self.storeIDs[0]]
+        items = self.store.getItemsByIDs(storeIDs)
+        self.assertEquals([x.storeID for x in items], storeIDs)
+        self.assertIdentical(items[0], self.store.getItemByID(storeIDs[0]))
+        self.assertIdentical(items[-1], items[-2])
+        self.assertEquals([type(x) for x in items[:2]],
+                          [TestItem, AttributefulItem])
+
+
+    def test_queries(self):
+        """
+        Items which are not cached are loaded with one query for their types
+        and one query for each type.
+        """
+        statements = []
+        querySQL = self.store.querySQL
+        def countingQuerySQL(sql, args=()):
+            statements.append(sql)
+            return querySQL(sql, args)
+        self.store.querySQL = countingQuerySQL
+        self.store.getItemsByIDs(self.storeIDs)
+        self.assertEquals(len(statements), 3)
+
+
+    def test_cached(self):
+        """
+        Items which are already cached are returned from the cache.
+        """
+        cached = self.store.getItemByID(self.storeIDs[1])
+        self.assertIdentical(
+            self.store.getItemsByIDs(self.storeIDs)[1], cached)
+
+
+    def test_store(self):
+        """
+        The special storeID of the store itself gives the store.
+        """
+        self.assertEquals(self.store.getItemsByIDs([store.STORE_SELF_ID]),
+                          [self.store])
+
+
+    def test_missing(self):
+        """
+        A storeID which does not refer to any item causes L{KeyError} to be
+        raised, unless a default is given.
+        """
+        missing = max(self.storeIDs) + 100
+        self.assertRaises(KeyError, self.store.getItemsByIDs,
+                          [self.storeIDs[0], missing])
+        self.assertEquals(
+            self.store.getItemsByIDs([missing, missing], default=None),
+            [None, None])
+
+
+    def test_deleted(self):
+        """
+        Deleted items cannot be loaded.
+        """
+        self.store.getItemByID(self.storeIDs[0]).deleteFromStore()
+        self.assertEquals(
+            self.store.getItemsByIDs(self.storeIDs[:2], default=None)[0],
+            None)
+
+
+    def test_wrongType(self):
+        """
+        Only integers are accepted as storeIDs.
+        """
+        self.assertRaises(TypeError, self.store.getItemsByIDs,
+                          [self.storeIDs[0], str(self.storeIDs[1])])
+
+
+
+class SavepointTests(unittest.TestCase):
+    """
+    Tests for L{Store.savepoint}, which reverts only part of a transaction.
+    """
+    def setUp(self):
+        self.store = store.Store()
+        self.existing = AttributefulItem(store=self.store, withoutDefault=1)
+
+
+    def _failingSavepoint(self, f):
+        """
+        Run C{f} in a savepoint, and make the savepoint fail.
+        """
+        def failing():
+            f()
+            raise RevertException()
+        self.assertRaises(RevertException, self.store.savepoint, failing)
+
+
+    def test_result(self):
+        """
+        L{Store.savepoint} returns the result of the function it runs, whose
+        changes are committed along with the rest of the transaction.
+        """
+        def txn():
+            def change():
+                self.existing.withoutDefault = 2
+                return 3
+            return self.store.savepoint(change)
+        self.assertEquals(self.store.transact(txn), 3)
+        self.assertEquals(
+            list(self.store.query(AttributefulItem).getColumn(
+                    "withoutDefault")),
+            [2])
+
+
+    def test_revertChanges(self):
+        """
+        Changes made to items in a savepoint which fails are reverted, while
+        those made earlier in the transaction are kept.
+        """
+        def txn():
+            created = AttributefulItem(store=self.store, withoutDefault=3)
+            self.existing.withDefault = 5
+            def change():
+                self.existing.withoutDefault = 2
+                created.withoutDefault = 4
+                self.existing.deleteFromStore()
+            self._failingSavepoint(change)
+            self.assertEquals(self.existing.withoutDefault, 1)
+            self.assertEquals(self.existing.withDefault, 5)
+            self.assertEquals(created.withoutDefault, 3)
+            return created.storeID
+        createdID = self.store.transact(txn)
+        self.assertEquals(
+            sorted(self.store.query(AttributefulItem).getColumn(
+                    "withoutDefault")),
+            [1, 3])
+        self.assertEquals(
+            self.store.getItemByID(createdID).withoutDefault, 3)
+
+
+    def test_revertCreation(self):
+        """
+        Items created in a savepoint which fails are forgotten, and are not
+        written to the database when the transaction is committed.
+        """
+        created = []
+        def txn():
+            self._failingSavepoint(lambda: created.append(
+                    AttributefulItem(store=self.store, withoutDefault=2)))
+        self.store.transact(txn)
+        self.assertEquals(
+            list(self.store.query(AttributefulItem).getColumn(
+                    "withoutDefault")),
+            [1])
+        self.assertRaises(KeyError, self.store.getItemByID,
+                          created[0].storeID)
+
+
+    def test_revertTableCreation(self):
+        """
+        The tables created for items in a savepoint which fails can be created
+        again.
+        """
+        def txn():
+            self._failingSavepoint(lambda: TestItem(store=self.store))
+            TestItem(store=self.store, foo=2)
+        self.store.transact(txn)
+        self.assertEquals(
+            list(self.store.query(TestItem).getColumn("foo")), [2])
+
+
+    def test_nested(self):
+        """
+        A savepoint which fails inside another reverts only what was done
+        inside it.
+        """
+        def txn():
+            def outer():
+                self.existing.withDefault = 5
+                self._failingSavepoint(
+                    lambda: AttributefulItem(store=self.store))
+                self.existing.withoutDefault = 2
+            self.store.savepoint(outer)
+        self.store.transact(txn)
+        self.assertEquals(
+            [(x.withDefault, x.withoutDefault)
+             for x in self.store.query(AttributefulItem)],
+            [(5, 2)])
+
+
+    def test_outsideTransaction(self):
+        """
+        Outside of a transaction, L{Store.savepoint} runs a transaction of its
+        own.
+        """
+        def change():
+            self.existing.withoutDefault = 2
+            raise RevertException()
+        self.assertRaises(RevertException, self.store.savepoint, change)
+        self.assertEquals(self.existing.withoutDefault, 1)
+
+
+
 # Item types we will use to change the underlying database schema (by creating
 # them).
 class ConcurrentItemA(item.Item):
@@ -0,0 +1,65 @@
+# -*- test-case-name: axiom.test.test_upgrading.BulkUpgradeTests -*-
+
+from axiom.attributes import integer, text, reference
+from axiom.item import Item, normalize, declareLegacyItem
+from axiom.upgrade import (
+    registerAttributeCopyingUpgrader, registerDeletionUpgrader)
+
+DEFAULT_SIZE = 7
+
+class Copied(Item):
+    """
+    An item upgraded in two steps, each of which adds an attribute.
+    """
+    # Don't import the old schema. -exarkun
+    typeName = normalize("axiom.test.upgrade_fixtures.bulk_old.Copied")
+    schemaVersion = 3
+
+    count = integer()
+    name = text()
+    other = reference()
+    size = integer(default=DEFAULT_SIZE)
+    label = text(default=u'unlabelled')
+
+declareLegacyItem(Copied.typeName, 2, dict(
+        count=integer(), name=text(), other=reference(),
+        size=integer(default=DEFAULT_SIZE)))
+
+registerAttributeCopyingUpgrader(Copied, 1, 2)
+registerAttributeCopyingUpgrader(Copied, 2, 3)
+
+
+class Strict(Item):
+    """
+    An item which does not allow its attribute to be C{None}.
+    """
+    # Don't import the old schema. -exarkun
+    typeName = normalize("axiom.test.upgrade_fixtures.bulk_old.Strict")
+    schemaVersion = 2
+
+    count = integer(allowNone=False)
+
+registerAttributeCopyingUpgrader(Strict, 1, 2)
+
+
+class Removed(Item):
+    """
+    An item which is deleted when it is upgraded.
+    """
+    # Don't import the old schema. -exarkun
+    typeName = normalize("axiom.test.upgrade_fixtures.bulk_old.Removed")
+    schemaVersion = 2
+
+    count = integer()
+
+registerDeletionUpgrader(Removed, 1, 2)
+
+
+class Removing(Item):
+    """
+    An item which is deleted along with the L{Removed} it refers to.
+    """
+    # Don't import the old schema. -exarkun
+    typeName = normalize("axiom.test.upgrade_fixtures.bulk_old.Removing")
+
+    removed = reference(whenDeleted=reference.CASCADE)
@@ -0,0 +1,34 @@
+# -*- test-case-name: axiom.test.test_upgrading.BulkUpgradeTests -*-
+
+from axiom.attributes import integer, text, reference
+from axiom.item import Item
+
+class Copied(Item):
+    """
+    An item which will be upgraded by copying its attributes.
+    """
+    count = integer()
+    name = text()
+    other = reference()
+
+
+class Strict(Item):
+    """
+    An item which will be upgraded by copying its attributes to a version
+    which does not allow one of them to be C{None}.
+    """
+    count = integer()
+
+
+class Removed(Item):
+    """
+    An item which will be upgraded by deleting it.
+    """
+    count = integer()
+
+
+class Removing(Item):
+    """
+    An item which is deleted along with the L{Removed} it refers to.
+    """
+    removed = reference()
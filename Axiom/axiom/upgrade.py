@@ -8,9 +8,10 @@ from twisted.python.failure import Failure
 from twisted.python.log import msg
 from twisted.python.reflect import qual
 
+from axiom import iaxiom, _schema
 from axiom.errors import NoUpgradePathAvailable, UpgraderRecursion
 from axiom.errors import ItemUpgradeError
-from axiom.item import _legacyTypes, _typeNameToMostRecentClass
+from axiom.item import Item, _legacyTypes, _typeNameToMostRecentClass
 
 
 _upgradeRegistry = {}
@@ -28,12 +29,17 @@ class _StoreUpgrade(object):
     @type _oldTypesRemaining: C{list}
     @ivar _oldTypesRemaining: All the old types which have not been fully
         upgraded in this database.
+
+    @type _bulkPlans: C{dict}
+    @ivar _bulkPlans: A map of old types to the results of
+        L{_bulkUpgradePlan} for them.
     """
 
     def __init__(self, store):
         self.store = store
         self._currentlyUpgrading = {}
         self._oldTypesRemaining = []
+        self._bulkPlans = {}
 
 
     def upgradesPending(self):
@@ -146,36 +152,41 @@ class _StoreUpgrade(object):
         store = self.store
 
         def _doBatch(itemType):
-            upgradedAnything = False
+            if itemType not in self._bulkPlans:
+                self._bulkPlans[itemType] = self._bulkUpgradePlan(itemType)
+            plan = self._bulkPlans[itemType]
+            if plan is not None:
+                return self._bulkUpgradeBatch(itemType, plan, n)
 
+            upgraded = 0
             for theItem in store.query(itemType, limit=n):
-                upgradedAnything = True
-                try:
-                    self.upgradeItem(theItem)
-                except:
-                    f = Failure()
-                    raise ItemUpgradeError(
-                        f, theItem.storeID, itemType,
-                        _typeNameToMostRecentClass[itemType.typeName])
-
-            return upgradedAnything
+                upgraded += 1
+                self._upgradeOne(itemType, theItem)
+            return upgraded
 
         if self.upgradesPending:
             didAny = False
+            upgradedOfType = 0
 
             while self._oldTypesRemaining:
                 t0 = self._oldTypesRemaining[0]
 
-                upgradedAnything = store.transact(_doBatch, t0)
-                if not upgradedAnything:
+                upgraded = store.transact(_doBatch, t0)
+                if not upgraded:
                     self._oldTypesRemaining.pop(0)
                     if didAny:
-                        msg("%s finished upgrading %s" % (store.dbdir.path, qual(t0)))
+                        msg("%s finished upgrading %s (%d items)" % (
+                                store.dbdir.path, qual(t0), upgradedOfType))
+                    upgradedOfType = 0
                     continue
                 elif not didAny:
                     didAny = True
                     msg("%s beginning upgrade..." % (store.dbdir.path,))
 
+                upgradedOfType += upgraded
+                msg(interface=iaxiom.IStatEvent,
+                    name='upgrade', typeName=t0.typeName,
+                    stat_items_upgraded=upgraded)
                 yield None
 
             if didAny:
@@ -183,6 +194,162 @@ class _StoreUpgrade(object):
 
 
 
+    def _upgradeOne(self, itemType, theItem):
+        """
+        Upgrade one legacy item of type C{itemType} all the way.
+
+        @raise axiom.errors.ItemUpgradeError: if the upgrade failed
+        """
+        try:
+            self.upgradeItem(theItem)
+        except:
+            f = Failure()
+            raise ItemUpgradeError(
+                f, theItem.storeID, itemType,
+                _typeNameToMostRecentClass[itemType.typeName])
+
+
+    def _bulkUpgradePlan(self, itemType):
+        """
+        Work out whether items of C{itemType} can be upgraded with a few SQL
+        statements, rather than loaded and upgraded one at a time.  That is the
+        case if the first upgrader for C{itemType} was registered by
+        L{registerDeletionUpgrader}, or if every upgrader between it and the
+        most recent version was registered by
+        L{registerAttributeCopyingUpgrader} without a C{postCopy} function, and
+        each attribute keeps the same type along the way.
+
+        @return: C{None} if the items must be upgraded one at a time.  If they
+            are to be deleted, a two-tuple of C{None}s.  Otherwise, a two-tuple
+            of the most recent item type and a list of three-tuples describing
+            each of its attributes: the attribute, the attribute of
+            C{itemType} whose column is copied to it (or C{None}), and the SQL
+            value it is given if no column is copied.
+        """
+        typeName = itemType.typeName
+        version = itemType.schemaVersion
+        upgrader = _upgradeRegistry.get((typeName, version))
+        if getattr(upgrader, 'deletesItems', False):
+            return (None, None)
+
+        # Map each attribute name of the current step's type to the attribute
+        # it has, the column of itemType it comes from, and its SQL value if
+        # it comes from no column.
+        values = dict([(name, (attr, attr, None))
+                       for (name, attr) in itemType.getSchema()])
+        newType = None
+        while (typeName, version) in _upgradeRegistry:
+            upgrader = _upgradeRegistry[typeName, version]
+            if not getattr(upgrader, 'copiesAttributes', False):
+                return None
+            version += 1
+            newType = _legacyTypes.get((typeName, version))
+            if newType is None:
+                newType = _typeNameToMostRecentClass.get(typeName)
+                if newType is None or newType.schemaVersion != version:
+                    return None
+            if newType.__init__.im_func is not Item.__init__.im_func:
+                return None
+            newSchema = newType.getSchema()
+            newNames = dict(newSchema)
+            for name in values:
+                if name not in newNames:
+                    return None
+            newValues = {}
+            for (name, attr) in newSchema:
+                if name in values:
+                    (oldAttr, source, default) = values[name]
+                    if type(attr) is not type(oldAttr):
+                        return None
+                    newValues[name] = (attr, source, default)
+                else:
+                    if attr.defaultFactory is not None:
+                        return None
+                    if attr.default is None and not attr.allowNone:
+                        return None
+                    newValues[name] = (
+                        attr, None,
+                        attr.infilter(attr.default, None, self.store))
+            values = newValues
+
+        if newType is None or newType.__legacy__:
+            return None
+        return (newType, [values[name] for (name, attr) in newType.getSchema()])
+
+
+    def _bulkUpgradeBatch(self, itemType, plan, n):
+        """
+        Upgrade up to C{n} items of C{itemType} according to C{plan}, without
+        loading those which are not already in memory.
+
+        @param plan: The result of L{_bulkUpgradePlan} for C{itemType}.
+
+        @return: The number of items upgraded.
+        """
+        store = self.store
+        oldTable = store.getTableName(itemType)
+        [(count, last)] = store.querySQL(
+            'SELECT COUNT(*), MAX(oid) FROM '
+            '(SELECT oid FROM %s ORDER BY oid LIMIT ?)' % (oldTable,), [n])
+        if not count:
+            return 0
+
+        # Legacy items are never cached, so none of these can be in memory
+        # already to be told they have been replaced.
+        try:
+            store.savepoint(self._bulkUpgrade, itemType, plan, oldTable, last)
+        except:
+            # Upgrade them one at a time instead, to report which item could
+            # not be upgraded.
+            for theItem in store.query(itemType, itemType.storeID <= last):
+                self._upgradeOne(itemType, theItem)
+        return count
+
+
+    def _bulkUpgrade(self, itemType, plan, oldTable, last):
+        """
+        Upgrade all the items of C{itemType} with a storeID no greater than
+        C{last} according to C{plan}, in SQL.
+        """
+        store = self.store
+        (newType, columns) = plan
+        if newType is None:
+            store.query(itemType, itemType.storeID <= last).deleteFromStore()
+            return
+
+        store.checkpoint()
+        nullChecks = ['%s IS NULL' % (store.getShortColumnName(source),)
+                      for (attr, source, default) in columns
+                      if source is not None and not attr.allowNone]
+        if nullChecks and store.querySQL(
+            'SELECT oid FROM %s WHERE oid <= ? AND (%s) LIMIT 1' % (
+                oldTable, ' OR '.join(nullChecks)), [last]):
+            raise ValueError("NULL values for attributes which disallow them")
+
+        newTypeID = store.getTypeID(newType)
+        names = ['oid']
+        selected = ['oid']
+        args = []
+        for (attr, source, default) in columns:
+            names.append(store.getShortColumnName(attr))
+            if source is None:
+                selected.append('?')
+                args.append(default)
+            else:
+                selected.append(store.getShortColumnName(source))
+        store.executeSQL(
+            'INSERT INTO %s (%s) SELECT %s FROM %s WHERE oid <= ?' % (
+                store.getTableName(newType), ', '.join(names),
+                ', '.join(selected), oldTable),
+            args + [last])
+        store.executeSchemaSQL(
+            _schema.CHANGE_TYPE_MANY % (
+                'SELECT oid FROM %s WHERE oid <= ?' % (oldTable,),),
+            [newTypeID, last])
+        store.executeSQL('DELETE FROM %s WHERE oid <= ?' % (oldTable,), [last])
+
+
+
 def registerUpgrader(upgrader, typeName, oldVersion, newVersion):
     """
     Register a callable which can perform a schema upgrade between two
@@ -219,6 +386,9 @@ def registerAttributeCopyingUpgrader(itemType, fromVersion, toVersion, postCopy=
         if postCopy is not None:
             postCopy(newitem)
         return newitem
+    # Without a postCopy function, the upgrade can be done without loading
+    # any items; see _StoreUpgrade._bulkUpgradePlan.
+    upgrader.copiesAttributes = postCopy is None
     registerUpgrader(upgrader, itemType.typeName, fromVersion, toVersion)
 
 
@@ -235,6 +405,7 @@ def registerDeletionUpgrader(itemType, fromVersion, toVersion):
     def upgrader(old):
         old.deleteFromStore()
         return None
+    upgrader.deletesItems = True
     registerUpgrader(upgrader, itemType.typeName, fromVersion, toVersion)
 
 
@@ -4,13 +4,31 @@
 """
 This module provides an implementation of I{Routes}, a system for multiplexing
 multiple L{IBoxReceiver}/I{IBoxSender} pairs over a single L{AMP} connection.
+
+By default, each box sent through a route is sent to the connection at once.
+A L{Router} given a C{callLater} function instead queues the boxes sent
+through each of its routes, and sends the queued boxes once per iteration of
+the reactor, taking them from each route in turn so that one busy route
+cannot hold up the others, and writing them to an L{AMP} connection all at
+once.  The boxes which wait in a route's queue are counted by
+L{Route.queueDepth} and L{Route.maxQueueDepth}.
+
+A L{Router} is also an L{IPushProducer}.  Registered as the producer of the
+connection's transport, it passes the transport's requests to pause and
+resume on to those receivers which are themselves L{IPushProducer}s, and it
+pauses the receiver of any route whose queue grows too long until the queue
+has been drained.
 """
 
 from itertools import count
+from collections import deque
 
 from zope.interface import implements
 
-from twisted.protocols.amp import IBoxReceiver, IBoxSender
+from twisted.python.failure import Failure
+from twisted.internet.interfaces import IPushProducer
+from twisted.protocols.amp import (
+    IBoxReceiver, IBoxSender, AmpBox, BinaryBoxProtocol)
 
 from epsilon.structlike import record
 
@@ -48,9 +66,21 @@ class Route(record('router receiver localRouteName remoteRouteName',
     @type remoteRouteName: C{unicode} or L{NoneType}
     @ivar remoteRouteName: The name of the route which will be added to all
         boxes sent to this sender.  If C{None}, no route will be added.
+
+    @ivar maxQueueDepth: The greatest number of boxes which have waited in
+        this route's queue at once.
+
+    @ivar _queue: C{None} until a box is queued, then a C{deque} of the boxes
+        sent through this route which the router has not yet sent on.
+
+    @ivar _receiverPaused: Whether C{receiver} has been asked to pause.
     """
     implements(IBoxSender)
 
+    maxQueueDepth = 0
+    _queue = None
+    _receiverPaused = False
+
     def connectTo(self, remoteRouteName):
         """
         Set the name of the route which will be added to outgoing boxes.
@@ -92,7 +122,38 @@ class Route(record('router receiver localRouteName remoteRouteName',
             raise RouteNotConnected()
         if self.remoteRouteName is not None:
             box[_ROUTE] = self.remoteRouteName.encode('ascii')
-        self.router._sender.sendBox(box)
+        self.router._sendBox(self, box)
+
+
+    def queueDepth(self):
+        """
+        Return the number of boxes sent through this route which are waiting
+        to be sent on by its router.
+        """
+        if self._queue is None:
+            return 0
+        return len(self._queue)
+
+
+    def _checkPressure(self):
+        """
+        Pause this route's receiver if its router is paused or its queue has
+        grown too long, or resume it once neither is so, if the receiver is
+        an L{IPushProducer}.
+        """
+        router = self.router
+        if self._receiverPaused:
+            limit = router.lowWaterMark
+        else:
+            limit = router.highWaterMark - 1
+        paused = router._paused or self.queueDepth() > limit
+        if paused != self._receiverPaused:
+            self._receiverPaused = paused
+            if IPushProducer.providedBy(self.receiver):
+                if paused:
+                    self.receiver.pauseProducing()
+                else:
+                    self.receiver.resumeProducing()
 
 
     def unhandledError(self, failure):
@@ -123,15 +184,45 @@ class Router:
 
     @ivar _routeCounter: A L{itertools.count} instance used to generate unique
         identifiers for routes in this router.
+
+    @ivar _callLater: C{None} if boxes are sent as soon as they are given to
+        a route, otherwise a function like L{IReactorTime.callLater} with
+        which queued boxes are sent later.
+
+    @ivar _active: A C{deque} of the routes with boxes in their queues, in the
+        order in which they will next have a box sent.
+
+    @ivar _flushCall: C{None}, or the L{IDelayedCall} which will send queued
+        boxes.
+
+    @ivar _paused: Whether the transport has asked this router to pause.
     """
-    implements(IBoxReceiver)
+    implements(IBoxReceiver, IPushProducer)
+
+    # The greatest number of queued boxes sent at once.  Any more are left for
+    # the next iteration of the reactor.
+    maxBatchSize = 1000
+
+    # The number of queued boxes at which a route's receiver is paused, and
+    # the number to which the queue must then shrink before it is resumed.
+    highWaterMark = 100
+    lowWaterMark = 10
 
     _routes = None
     _sender = None
+    _flushCall = None
+    _paused = False
 
-    def __init__(self):
+    def __init__(self, callLater=None):
+        """
+        @param callLater: C{None} to send each box as soon as it is given to a
+            route, or a function like L{IReactorTime.callLater} with which to
+            send queued boxes once per iteration of the reactor.
+        """
         self._routeCounter = count()
         self._unstarted = {}
+        self._callLater = callLater
+        self._active = deque()
 
 
     def createRouteIdentifier(self):
@@ -194,12 +285,167 @@ class Router:
 
     def stopReceivingBoxes(self, reason):
         """
-        Stop all the L{IBoxReceiver}s which have been added to this router.
+        Stop all the L{IBoxReceiver}s which have been added to this router,
+        discarding any boxes still queued.
         """
+        self._cancelFlush()
+        for route in self._active:
+            route._queue.clear()
+        self._active.clear()
         for routeName, route in self._routes.iteritems():
             route.stop(reason)
         self._routes = None
 
 
+    def _sendBox(self, route, box):
+        """
+        Send a box given to one of this router's routes, or queue it to be sent
+        with others later.
+        """
+        if self._callLater is None:
+            self._sender.sendBox(box)
+            return
+        queue = route._queue
+        if queue is None:
+            queue = route._queue = deque()
+        if not queue:
+            self._active.append(route)
+        queue.append(box)
+        if len(queue) > route.maxQueueDepth:
+            route.maxQueueDepth = len(queue)
+        route._checkPressure()
+        self._scheduleFlush()
+
+
+    def _scheduleFlush(self):
+        """
+        Arrange to send queued boxes, unless that has been arranged already or
+        this router is paused.
+        """
+        if self._flushCall is None and not self._paused and self._active:
+            self._flushCall = self._callLater(0, self._flush)
+
+
+    def _cancelFlush(self):
+        """
+        Forget any arrangement to send queued boxes.
+        """
+        if self._flushCall is not None:
+            if self._flushCall.active():
+                self._flushCall.cancel()
+            self._flushCall = None
+
+
+    def _flush(self):
+        """
+        Send as many as L{maxBatchSize} queued boxes, one from each route with
+        queued boxes in turn, and resume the receivers of any routes whose
+        queues have been drained.
+        """
+        self._flushCall = None
+        active = self._active
+        batch = []
+        drained = {}
+        while active and len(batch) < self.maxBatchSize:
+            route = active.popleft()
+            batch.append(route._queue.popleft())
+            if route._queue:
+                active.append(route)
+            if route._receiverPaused:
+                drained[route] = True
+        self._write(batch)
+        for route in drained:
+            route._checkPressure()
+        self._scheduleFlush()
+
+
+    def _write(self, boxes):
+        """
+        Send some boxes with this router's sender, in a single write if it
+        writes serialized boxes to a transport itself.  Failures are reported
+        to the sender, since whoever sent the boxes can no longer be told of
+        them.
+        """
+        sender = self._sender
+        if isinstance(sender, BinaryBoxProtocol):
+            serialized = []
+            for box in boxes:
+                if not isinstance(box, AmpBox):
+                    box = AmpBox(box)
+                try:
+                    serialized.append(box.serialize())
+                except:
+                    sender.unhandledError(Failure())
+            if not serialized:
+                return
+            boxes = [_SerializedBoxes(''.join(serialized))]
+        for box in boxes:
+            try:
+                sender.sendBox(box)
+            except:
+                sender.unhandledError(Failure())
+
+
+    def pauseProducing(self):
+        """
+        Stop sending queued boxes, and pause the receivers of the connected
+        routes.
+        """
+        self._paused = True
+        self._cancelFlush()
+        self._checkPressure()
+
+
+    def resumeProducing(self):
+        """
+        Start sending queued boxes again, and resume the receivers of the
+        connected routes whose queues are not too long.
+        """
+        self._paused = False
+        self._checkPressure()
+        self._scheduleFlush()
+
+
+    def stopProducing(self):
+        """
+        Stop sending queued boxes.  The connection is going away, and this
+        router will be told to stop receiving boxes.
+        """
+        self._paused = True
+        self._cancelFlush()
+
+
+    def _checkPressure(self):
+        """
+        Pause or resume the receivers of the connected routes to match the
+        state of this router.
+        """
+        routes = self._routes
+        if routes is None:
+            routes = self._unstarted
+        for route in routes.values():
+            if route.remoteRouteName is not _unspecified:
+                route._checkPressure()
+
+
+
+class _SerializedBoxes:
+    """
+    Boxes already serialized, to be sent together by a L{BinaryBoxProtocol},
+    which only asks the boxes it sends to serialize themselves.
+
+    @ivar bytes: The serialized boxes, one after the other.
+    """
+    def __init__(self, bytes):
+        self.bytes = bytes
+
+
+    def serialize(self):
+        """
+        Return the serialized boxes.
+        """
+        return self.bytes
+
+
 
 __all__ = ['Router', 'Route']
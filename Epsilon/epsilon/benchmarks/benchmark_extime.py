@@ -0,0 +1,67 @@
+
+"""
+Benchmark the conversions of L{epsilon.extime.Time} to and from the formats
+used in message headers and in tables of items.
+
+The first argument, if given, is the number of distinct times to convert.
+Each is converted twice, so that strings seen before are parsed as well as
+new ones.
+"""
+
+import sys, time, random
+
+from epsilon.scripts import benchmark
+
+from epsilon import extime
+
+def timed(f, values):
+    """
+    Call C{f} with each of C{values} and return the mean number of
+    microseconds each call took.
+    """
+    before = time.time()
+    for value in values:
+        f(value)
+    return (time.time() - before) / len(values) * 1e6
+
+
+def main():
+    count = 20000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    timestamps = [random.randrange(0, 2 ** 31) for i in xrange(count)]
+    times = [extime.Time.fromPOSIXTimestamp(secs) for secs in timestamps]
+    tzinfo = extime.FixedOffset(-5, 0)
+    rfc2822 = [t.asRFC2822(tzinfo) for t in times] * 2
+    iso8601 = [t.asISO8601TimeAndDate() for t in times] * 2
+    # A day's worth of times, as a table of recent items would show.
+    today = [timestamps[0] + secs for secs in xrange(0, 86400, 86400 // count)]
+
+    results = []
+    benchmark.start()
+    results.append(('fromRFC2822', timed(extime.Time.fromRFC2822, rfc2822)))
+    results.append(('fromISO8601TimeAndDate',
+                    timed(extime.Time.fromISO8601TimeAndDate, iso8601)))
+    results.append(('asRFC2822', timed(extime.Time.asRFC2822, times)))
+    results.append(('asISO8601TimeAndDate',
+                    timed(extime.Time.asISO8601TimeAndDate, times)))
+    results.append(('fromPOSIXTimestamp(...).asRFC2822', timed(
+                lambda secs: extime.Time.fromPOSIXTimestamp(secs).asRFC2822(),
+                today)))
+    results.append(('rfc2822FromPOSIXTimestamps', timed(
+                extime.rfc2822FromPOSIXTimestamps, [today]) / len(today)))
+    results.append(('fromPOSIXTimestamp(...).asISO8601TimeAndDate', timed(
+                lambda secs: extime.Time.fromPOSIXTimestamp(
+                    secs).asISO8601TimeAndDate(),
+                today)))
+    results.append(('iso8601FromPOSIXTimestamps', timed(
+                extime.iso8601FromPOSIXTimestamps, [today]) / len(today)))
+    benchmark.stop()
+
+    for (name, microseconds) in results:
+        print '%s: %.2f microseconds' % (name, microseconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+
+"""
+Benchmark the throughput of Juice: the serialization of boxes by one protocol
+and the decoding of them by another.
+
+The first argument, if given, is the size in bytes of the body of each box;
+the second is the number of boxes.
+"""
+
+import sys, time
+
+from epsilon.scripts import benchmark
+
+from epsilon.juice import Juice, Box
+
+# The number of bytes handed to the decoding protocol at once.
+CHUNK = 65536
+
+class Transport:
+    """
+    A transport which keeps what is written to it.
+    """
+    disconnecting = False
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+    def writeSequence(self, iovec):
+        self.written.extend(iovec)
+
+    def getPeer(self):
+        return 'benchmark'
+
+    getHost = getPeer
+
+
+
+class Receiver(Juice):
+    """
+    A protocol which counts the boxes it receives.
+    """
+    received = 0
+
+    def juiceBoxReceived(self, box):
+        self.received += 1
+
+
+
+def main():
+    size = 100
+    count = 100000
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        count = int(sys.argv[2])
+
+    sender = Juice(False)
+    sender.makeConnection(Transport())
+    receiver = Receiver(True)
+    receiver.makeConnection(Transport())
+    box = Box('x' * size, _command='benchmark', _ask='1', argument='value')
+
+    benchmark.start()
+    before = time.time()
+    for i in xrange(count):
+        sender.sendPacket(box)
+    data = ''.join(sender.transport.written)
+    middle = time.time()
+    for i in xrange(0, len(data), CHUNK):
+        receiver.dataReceived(data[i:i + CHUNK])
+    after = time.time()
+    benchmark.stop()
+
+    if receiver.received != count:
+        raise AssertionError("Received %d boxes" % (receiver.received,))
+    print 'serialized %d boxes (%d bytes) in %.2f seconds' % (
+        count, len(data), middle - before)
+    print 'decoded them in %.2f seconds, %.1f MB/s' % (
+        after - middle, len(data) / (after - middle) / 1e6)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,6 +12,24 @@ from email.Utils import parsedate_tz
 
 _EPOCH = datetime.datetime.utcfromtimestamp(0)
 
+# The greatest number of strings whose parsed values are remembered by each of
+# Time.fromRFC2822 and Time.fromISO8601TimeAndDate.  Once there are more, the
+# memo is emptied.
+PARSE_CACHE_SIZE = 1000
+
+_rfc2822Cache = {}
+_iso8601Cache = {}
+
+# Intervals used on every parse or format, made only once.
+_SECOND = datetime.timedelta(seconds=1)
+_NO_RESOLUTION = datetime.timedelta()
+_ONE_DAY = datetime.timedelta(days=1)
+_ISO8601_RESOLUTIONS = (
+    datetime.timedelta(days=366), datetime.timedelta(days=31), _ONE_DAY,
+    datetime.timedelta(hours=1), datetime.timedelta(hours=1),
+    datetime.timedelta(minutes=1), _SECOND,
+    datetime.timedelta(microseconds=1), datetime.timedelta(hours=1))
+
 
 class InvalidPrecision(Exception):
     """
@@ -100,6 +118,36 @@ class FixedOffset(datetime.tzinfo):
 
 
 
+_UTC = FixedOffset(0, 0)
+
+_fixedOffsets = {}
+
+def _fixedOffset(minutes):
+    """
+    Return a L{FixedOffset} for an offset of C{minutes} minutes from UTC,
+    shared with the other callers asking for the same offset.
+    """
+    try:
+        return _fixedOffsets[minutes]
+    except KeyError:
+        if len(_fixedOffsets) >= PARSE_CACHE_SIZE:
+            _fixedOffsets.clear()
+        offset = _fixedOffsets[minutes] = FixedOffset(0, minutes)
+        return offset
+
+
+
+def _remember(cache, key, value):
+    """
+    Remember C{value} as the result of parsing C{key} in C{cache}, emptying
+    the cache first if it is full.
+    """
+    if len(cache) >= PARSE_CACHE_SIZE:
+        cache.clear()
+    cache[key] = value
+
+
+
 class Time(object):
     """An object representing a well defined instant in time.
 
@@ -162,6 +210,9 @@ class Time(object):
     # is a naive datetime object which is always UTC. A UTC tzinfo would be
     # great, if one existed, and anyway it complicates pickling.
 
+    # Applications keep a great many of these, so they have no __dict__.
+    __slots__ = ('_time', 'resolution')
+
 
     class Precision(object):
         MINUTES = object() 
@@ -177,8 +228,6 @@ class Time(object):
     rfc2822Months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug',
                      'Sep', 'Oct', 'Nov', 'Dec']
 
-    resolution = datetime.timedelta.resolution
-
     #
     # Methods to create new instances
     #
@@ -190,6 +239,37 @@ class Time(object):
         initializers.
         """
         self._time = datetime.datetime.utcnow()
+        self.resolution = datetime.timedelta.resolution
+
+
+    def __getstate__(self):
+        """
+        Return the state of this instance as a C{dict}, as it was pickled
+        before instances had slots.
+        """
+        return {'_time': self._time, 'resolution': self.resolution}
+
+
+    def __setstate__(self, state):
+        """
+        Restore the state of an unpickled instance, which may not include a
+        resolution if it was pickled before instances had slots.
+        """
+        self._time = state['_time']
+        self.resolution = state.get(
+            'resolution', datetime.timedelta.resolution)
+
+
+    def _fromUTC(klass, dtime, resolution):
+        """
+        Return a new instance for a naive datetime in UTC and a resolution.
+        """
+        self = klass.__new__(klass)
+        self._time = dtime
+        self.resolution = resolution
+        return self
+
+    _fromUTC = classmethod(_fromUTC)
 
 
     def _fromWeekday(klass, match, tzinfo, now):
@@ -390,6 +470,11 @@ class Time(object):
         )? $""", re.VERBOSE)
 
 
+    _fastISO8601Pattern = re.compile(
+        r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})'
+        r'(?:[\.,](\d+))?(?:(Z)|([+\-]\d{2})(?::?(\d{2}))?)?$')
+
+
     def fromISO8601TimeAndDate(klass, iso8601string, tzinfo=None):
         """Return a new Time instance from a string formated as in ISO 8601.
 
@@ -404,6 +489,71 @@ class Time(object):
         are not free. Only a subset of all valid ISO 8601 dates are parsed,
         because I can't find a formal description of the format. However,
         common ones should work.
+
+        Complete dates and times, as asISO8601TimeAndDate writes them, are
+        parsed without the general pattern, and the results for the last
+        PARSE_CACHE_SIZE strings parsed are remembered.
+        """
+        key = (iso8601string, tzinfo)
+        try:
+            parsed = _iso8601Cache[key]
+        except KeyError:
+            parsed = klass._fastISO8601(iso8601string, tzinfo)
+            if parsed is None:
+                self = klass._parseISO8601TimeAndDate(iso8601string, tzinfo)
+                parsed = (self._time, self.resolution)
+            _remember(_iso8601Cache, key, parsed)
+        return klass._fromUTC(*parsed)
+
+    fromISO8601TimeAndDate = classmethod(fromISO8601TimeAndDate)
+
+
+    def _fastISO8601(klass, iso8601string, tzinfo):
+        """
+        Parse a complete ISO 8601 date and time with delimiters.
+
+        @return: C{None} if the string is not of that form, or is not a valid
+            time, otherwise a naive datetime in UTC and the resolution of the
+            time.
+        """
+        match = klass._fastISO8601Pattern.match(iso8601string)
+        if match is None:
+            return None
+        (year, month, day, hour, minute, second, fraction, zulu,
+         tzhour, tzmin) = match.groups()
+        # Let the general parser reject the timezones it rejects.
+        if tzhour is not None and (abs(int(tzhour)) > 23
+                                   or int(tzmin or 0) > 59):
+            return None
+        if fraction is None:
+            microsecond = 0
+            resolution = _SECOND
+        else:
+            microsecond = int(round(float('.' + fraction) * 1000000))
+            resolution = max(datetime.timedelta.resolution,
+                datetime.timedelta(
+                    microseconds=1 * 10 ** -len(fraction) * 1000000))
+        try:
+            dtime = datetime.datetime(
+                int(year), int(month), int(day), int(hour), int(minute),
+                int(second), microsecond)
+            if tzhour is not None:
+                dtime -= datetime.timedelta(
+                    minutes=int(tzhour) * 60 + int(tzmin or 0))
+            elif zulu is None and tzinfo is not None:
+                dtime = dtime.replace(tzinfo=tzinfo).astimezone(
+                    _UTC).replace(tzinfo=None)
+        except (ValueError, OverflowError):
+            return None
+        return dtime, resolution
+
+    _fastISO8601 = classmethod(_fastISO8601)
+
+
+    def _parseISO8601TimeAndDate(klass, iso8601string, tzinfo):
+        """
+        Return a new Time instance from a string formatted as in ISO 8601, as
+        described by fromISO8601TimeAndDate, with the general pattern.
         """
 
         def calculateTimezone():
@@ -567,7 +717,7 @@ class Time(object):
         self.resolution = determineResolution()
         return self
 
-    fromISO8601TimeAndDate = classmethod(fromISO8601TimeAndDate)
+    _parseISO8601TimeAndDate = classmethod(_parseISO8601TimeAndDate)
 
     def fromStructTime(klass, structTime, tzinfo=None):
         """Return a new Time instance from a time.struct_time.
@@ -596,7 +746,7 @@ class Time(object):
         """
         self = klass.__new__(klass)
         if dtime.tzinfo is not None:
-            self._time = dtime.astimezone(FixedOffset(0, 0)).replace(tzinfo=None)
+            self._time = dtime.astimezone(_UTC).replace(tzinfo=None)
         else:
             self._time = dtime
         self.resolution = datetime.timedelta.resolution
@@ -620,10 +770,24 @@ class Time(object):
 
     fromPOSIXTimestamp = classmethod(fromPOSIXTimestamp)
 
+    _fastRFC2822Pattern = re.compile(
+        r'\s*(?:(?:Mon|Tue|Wed|Thu|Fri|Sat|Sun),\s*)?(\d{1,2})'
+        r' (Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) (\d{4})'
+        r' (\d{2}):(\d{2}):(\d{2}) ([+\-])(\d{2})(\d{2})\s*$')
+
+    _rfc2822MonthNumbers = dict(zip(
+        ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct',
+         'Nov', 'Dec'], range(1, 13)))
+
+
     def fromRFC2822(klass, rfc822string):
         """
         Return a new Time instance from a string formated as described in RFC 2822.
 
+        Dates as asRFC2822 writes them, with a numeric timezone, are parsed
+        without the general parser, and the results for the last
+        PARSE_CACHE_SIZE strings parsed are remembered.
+
         @type rfc822string: str
 
         @raise ValueError: if the timestamp is not formatted properly (or if
@@ -631,6 +795,61 @@ class Time(object):
 
         @return: a new L{Time}
         """
+        try:
+            dtime = _rfc2822Cache[rfc822string]
+        except KeyError:
+            dtime = klass._fastRFC2822(rfc822string)
+            if dtime is None:
+                dtime = klass._parseRFC2822(rfc822string)._time
+            _remember(_rfc2822Cache, rfc822string, dtime)
+        return klass._fromUTC(dtime, _SECOND)
+
+    fromRFC2822 = classmethod(fromRFC2822)
+
+
+    def _fastRFC2822(klass, rfc822string):
+        """
+        Parse an RFC 2822 date with a four digit year, a time with seconds and
+        a numeric timezone.
+
+        @return: C{None} if the string is not of that form, or if the general
+            parser would adjust its values, otherwise a naive datetime in UTC.
+        """
+        match = klass._fastRFC2822Pattern.match(rfc822string)
+        if match is None:
+            return None
+        (day, month, year, hour, minute, second, sign,
+         tzhour, tzmin) = match.groups()
+        day = int(day)
+        year = int(year)
+        hour = int(hour)
+        minute = int(minute)
+        second = int(second)
+        tzhour = int(tzhour)
+        tzmin = int(tzmin)
+        # Let the general parser deal with the years it takes for two digit
+        # years, and the values it clamps or rejects.
+        if (year < 100 or not 1 <= day <= 31 or hour > 23 or minute > 59
+            or second > 59 or tzhour > 23 or tzmin > 59):
+            return None
+        offset = tzhour * 60 + tzmin
+        if sign == '-':
+            offset = -offset
+        try:
+            return datetime.datetime(
+                year, klass._rfc2822MonthNumbers[month], day, hour, minute,
+                second) - datetime.timedelta(minutes=offset)
+        except (ValueError, OverflowError):
+            return None
+
+    _fastRFC2822 = classmethod(_fastRFC2822)
+
+
+    def _parseRFC2822(klass, rfc822string):
+        """
+        Return a new Time instance from a string formatted as described in RFC
+        2822, with the general parser.
+        """
 
         # parsedate_tz is going to give us a "struct_time plus", a 10-tuple
         # containing the 9 values a struct_time would, i.e.: (tm_year, tm_mon,
@@ -653,7 +872,7 @@ class Time(object):
         self.resolution = datetime.timedelta(seconds=1)
         return self
 
-    fromRFC2822 = classmethod(fromRFC2822)
+    _parseRFC2822 = classmethod(_parseRFC2822)
 
     #
     # Methods to produce various formats
@@ -675,12 +894,12 @@ class Time(object):
         describing UTC if the tzinfo parameter is None.
         """
         if tzinfo is None:
-            tzinfo = FixedOffset(0, 0)
+            tzinfo = _UTC
 
         if not self.isTimezoneDependent():
             return self._time.replace(tzinfo=tzinfo)
         else:
-            return self._time.replace(tzinfo=FixedOffset(0, 0)).astimezone(tzinfo)
+            return self._time.replace(tzinfo=_UTC).astimezone(tzinfo)
 
     def asNaiveDatetime(self, tzinfo=None):
         """Return this time as a naive datetime.datetime instance.
@@ -705,18 +924,15 @@ class Time(object):
         RFC 2822 states that the weekday is optional. The parameter
         includeDayOfWeek indicates whether or not to include it.
         """
-        dtime = self.asDatetime(tzinfo)
-
         if tzinfo is None:
+            # The internal representation is already in UTC.
+            dtime = self._time
             rfcoffset = '-0000'
         else:
+            dtime = self.asDatetime(tzinfo)
             rfcoffset = '%s%02i%02i' % _timedeltaToSignHrMin(dtime.utcoffset())
 
-        rfcstring = ''
-        if includeDayOfWeek:
-            rfcstring += self.rfc2822Weekdays[dtime.weekday()] + ', '
-
-        rfcstring += '%i %s %4i %02i:%02i:%02i %s' % (
+        rfcstring = '%i %s %4i %02i:%02i:%02i %s' % (
             dtime.day,
             self.rfc2822Months[dtime.month - 1],
             dtime.year,
@@ -725,6 +941,8 @@ class Time(object):
             dtime.second,
             rfcoffset)
 
+        if includeDayOfWeek:
+            rfcstring = self.rfc2822Weekdays[dtime.weekday()] + ', ' + rfcstring
         return rfcstring
 
     def asISO8601TimeAndDate(self, includeDelimiters=True, tzinfo=None,
@@ -744,7 +962,11 @@ class Time(object):
         """
         if not self.isTimezoneDependent():
             tzinfo = None
-        dtime = self.asDatetime(tzinfo)
+        if tzinfo is None:
+            # The internal representation is already in UTC.
+            dtime = self._time
+        else:
+            dtime = self.asDatetime(tzinfo)
 
         if includeDelimiters:
             dateSep = '-'
@@ -765,21 +987,28 @@ class Time(object):
         if microsecond:
             microsecond = '.' + microsecond
 
+        resolution = self.resolution
+        if resolution <= datetime.timedelta.resolution:
+            # Every part is included.
+            return '%04i%s%02i%s%02iT%02i%s%02i%s%02i%s%s' % (
+                dtime.year, dateSep, dtime.month, dateSep, dtime.day,
+                dtime.hour, timeSep, dtime.minute, timeSep, dtime.second,
+                microsecond, timezone)
+
         parts = [
-            ('%04i' % (dtime.year,), datetime.timedelta(days=366)),
-            ('%s%02i' % (dateSep, dtime.month), datetime.timedelta(days=31)),
-            ('%s%02i' % (dateSep, dtime.day), datetime.timedelta(days=1)),
-            ('T', datetime.timedelta(hours=1)),
-            ('%02i' % (dtime.hour,), datetime.timedelta(hours=1)),
-            ('%s%02i' % (timeSep, dtime.minute), datetime.timedelta(minutes=1)),
-            ('%s%02i' % (timeSep, dtime.second), datetime.timedelta(seconds=1)),
-            (microsecond, datetime.timedelta(microseconds=1)),
-            (timezone, datetime.timedelta(hours=1))
-        ]
+            '%04i' % (dtime.year,),
+            '%s%02i' % (dateSep, dtime.month),
+            '%s%02i' % (dateSep, dtime.day),
+            'T',
+            '%02i' % (dtime.hour,),
+            '%s%02i' % (timeSep, dtime.minute),
+            '%s%02i' % (timeSep, dtime.second),
+            microsecond,
+            timezone]
 
         formatted = ''
-        for part, minResolution in parts:
-            if self.resolution <= minResolution:
+        for part, minResolution in zip(parts, _ISO8601_RESOLUTIONS):
+            if resolution <= minResolution:
                 formatted += part
 
         return formatted
@@ -906,7 +1135,7 @@ class Time(object):
 
     def isAllDay(self):
         """Return True iff this instance represents exactly all day."""
-        return self.resolution == datetime.timedelta(days=1)
+        return self.resolution == _ONE_DAY
 
     def isTimezoneDependent(self):
         """Return True iff timezone is relevant for this instance.
@@ -914,7 +1143,7 @@ class Time(object):
         Timezone is only relevent for instances with a resolution better than
         one day.
         """
-        return self.resolution < datetime.timedelta(days=1)
+        return self.resolution < _ONE_DAY
 
     #
     # other magic methods
@@ -978,3 +1207,104 @@ class Time(object):
             return self.asDatetime() - subtrahend.asDatetime()
 
         return NotImplemented
+
+
+
+def rfc2822FromPOSIXTimestamps(timestamps, tzinfo=None,
+                               includeDayOfWeek=True):
+    """
+    Format many POSIX timestamps as RFC 2822 dates at once.
+
+    The result is the same as formatting each timestamp with
+    C{Time.fromPOSIXTimestamp(secs).asRFC2822(tzinfo, includeDayOfWeek)}, but
+    no L{Time} is made for each one, and the date of timestamps on the same
+    day in UTC is only formatted once.
+
+    @param timestamps: an iterable of numbers of seconds since the POSIX
+        epoch.
+
+    @return: a C{list} of C{str}s.
+    """
+    if tzinfo is not None:
+        time = Time._fromUTC(_EPOCH, _NO_RESOLUTION)
+        result = []
+        for secs in timestamps:
+            time._time = _EPOCH + datetime.timedelta(seconds=secs)
+            result.append(time.asRFC2822(tzinfo, includeDayOfWeek))
+        return result
+
+    days = {}
+    result = []
+    for secs in timestamps:
+        delta = datetime.timedelta(seconds=secs)
+        try:
+            date = days[delta.days]
+        except KeyError:
+            dtime = _EPOCH + datetime.timedelta(days=delta.days)
+            date = days[delta.days] = '%i %s %4i ' % (
+                dtime.day, Time.rfc2822Months[dtime.month - 1], dtime.year)
+            if includeDayOfWeek:
+                date = days[delta.days] = (
+                    Time.rfc2822Weekdays[dtime.weekday()] + ', ' + date)
+        seconds = delta.seconds
+        result.append('%s%02i:%02i:%02i -0000' % (
+            date, seconds // 3600, seconds // 60 % 60, seconds % 60))
+    return result
+
+
+
+def iso8601FromPOSIXTimestamps(timestamps, includeDelimiters=True,
+                               tzinfo=None, includeTimezone=True):
+    """
+    Format many POSIX timestamps as ISO 8601 dates and times at once.
+
+    The result is the same as formatting each timestamp with
+    C{Time.fromPOSIXTimestamp(secs).asISO8601TimeAndDate(includeDelimiters,
+    tzinfo, includeTimezone)}, but no L{Time} is made for each one, and the
+    date of timestamps on the same day in UTC is only formatted once.
+
+    @param timestamps: an iterable of numbers of seconds since the POSIX
+        epoch.
+
+    @return: a C{list} of C{str}s.
+    """
+    if tzinfo is not None:
+        time = Time._fromUTC(_EPOCH, _NO_RESOLUTION)
+        result = []
+        for secs in timestamps:
+            time._time = _EPOCH + datetime.timedelta(seconds=secs)
+            result.append(time.asISO8601TimeAndDate(
+                includeDelimiters, tzinfo, includeTimezone))
+        return result
+
+    if includeDelimiters:
+        dateFormat = '%04i-%02i-%02iT'
+        timeFormat = '%s%02i:%02i:%02i%s%s'
+        timezone = '+00:00'
+    else:
+        dateFormat = '%04i%02i%02iT'
+        timeFormat = '%s%02i%02i%02i%s%s'
+        timezone = '+0000'
+    if not includeTimezone:
+        timezone = ''
+
+    days = {}
+    result = []
+    for secs in timestamps:
+        delta = datetime.timedelta(seconds=secs)
+        try:
+            date = days[delta.days]
+        except KeyError:
+            dtime = _EPOCH + datetime.timedelta(days=delta.days)
+            date = days[delta.days] = dateFormat % (
+                dtime.year, dtime.month, dtime.day)
+        seconds = delta.seconds
+        microsecond = delta.microseconds
+        if microsecond:
+            microsecond = ('.%06i' % (microsecond,)).rstrip('0')
+        else:
+            microsecond = ''
+        result.append(timeFormat % (
+            date, seconds // 3600, seconds // 60 % 60, seconds % 60,
+            microsecond, timezone))
+    return result
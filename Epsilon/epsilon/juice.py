@@ -7,12 +7,11 @@ import warnings, pprint
 
 from twisted.internet.main import CONNECTION_LOST
 from twisted.internet.defer import Deferred, maybeDeferred, fail
-from twisted.internet.protocol import ServerFactory, ClientFactory
+from twisted.internet.protocol import Protocol, ServerFactory, ClientFactory
 from twisted.internet.ssl import Certificate
 from twisted.python.failure import Failure
 from twisted.python import log, filepath
 
-from epsilon.liner import LineReceiver
 from epsilon import extime
 
 ASK = '_ask'
@@ -26,6 +25,26 @@ BODY = 'body'
 
 debug = False
 
+# The greatest number of keys whose header names, or header names whose keys,
+# are remembered.  Applications use only a few distinct keys, so the memos are
+# simply emptied if they ever grow this large.
+KEY_CACHE_SIZE = 1000
+
+_headerNames = {}
+
+def _headerName(key):
+    """
+    Return the header name under which the value of C{key} is written, with
+    the separator which follows it.
+    """
+    try:
+        return _headerNames[key]
+    except KeyError:
+        if len(_headerNames) >= KEY_CACHE_SIZE:
+            _headerNames.clear()
+        name = _headerNames[key] = key.replace('_', '-').title() + ': '
+        return name
+
 class JuiceBox(dict):
     """ I am a packet in the JUICE protocol.  """
 
@@ -52,25 +71,38 @@ class JuiceBox(dict):
         newBox.update(self)
         return newBox
 
-    def serialize(self,
-                  delimiter='\r\n',
-                  escaped='\r\n '):
+    def serializeInto(self, L,
+                      delimiter='\r\n',
+                      escaped='\r\n '):
+        """
+        Serialize the headers of this box onto the end of a list.
+
+        @param L: a C{list} to which the C{str} pieces of the headers, and the
+            blank line which ends them, are appended.
+
+        @return: the body of this box, which follows the headers on the wire.
+        It is returned as it is, rather than copied into C{L}, so that large
+        bodies can be written without being joined to their headers.
+        """
         assert LENGTH not in self
 
-        L = []
+        append = L.append
         for (k, v) in self.iteritems():
             if k == BODY:
                 k = LENGTH
-                v = str(len(self[BODY]))
-            L.append(k.replace('_', '-').title())
-            L.append(': ')
-            L.append(v.replace(delimiter, escaped))
-            L.append(delimiter)
+                v = str(len(v))
+            append(_headerName(k))
+            append(v.replace(delimiter, escaped))
+            append(delimiter)
 
-        L.append(delimiter)
-        if BODY in self:
-            L.append(self[BODY])
+        append(delimiter)
+        return self.get(BODY, '')
 
+    def serialize(self,
+                  delimiter='\r\n',
+                  escaped='\r\n '):
+        L = []
+        L.append(self.serializeInto(L, delimiter, escaped))
         bytes = ''.join(L)
         return bytes
 
@@ -273,10 +305,19 @@ PYTHON_KEYWORDS = [
     'if', 'or', 'while', 'continue', 'exec', 'import', 'pass', 'yield',
     'def', 'finally', 'in', 'print']
 
+_normalizedKeys = {}
+
 def normalizeKey(key):
+    try:
+        return _normalizedKeys[key]
+    except KeyError:
+        pass
     lkey = key.lower().replace('-', '_')
     if lkey in PYTHON_KEYWORDS:
-        return lkey.title()
+        lkey = lkey.title()
+    if len(_normalizedKeys) >= KEY_CACHE_SIZE:
+        _normalizedKeys.clear()
+    _normalizedKeys[key] = lkey
     return lkey
 
 
@@ -303,6 +344,126 @@ def parseJuiceHeaders(lines):
         b[key] = value
     return int(b.pop(LENGTH, 0)), b
 
+
+
+class JuiceDecoder:
+    """
+    An incremental parser of the boxes in a stream of bytes.
+
+    Bytes are given to L{feed} as they arrive and complete boxes are taken
+    from L{next}.  Rather than splitting the stream into lines, the decoder
+    finds the blank line which ends each box's headers in the bytes it has
+    buffered, and then takes the box's body, the length of which the headers
+    give, straight from the buffer.  A body which arrives in several pieces is
+    kept in pieces until it is complete, and then joined once.
+
+    @ivar _buffer: the bytes received but not yet decoded, starting at
+        C{_offset}.
+
+    @ivar _searched: the offset in C{_buffer} from which the end of the
+        current headers is still to be looked for.
+
+    @ivar _pendingBox: C{None}, or the L{JuiceBox} whose headers have been
+        decoded but whose body has not all arrived.
+
+    @ivar _bodyChunks: the pieces of the body of C{_pendingBox} received so
+        far.
+
+    @ivar _bodyRemaining: the number of bytes of the body of C{_pendingBox}
+        which have not arrived.
+    """
+    def __init__(self):
+        self._buffer = ''
+        self._offset = 0
+        self._searched = 0
+        self._pendingBox = None
+        self._bodyChunks = None
+        self._bodyRemaining = 0
+
+
+    def feed(self, data):
+        """
+        Add some bytes received to those to decode.
+
+        @type data: C{str}
+        """
+        if self._bodyRemaining:
+            if len(data) < self._bodyRemaining:
+                self._bodyChunks.append(data)
+                self._bodyRemaining -= len(data)
+                return
+            self._bodyChunks.append(data[:self._bodyRemaining])
+            data = data[self._bodyRemaining:]
+            self._bodyRemaining = 0
+        if self._offset:
+            self._searched = max(self._searched - self._offset, 0)
+            self._buffer = self._buffer[self._offset:] + data
+            self._offset = 0
+        else:
+            self._buffer += data
+
+
+    def next(self):
+        """
+        Decode the next box.
+
+        @return: a L{JuiceBox}, or C{None} if all of the next box has not yet
+            been received.
+
+        @raise MalformedJuiceBox: if the next box's headers cannot be parsed.
+        """
+        box = self._pendingBox
+        if box is not None:
+            if self._bodyRemaining:
+                return None
+            box[BODY] = ''.join(self._bodyChunks)
+            self._pendingBox = self._bodyChunks = None
+            return box
+
+        buffer = self._buffer
+        offset = self._offset
+        if buffer.startswith('\r\n', offset):
+            lines = []
+            offset += 2
+        else:
+            end = buffer.find('\r\n\r\n', max(self._searched, offset))
+            if end == -1:
+                self._searched = max(len(buffer) - 3, offset)
+                return None
+            lines = buffer[offset:end].split('\r\n')
+            offset = end + 4
+        bodylen, box = parseJuiceHeaders(lines)
+
+        if bodylen:
+            available = len(buffer) - offset
+            if available < bodylen:
+                self._pendingBox = box
+                self._bodyChunks = [buffer[offset:]]
+                self._bodyRemaining = bodylen - available
+                self._buffer = ''
+                self._offset = self._searched = 0
+                return None
+            box[BODY] = buffer[offset:offset + bodylen]
+            offset += bodylen
+        if offset == len(buffer):
+            self._buffer = ''
+            self._offset = self._searched = 0
+        else:
+            self._offset = self._searched = offset
+        return box
+
+
+    def clear(self):
+        """
+        Stop decoding, and return the bytes received which were not part of a
+        box that has been decoded.
+
+        @rtype: C{str}
+        """
+        remaining = self._buffer[self._offset:]
+        self.__init__()
+        return remaining
+
 class JuiceParserBase(DispatchMixin):
 
     def __init__(self):
@@ -722,7 +883,7 @@ class Negotiate(Command):
     responseType = NegotiateBox
 
 
-class Juice(LineReceiver, JuiceParserBase):
+class Juice(Protocol, JuiceParserBase):
     """
     JUICE (JUice Is Concurrent Events) is a simple connection-oriented
     request/response protocol.  Packets, or "boxes", are collections of
@@ -788,7 +949,6 @@ class Juice(LineReceiver, JuiceParserBase):
         """
 
         assert self.innerProtocol is None, "Protocol can only be safely switched once."
-        self.setRawMode()
         self.innerProtocol = newProto
         self.innerProtocolClientFactory = clientFactory
         newProto.makeConnection(self.transport)
@@ -815,7 +975,14 @@ class Juice(LineReceiver, JuiceParserBase):
             if debug:
                 log.msg("Juice send: %s" % pprint.pformat(dict(completeBox.iteritems())))
 
-            self.transport.write(completeBox.serialize())
+            L = self._sendBuffer
+            body = completeBox.serializeInto(L)
+            headers = ''.join(L)
+            del L[:]
+            if body:
+                self.transport.writeSequence([headers, body])
+            else:
+                self.transport.write(headers)
 
     def sendCommand(self, command, __content='', __answer=True, **kw):
         box = JuiceBox(__content, **kw)
@@ -832,8 +999,9 @@ class Juice(LineReceiver, JuiceParserBase):
                                                                     self._transportHost,
                                                                     self._transportPeer))
         self._outstandingRequests = {}
-        self._requestBuffer = []
-        LineReceiver.makeConnection(self, transport)
+        self._decoder = JuiceDecoder()
+        self._sendBuffer = []
+        Protocol.makeConnection(self, transport)
 
     _startingTLSBuffer = None
 
@@ -863,7 +1031,24 @@ class Juice(LineReceiver, JuiceParserBase):
         # means the connection was secured properly.  Make a note of that fact.
         if self._justStartedTLS:
             self._justStartedTLS = False
-        return LineReceiver.dataReceived(self, data)
+        if self.innerProtocol is not None:
+            self.innerProtocol.dataReceived(data)
+            return
+        decoder = self._decoder
+        decoder.feed(data)
+        while True:
+            box = decoder.next()
+            if box is None:
+                return
+            self.juiceBoxReceived(box)
+            if self.transport is not None and self.transport.disconnecting:
+                decoder.clear()
+                return
+            if self.innerProtocol is not None:
+                extraData = decoder.clear()
+                if extraData:
+                    self.innerProtocol.dataReceived(extraData)
+                return
 
     def connectionLost(self, reason):
         log.msg("%s %s connection lost (HOST:%s PEER:%s)" % (
@@ -877,46 +1062,6 @@ class Juice(LineReceiver, JuiceParserBase):
             if self.innerProtocolClientFactory is not None:
                 self.innerProtocolClientFactory.clientConnectionLost(None, reason)
 
-    def lineReceived(self, line):
-        if line:
-            self._requestBuffer.append(line)
-        else:
-            buf = self._requestBuffer
-            self._requestBuffer = []
-            bodylen, b = parseJuiceHeaders(buf)
-            if bodylen:
-                self._bodyRemaining = bodylen
-                self._bodyBuffer = []
-                self._pendingBox = b
-                self.setRawMode()
-            else:
-                self.juiceBoxReceived(b)
-
-    def rawDataReceived(self, data):
-        if self.innerProtocol is not None:
-            self.innerProtocol.dataReceived(data)
-            return
-        self._bodyRemaining -= len(data)
-        if self._bodyRemaining <= 0:
-            if self._bodyRemaining < 0:
-                self._bodyBuffer.append(data[:self._bodyRemaining])
-                extraData = data[self._bodyRemaining:]
-            else:
-                self._bodyBuffer.append(data)
-                extraData = ''
-            self._pendingBox['body'] = ''.join(self._bodyBuffer)
-            self._bodyBuffer = None
-            b, self._pendingBox = self._pendingBox, None
-            self.juiceBoxReceived(b)
-            if self.innerProtocol is not None:
-                self.innerProtocol.makeConnection(self.transport)
-                if extraData:
-                    self.innerProtocol.dataReceived(extraData)
-            else:
-                self.setLineMode(extraData)
-        else:
-            self._bodyBuffer.append(data)
-
     protocolVersion = 0
 
     def _setProtocolVersion(self, version):
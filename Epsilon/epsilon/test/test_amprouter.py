@@ -8,7 +8,11 @@ from zope.interface import implements
 from zope.interface.verify import verifyObject
 
 from twisted.python.failure import Failure
-from twisted.protocols.amp import IBoxReceiver, IBoxSender
+from twisted.internet.interfaces import IPushProducer
+from twisted.internet.task import Clock
+from twisted.protocols.amp import (
+    IBoxReceiver, IBoxSender, BinaryBoxProtocol, AmpBox, MAX_VALUE_LENGTH)
+from twisted.test.proto_helpers import StringTransport
 from twisted.trial.unittest import TestCase
 
 from epsilon.amprouter import _ROUTE, RouteNotConnected, Router
@@ -58,6 +62,28 @@ class SomeReceiver:
 
 
 
+class PausableReceiver(SomeReceiver):
+    """
+    A stub AMP box receiver which is also a push producer, and keeps track of
+    whether it has been paused.
+    """
+    implements(IPushProducer)
+
+    paused = False
+
+    def pauseProducing(self):
+        self.paused = True
+
+
+    def resumeProducing(self):
+        self.paused = False
+
+
+    def stopProducing(self):
+        pass
+
+
+
 class CollectingSender:
     """
     An L{IBoxSender} which collects and saves boxes and errors sent to it.
@@ -317,3 +343,183 @@ class RouterTests(TestCase):
 
         self.assertTrue(receiver.stopped)
         receiver.reason.trap(DummyException)
+
+
+
+class BatchingTests(TestCase):
+    """
+    Tests for a L{Router} which queues the boxes sent through its routes.
+    """
+    def setUp(self):
+        """
+        Create a batching router with two connected routes.
+        """
+        self.clock = Clock()
+        self.sender = CollectingSender()
+        self.router = Router(self.clock.callLater)
+        self.router.startReceivingBoxes(self.sender)
+        self.receivers = [PausableReceiver(), SomeReceiver()]
+        self.routes = []
+        for name, receiver in zip([u'a', u'b'], self.receivers):
+            route = self.router.bindRoute(receiver)
+            route.connectTo(name)
+            self.routes.append(route)
+
+
+    def iterate(self):
+        """
+        Run the calls which were scheduled before this iteration of the
+        reactor, but not those scheduled by them, as the reactor does.
+        """
+        calls = self.clock.calls
+        self.clock.calls = []
+        for call in calls:
+            call.func(*call.args, **call.kw)
+
+
+    def test_interfaces(self):
+        """
+        L{Router} instances provide L{IPushProducer}.
+        """
+        self.assertTrue(verifyObject(IPushProducer, self.router))
+
+
+    def test_queued(self):
+        """
+        Boxes sent through a route are queued until the next iteration of the
+        reactor, and the depth of the queue is counted.
+        """
+        route = self.routes[0]
+        self.assertEqual(route.queueDepth(), 0)
+        route.sendBox({'foo': 'bar'})
+        route.sendBox({'baz': 'quux'})
+        self.assertEqual(self.sender.boxes, [])
+        self.assertEqual(route.queueDepth(), 2)
+        self.iterate()
+        self.assertEqual(
+            self.sender.boxes,
+            [{_ROUTE: 'a', 'foo': 'bar'}, {_ROUTE: 'a', 'baz': 'quux'}])
+        self.assertEqual(route.queueDepth(), 0)
+        self.assertEqual(route.maxQueueDepth, 2)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_fairness(self):
+        """
+        Queued boxes are taken from each route in turn, and no more than
+        C{maxBatchSize} of them are sent at once.
+        """
+        self.router.maxBatchSize = 4
+        for i in range(5):
+            self.routes[0].sendBox({'n': str(i)})
+        self.routes[1].sendBox({'n': '0'})
+        self.iterate()
+        self.assertEqual(
+            [(box[_ROUTE], box['n']) for box in self.sender.boxes],
+            [('a', '0'), ('b', '0'), ('a', '1'), ('a', '2')])
+        self.iterate()
+        self.assertEqual(len(self.sender.boxes), 6)
+
+
+    def test_singleWrite(self):
+        """
+        Boxes queued for a L{BinaryBoxProtocol} are written to its transport
+        all at once.
+        """
+        router = Router(self.clock.callLater)
+        protocol = BinaryBoxProtocol(router)
+        transport = StringTransport()
+        writes = []
+        transport.write = writes.append
+        protocol.makeConnection(transport)
+        route = router.bindRoute(SomeReceiver())
+        route.connectTo(None)
+        boxes = [AmpBox(foo='bar'), {'baz': 'quux'}, AmpBox(x='y')]
+        for box in boxes:
+            route.sendBox(box)
+        self.assertEqual(writes, [])
+        self.iterate()
+        self.assertEqual(
+            writes, [''.join([AmpBox(box).serialize() for box in boxes])])
+
+
+    def test_serializationError(self):
+        """
+        A box which cannot be serialized is reported to the sender, and the
+        others are still written.
+        """
+        router = Router(self.clock.callLater)
+        protocol = BinaryBoxProtocol(router)
+        transport = StringTransport()
+        protocol.makeConnection(transport)
+        errors = []
+        protocol.unhandledError = errors.append
+        route = router.bindRoute(SomeReceiver())
+        route.connectTo(None)
+        route.sendBox({'foo': 'x' * (MAX_VALUE_LENGTH + 1)})
+        route.sendBox({'baz': 'quux'})
+        self.iterate()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(transport.value(), AmpBox(baz='quux').serialize())
+
+
+    def test_highWaterMark(self):
+        """
+        The receiver of a route whose queue reaches C{highWaterMark} boxes is
+        paused, and resumed once the queue is drained to C{lowWaterMark}.
+        """
+        self.router.highWaterMark = 4
+        self.router.lowWaterMark = 2
+        self.router.maxBatchSize = 1
+        route, receiver = self.routes[0], self.receivers[0]
+        for i in range(3):
+            route.sendBox({'n': str(i)})
+        self.assertFalse(receiver.paused)
+        route.sendBox({'n': '3'})
+        self.assertTrue(receiver.paused)
+        self.assertEqual(route.maxQueueDepth, 4)
+        self.iterate()
+        self.assertTrue(receiver.paused)
+        self.iterate()
+        self.assertFalse(receiver.paused)
+
+
+    def test_pauseProducing(self):
+        """
+        While a L{Router} is paused, no queued boxes are sent and the
+        receivers of its routes are paused.
+        """
+        self.routes[1].sendBox({'foo': 'bar'})
+        self.router.pauseProducing()
+        self.assertTrue(self.receivers[0].paused)
+        self.iterate()
+        self.assertEqual(self.sender.boxes, [])
+        self.router.resumeProducing()
+        self.assertFalse(self.receivers[0].paused)
+        self.iterate()
+        self.assertEqual(self.sender.boxes, [{_ROUTE: 'b', 'foo': 'bar'}])
+
+
+    def test_pauseUnbatched(self):
+        """
+        A L{Router} which sends boxes at once still passes requests to pause
+        and resume on to the receivers of its routes.
+        """
+        router = Router()
+        router.startReceivingBoxes(self.sender)
+        receiver = PausableReceiver()
+        router.bindRoute(receiver).connectTo(u'c')
+        router.pauseProducing()
+        self.assertTrue(receiver.paused)
+        router.resumeProducing()
+        self.assertFalse(receiver.paused)
+
+
+    def test_stopReceivingBoxes(self):
+        """
+        Queued boxes are discarded when the router is stopped.
+        """
+        self.routes[0].sendBox({'foo': 'bar'})
+        self.router.stopReceivingBoxes(Failure(RuntimeError("foo")))
+        self.assertEqual(self.routes[0].queueDepth(), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
@@ -493,3 +493,96 @@ class TestTime(unittest.TestCase):
         self.failIf(self._createReference().isAllDay())
         self.failUnless(extime.Time.fromISO8601TimeAndDate('2005-123').isAllDay())
 
+
+    def test_slots(self):
+        """
+        Time instances have no C{__dict__}, but can still be pickled, and
+        unpickled from the state pickled before they had slots.
+        """
+        import pickle
+        now = extime.Time()
+        self.failIf(hasattr(now, '__dict__'))
+        for protocol in range(3):
+            copy = pickle.loads(pickle.dumps(now, protocol))
+            self.assertEquals(copy, now)
+            self.assertEquals(copy.resolution, now.resolution)
+        old = extime.Time.__new__(extime.Time)
+        old.__setstate__({'_time': now._time})
+        self.assertEquals(old.resolution, datetime.timedelta.resolution)
+
+    def test_parseCache(self):
+        """
+        Parsing a string again gives a new, equal Time.
+        """
+        for parse, string in [
+            (extime.Time.fromRFC2822, 'Tue, 1 Feb 2005 10:00:00 +0130'),
+            (extime.Time.fromISO8601TimeAndDate, '2005-02-01T10:00:00.5Z'),
+            (extime.Time.fromISO8601TimeAndDate, '2005-02')]:
+            first = parse(string)
+            second = parse(string)
+            self.failIf(first is second)
+            self.assertEquals(first, second)
+            self.assertEquals(first.resolution, second.resolution)
+            first.resolution = datetime.timedelta(days=7)
+            self.assertNotEquals(parse(string).resolution, first.resolution)
+
+    def test_fastParsing(self):
+        """
+        Strings parsed without the general parsers give the same times as the
+        general parsers do.
+        """
+        for string in [
+            'Tue, 1 Feb 2005 10:00:00 +0130', '01 Feb 2005 10:00:00 -0145',
+            'Tue, 1 Feb 2005 10:00:00 -0000', '1 Jan 0050 00:00:00 +0000',
+            '31 Dec 9999 23:59:59 +0100']:
+            fast = extime.Time.fromRFC2822(string)
+            general = extime.Time._parseRFC2822(string)
+            self.assertEquals(fast, general)
+            self.assertEquals(fast.resolution, general.resolution)
+
+        for string, tzinfo in [
+            ('2005-02-01T10:00:00', None), ('2005-02-01T10:00:00', self.MST()),
+            ('2005-02-01T10:00:00Z', self.MST()),
+            ('2005-02-01T10:00:00.25-05:30', None),
+            ('2005-02-01T10:00:00,123456+0100', None),
+            ('2005-02-01T10:00:00+01', None)]:
+            fast = extime.Time.fromISO8601TimeAndDate(string, tzinfo)
+            general = extime.Time._parseISO8601TimeAndDate(string, tzinfo)
+            self.assertEquals(fast, general)
+            self.assertEquals(fast.resolution, general.resolution)
+
+        for string in ['30 Feb 2005 10:00:00 +0000',
+                       '1 Jan 1999 00:00:00 +9999',
+                       '1 Jan 1999 00:00:00 -2400']:
+            self.assertRaises(ValueError, extime.Time.fromRFC2822, string)
+        for string in ['2005-02-30T10:00:00', '2000-01-01T00:00:00+05:',
+                       '2000-01-01T00:00:00+99:99', '2000-01-01T00:00:00-24']:
+            self.assertRaises(
+                ValueError, extime.Time.fromISO8601TimeAndDate, string)
+
+    def test_bulkFormatting(self):
+        """
+        L{extime.rfc2822FromPOSIXTimestamps} and
+        L{extime.iso8601FromPOSIXTimestamps} format each timestamp as a Time
+        made from it would be formatted.
+        """
+        timestamps = [0, 1.5, -86400.25, 1104537600, 1104537600.000001,
+                      2 ** 31 + 0.75, 1104537599]
+        for tzinfo in None, self.MST():
+            for includeDayOfWeek in True, False:
+                self.assertEquals(
+                    extime.rfc2822FromPOSIXTimestamps(
+                        timestamps, tzinfo, includeDayOfWeek),
+                    [extime.Time.fromPOSIXTimestamp(secs).asRFC2822(
+                            tzinfo, includeDayOfWeek)
+                     for secs in timestamps])
+            for includeDelimiters in True, False:
+                for includeTimezone in True, False:
+                    self.assertEquals(
+                        extime.iso8601FromPOSIXTimestamps(
+                            timestamps, includeDelimiters, tzinfo,
+                            includeTimezone),
+                        [extime.Time.fromPOSIXTimestamp(
+                                secs).asISO8601TimeAndDate(
+                                includeDelimiters, tzinfo, includeTimezone)
+                         for secs in timestamps])
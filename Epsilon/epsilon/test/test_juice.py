@@ -199,6 +199,107 @@ World: this header is ignored
             p.flush()
             self.assertEquals(s.boxes[-1], jb)
 
+class DecoderTest(unittest.TestCase):
+    """
+    Tests for L{juice.JuiceDecoder} and the serialization of boxes it decodes.
+    """
+    boxes = [
+        juice.Box(simple='test', newline='one\r\n\r\ntwo'),
+        juice.Box('blah\r\n\r\ntesttest', simple='test'),
+        juice.Box(),
+        juice.Box('x' * 1000, ceq=': ')]
+
+    def decodeAll(self, chunks):
+        decoder = juice.JuiceDecoder()
+        result = []
+        for chunk in chunks:
+            decoder.feed(chunk)
+            while True:
+                box = decoder.next()
+                if box is None:
+                    break
+                result.append(box)
+        return result
+
+    def testSerialize(self):
+        """
+        Headers are titled, bodies are given as a C{-Length} header and
+        follow the headers.
+        """
+        box = juice.Box('hello', _command='x', class_='y', for_='z')
+        L = []
+        self.assertEquals(box.serializeInto(L), 'hello')
+        self.assertEquals(sorted(''.join(L).split('\r\n')),
+                          ['', '', '-Command: x', '-Length: 5',
+                           'Class-: y', 'For-: z'])
+        self.assertEquals(box.serialize(), ''.join(L) + 'hello')
+
+    def testWholeStream(self):
+        """
+        Boxes all received at once are decoded in order.
+        """
+        data = ''.join([box.serialize() for box in self.boxes])
+        self.assertEquals(self.decodeAll([data]), self.boxes)
+
+    def testByteAtATime(self):
+        """
+        Boxes received a byte at a time are decoded.
+        """
+        data = ''.join([box.serialize() for box in self.boxes])
+        self.assertEquals(self.decodeAll(data), self.boxes)
+
+    def testSplitBody(self):
+        """
+        A body received in pieces, the last of which also holds the start of
+        the next box, is decoded.
+        """
+        data = ''.join([box.serialize() for box in self.boxes[-1:] * 2])
+        chunks = [data[:50], data[50:500], data[500:1100], data[1100:]]
+        self.assertEquals(self.decodeAll(chunks), self.boxes[-1:] * 2)
+
+    def testKeywords(self):
+        """
+        Keys which are Python keywords are decoded with a capital letter, as
+        L{juice.normalizeKey} gives them.
+        """
+        self.assertEquals(self.decodeAll(['For: x\r\nA-B: y\r\n\r\n']),
+                          [{'For': 'x', 'a_b': 'y'}])
+
+    def testMalformed(self):
+        """
+        L{juice.MalformedJuiceBox} is raised for headers without values.
+        """
+        self.assertRaises(juice.MalformedJuiceBox, self.decodeAll,
+                          ['Hello\r\n\r\n'])
+
+    def testClear(self):
+        """
+        L{juice.JuiceDecoder.clear} returns the bytes which were not decoded,
+        and the decoder starts again.
+        """
+        decoder = juice.JuiceDecoder()
+        decoder.feed('A: b\r\n\r\nnot juice')
+        self.assertEquals(decoder.next(), {'a': 'b'})
+        self.assertEquals(decoder.clear(), 'not juice')
+        self.assertIdentical(decoder.next(), None)
+        decoder.feed('C: d\r\n\r\n')
+        self.assertEquals(decoder.next(), {'c': 'd'})
+
+    def testLargeBodyWrittenSeparately(self):
+        """
+        L{juice.Juice} writes the body of a box without joining it to the
+        headers.
+        """
+        c, s, p = connectedServerAndClient(
+            ClientClass=lambda: LiteralJuice(False),
+            ServerClass=lambda: LiteralJuice(True))
+        writes = []
+        c.transport.writeSequence = writes.append
+        body = 'x' * 100000
+        juice.Box(body, simple='test').sendTo(c)
+        [[headers, sent]] = writes
+        self.assertIdentical(sent, body)
+
 SWITCH_CLIENT_DATA = 'Success!'
 SWITCH_SERVER_DATA = 'No, really.  Success.'
 
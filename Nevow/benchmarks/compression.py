@@ -0,0 +1,88 @@
+
+from time import time
+
+from twisted.python.usage import Options
+
+from nevow import util, testutil
+from nevow.context import RequestContext
+from nevow.static import File
+from nevow.compression import CompressingResourceWrapper, CompressedCache
+from nevow.compression import CompressingRequestWrapper
+
+if __name__ == '__main__':
+    from compression import main
+    raise SystemExit(main())
+
+
+
+class Compression(Options):
+    optParameters = [
+        ('iterations', 'i', '200', 'Number of requests for each case.'),
+        ('writes', 'w', '1000', 'Number of writes in the dynamic response.')]
+
+
+    def postOptions(self):
+        self['iterations'] = int(self['iterations'])
+        self['writes'] = int(self['writes'])
+
+
+
+class CountingRequest(testutil.FakeRequest):
+    """
+    A request which counts the writes made to it instead of keeping them.
+    """
+    writes = 0
+
+    def write(self, bytes):
+        self.writes += 1
+
+
+
+def request():
+    r = CountingRequest()
+    r.received_headers['accept-encoding'] = 'gzip'
+    return r
+
+
+
+def benchmark(iterations, writes):
+    """
+    Serve Athena's largest module through L{CompressingResourceWrapper}
+    C{iterations} times, compressing it on every request and keeping it
+    compressed, then compress a dynamic response made of C{writes} writes
+    C{iterations} times.
+
+    Prints the number of requests per second for each.
+    """
+    path = util.resource_filename('nevow', 'js/Nevow/Athena/__init__.js')
+    for (name, maxEntrySize) in [('compressed per request', 0),
+                                 ('kept compressed', 2 ** 20)]:
+        wrapped = CompressingResourceWrapper(File(path))
+        wrapped.cache = CompressedCache(maxEntrySize=maxEntrySize)
+        before = time()
+        for i in xrange(iterations):
+            wrapped.renderHTTP(RequestContext(tag=request()))
+        print 'Athena module, %s: %d requests per second' % (
+            name, iterations / (time() - before))
+
+    line = '<tr><td>A row of a table</td><td>%d</td></tr>\n'
+    before = time()
+    for i in xrange(iterations):
+        underlying = request()
+        wrapper = CompressingRequestWrapper(underlying)
+        for j in xrange(writes):
+            wrapper.write(line % (j,))
+        wrapper.finishRequest(True)
+    print 'dynamic response: %d requests per second, %d writes each' % (
+        iterations / (time() - before), underlying.writes)
+
+
+
+def main(args=None):
+    """
+    Benchmark nevow.compression on static and dynamic responses, maybe with
+    some parameters.
+    """
+    options = Compression()
+    options.parseOptions(args)
+    benchmark(options['iterations'], options['writes'])
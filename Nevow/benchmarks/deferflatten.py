@@ -0,0 +1,101 @@
+
+from time import time
+
+from twisted.python.usage import Options
+from twisted.internet.defer import Deferred, succeed
+
+from nevow._flat import deferflatten, BUFFER_SIZE
+from nevow.tags import table, tr, td, span, a
+
+if __name__ == '__main__':
+    from deferflatten import main
+    raise SystemExit(main())
+
+
+
+class Trees(Options):
+    optParameters = [
+        ('iterations', 'i', '10', 'Number of iterations for which to run the benchmark.'),
+        ('rows', 'r', '5000', 'Number of rows in the tables rendered.'),
+        ('buffer-sizes', 'b', '0,%d' % (BUFFER_SIZE,),
+         'Comma-separated buffer sizes to render with.')]
+
+
+    def postOptions(self):
+        self['iterations'] = int(self['iterations'])
+        self['rows'] = int(self['rows'])
+        self['buffer-sizes'] = map(int, self['buffer-sizes'].split(','))
+
+
+
+def tree(rows, makeCell):
+    """
+    Make a table of C{rows} rows, like a page listing the results of a search.
+    Its cells are made by calling C{makeCell} with their text, so that they may
+    be wrapped in L{Deferred}s.
+    """
+    return table[[
+            tr(id='row-%d' % (n,))[
+                td[a(href='/item/%d' % (n,))[makeCell(u'Item %d' % (n,))]],
+                td(_class='size')[makeCell(str(n * 1024))],
+                td[span(_class='tag')[makeCell('one')], ' & ',
+                   span(_class='tag')[makeCell('two')]]]
+            for n in xrange(rows)]]
+
+
+
+def render(root, bufferSize, pending):
+    """
+    Flatten C{root}, calling back each of C{pending} in turn once the
+    flattener is waiting on it.
+
+    @return: The number of times the writer was called.
+    """
+    writes = []
+    d = deferflatten(None, root, False, False, writes.append, bufferSize)
+    for deferred in pending:
+        deferred.callback(deferred.value)
+    if not d.called:
+        raise RuntimeError("Flattening did not finish.")
+    return len(writes)
+
+
+
+def benchmark(iterations, rows, bufferSizes):
+    """
+    Render tables of C{rows} rows C{iterations} times, without L{Deferred}s,
+    with L{Deferred}s which have results already and with L{Deferred}s which
+    are called back later, with each of C{bufferSizes}.
+
+    Prints the mean time per render and the number of writes for each.
+    """
+    def pendingCell(value):
+        deferred = Deferred()
+        deferred.value = value
+        pending.append(deferred)
+        return deferred
+
+    kinds = [('no Deferreds', lambda value: value),
+             ('fired Deferreds', succeed),
+             ('unfired Deferreds', pendingCell)]
+    for (name, makeCell) in kinds:
+        for bufferSize in bufferSizes:
+            elapsed = 0.0
+            for i in xrange(iterations):
+                pending = []
+                root = tree(rows, makeCell)
+                before = time()
+                writes = render(root, bufferSize, pending)
+                elapsed += time() - before
+            print '%s, buffer size %d: %f per render, %d writes' % (
+                name, bufferSize, elapsed / iterations, writes)
+
+
+
+def main(args=None):
+    """
+    Benchmark deferflatten on large stan trees, maybe with some parameters.
+    """
+    options = Trees()
+    options.parseOptions(args)
+    benchmark(options['iterations'], options['rows'], options['buffer-sizes'])
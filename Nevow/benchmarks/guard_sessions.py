@@ -0,0 +1,117 @@
+
+import gc, os, resource
+from time import time
+
+from twisted.python.usage import Options
+from twisted.internet import reactor
+
+from nevow.guard import SessionWrapper, GuardSession
+
+if __name__ == '__main__':
+    from guard_sessions import main
+    raise SystemExit(main())
+
+
+
+class Sessions(Options):
+    optParameters = [
+        ('sessions', 's', '100000', 'Number of sessions to make.')]
+
+
+    def postOptions(self):
+        self['sessions'] = int(self['sessions'])
+
+
+
+class CallLaterSession(GuardSession):
+    """
+    A session which schedules the check for its expiry with the reactor, as
+    every session did before L{SessionWrapper} had a timing wheel.
+    """
+    def checkExpired(self):
+        self.checkExpiredID = None
+        if time() - self.lastModified > self.lifetime / 2:
+            self.expire()
+        else:
+            self.checkExpiredID = reactor.callLater(
+                self.lifetime, self.checkExpired)
+
+
+
+def maxResident():
+    """
+    Return the largest resident set size of the process so far, in kilobytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+
+def measure(sessionFactory, sessions):
+    """
+    Make C{sessions} sessions with a L{SessionWrapper} using
+    C{sessionFactory}, touch each once, and expire them all.
+
+    @return: The seconds taken to make them, to touch them and to expire them,
+        and the kilobytes by which they grew the process.
+    """
+    wrapper = SessionWrapper(None)
+    wrapper.sessionFactory = sessionFactory
+    gc.collect()
+    resident = maxResident()
+    before = time()
+    for i in xrange(sessions):
+        key = '%032x' % (i,)
+        session = wrapper.sessions[key] = sessionFactory(wrapper, key)
+        session.setLifetime(wrapper.sessionLifetime)
+        session.checkExpired()
+    made = time()
+    for session in wrapper.sessions.itervalues():
+        session.touch()
+    touched = time()
+    grown = maxResident() - resident
+    for session in wrapper.sessions.values():
+        session.expire()
+    return made - before, touched - made, time() - touched, grown
+
+
+
+def benchmark(sessions):
+    """
+    Make, touch and expire C{sessions} sessions, each in a process of its own,
+    with their expiry checked by the timing wheel of their L{SessionWrapper}
+    and by a call scheduled with the reactor for each.
+
+    Prints the time taken and the memory used by each.
+    """
+    for (name, sessionFactory) in [('reactor.callLater', CallLaterSession),
+                                   ('timing wheel', GuardSession)]:
+        read, write = os.pipe()
+        pid = os.fork()
+        if not pid:
+            os.close(read)
+            os.write(write, repr(measure(sessionFactory, sessions)))
+            os._exit(0)
+        os.close(write)
+        result = ''
+        while True:
+            data = os.read(read, 1024)
+            if not data:
+                break
+            result += data
+        os.close(read)
+        os.waitpid(pid, 0)
+        made, touched, expired, grown = eval(result)
+        print ('%d sessions, %s: %.2f s to make, %.3f s to touch, '
+               '%.2f s to expire, %d KB (%d bytes each)') % (
+            sessions, name, made, touched, expired, grown,
+            grown * 1024 / sessions)
+
+
+
+def main(args=None):
+    """
+    Benchmark the expiry of nevow.guard sessions, maybe with some parameters.
+    """
+    options = Sessions()
+    options.parseOptions(args)
+    benchmark(options['sessions'])
@@ -0,0 +1,69 @@
+
+from time import time
+
+from twisted.python.usage import Options
+
+from nevow.json import serialize, parse
+
+if __name__ == '__main__':
+    from json_payloads import main
+    raise SystemExit(main())
+
+
+
+class Payloads(Options):
+    optParameters = [
+        ('iterations', 'i', '10', 'Number of iterations for which to run the benchmark.'),
+        ('sizes', 's', '10,100,1000,10000', 'Comma-separated numbers of rows in the payloads.')]
+
+
+    def postOptions(self):
+        self['iterations'] = int(self['iterations'])
+        self['sizes'] = map(int, self['sizes'].split(','))
+
+
+
+def row(n):
+    """
+    Make one row of a payload like the pages of results a scrolltable asks
+    for.
+    """
+    return {u'__id__': u'%x' % (n,),
+            u'name': u'Person %d "the %dth"' % (n, n),
+            u'email': u'person%d@example.com' % (n,),
+            u'sent': n * 1.5,
+            u'count': n,
+            u'read': n % 2 == 0,
+            u'tags': [u'one', u'two\n', None]}
+
+
+
+def benchmark(iterations, sizes):
+    """
+    Serialize and parse payloads of each of C{sizes} rows C{iterations} times.
+
+    Prints the mean time per call for each size, in each direction.
+    """
+    for size in sizes:
+        payload = [row(n) for n in xrange(size)]
+        before = time()
+        for i in xrange(iterations):
+            s = serialize(payload)
+        middle = time()
+        for i in xrange(iterations):
+            parse(s)
+        after = time()
+        print '%d rows (%d bytes): %f serialize, %f parse per call' % (
+            size, len(s), (middle - before) / iterations,
+            (after - middle) / iterations)
+
+
+
+def main(args=None):
+    """
+    Benchmark nevow.json serialization and parsing of payloads of growing
+    size, maybe with some parameters.
+    """
+    options = Payloads()
+    options.parseOptions(args)
+    benchmark(options['iterations'], options['sizes'])
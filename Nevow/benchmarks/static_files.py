@@ -0,0 +1,118 @@
+
+import os, tempfile
+from time import time
+
+from twisted.python.usage import Options
+
+from nevow import context, testutil
+from nevow.static import File
+
+if __name__ == '__main__':
+    from static_files import main
+    raise SystemExit(main())
+
+
+
+class Files(Options):
+    optParameters = [
+        ('iterations', 'i', '1000', 'Number of requests for the small file.'),
+        ('small', 's', '1024', 'Size of the small file in bytes.'),
+        ('large', 'l', '20000000', 'Size of the large file in bytes.')]
+
+
+    def postOptions(self):
+        for name in 'iterations', 'small', 'large':
+            self[name] = int(self[name])
+
+
+
+class CountingRequest(testutil.FakeRequest):
+    """
+    A request which counts the bytes written to it instead of keeping them.
+    """
+    written = 0
+
+    def write(self, bytes):
+        self.written += len(bytes)
+
+
+
+def serve(resource, **headers):
+    """
+    Render C{resource} for a request with C{headers}.
+
+    @return: The number of bytes in the response body.
+    """
+    request = CountingRequest()
+    request.received_headers.update(headers)
+    result = resource.renderHTTP(context.PageContext(
+            tag=resource, parent=context.RequestContext(tag=request)))
+    if isinstance(result, str):
+        request.write(result)
+    return request.written
+
+
+
+def makeFile(directory, size):
+    """
+    Make a file of C{size} bytes in C{directory} and return its path.
+    """
+    path = os.path.join(directory, 'file-%d' % (size,))
+    f = file(path, 'wb')
+    chunk = os.urandom(min(size, 2 ** 16))
+    while size > 0:
+        f.write(chunk[:size])
+        size -= len(chunk)
+    f.close()
+    return path
+
+
+
+def benchmark(iterations, small, large):
+    """
+    Serve a small file C{iterations} times, with and without the status of the
+    file being remembered and to requests which already have it, then serve a
+    large file.
+
+    Prints the number of requests per second for the small file and the
+    throughput for the large one.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        resource = File(makeFile(directory, small))
+        etag = resource.restat(resource.fp)
+        for (name, ttl, headers) in [
+            ('uncached status', 0, {}),
+            ('cached status', File.statCacheTTL, {}),
+            ('If-None-Match', File.statCacheTTL, {'if-none-match': etag})]:
+            resource.statCacheTTL = ttl
+            before = time()
+            for i in xrange(iterations):
+                serve(resource, **headers)
+            print '%d byte file, %s: %d requests per second' % (
+                small, name, iterations / (time() - before))
+
+        resource = File(makeFile(directory, large))
+        for (name, headers) in [
+            ('whole', {}),
+            ('4 ranges', {'range': 'bytes=0-999999,-1000000,'
+                          '2000000-2999999,5000000-5999999'})]:
+            before = time()
+            size = serve(resource, **headers)
+            print '%d byte file, %s: %f MB/s' % (
+                large, name, size / (time() - before) / 2 ** 20)
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+
+
+def main(args=None):
+    """
+    Benchmark serving small and large files with nevow.static.File, maybe with
+    some parameters.
+    """
+    options = Files()
+    options.parseOptions(args)
+    benchmark(options['iterations'], options['small'], options['large'])
@@ -32,6 +32,10 @@ from nevow.flat import flattenFactory
 from nevow.flat.ten import getFlattener
 from nevow.tags import raw
 
+# The number of bytes of output which deferflatten collects before passing
+# them to its writer.
+BUFFER_SIZE = 2 ** 14
+
 
 class FlattenerError(Exception):
     """
@@ -435,61 +439,87 @@ def flatten(request, root, inAttribute, inXML):
 
 
 
-def _flattensome(state, write, schedule, result):
+def _flattensome(state, write, result, bufferSize):
     """
     Take strings from an iterator and pass them to a writer function.
 
+    Strings are collected until there are at least C{bufferSize} bytes of them,
+    until C{state} produces a L{Deferred} which has no result yet, or until it
+    is exhausted, and are then joined and written at once.  A L{Deferred} which
+    has a result already is not waited on: iteration of C{state} carries on
+    immediately, without growing the call stack.
+
     @param state: An iterator of C{str} and L{Deferred}.  C{str} instances will
         be passed to C{write}.  L{Deferred} instances will be waited on before
         resuming iteration of C{state}.
 
-    @param write: A callable which will be invoked with each C{str}
-        produced by iterating C{state}.
-
-    @param schedule: A callable which will arrange for a function to be called
-        with some positional arguments I{later}.  This is used to avoid
-        unbounded call stack depth due to already-fired L{Deferred}s produced
-        by C{state}.
+    @param write: A callable which will be invoked with the C{str} produced by
+        iterating C{state}.
 
     @param result: A L{Deferred} which will be called back when C{state} has
         been completely flattened into C{write} or which will be errbacked if
         an unexpected exception occurs.
 
+    @param bufferSize: The number of bytes to collect before calling C{write}.
+
     @return: C{None}
     """
+    buffer = []
+    buffered = 0
     while True:
         try:
             element = state.next()
         except StopIteration:
-            result.callback(None)
+            element = None
         except:
+            if buffer:
+                write(''.join(buffer))
             result.errback()
-        else:
-            if type(element) is str:
-                write(element)
-                continue
+            return
+        if type(element) is str:
+            buffer.append(element)
+            buffered += len(element)
+            if buffered >= bufferSize:
+                write(''.join(buffer))
+                buffer = []
+                buffered = 0
+            continue
+        if element is None:
+            if buffer:
+                write(''.join(buffer))
+            result.callback(None)
+            return
+
+        # Find out whether the Deferred has a result already by seeing if the
+        # callbacks run before addCallbacks returns.  If they do, iteration
+        # carries on here; otherwise what has been collected so far is written
+        # and iteration resumes in a new call when the Deferred fires.
+        fired = []
+        def cbResume(original):
+            if fired:
+                _flattensome(state, write, result, bufferSize)
             else:
-                def cby(original):
-                    schedule(_flattensome, state, write, schedule, result)
-                    return original
-                element.addCallbacks(cby, result.errback)
-        break
-
-
-
-def _schedule(f, *a):
-    """
-    Scheduler for use with L{_flattensome} which uses L{IReactorTime.callLater}
-    to schedule calls.  This works around the fact that L{Deferred} can exceed
-    the stack limit in certain cases.
-    """
-    # XXX SUCKY
-    from twisted.internet import reactor
-    reactor.callLater(0, f, *a)
+                fired.append(True)
+            return original
+        def ebFailed(failure):
+            if fired:
+                result.errback(failure)
+            else:
+                fired.append(failure)
+        element.addCallbacks(cbResume, ebFailed)
+        if not fired or fired[0] is not True:
+            if buffer:
+                write(''.join(buffer))
+            if fired:
+                result.errback(fired[0])
+            else:
+                fired.append(None)
+            return
 
 
 
-def deferflatten(request, root, inAttribute, inXML, write):
+def deferflatten(request, root, inAttribute, inXML, write,
+                 bufferSize=BUFFER_SIZE):
     """
     Incrementally write out a string representation of C{root} using C{write}.
 
@@ -516,8 +546,16 @@ def deferflatten(request, root, inAttribute, inXML, write):
     @param inXML: A flag which, if set, indicates that the string should be
         quoted for use as an XML text node or as the value of an XML tag value.
 
-    @param write: A callable which will be invoked with each C{str}
-        produced by flattening C{root}.
+    @param write: A callable which will be invoked with the C{str} produced by
+        flattening C{root}.  Consecutive strings are joined and passed to it
+        together, as described for C{bufferSize}.
+
+    @type bufferSize: C{int}
+    @param bufferSize: The number of bytes of output to collect before passing
+        them to C{write}.  Whatever has been collected is also written whenever
+        a L{Deferred} without a result is encountered and when flattening is
+        finished.  C{0} passes each string to C{write} as soon as it is
+        produced.
 
     @return: A L{Deferred} which will be called back when C{root} has
         been completely flattened into C{write} or which will be errbacked if
@@ -525,5 +563,5 @@ def deferflatten(request, root, inAttribute, inXML, write):
     """
     result = Deferred()
     state = flatten(request, root, inAttribute, inXML)
-    _flattensome(state, write, _schedule, result)
+    _flattensome(state, write, result, bufferSize)
     return result
@@ -1,17 +1,26 @@
 # -*- test-case-name: nevow.test.test_gzip -*-
 """
 Implementation of on-the-fly content compression for HTTP resources.
+
+Static files are compressed once and the result kept, or a precompressed
+C{.gz} file next to them is served instead.
 """
-from gzip import GzipFile
+import zlib
 
 from zope.interface import implements
 
 from twisted.internet.defer import maybeDeferred, Deferred
 from twisted.internet.interfaces import IConsumer
+from twisted.web import http
 
 from nevow.inevow import IRequest, IResource
 from nevow.appserver import errorMarker
 from nevow.rend import NotFound
+from nevow.static import File, getTypeAndEncoding, setValidators
+
+# The window size which makes zlib write a gzip header and trailer around the
+# compressed data.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
 
 
 
@@ -79,6 +88,68 @@ class _ProxyDescriptor(object):
 
 
 
+def compress(data, compressLevel):
+    """
+    Compress C{data} into the gzip format.
+
+    @type data: C{str}
+    @type compressLevel: C{int}
+    @rtype: C{str}
+    """
+    compressor = zlib.compressobj(compressLevel, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+
+class CompressedCache(object):
+    """
+    A store for the compressed content of resources, bounded by the number of
+    bytes it holds.  When another entry would take it over that number, it is
+    emptied.
+
+    @ivar maxSize: The greatest number of bytes held.
+    @type maxSize: C{int}
+    @ivar maxEntrySize: The greatest number of bytes of uncompressed content
+        which is worth compressing and keeping.
+    @type maxEntrySize: C{int}
+    @ivar size: The number of bytes held.
+    @type size: C{int}
+    """
+    def __init__(self, maxSize=2 ** 23, maxEntrySize=2 ** 20):
+        self.maxSize = maxSize
+        self.maxEntrySize = maxEntrySize
+        self.size = 0
+        self._entries = {}
+
+
+    def get(self, key):
+        """
+        Return the content kept for C{key}, or C{None} if there is none.
+        """
+        return self._entries.get(key)
+
+
+    def put(self, key, data):
+        """
+        Keep C{data} for C{key}, unless it is larger than the whole cache.
+        """
+        if len(data) > self.maxSize:
+            return
+        if self.size + len(data) > self.maxSize:
+            self.clear()
+        self._entries[key] = data
+        self.size += len(data)
+
+
+    def clear(self):
+        """
+        Forget everything kept.
+        """
+        self._entries.clear()
+        self.size = 0
+
+
+
 def _makeBase():
     """
     Make a base class with proxies for attributes on the underlying request.
@@ -109,7 +180,7 @@ class CompressingRequestWrapper(_makeBase()):
     def __init__(self, underlying):
         self.underlying = underlying
         self.setHeader('content-encoding', self.encoding)
-        self._gzipFile = None
+        self._compressor = None
 
         # See setHeader docstring for more commentary.
         self.underlying.headers.pop('content-length', None)
@@ -117,7 +188,7 @@ class CompressingRequestWrapper(_makeBase()):
 
     def setHeader(self, name, value):
         """
-        Discard the Content-Length header.
+        Discard the Content-Length header, and weaken the ETag header.
 
         When compression encoding is in use, the Content-Length header must
         indicate the length of the compressed content; since we are doing the
@@ -125,29 +196,38 @@ class CompressingRequestWrapper(_makeBase()):
         compression, so we discard this header. If this is an HTTP/1.1 request,
         chunked transfer encoding should be used, softening the impact of
         losing this header.
+
+        Compressed content is not the same, byte for byte, as the content an
+        entity tag was made for, so strong entity tags are made weak.
         """
-        if name.lower() == 'content-length':
+        lowered = name.lower()
+        if lowered == 'content-length':
             return
-        else:
-            return self.underlying.setHeader(name, value)
+        if lowered == 'etag' and value.startswith('"'):
+            value = 'W/' + value
+        return self.underlying.setHeader(name, value)
 
 
     def write(self, data):
         """
-        Pass data through to the gzip layer.
+        Pass data through to the compressor, writing out whatever compressed
+        data it has ready.
         """
-        if self._gzipFile is None:
-            self._gzipFile = GzipFile(fileobj=self.underlying, mode='wb', compresslevel=self.compressLevel)
-        self._gzipFile.write(data)
+        if self._compressor is None:
+            self._compressor = zlib.compressobj(
+                self.compressLevel, zlib.DEFLATED, GZIP_WBITS)
+        data = self._compressor.compress(data)
+        if data:
+            self.underlying.write(data)
 
 
     def finishRequest(self, success):
         """
         Finish off gzip stream.
         """
-        if self._gzipFile is None:
+        if self._compressor is None:
             self.write('')
-        self._gzipFile.close()
+        self.underlying.write(self._compressor.flush())
         self.underlying.finishRequest(success)
 
 
@@ -156,11 +236,26 @@ class CompressingResourceWrapper(object):
     """
     A resource wrapper with support for transport encoding compression.
 
+    When the underlying resource is a L{File}, a file next to it with the same
+    name and C{.gz} appended is served in its place if it is at least as new.
+    Otherwise, the compressed content of files which are small enough is kept
+    in L{cache}, keyed by their path and entity tag, and served with a
+    Content-Length.  Any other response is compressed as it is written.
+
     @ivar underlying: the resource being wrapped.
     @type underlying: L{IResource}
+    @ivar cache: the compressed content of files, shared by all wrappers.
+    @type cache: L{CompressedCache}
+    @ivar cacheCompressLevel: the level of gzip compression to apply to the
+        content kept in C{cache}, which is compressed only once.
+    @type cacheCompressLevel: C{int}
     """
     implements(IResource)
 
+    encoding = 'gzip'
+    cache = CompressedCache()
+    cacheCompressLevel = 9
+
     def __init__(self, underlying):
         self.underlying = underlying
 
@@ -185,6 +280,12 @@ class CompressingResourceWrapper(object):
         if not self.canCompress(req):
             return self.underlying.renderHTTP(ctx)
 
+        req.setHeader('vary', 'accept-encoding')
+        if isinstance(self.underlying, File):
+            result = self._renderFile(ctx, req, self.underlying)
+            if result is not None:
+                return result
+
         req = CompressingRequestWrapper(req)
         ctx.remember(req, IRequest)
 
@@ -198,6 +299,58 @@ class CompressingResourceWrapper(object):
         return maybeDeferred(self.underlying.renderHTTP, ctx).addCallback(_cbDoneRendering)
 
 
+    def _renderFile(self, ctx, req, resource):
+        """
+        Render the compressed content of the file served by C{resource}, from
+        a precompressed file or from L{cache}.
+
+        @return: The result of rendering, or C{None} if the content must be
+            compressed as it is rendered instead.
+        """
+        etag = resource.restat(resource.fp)
+        if etag is None or not resource.fp.isfile():
+            return None
+        type, encoding = getTypeAndEncoding(resource.fp.basename(),
+                                            resource.contentTypes,
+                                            resource.contentEncodings,
+                                            resource.defaultType)
+        if encoding is not None:
+            return None
+        mtime = resource.fp.getmtime()
+
+        sibling = resource.fp.siblingExtension('.gz')
+        if (resource.restat(sibling) is not None and sibling.isfile()
+            and sibling.getmtime() >= mtime):
+            precompressed = resource.createSimilarFile(sibling.path)
+            precompressed.type = type
+            precompressed.encoding = self.encoding
+            return precompressed.renderHTTP(ctx)
+
+        if resource.getFileSize() > self.cache.maxEntrySize:
+            return None
+        key = (resource.fp.path, etag)
+        data = self.cache.get(key)
+        if data is None:
+            f = resource.openForReading()
+            try:
+                data = compress(f.read(), self.cacheCompressLevel)
+            finally:
+                f.close()
+            self.cache.put(key, data)
+
+        if type:
+            req.setHeader('content-type', type)
+        req.setHeader('content-encoding', self.encoding)
+        # The compressed content is a different entity from the file, so it
+        # needs a tag of its own.
+        if setValidators(req, etag[:-1] + '-gz"', mtime) is http.CACHED:
+            return ''
+        req.setHeader('content-length', str(len(data)))
+        if req.method == 'HEAD':
+            return ''
+        return data
+
+
     def locateChild(self, ctx, segments):
         """
         Retrieve wrapped child resources via the underlying resource.
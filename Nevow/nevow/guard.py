@@ -10,6 +10,7 @@ L{SessionWrapper}.
 
 __metaclass__ = type
 
+import math
 import random
 import time
 try:
@@ -17,13 +18,20 @@ try:
 except ImportError:
     from md5 import md5
 import StringIO
+try:
+    import sqlite3
+except ImportError:
+    try:
+        from pysqlite2 import dbapi2 as sqlite3
+    except ImportError:
+        sqlite3 = None
 
 from zope.interface import implements
 
 # Twisted Imports
 
 from twisted.python import log, components
-from twisted.internet import defer
+from twisted.internet import defer, error
 from twisted.cred.error import UnauthorizedLogin
 from twisted.cred.credentials import UsernamePassword, Anonymous
 
@@ -40,6 +48,163 @@ def _sessionCookie():
     return md5("%s_%s" % (str(random.random()) , str(time.time()))).hexdigest()
 
 
+
+class _WheelCall(object):
+    """
+    A call scheduled with a L{TimingWheel}, which can be cancelled like a
+    L{DelayedCall<twisted.internet.base.DelayedCall>}.
+
+    @ivar wheel: The L{TimingWheel} the call is scheduled with, or C{None}
+        once it has been made or cancelled.
+    @ivar due: The tick of C{wheel} the call is due on.
+    """
+    __slots__ = ('wheel', 'due', 'f', 'args')
+
+    def __init__(self, wheel, due, f, args):
+        self.wheel = wheel
+        self.due = due
+        self.f = f
+        self.args = args
+
+
+    def active(self):
+        """
+        Determine whether the call has been neither made nor cancelled.
+        """
+        return self.wheel is not None
+
+
+    def cancel(self):
+        """
+        Unschedule the call.
+
+        @raise AlreadyCalled: If the call has been made.
+        @raise AlreadyCancelled: If the call has been cancelled.
+        """
+        if self.wheel is None:
+            if self.f is None:
+                raise error.AlreadyCancelled()
+            raise error.AlreadyCalled()
+        self.wheel._remove(self)
+        self.wheel = self.f = self.args = None
+
+
+
+class TimingWheel(object):
+    """
+    A hashed timing wheel: a fixed number of slots, each holding the calls due
+    on the ticks which are the same modulo that number.  A single timed call
+    advances the wheel by one slot each tick, making every call in the slot
+    which is due.
+
+    Scheduling and cancelling a call take constant time, and only one call is
+    scheduled with the reactor, and only while calls are scheduled with the
+    wheel, however many there are.  Calls are made up to C{tick} seconds late.
+
+    @ivar tick: The number of seconds between advances of the wheel.
+    @ivar now: The number of ticks the wheel has advanced.
+    @ivar count: The number of calls scheduled.
+    @ivar clock: The L{IReactorTime} provider the wheel is advanced by.  If
+        C{None}, the global reactor is used.
+    """
+    def __init__(self, tick=1.0, size=1024, clock=None):
+        self.tick = tick
+        self.clock = clock
+        self.now = 0
+        self.count = 0
+        self._slots = [set() for i in xrange(size)]
+        self._advanceCall = None
+        self._lastAdvance = None
+
+
+    def __getstate__(self):
+        # Scheduled calls do not survive pickling; sessions are rescheduled
+        # when they and their SessionWrapper have been unpickled.
+        return {'tick': self.tick, 'size': len(self._slots)}
+
+
+    def __setstate__(self, state):
+        self.__init__(state['tick'], state['size'])
+
+
+    def _getClock(self):
+        if self.clock is None:
+            # Import reactor here to avoid installing default at startup
+            from twisted.internet import reactor
+            self.clock = reactor
+        return self.clock
+
+
+    def seconds(self):
+        """
+        Return the current time according to the wheel's clock.
+        """
+        return self._getClock().seconds()
+
+
+    def callLater(self, delay, f, *args):
+        """
+        Call C{f} with C{args} on the first tick at least C{delay} seconds from
+        now.
+
+        @return: A L{_WheelCall}, with which the call can be cancelled.
+        """
+        clock = self._getClock()
+        now = clock.seconds()
+        if self._advanceCall is None:
+            self._lastAdvance = now
+            self._advanceCall = clock.callLater(self.tick, self._advance)
+        ticks = int(math.ceil((now - self._lastAdvance + delay) / self.tick))
+        call = _WheelCall(self, self.now + max(ticks, 1), f, args)
+        self._slots[call.due % len(self._slots)].add(call)
+        self.count += 1
+        return call
+
+
+    def _remove(self, call):
+        """
+        Take a cancelled call out of its slot, and stop advancing the wheel if
+        no others are left.
+        """
+        self._slots[call.due % len(self._slots)].discard(call)
+        self.count -= 1
+        if not self.count and self._advanceCall is not None:
+            self._advanceCall.cancel()
+            self._advanceCall = None
+
+
+    def _advance(self):
+        """
+        Advance the wheel by as many ticks as have passed, making all the calls
+        which have come due, then schedule the next advance if any calls are
+        left.
+        """
+        clock = self._getClock()
+        self._advanceCall = None
+        ticks = max(int((clock.seconds() - self._lastAdvance) / self.tick), 1)
+        self._lastAdvance += ticks * self.tick
+        end = self.now + ticks
+        size = len(self._slots)
+        ready = []
+        for tick in xrange(max(self.now + 1, end - size + 1), end + 1):
+            slot = self._slots[tick % size]
+            due = [call for call in slot if call.due <= end]
+            slot.difference_update(due)
+            ready.extend(due)
+        self.now = end
+        self.count -= len(ready)
+        for call in ready:
+            call.wheel = None
+            try:
+                call.f(*call.args)
+            except:
+                log.err()
+        if self.count and self._advanceCall is None:
+            self._advanceCall = clock.callLater(
+                max(self._lastAdvance + self.tick - clock.seconds(), 0),
+                self._advance)
+
+
 class GuardSession(components.Componentized):
     """A user's session with a system.
 
@@ -131,8 +296,9 @@ class GuardSession(components.Componentized):
 
         This is highly imprecise, but it allows you to set some general
         parameters about when this session will expire.  A callback will be
-        scheduled each 'lifetime' seconds, and if I have not been 'touch()'ed
-        in half a lifetime, I will be immediately expired.
+        scheduled each 'lifetime' seconds with the L{TimingWheel} of the
+        guard, and if I have not been 'touch()'ed in half a lifetime, I will
+        be immediately expired.
         """
         self.lifetime = lifetime
 
@@ -165,8 +331,6 @@ class GuardSession(components.Componentized):
         self.lastModified = time.time()
 
     def checkExpired(self):
-        # Import reactor here to avoid installing default at startup
-        from twisted.internet import reactor
         self.checkExpiredID = None
         # If I haven't been touched in 15 minutes:
         if time.time() - self.lastModified > self.lifetime / 2:
@@ -176,8 +340,8 @@ class GuardSession(components.Componentized):
                 log.msg("no session to expire: %s" % str(self.uid))
         else:
             log.msg("session given the will to live for %s more seconds" % self.lifetime)
-            self.checkExpiredID = reactor.callLater(self.lifetime,
-                                                    self.checkExpired)
+            self.checkExpiredID = self.guard.expiryWheel.callLater(
+                self.lifetime, self.checkExpired)
     def __getstate__(self):
         d = self.__dict__.copy()
         if d.has_key('checkExpiredID'):
@@ -186,8 +350,168 @@ class GuardSession(components.Componentized):
 
     def __setstate__(self, d):
         self.__dict__.update(d)
+        self.checkExpiredID = None
         self.touch()
-        self.checkExpired()
+        # The guard may not have been unpickled yet, in which case it
+        # schedules the check once it has been.
+        if 'expiryWheel' in self.guard.__dict__:
+            self.checkExpired()
+
+
+class MemorySessionStore(dict):
+    """
+    The store of the sessions of a L{SessionWrapper}, mapping their keys to
+    them, kept in memory.
+
+    A session store may be any object which supports C{in}, C{has_key},
+    item access, assignment and deletion, and C{values}, as a C{dict} does.
+    The wrapper expires the sessions itself, with its L{TimingWheel}.
+
+    @ivar wrapper: The L{SessionWrapper} whose sessions are stored.
+    """
+    def __init__(self, wrapper):
+        dict.__init__(self)
+        self.wrapper = wrapper
+
+
+
+class SQLiteSessionStore(MemorySessionStore):
+    """
+    A store of sessions which also records the keys of sessions, and when they
+    were last used, in an SQLite database.  Any number of processes may share
+    the database: when a request presents the key of a session which is not in
+    memory, but which the database shows was used recently enough, a new
+    session is made for it, so a session survives a restart and follows the
+    user from one process to another.
+
+    Only the keys are shared.  Whatever is remembered on a session, including
+    the avatars logged in with it, stays in the memory of the process which
+    remembered it.
+
+    Uses of sessions are written to the database together, at most once every
+    C{flushInterval} seconds, rather than on every request.
+
+    @ivar connection: The connection to the database.
+    @ivar flushInterval: The number of seconds uses of sessions may go
+        unwritten.
+    """
+    flushInterval = 60
+
+    def __init__(self, wrapper, path):
+        """
+        @param path: The name of the file the database is kept in.
+        """
+        MemorySessionStore.__init__(self, wrapper)
+        if sqlite3 is None:
+            raise RuntimeError("SQLiteSessionStore requires sqlite3")
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS nevow_sessions '
+            '(sessionKey TEXT PRIMARY KEY, lastUsed REAL NOT NULL)')
+        self.connection.commit()
+        self._used = {}
+        self._flushCall = None
+
+
+    def _restore(self, key):
+        """
+        Make a new session for C{key} if the database shows it was used less
+        than the wrapper's C{sessionLifetime} ago.
+
+        @raise KeyError: If it was not.
+        """
+        if not isinstance(key, str):
+            raise KeyError(key)
+        row = self.connection.execute(
+            'SELECT lastUsed FROM nevow_sessions WHERE sessionKey = ?',
+            (key.decode('latin-1'),)).fetchone()
+        if row is None or time.time() - row[0] > self.wrapper.sessionLifetime:
+            raise KeyError(key)
+        session = self.wrapper.sessionFactory(self.wrapper, key)
+        session.setLifetime(self.wrapper.sessionLifetime)
+        dict.__setitem__(self, key, session)
+        session.checkExpired()
+        return session
+
+
+    def __contains__(self, key):
+        if dict.__contains__(self, key):
+            return True
+        try:
+            self._restore(key)
+        except KeyError:
+            return False
+        return True
+
+    has_key = __contains__
+
+
+    def __getitem__(self, key):
+        try:
+            session = dict.__getitem__(self, key)
+        except KeyError:
+            session = self._restore(key)
+        self._used[key] = time.time()
+        if self._flushCall is None:
+            self._flushCall = self.wrapper.expiryWheel.callLater(
+                self.flushInterval, self.flush)
+        return session
+
+
+    def __setitem__(self, key, session):
+        dict.__setitem__(self, key, session)
+        self.connection.execute(
+            'INSERT OR REPLACE INTO nevow_sessions VALUES (?, ?)',
+            (key.decode('latin-1'), time.time()))
+        self.connection.commit()
+
+
+    def __delitem__(self, key):
+        """
+        Forget the session for C{key} and take it out of the database.  Another
+        process still using the session puts it back when it next flushes.
+        """
+        dict.__delitem__(self, key)
+        self._used.pop(key, None)
+        self.connection.execute(
+            'DELETE FROM nevow_sessions WHERE sessionKey = ?',
+            (key.decode('latin-1'),))
+        self.connection.commit()
+
+
+    def flush(self):
+        """
+        Write the uses of sessions since the last flush to the database,
+        putting back any which another process has taken out, and take out of
+        it the sessions which no process has used for longer than the
+        wrapper's C{sessionLifetime}.
+        """
+        if self._flushCall is not None:
+            if self._flushCall.active():
+                self._flushCall.cancel()
+            self._flushCall = None
+        used, self._used = self._used, {}
+        rows = [(key.decode('latin-1'), when)
+                for (key, when) in used.iteritems()]
+        self.connection.executemany(
+            'UPDATE nevow_sessions SET lastUsed = ? '
+            'WHERE sessionKey = ? AND lastUsed < ?',
+            [(when, key, when) for (key, when) in rows])
+        self.connection.executemany(
+            'INSERT OR IGNORE INTO nevow_sessions VALUES (?, ?)', rows)
+        self.connection.execute(
+            'DELETE FROM nevow_sessions WHERE lastUsed < ?',
+            (time.time() - self.wrapper.sessionLifetime,))
+        self.connection.commit()
+
+
+    def close(self):
+        """
+        Write any uses of sessions not yet written, and close the database.
+        """
+        self.flush()
+        self.connection.close()
+
 
 
 def urlToChild(ctx, *ar, **kw):
@@ -240,11 +564,21 @@ class SessionWrapper:
         saved to disk, and thus last only as long as the session does.  If
         the browser is closed before the session timeout, both the session
         and the cookie go away.
+
+    @ivar sessionStoreFactory: A callable which is passed the wrapper and
+        returns the store its sessions are kept in, such as
+        L{MemorySessionStore} (the default) or L{SQLiteSessionStore}.
+
+    @ivar sessions: The store of sessions made by C{sessionStoreFactory}.
+
+    @ivar expiryWheel: The L{TimingWheel} which sessions schedule the checks
+        for their expiry with.
     """
     implements(inevow.IResource)
 
     sessionLifetime = 3600
     sessionFactory = GuardSession
+    sessionStoreFactory = MemorySessionStore
 
     # The interface to cred for when logging into the portal
     credInterface = inevow.IResource
@@ -258,7 +592,8 @@ class SessionWrapper:
         if cookieKey is None:
             cookieKey = "woven_session_" + _sessionCookie()
         self.cookieKey = cookieKey
-        self.sessions = {}
+        self.expiryWheel = TimingWheel()
+        self.sessions = self.sessionStoreFactory(self)
         if mindFactory is None:
             mindFactory = nomind
         self.mindFactory = mindFactory
@@ -269,6 +604,16 @@ class SessionWrapper:
         # Backwards compatibility; remove asap
         self.resource = self
 
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        if 'expiryWheel' not in d:
+            # Pickled before sessions were expired with a wheel.
+            self.expiryWheel = TimingWheel()
+        # Schedule the checks of the sessions which were unpickled first.
+        for session in self.sessions.values():
+            if getattr(session, 'checkExpiredID', False) is None:
+                session.checkExpired()
+
     def renderHTTP(self, ctx):
         request = inevow.IRequest(ctx)
         d = defer.maybeDeferred(self._delegate, ctx, [])
@@ -104,45 +104,83 @@ actions = [
     (floatNumber, lambda s: (float(s), s)),
     (longNumber, lambda s: (jsonlong(s), s)),
 ]
+# All of the expressions in actions, as alternatives of one expression, so that
+# each token is found with a single match at its position in the input.  Where
+# more than one alternative could match, the first is the one which comes
+# first in actions.
+_token = re.compile(
+    r'(?P<whitespace>[\r\n\t\ ]+|/\*.*?\*/|//[^\n]*[\n])'
+    r'|(?P<punctuation>[{}\[\]:,])'
+    r'|(?P<string>"[^"\\]*(?:\\.[^"\\]*)*")'
+    r'|(?P<constant>true|false|null)'
+    r'|(?P<identifier>[A-Za-z_][A-Za-z_0-9]*)'
+    r'|(?P<float>-?(?:[1-9][0-9]*|0)\.[0-9]+(?:[eE][-+]?[0-9]+)?)'
+    r'|(?P<long>-?(?:[1-9][0-9]*|0)(?:[eE][-+]?[0-9]+)?)',
+    re.DOTALL)
+
+_constants = {'true': True, 'false': False, 'null': None}
+
 def tokenise(s):
+    """
+    Split a JSON-encoded string into tokens, in a single pass over it.
+
+    @return: a C{list} of tokens, which are the punctuation characters,
+        L{StringToken}s, L{IdentifierToken}s, C{True}, C{False}, C{None} and
+        numbers.
+    """
     tokens = []
-    while s:
-        for regexp, action in actions:
-            m = regexp.match(s)
-            if m:
-                tok, tokstr = action(m.group(0))
-                break
+    append = tokens.append
+    match = _token.match
+    pos = 0
+    end = len(s)
+    while pos < end:
+        m = match(s, pos)
+        if m is None:
+            raise ValueError, "Invalid Input, %r" % (s[pos:pos + 10],)
+        kind = m.lastgroup
+        pos = m.end()
+        if kind == 'punctuation':
+            append(m.group())
+        elif kind == 'string':
+            append(StringToken(m.group()))
+        elif kind == 'whitespace':
+            pass
+        elif kind == 'long':
+            append(jsonlong(m.group()))
+        elif kind == 'constant':
+            append(_constants[m.group()])
+        elif kind == 'float':
+            append(float(m.group()))
         else:
-            raise ValueError, "Invalid Input, %r" % (s[:10],)
-
-        if tok is not WhitespaceToken:
-            tokens.append(tok)
-        s = s[len(tokstr):]
-
+            append(IdentifierToken(m.group()))
     return tokens
 
+# The parsing functions below take a list of the tokens still to be parsed in
+# reverse order, so that each token can be taken from the end of the list.
+
 def accept(want, tokens):
-    t = tokens.pop(0)
+    t = tokens.pop()
     if want != t:
         raise ParseError, "Unexpected %r, %s expected" % (t , want)
 
 def parseValue(tokens):
-    if tokens[0] == '{':
+    token = tokens[-1]
+    if token == '{':
         return parseObject(tokens)
 
-    if tokens[0] == '[':
+    if token == '[':
         return parseList(tokens)
 
-    if tokens[0] in (True, False, None):
-        return tokens.pop(0), tokens
+    if token in (True, False, None):
+        return tokens.pop(), tokens
 
-    if type(tokens[0]) == StringToken:
+    if type(token) == StringToken:
         return parseString(tokens)
 
-    if type(tokens[0]) in (int, float, long):
-        return tokens.pop(0), tokens
+    if type(token) in (int, float, long):
+        return tokens.pop(), tokens
 
-    raise ParseError, "Unexpected %r" % tokens[0]
+    raise ParseError, "Unexpected %r" % token
 
 
 _stringExpr = re.compile(
@@ -174,23 +212,25 @@ def _stringSub(m):
 
 
 def parseString(tokens):
-    if type(tokens[0]) is not StringToken:
-        raise ParseError, "Unexpected %r" % tokens[0]
-    s = _stringExpr.sub(_stringSub, tokens.pop(0)[1:-1].decode('utf-8'))
+    if type(tokens[-1]) is not StringToken:
+        raise ParseError, "Unexpected %r" % tokens[-1]
+    s = tokens.pop()[1:-1].decode('utf-8')
+    if '\\' in s:
+        s = _stringExpr.sub(_stringSub, s)
     return s, tokens
 
 
 def parseIdentifier(tokens):
-    if type(tokens[0]) is not IdentifierToken:
-        raise ParseError("Unexpected %r" % (tokens[0],))
-    return tokens.pop(0), tokens
+    if type(tokens[-1]) is not IdentifierToken:
+        raise ParseError("Unexpected %r" % (tokens[-1],))
+    return tokens.pop(), tokens
 
 
 def parseList(tokens):
     l = []
-    tokens.pop(0)
+    tokens.pop()
     first = True
-    while tokens[0] != ']':
+    while tokens[-1] != ']':
         if not first:
             accept(',', tokens)
         first = False
@@ -204,9 +244,9 @@ def parseList(tokens):
 
 def parseObject(tokens):
     o = {}
-    tokens.pop(0)
+    tokens.pop()
     first = True
-    while tokens[0] != '}':
+    while tokens[-1] != '}':
         if not first:
             accept(',', tokens)
         first = False
@@ -225,9 +265,10 @@ def parse(s):
     Return the object represented by the JSON-encoded string C{s}.
     """
     tokens = tokenise(s)
+    tokens.reverse()
     value, tokens = parseValue(tokens)
     if tokens:
-        raise ParseError, "Unexpected %r" % tokens[0]
+        raise ParseError, "Unexpected %r" % tokens[-1]
     return value
 
 class CycleError(Exception):
@@ -245,11 +286,65 @@ _translation.update({
     ord(u'\r'): ur'\r',
     })
 
+# The characters which stringEncode replaces.
+_escaped = re.compile(u'[\x00-\x1f\\\\"]')
+
+def _escape(m):
+    return _translation[ord(m.group())]
+
 def stringEncode(s):
-    return s.translate(_translation).encode('utf-8')
+    if _escaped.search(s) is not None:
+        s = _escaped.sub(_escape, s)
+    return s.encode('utf-8')
+
+
+def _serializeSequence(obj, w, seen):
+    w('[')
+    first = True
+    for e in obj:
+        if first:
+            first = False
+        else:
+            w(',')
+        _serialize(e, w, seen)
+    w(']')
+
+
+def _serializeDict(obj, w, seen):
+    w('{')
+    first = True
+    for (k, v) in obj.iteritems():
+        if first:
+            first = False
+        else:
+            w(',')
+        _serialize(k, w, seen)
+        w(':')
+        _serialize(v, w, seen)
+    w('}')
+
+
+# Functions which serialize objects of the most common types.  Instances of
+# other types, including subclasses of these, are handled by _serialize.
+_serializers = {
+    bool: lambda obj, w, seen: w(obj and 'true' or 'false'),
+    int: lambda obj, w, seen: w(str(obj)),
+    long: lambda obj, w, seen: w(str(obj)),
+    float: lambda obj, w, seen: w(str(obj)),
+    unicode: lambda obj, w, seen: w('"' + stringEncode(obj) + '"'),
+    types.NoneType: lambda obj, w, seen: w('null'),
+    list: _serializeSequence,
+    tuple: _serializeSequence,
+    dict: _serializeDict,
+    }
 
 
 def _serialize(obj, w, seen):
+    serializer = _serializers.get(type(obj))
+    if serializer is not None:
+        serializer(obj, w, seen)
+        return
+
     from nevow import athena
 
     if isinstance(obj, types.BooleanType):
@@ -268,21 +363,9 @@ def _serialize(obj, w, seen):
     elif id(obj) in seen:
         raise CycleError(type(obj))
     elif isinstance(obj, (tuple, list)):
-        w('[')
-        for n, e in enumerate(obj):
-            _serialize(e, w, seen)
-            if n != len(obj) - 1:
-                w(',')
-        w(']')
+        _serializeSequence(obj, w, seen)
     elif isinstance(obj, dict):
-        w('{')
-        for n, (k, v) in enumerate(obj.iteritems()):
-            _serialize(k, w, seen)
-            w(':')
-            _serialize(v, w, seen)
-            if n != len(obj) - 1:
-                w(',')
-        w('}')
+        _serializeDict(obj, w, seen)
     elif isinstance(obj, (athena.LiveFragment, athena.LiveElement)):
         _serialize(obj._structured(), w, seen)
     elif isinstance(obj, (rend.Fragment, page.Element)):
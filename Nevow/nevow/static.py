@@ -8,7 +8,6 @@
 # System Imports
 import os, string, time
 import cStringIO
-import traceback
 import warnings
 StringIO = cStringIO
 del cStringIO
@@ -35,6 +34,16 @@ from nevow import appserver, dirlist, inevow, rend
 
 dangerousPathError = NoResource("Invalid request URL.")
 
+# The greatest number of paths whose status File remembers.  The memo is
+# emptied whenever it reaches this size.
+STAT_CACHE_SIZE = 1000
+
+# The greatest number of ranges a request may ask for at once.  A request for
+# more is answered with the whole file instead.
+MAX_RANGES = 100
+
+_statCache = {}
+
 def isDangerous(path):
     return path == '..' or '/' in path or os.sep in path
 
@@ -141,6 +150,138 @@ def loadMimeTypes(mimetype_locations=['/etc/mime.types']):
             
     return contentTypes
 
+def parseRange(header, size):
+    """
+    Find the ranges of bytes of an entity asked for by the value of the Range
+    header of a request.
+
+    @type header: C{str}
+    @param header: The value of the header, for example C{"bytes=0-99,-20"}.
+
+    @type size: C{int}
+    @param size: The number of bytes in the entity.
+
+    @return: C{None} if the header is not understood or asks for more than
+        L{MAX_RANGES} ranges, in which case it should be ignored.  Otherwise, a
+        C{list} of C{(start, end)} tuples giving the offsets of the first and
+        last bytes of each range which can be satisfied, in the order they
+        were asked for.  The list is empty if none of them can be.
+    """
+    bytesrange = header.split('=', 1)
+    if len(bytesrange) != 2 or bytesrange[0].strip().lower() != 'bytes':
+        return None
+    specs = [spec.strip() for spec in bytesrange[1].split(',')]
+    specs = [spec for spec in specs if spec]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        bounds = spec.split('-', 1)
+        if len(bounds) != 2:
+            return None
+        start, end = bounds[0].strip(), bounds[1].strip()
+        try:
+            if start:
+                start = int(start)
+                if end:
+                    end = int(end)
+                else:
+                    end = max(start, size - 1)
+            else:
+                suffix = int(end)
+                start = max(size - suffix, 0)
+                end = size - 1
+                if suffix == 0:
+                    continue
+        except ValueError:
+            return None
+        if start < 0 or end < start:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    return ranges
+
+
+
+def entityTag(statinfo):
+    """
+    Make a strong entity tag for the contents of a file from the result of
+    C{stat}ing it.  It changes whenever the file is replaced or modified.
+
+    @rtype: C{str}
+    """
+    return '"%x-%x-%x"' % (statinfo.st_ino, statinfo.st_size,
+                           long(statinfo.st_mtime * 1000000))
+
+
+
+def _matchesTag(etag, header):
+    """
+    Determine whether C{etag} is one of the entity tags listed in the value of
+    an If-None-Match header, or the header is C{*}.
+    """
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*' or tag == etag or tag == 'W/' + etag:
+            return True
+    return False
+
+
+
+def setValidators(request, etag, mtime):
+    """
+    Set the ETag and Last-Modified headers of the response to C{request}, and
+    answer its If-None-Match header, or its If-Modified-Since header if it has
+    none.
+
+    @return: L{http.CACHED} if the response has been given a status which
+        means it has no body, otherwise C{None}.
+    """
+    request.setHeader('etag', etag)
+    ifNoneMatch = request.getHeader('if-none-match')
+    if ifNoneMatch is None:
+        return request.setLastModified(mtime)
+    # If-None-Match takes the place of If-Modified-Since.
+    request.setLastModified(mtime)
+    if _matchesTag(etag, ifNoneMatch):
+        if request.method in ('GET', 'HEAD'):
+            request.setResponseCode(http.NOT_MODIFIED)
+        else:
+            request.setResponseCode(http.PRECONDITION_FAILED)
+        return http.CACHED
+    request.setResponseCode(http.OK)
+    return None
+
+
+
+def _readParts(source, parts, chunkSize):
+    """
+    Generate the bytes of a response made of C{parts} in strings of at most
+    C{chunkSize} bytes, or as they are for strings in C{parts}.
+
+    @param source: A file to read from.
+
+    @param parts: A C{list} whose elements are C{str}, to be included as they
+        are, or C{(offset, length)} tuples giving bytes to read from
+        C{source}.
+
+    @raise EOFError: If C{source} ends before all of the bytes have been read.
+    """
+    for part in parts:
+        if isinstance(part, str):
+            yield part
+        else:
+            offset, length = part
+            source.seek(offset)
+            while length > 0:
+                data = source.read(min(chunkSize, length))
+                if not data:
+                    raise EOFError("File ended %d bytes early" % (length,))
+                length -= len(data)
+                yield data
+
+
+
 def getTypeAndEncoding(filename, types, encodings, defaultType):
     p, ext = os.path.splitext(filename)
     ext = ext.lower()
@@ -185,6 +326,11 @@ class File:
 
     type = None
 
+    # The number of seconds for which the status of a file is remembered
+    # rather than looked up again.  A file which changes is not noticed until
+    # then.
+    statCacheTTL = 1.0
+
     def __init__(self, path, defaultType="text/html", ignoredExts=(), registry=None, allowExt=0):
         """Create a file with the given path.
         """
@@ -202,6 +348,46 @@ class File:
         self.registry = registry or Registry()
         self.children = {}
 
+
+    def time(self):
+        """
+        Return the current time as a float.
+
+        The default implementation simply uses L{time.time}.  This is mainly
+        provided as a hook for tests to override.
+        """
+        return time.time()
+
+
+    def restat(self, fp):
+        """
+        Give C{fp} the status of its file, as it was found by this or any other
+        L{File} at most L{statCacheTTL} seconds ago.
+
+        @type fp: L{filepath.FilePath}
+
+        @return: The L{entityTag} of the file, or C{None} if it does not exist.
+        """
+        now = self.time()
+        try:
+            expires, statinfo, etag = _statCache[fp.path]
+        except KeyError:
+            expires = None
+        if expires is not None and now < expires:
+            fp.statinfo = statinfo
+            return etag
+        fp.restat(False)
+        statinfo = fp.statinfo
+        if statinfo:
+            etag = entityTag(statinfo)
+        else:
+            etag = None
+        if self.statCacheTTL > 0:
+            if len(_statCache) >= STAT_CACHE_SIZE:
+                _statCache.clear()
+            _statCache[fp.path] = (now + self.statCacheTTL, statinfo, etag)
+        return etag
+
     def ignoreExt(self, ext):
         """Ignore the given extension.
 
@@ -226,7 +412,7 @@ class File:
         
         path=segments[0]
         
-        self.fp.restat()
+        self.restat(self.fp)
         
         if not self.fp.isdir():
             return rend.NotFound
@@ -237,6 +423,7 @@ class File:
             fpath = self.fp.childSearchPreauth(*self.indexNames)
             if fpath is None:
                 return self.directoryListing(), segments[1:]
+            self.restat(fpath)
 
         if not fpath.exists():
             fpath = fpath.siblingExtensionSearch(*self.ignoredExts)
@@ -271,7 +458,7 @@ class File:
 
     def renderHTTP(self, ctx):
         """You know what you doing."""
-        self.fp.restat()
+        etag = self.restat(self.fp)
 
         if self.type is None:
             self.type, self.encoding = getTypeAndEncoding(self.fp.basename(),
@@ -289,7 +476,7 @@ class File:
 
         # fsize is the full file size
         # size is the length of the part actually transmitted
-        fsize = size = self.getFileSize()
+        fsize = self.getFileSize()
 
         request.setHeader('accept-ranges','bytes')
 
@@ -307,43 +494,103 @@ class File:
             else:
                 raise
 
-        if request.setLastModified(self.fp.getmtime()) is http.CACHED:
+        mtime = self.fp.getmtime()
+        if setValidators(request, etag, mtime) is http.CACHED:
+            f.close()
             return ''
 
-        try:
-            range = request.getHeader('range')
-
-            if range is not None:
-                # This is a request for partial data...
-                bytesrange = string.split(range, '=')
-                assert bytesrange[0] == 'bytes',\
-                       "Syntactically invalid http range header!"
-                start, end = string.split(bytesrange[1],'-')
-                if start:
-                    f.seek(int(start))
-                if end:
-                    end = int(end)
-                else:
-                    end = fsize-1
-                request.setResponseCode(http.PARTIAL_CONTENT)
-                request.setHeader('content-range',"bytes %s-%s/%s" % (
-                    str(start), str(end), str(fsize)))
-                #content-length should be the actual size of the stuff we're
-                #sending, not the full size of the on-server entity.
-                size = 1 + end - int(start)
-
-            request.setHeader('content-length', str(size))
-        except:
-            traceback.print_exc(file=log.logfile)
+        ranges = None
+        range = request.getHeader('range')
+        if range is not None and self._rangeApplies(request, etag, mtime):
+            ranges = parseRange(range, fsize)
+
+        if ranges is None:
+            parts = [(0, fsize)]
+        elif not ranges:
+            f.close()
+            request.setResponseCode(http.REQUESTED_RANGE_NOT_SATISFIABLE)
+            request.setHeader('content-range', 'bytes */%d' % (fsize,))
+            request.setHeader('content-length', '0')
+            return ''
+        elif len(ranges) == 1:
+            # This is a request for partial data...
+            [(start, end)] = ranges
+            request.setResponseCode(http.PARTIAL_CONTENT)
+            request.setHeader('content-range', "bytes %d-%d/%d" % (
+                start, end, fsize))
+            parts = [(start, 1 + end - start)]
+        else:
+            request.setResponseCode(http.PARTIAL_CONTENT)
+            parts = self._multipartParts(request, ranges, fsize)
+
+        #content-length should be the actual size of the stuff we're
+        #sending, not the full size of the on-server entity.
+        size = 0
+        for part in parts:
+            if isinstance(part, str):
+                size += len(part)
+            else:
+                size += part[1]
+        request.setHeader('content-length', str(size))
 
         if request.method == 'HEAD':
+            f.close()
             return ''
 
+        # Small responses are returned at once, rather than being produced.
+        if size <= abstract.FileDescriptor.bufferSize:
+            try:
+                return ''.join(_readParts(f, parts, size))
+            finally:
+                f.close()
+
         # return data
-        FileTransfer(f, size, request)
+        FileRangeTransfer(f, parts, size, request)
         # and make sure the connection doesn't get closed
         return request.deferred
 
+
+    def _rangeApplies(self, request, etag, mtime):
+        """
+        Determine whether the Range header of C{request} should be obeyed, as
+        it should unless the request has an If-Range header giving a version
+        of the file other than the current one.
+        """
+        ifRange = request.getHeader('if-range')
+        if ifRange is None:
+            return True
+        ifRange = ifRange.strip()
+        if ifRange.startswith('"'):
+            return ifRange == etag
+        try:
+            return http.stringToDatetime(ifRange) >= mtime
+        except (ValueError, IndexError):
+            return False
+
+
+    def _multipartParts(self, request, ranges, fsize):
+        """
+        Set the content type of C{request} to I{multipart/byteranges} and
+        return the parts of a response to it containing each of C{ranges}, for
+        L{_readParts}.
+        """
+        boundary = os.urandom(16).encode('hex')
+        request.setHeader(
+            'content-type', 'multipart/byteranges; boundary=' + boundary)
+        if self.type:
+            partType = 'Content-Type: %s\r\n' % (self.type,)
+        else:
+            partType = ''
+        parts = []
+        for (start, end) in ranges:
+            parts.append(
+                '\r\n--%s\r\n%sContent-Range: bytes %d-%d/%d\r\n\r\n' % (
+                    boundary, partType, start, end, fsize))
+            parts.append((start, 1 + end - start))
+        parts.append('\r\n--%s--\r\n' % (boundary,))
+        return parts
+
+
     def redirect(self, request):
         return redirectTo(addSlash(request), request)
 
@@ -408,6 +655,64 @@ class FileTransfer(pb.Viewable):
 
 threadable.synchronize(FileTransfer)
 
+
+
+class FileRangeTransfer:
+    """
+    A producer of the parts of a file which make up the response to a
+    request.  If the file is truncated while they are being read, the response
+    ends early.
+
+    @ivar remaining: The number of bytes still to be written.
+    """
+    request = None
+
+    def __init__(self, source, parts, size, request):
+        """
+        @param source: A file to read from.  It is closed when the transfer
+            is over.
+
+        @param parts: A C{list} of C{str} to be written as they are and
+            C{(offset, length)} tuples giving bytes to read from C{source}.
+
+        @param size: The number of bytes in all of C{parts}.
+        """
+        self.source = source
+        self.remaining = size
+        self.request = request
+        self._chunks = _readParts(
+            source, parts, abstract.FileDescriptor.bufferSize)
+        request.registerProducer(self, 0)
+
+
+    def resumeProducing(self):
+        if not self.request:
+            return
+        try:
+            data = self._chunks.next()
+        except StopIteration:
+            data = ''
+        except:
+            log.err(None, "Error reading file for transfer")
+            data = ''
+        if data:
+            self.request.write(data)
+            self.remaining -= len(data)
+        if not data or self.remaining <= 0:
+            self.source.close()
+            self.request.unregisterProducer()
+            self.request.finish()
+            self.request = None
+
+
+    def pauseProducing(self):
+        pass
+
+
+    def stopProducing(self):
+        self.source.close()
+        self.request = None
+
 """I contain AsIsProcessor, which serves files 'As Is'
    Inspired by Apache's mod_asis
 """
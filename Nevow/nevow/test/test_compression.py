@@ -1,6 +1,7 @@
 """
 Tests for on-the-fly content compression encoding.
 """
+import os
 from StringIO import StringIO
 from gzip import GzipFile
 
@@ -14,8 +15,10 @@ from nevow.testutil import FakeRequest
 from nevow.context import RequestContext
 from nevow.appserver import errorMarker
 from nevow.rend import NotFound
+from nevow.static import File
 from nevow.compression import CompressingResourceWrapper, CompressingRequestWrapper
 from nevow.compression import parseAcceptEncoding, _ProxyDescriptor
+from nevow.compression import CompressedCache, compress
 
 
 
@@ -207,6 +210,41 @@ class RequestWrapperTests(TestCase):
         self.assertTrue(self.request.finished)
 
 
+    def test_weakETag(self):
+        """
+        A strong ETag header is made weak, since the compressed content is not
+        the content it was made for.
+        """
+        self.wrapper.setHeader('ETag', '"abc"')
+        self.assertEqual(self.request.headers['etag'], 'W/"abc"')
+        self.wrapper.setHeader('ETag', 'W/"def"')
+        self.assertEqual(self.request.headers['etag'], 'W/"def"')
+
+
+
+class CompressedCacheTests(TestCase):
+    """
+    Tests for L{CompressedCache}.
+    """
+    def test_bounded(self):
+        """
+        L{CompressedCache} holds at most C{maxSize} bytes, forgetting
+        everything when another entry would take it over that, and does not
+        keep entries larger than that at all.
+        """
+        cache = CompressedCache(maxSize=10)
+        cache.put('a', 'x' * 6)
+        self.assertEqual(cache.get('a'), 'x' * 6)
+        cache.put('b', 'y' * 4)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.size),
+                         ('x' * 6, 'y' * 4, 10))
+        cache.put('c', 'z')
+        self.assertEqual((cache.get('a'), cache.get('c'), cache.size),
+                         (None, 'z', 1))
+        cache.put('d', 'w' * 11)
+        self.assertEqual((cache.get('d'), cache.size), (None, 1))
+
+
 
 class TestResource(object):
     """
@@ -463,3 +501,124 @@ class ResourceWrapper(TestCase):
 
         self.request.received_headers['accept-encoding'] = 'gzip;q=0'
         self.assertFalse(self.wrapped.canCompress(self.request))
+
+
+
+class FileCompressionTests(TestCase):
+    """
+    Tests for L{CompressingResourceWrapper} wrapping a L{File}.
+    """
+    def setUp(self):
+        self.directory = self.mktemp()
+        os.mkdir(self.directory)
+        self.path = os.path.join(self.directory, 'module.js')
+        self.contents = 'function f() { return 1; }\n' * 100
+        f = file(self.path, 'w')
+        f.write(self.contents)
+        f.close()
+        self.wrapped = CompressingResourceWrapper(File(self.path))
+        self.wrapped.cache = CompressedCache()
+
+
+    def render(self, **headers):
+        """
+        Render the wrapped file for a request accepting compression, with
+        C{headers}.
+        """
+        request = FakeRequest()
+        request.received_headers['accept-encoding'] = 'gzip'
+        request.received_headers.update(headers)
+        result = self.wrapped.renderHTTP(RequestContext(tag=request))
+        if isinstance(result, str):
+            request.write(result)
+        return request
+
+
+    def _ungzip(self, data):
+        return GzipFile(fileobj=StringIO(data), mode='rb').read()
+
+
+    def test_cached(self):
+        """
+        The compressed content of a file is served with a Content-Length and an
+        entity tag of its own, and kept for later requests.
+        """
+        request = self.render()
+        self.assertEqual(self._ungzip(request.accumulator), self.contents)
+        self.assertEqual(request.headers['content-encoding'], 'gzip')
+        self.assertEqual(request.headers['content-type'], 'text/javascript')
+        self.assertEqual(request.headers['content-length'],
+                         str(len(request.accumulator)))
+        self.assertEqual(request.headers['vary'], 'accept-encoding')
+        self.assertTrue(request.headers['etag'].endswith('-gz"'))
+        self.assertEqual(self.wrapped.cache.size, len(request.accumulator))
+
+        self.wrapped.underlying.openForReading = None
+        self.assertEqual(self.render().accumulator, request.accumulator)
+
+
+    def test_cachedNotModified(self):
+        """
+        A request whose If-None-Match header lists the entity tag of the
+        compressed content is answered with I{304 Not Modified}.
+        """
+        etag = self.render().headers['etag']
+        request = self.render(**{'if-none-match': etag})
+        self.assertEqual((request.code, request.accumulator), (304, ''))
+
+
+    def test_precompressed(self):
+        """
+        A C{.gz} file next to the file, which is at least as new, is served in
+        its place.
+        """
+        precompressed = compress('precompressed', 9)
+        f = file(self.path + '.gz', 'wb')
+        f.write(precompressed)
+        f.close()
+        request = self.render()
+        self.assertEqual(request.accumulator, precompressed)
+        self.assertEqual(request.headers['content-encoding'], 'gzip')
+        self.assertEqual(request.headers['content-type'], 'text/javascript')
+        self.assertEqual(request.headers['content-length'],
+                         str(len(precompressed)))
+
+
+    def test_stalePrecompressed(self):
+        """
+        A C{.gz} file older than the file is not served.
+        """
+        f = file(self.path + '.gz', 'wb')
+        f.write(compress('stale', 9))
+        f.close()
+        os.utime(self.path + '.gz', (1000, 1000))
+        request = self.render()
+        self.assertEqual(self._ungzip(request.accumulator), self.contents)
+
+
+    def test_large(self):
+        """
+        Files larger than the cache's C{maxEntrySize} are compressed as they
+        are served, and not kept.
+        """
+        self.wrapped.cache.maxEntrySize = 10
+        request = self.render()
+        self.assertNotIn('content-length', request.headers)
+        self.assertTrue(request.headers['etag'].startswith('W/'))
+        self.assertEqual(self._ungzip(request.accumulator), self.contents)
+        self.assertEqual(self.wrapped.cache.size, 0)
+
+
+    def test_largePrecompressed(self):
+        """
+        A C{.gz} file too large to be returned at once is read from the file
+        as it is served.
+        """
+        precompressed = os.urandom(300000)
+        f = file(self.path + '.gz', 'wb')
+        f.write(precompressed)
+        f.close()
+        request = self.render()
+        self.assertEqual(request.accumulator, precompressed)
+        self.assertEqual(request.headers['content-length'],
+                         str(len(precompressed)))
@@ -6,13 +6,15 @@ Tests for L{nevow.guard}.
 """
 
 import gc
+import pickle
 
 from zope.interface import implements
 
 from twisted.cred.checkers import InMemoryUsernamePasswordDatabaseDontUse, AllowAnonymousAccess, ANONYMOUS
 from twisted.cred.portal import Portal, IRealm
 from twisted.cred.credentials import IUsernamePassword, IAnonymous
-from twisted.internet import address
+from twisted.internet import address, error
+from twisted.internet.task import Clock
 from twisted.trial.unittest import TestCase
 
 from nevow import rend
@@ -859,3 +861,300 @@ class GuardTest_NotAtRoot_oneLevel(GuardTestSuper, GuardTestFuncs):
 
 class GuardTest_NotAtRoot_manyLevels(GuardTestSuper, GuardTestFuncs):
     guardPath = ['foo', 'bar', 'baz']
+
+
+
+class TimingWheelTests(TestCase):
+    """
+    Tests for L{guard.TimingWheel}.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.wheel = guard.TimingWheel(tick=1.0, size=8, clock=self.clock)
+        self.calls = []
+
+
+    def test_callLater(self):
+        """
+        A call is made on the first tick at least its delay from the time it
+        was scheduled, with its arguments, using one timed call of the clock
+        for all the calls scheduled.
+        """
+        self.wheel.callLater(1, self.calls.append, 'a')
+        self.clock.advance(0.5)
+        self.wheel.callLater(2, self.calls.append, 'b')
+        self.wheel.callLater(3.5, self.calls.append, 'c')
+        self.assertEquals(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(2)
+        self.assertEquals(self.calls, ['a'])
+        self.clock.advance(0.5)
+        self.assertEquals(self.calls, ['a', 'b'])
+        self.clock.advance(1)
+        self.assertEquals(self.calls, ['a', 'b', 'c'])
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+
+    def test_laterRounds(self):
+        """
+        Calls scheduled further ahead than the size of the wheel stay in their
+        slot until the wheel comes round to them again.
+        """
+        call = self.wheel.callLater(11, self.calls.append, 'a')
+        self.clock.pump([1] * 10)
+        self.assertEquals(self.calls, [])
+        self.assertTrue(call.active())
+        self.clock.advance(1)
+        self.assertEquals(self.calls, ['a'])
+        self.assertFalse(call.active())
+
+
+    def test_late(self):
+        """
+        If the clock moves on by several ticks at once, all the calls which
+        have come due are made together.
+        """
+        for delay in 1, 5, 30:
+            self.wheel.callLater(delay, self.calls.append, delay)
+        self.wheel.callLater(40, self.calls.append, 40)
+        self.clock.advance(35)
+        self.assertEquals(sorted(self.calls), [1, 5, 30])
+        self.clock.advance(5)
+        self.assertEquals(sorted(self.calls), [1, 5, 30, 40])
+
+
+    def test_cancel(self):
+        """
+        A cancelled call is not made, and once no calls are left the wheel
+        cancels its timed call.  Cancelling a call which has been made or
+        cancelled raises the same exceptions as cancelling a timed call does.
+        """
+        call = self.wheel.callLater(1, self.calls.append, 'a')
+        call.cancel()
+        self.assertFalse(call.active())
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+        self.assertRaises(error.AlreadyCancelled, call.cancel)
+        call = self.wheel.callLater(1, self.calls.append, 'b')
+        self.clock.advance(1)
+        self.assertEquals(self.calls, ['b'])
+        self.assertRaises(error.AlreadyCalled, call.cancel)
+
+
+    def test_reschedule(self):
+        """
+        A call may schedule another call with the wheel.
+        """
+        def again():
+            self.calls.append(self.clock.seconds())
+            if len(self.calls) < 3:
+                self.wheel.callLater(2, again)
+        self.wheel.callLater(2, again)
+        self.clock.pump([1] * 10)
+        self.assertEquals(self.calls, [2, 4, 6])
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+
+
+class SessionExpiryTests(TestCase):
+    """
+    Tests for the expiry of L{guard.GuardSession}s with the L{TimingWheel} of
+    their L{guard.SessionWrapper}.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.wrapper = guard.SessionWrapper(None)
+        self.wrapper.expiryWheel = guard.TimingWheel(clock=self.clock)
+
+
+    def makeSession(self, key):
+        """
+        Make a session with a lifetime of ten seconds, as the wrapper does.
+        """
+        session = self.wrapper.sessions[key] = guard.GuardSession(
+            self.wrapper, key)
+        session.setLifetime(10)
+        session.checkExpired()
+        return session
+
+
+    def test_expiry(self):
+        """
+        A session is expired when it is checked, each lifetime, if it has not
+        been touched in half a lifetime, and all the sessions are checked with
+        one timed call.
+        """
+        sessions = [self.makeSession(str(i)) for i in range(100)]
+        self.assertEquals(len(self.clock.getDelayedCalls()), 1)
+        for session in sessions[:50]:
+            session.lastModified -= 6
+        self.clock.advance(10)
+        self.assertEquals(sorted(self.wrapper.sessions.keys()),
+                          sorted([str(i) for i in range(50, 100)]))
+        for session in sessions[50:]:
+            session.lastModified -= 6
+        self.clock.advance(10)
+        self.assertEquals(self.wrapper.sessions, {})
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+
+    def test_explicitExpiry(self):
+        """
+        Expiring a session cancels the check for its expiry.
+        """
+        session = self.makeSession('a')
+        session.expire()
+        self.assertEquals(self.wrapper.sessions, {})
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+
+    def assertUnpickled(self, wrapper):
+        """
+        Assert that C{wrapper} has been unpickled with its session, and that
+        the check for the session's expiry is scheduled with its wheel.
+        """
+        session = wrapper.sessions['a']
+        self.addCleanup(session.expire)
+        self.assertIdentical(session.guard, wrapper)
+        self.assertIdentical(session.checkExpiredID.wheel,
+                             wrapper.expiryWheel)
+        self.assertEquals(wrapper.expiryWheel.count, 1)
+
+
+    def test_pickle(self):
+        """
+        A wrapper with sessions can be pickled and unpickled, whether the
+        wrapper or a session is unpickled first.
+        """
+        session = self.makeSession('a')
+        for protocol in 0, 2:
+            self.assertUnpickled(
+                pickle.loads(pickle.dumps(self.wrapper, protocol)))
+            self.assertUnpickled(
+                pickle.loads(pickle.dumps(session, protocol)).guard)
+
+
+    def test_unpickleWithoutWheel(self):
+        """
+        A wrapper pickled before it had a wheel is given one when it is
+        unpickled.
+        """
+        self.makeSession('a')
+        self.wrapper.sessions = dict(self.wrapper.sessions)
+        del self.wrapper.expiryWheel
+        self.assertUnpickled(pickle.loads(pickle.dumps(self.wrapper)))
+
+
+
+class SQLiteSessionStoreTests(TestCase):
+    """
+    Tests for L{guard.SQLiteSessionStore}.
+    """
+    if guard.sqlite3 is None:
+        skip = "SQLiteSessionStore requires sqlite3"
+
+    def setUp(self):
+        self.path = self.mktemp()
+        self.clock = Clock()
+        self.stores = []
+
+
+    def makeWrapper(self):
+        """
+        Make a L{SessionWrapper} keeping its sessions in the database, as a
+        process sharing it would.
+        """
+        wrapper = guard.SessionWrapper(None)
+        wrapper.sessionLifetime = 100
+        wrapper.expiryWheel = guard.TimingWheel(clock=self.clock)
+        wrapper.sessions = guard.SQLiteSessionStore(wrapper, self.path)
+        self.stores.append(wrapper.sessions)
+        return wrapper
+
+
+    def tearDown(self):
+        for store in self.stores:
+            for session in store.values():
+                session.expire()
+            store.close()
+
+
+    def makeSession(self, wrapper, key='a'):
+        """
+        Make a session for C{wrapper}, as it does.
+        """
+        session = wrapper.sessions[key] = guard.GuardSession(wrapper, key)
+        session.setLifetime(wrapper.sessionLifetime)
+        session.checkExpired()
+        return session
+
+
+    def lastUsed(self, wrapper, key):
+        return wrapper.sessions.connection.execute(
+            'SELECT lastUsed FROM nevow_sessions WHERE sessionKey = ?',
+            (key,)).fetchone()
+
+
+    def test_shared(self):
+        """
+        A session made in one process is found by another sharing the
+        database, as a new session with the same key and lifetime.
+        """
+        first = self.makeWrapper()
+        session = self.makeSession(first)
+        second = self.makeWrapper()
+        self.assertTrue(session.uid in second.sessions)
+        other = second.sessions[session.uid]
+        self.assertNotIdentical(other, session)
+        self.assertEquals(other.uid, session.uid)
+        self.assertIdentical(other.guard, second)
+        self.assertEquals(other.lifetime, second.sessionLifetime)
+        self.assertFalse('unknown' in second.sessions)
+        self.assertRaises(KeyError, lambda: second.sessions['unknown'])
+        self.assertFalse(None in second.sessions)
+
+
+    def test_stale(self):
+        """
+        A session which was last used longer than a lifetime ago is not found,
+        and is taken out of the database when it is next flushed.
+        """
+        first = self.makeWrapper()
+        session = self.makeSession(first)
+        first.sessions.connection.execute(
+            'UPDATE nevow_sessions SET lastUsed = lastUsed - 101')
+        first.sessions.connection.commit()
+        second = self.makeWrapper()
+        self.assertFalse(session.uid in second.sessions)
+        second.sessions.flush()
+        self.assertIdentical(self.lastUsed(second, session.uid), None)
+
+
+    def test_flush(self):
+        """
+        Uses of sessions are written to the database by C{flush}, which is
+        scheduled with the wheel when a session is used.
+        """
+        wrapper = self.makeWrapper()
+        session = self.makeSession(wrapper)
+        wrapper.sessions.connection.execute(
+            'UPDATE nevow_sessions SET lastUsed = 0')
+        wrapper.sessions.connection.commit()
+        self.assertIdentical(wrapper.sessions[session.uid], session)
+        self.assertEquals(self.lastUsed(wrapper, session.uid), (0,))
+        self.clock.advance(wrapper.sessions.flushInterval)
+        self.assertNotEquals(self.lastUsed(wrapper, session.uid), (0,))
+
+
+    def test_expire(self):
+        """
+        Expiring a session takes it out of the database, but another process
+        which has used it since it was last flushed puts it back.
+        """
+        first = self.makeWrapper()
+        session = self.makeSession(first)
+        second = self.makeWrapper()
+        second.sessions[session.uid]
+        session.expire()
+        self.assertIdentical(self.lastUsed(first, session.uid), None)
+        self.assertFalse(session.uid in first.sessions)
+        second.sessions.flush()
+        self.assertTrue(session.uid in first.sessions)
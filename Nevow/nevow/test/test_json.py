@@ -123,6 +123,38 @@ class JavascriptObjectNotationTestCase(unittest.TestCase):
             u"\f\b\n\t\r")
 
 
+    def test_tokenise(self):
+        """
+        L{json.tokenise} skips whitespace and comments, and gives the first of
+        the possible tokens where more than one could match.
+        """
+        self.assertEquals(
+            json.tokenise('{"a\\"" : [1, -2.5e3, true, nullable]} // x\n'
+                          '/* y\n */ 1e0'),
+            ['{', '"a\\""', ':', '[', 1, ',', -2500.0, ',', True, ',', None,
+             'able', ']', '}', 1])
+        self.assertRaises(ValueError, json.tokenise, '[1, "unterminated]')
+
+
+    def test_stringEncode(self):
+        """
+        L{json.stringEncode} escapes quotes, backslashes and control
+        characters, and encodes the rest as UTF-8.
+        """
+        self.assertEquals(
+            json.stringEncode(u'a"b\\c\nd\x00\u1234'),
+            'a\\"b\\\\c\\nd\\x00\xe1\x88\xb4')
+
+
+    def test_largePayload(self):
+        """
+        Payloads with many values are serialized and parsed.
+        """
+        struct = [{u'id': n, u'name': u'row "%d"' % (n,), u'ok': n % 2 == 0}
+                  for n in range(5000)]
+        self.assertEquals(json.parse(json.serialize(struct)), struct)
+
+
     def _rendererTest(self, cls):
         self.assertEquals(
             json.serialize(
@@ -10,13 +10,13 @@ import sys, traceback
 from zope.interface import implements
 
 from twisted.trial.unittest import TestCase
-from twisted.internet.defer import Deferred, succeed
+from twisted.internet.defer import Deferred, succeed, fail
 
 from nevow.inevow import IRequest, IQ, IRenderable, IData
 from nevow._flat import FlattenerError, UnsupportedType, UnfilledSlot
 from nevow._flat import flatten, deferflatten
 from nevow.tags import Proto, Tag, slot, raw, xml
-from nevow.tags import invisible, br, div, directive
+from nevow.tags import invisible, br, div, span, directive
 from nevow.entities import nbsp
 from nevow.url import URL
 from nevow.rend import Fragment
@@ -1327,6 +1327,95 @@ class DeferflattenTests(TestCase, FlattenMixin):
         return finished
 
 
+    def test_coalescedWrites(self):
+        """
+        L{deferflatten} joins the strings it produces and passes them to its
+        writer in pieces of at least C{bufferSize} bytes, except for the last.
+        """
+        writes = []
+        root = div[[span["x" * 10] for i in range(10)]]
+        expected = "".join(flatten(None, root, False, False))
+        flattened = deferflatten(None, root, False, False, writes.append, 50)
+        self.assertEqual(flattened.called, True)
+        self.assertEqual("".join(writes), expected)
+        for data in writes[:-1]:
+            self.assertTrue(len(data) >= 50)
+        self.assertTrue(1 < len(writes) <= len(expected) // 50 + 1)
+
+
+    def test_unbufferedWrites(self):
+        """
+        L{deferflatten} passes each string to its writer as it is produced if
+        C{bufferSize} is C{0}.
+        """
+        writes = []
+        root = div[span["foo"], "bar"]
+        deferflatten(None, root, False, False, writes.append, 0)
+        self.assertEqual(writes, list(flatten(None, root, False, False)))
+
+
+    def test_synchronousDeferredsNotWaitedOn(self):
+        """
+        L{deferflatten} carries on without waiting when it encounters a
+        L{Deferred} which has a result already, so the L{Deferred} it returns
+        has a result already if all of them do, and the output around them is
+        written together.
+        """
+        writes = []
+        root = div[succeed("foo"), span[succeed("bar")]]
+        flattened = deferflatten(None, root, False, False, writes.append)
+        self.assertEqual(flattened.called, True)
+        self.assertEqual(writes, ["<div>foo<span>bar</span></div>"])
+
+
+    def test_flushBeforeWaiting(self):
+        """
+        L{deferflatten} writes the output collected so far before waiting on a
+        L{Deferred} without a result, and resumes as soon as it is called back.
+        """
+        writes = []
+        deferred = Deferred()
+        root = div[span["foo"], deferred, "baz"]
+        flattened = deferflatten(None, root, False, False, writes.append)
+        self.assertEqual(writes, ["<div><span>foo</span>"])
+        self.assertEqual(flattened.called, False)
+        deferred.callback("bar")
+        self.assertEqual(writes, ["<div><span>foo</span>", "barbaz</div>"])
+        self.assertEqual(flattened.called, True)
+
+
+    def test_flushBeforeFailure(self):
+        """
+        L{deferflatten} writes the output collected before a L{Deferred} which
+        has failed already, then fails with its failure.
+        """
+        writes = []
+        root = div["foo", fail(RuntimeError())]
+        flattened = deferflatten(None, root, False, False, writes.append)
+        self.assertEqual(writes, ["<div>foo"])
+        return self.assertFailure(flattened, RuntimeError)
+
+
+    def test_manyAsynchronousDeferreds(self):
+        """
+        Flattening a structure with many more L{Deferred}s than there are
+        frames allowed by the Python recursion limit succeeds if the
+        L{Deferred}s are called back one after another.
+        """
+        deferreds = [Deferred() for i in xrange(1000)]
+        flattened = self.deferflatten(deferreds)
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(100)
+        try:
+            for (i, d) in enumerate(deferreds):
+                d.callback(str(i))
+        finally:
+            sys.setrecursionlimit(limit)
+        flattened.addCallback(
+            self.assertStringEqual, "".join(map(str, xrange(1000))))
+        return flattened
+
+
     def test_attributeString(self):
         """
         An instance of L{str} is flattened with attribute quoting rules if
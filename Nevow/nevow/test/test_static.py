@@ -135,3 +135,238 @@ class Range(unittest.TestCase):
         return deferredRender(self.file, self.request).addCallback(
             lambda r: self.assertEquals(r.headers.get('content-range'),
                                         'bytes 0-7999/8000'))
+
+    def test_multipleRanges(self):
+        """
+        A request for several ranges is answered with a I{multipart/byteranges}
+        response containing each of them.
+        """
+        self.request.received_headers['range'] = 'bytes=0-3,-2'
+        def rendered(r):
+            self.assertEquals(r.code, 206)
+            contentType = r.headers['content-type']
+            self.assertTrue(
+                contentType.startswith('multipart/byteranges; boundary='))
+            boundary = contentType.split('=', 1)[1]
+            self.assertEquals(
+                r.v,
+                '\r\n--%(b)s\r\nContent-Type: text/html\r\n'
+                'Content-Range: bytes 0-3/8000\r\n\r\n0123'
+                '\r\n--%(b)s\r\nContent-Type: text/html\r\n'
+                'Content-Range: bytes 7998-7999/8000\r\n\r\n89'
+                '\r\n--%(b)s--\r\n' % {'b': boundary})
+            self.assertEquals(r.headers['content-length'], str(len(r.v)))
+        return deferredRender(self.file, self.request).addCallback(rendered)
+
+
+    def test_unsatisfiableRange(self):
+        """
+        A request for ranges which are all beyond the end of the file is
+        answered with I{416 Requested Range Not Satisfiable}.
+        """
+        self.request.received_headers['range'] = 'bytes=8000-,9000-9001'
+        def rendered(r):
+            self.assertEquals(r.code, 416)
+            self.assertEquals(r.headers['content-range'], 'bytes */8000')
+            self.assertEquals(r.v, '')
+        return deferredRender(self.file, self.request).addCallback(rendered)
+
+
+    def test_invalidRange(self):
+        """
+        A Range header which cannot be understood is ignored.
+        """
+        self.request.received_headers['range'] = 'bytes=5-2'
+        def rendered(r):
+            self.assertEquals(r.code, 200)
+            self.assertEquals(len(r.v), 8000)
+            self.assertEquals(r.headers['content-length'], '8000')
+        return deferredRender(self.file, self.request).addCallback(rendered)
+
+
+    def test_ifRange(self):
+        """
+        A Range header is ignored if the request's If-Range header gives an
+        entity tag other than the file's.
+        """
+        self.request.received_headers['range'] = 'bytes=0-1'
+        self.request.received_headers['if-range'] = '"stale"'
+        return deferredRender(self.file, self.request).addCallback(
+            lambda r: self.assertEquals((r.code, len(r.v)), (200, 8000)))
+
+
+
+class ParseRangeTests(unittest.TestCase):
+    """
+    Tests for L{static.parseRange}.
+    """
+    def test_ranges(self):
+        """
+        L{static.parseRange} returns the first and last offsets of each range,
+        in the order they were asked for.
+        """
+        self.assertEquals(
+            static.parseRange('bytes=10-19, 0-, -5,3-3', 100),
+            [(10, 19), (0, 99), (95, 99), (3, 3)])
+
+
+    def test_clipped(self):
+        """
+        Ranges extending beyond the end of the entity are clipped to it, and
+        those starting beyond it are left out.
+        """
+        self.assertEquals(static.parseRange('bytes=50-200,-500,100-', 100),
+                          [(50, 99), (0, 99)])
+        self.assertEquals(static.parseRange('bytes=100-,-0', 100), [])
+
+
+    def test_invalid(self):
+        """
+        L{static.parseRange} returns C{None} for headers it does not
+        understand and for those asking for too many ranges.
+        """
+        for header in ['bytes', 'items=0-1', 'bytes=', 'bytes=1', 'bytes=a-b',
+                       'bytes=5-2', 'bytes=--3',
+                       'bytes=' + ','.join(['0-1'] * (static.MAX_RANGES + 1))]:
+            self.assertIdentical(static.parseRange(header, 100), None, header)
+
+
+
+class ConditionalTests(unittest.TestCase):
+    """
+    Tests for entity tags and the cached status of files served by
+    L{static.File}.
+    """
+    def setUp(self):
+        self.path = self.mktemp()
+        f = file(self.path, 'w')
+        f.write('contents')
+        f.close()
+        self.file = static.File(self.path)
+        self.now = 1000.0
+        self.file.time = lambda: self.now
+        static._statCache.clear()
+
+
+    def render(self, **headers):
+        request = testutil.FakeRequest()
+        request.received_headers.update(headers)
+        return deferredRender(self.file, request)
+
+
+    def test_etag(self):
+        """
+        The response to a request for a file has a strong entity tag which
+        changes when the file is changed.
+        """
+        def rendered(r):
+            etag = r.headers['etag']
+            self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+            os.utime(self.path, (2000, 2000))
+            self.now += self.file.statCacheTTL
+            return self.render().addCallback(
+                lambda r: self.assertNotEquals(r.headers['etag'], etag))
+        return self.render().addCallback(rendered)
+
+
+    def test_ifNoneMatch(self):
+        """
+        A request whose If-None-Match header lists the file's entity tag is
+        answered with I{304 Not Modified} and no body.
+        """
+        def rendered(r):
+            etag = r.headers['etag']
+            return self.render(**{'if-none-match': '"other", ' + etag})
+        def notModified(r):
+            self.assertEquals(r.code, 304)
+            self.assertEquals(r.v, '')
+        return self.render().addCallback(rendered).addCallback(notModified)
+
+
+    def test_ifNoneMatchOther(self):
+        """
+        A request whose If-None-Match header lists only other entity tags is
+        answered with the file.
+        """
+        def rendered(r):
+            self.assertEquals(r.code, 200)
+            self.assertEquals(r.v, 'contents')
+        return self.render(**{'if-none-match': '"other"'}).addCallback(
+            rendered)
+
+
+    def test_statCached(self):
+        """
+        The status of a file is looked up again only once L{File.statCacheTTL}
+        seconds have passed.
+        """
+        def first(r):
+            f = file(self.path, 'w')
+            f.write('longer contents')
+            f.close()
+            self.now += self.file.statCacheTTL / 2
+            return self.render()
+        def second(r):
+            self.assertEquals(r.headers['content-length'], '8')
+            self.now += self.file.statCacheTTL
+            return self.render()
+        def third(r):
+            self.assertEquals(r.v, 'longer contents')
+        return self.render().addCallback(first).addCallback(
+            second).addCallback(third)
+
+
+
+class LargeFileTests(unittest.TestCase):
+    """
+    Tests for L{static.File} serving files too large to be returned at once.
+    """
+    def setUp(self):
+        self.contents = ''.join([chr(i % 256) for i in xrange(300000)])
+        path = self.mktemp()
+        f = file(path, 'wb')
+        f.write(self.contents)
+        f.close()
+        self.file = static.File(path)
+
+
+    def render(self, **headers):
+        request = testutil.FakeRequest()
+        request.received_headers.update(headers)
+        return deferredRender(self.file, request)
+
+
+    def test_whole(self):
+        """
+        The whole of a large file is served.
+        """
+        return self.render().addCallback(
+            lambda r: self.assertEquals(r.v, self.contents))
+
+
+    def test_truncated(self):
+        """
+        If a file is truncated while it is being served, the response is
+        finished early and the error is logged.
+        """
+        path = self.file.fp.path
+        class TruncatingRequest(testutil.FakeRequest):
+            def write(self, data):
+                testutil.FakeRequest.write(self, data)
+                file(path, 'wb').close()
+        request = TruncatingRequest()
+        def rendered(r):
+            self.assertEquals(len(self.flushLoggedErrors(EOFError)), 1)
+            self.assertTrue(0 < len(r.v) < len(self.contents))
+        return deferredRender(self.file, request).addCallback(rendered)
+
+
+    def test_multipleRanges(self):
+        """
+        Several large ranges of a file are served one after another.
+        """
+        def rendered(r):
+            self.assertEquals(r.headers['content-length'], str(len(r.v)))
+            self.assertIn(self.contents[:100000], r.v)
+            self.assertIn(self.contents[200000:], r.v)
+        return self.render(range='bytes=0-99999,200000-').addCallback(rendered)